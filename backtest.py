@@ -7,6 +7,14 @@ import random
 import os
 from plot_trading_day import plot_trading_day
 from equity_report import render_equity_report
+from feature_store import FeatureStore, aggregate_daily_bars, compute_trend_features_from_daily
+from day_matrix import DayMatrix
+
+# 回测引擎版本：成交或统计口径变化时递增，result_cache 中旧版本的结果随之失效
+ENGINE_VERSION = 1
+
+# simulate_day mark_trace 事件类型：持仓 K 线标记 / 空仓 K 线标记 / 平仓后已实现
+TRACE_MARK, TRACE_FLAT, TRACE_CLOSE = 0, 1, 2
 
 def calculate_vwap(turnovers, volumes, prices):
     """
@@ -54,10 +62,35 @@ def calculate_vwap_with_turnover(day_df, current_index):
     else:
         # 处理成交量为0的情况，使用当前收盘价
         vwap = current_day_data['Close'].iloc[-1]
-    
+
     return vwap
 
 
+def calculate_day_vwaps(day_df):
+    """
+    整日逐根 K 的累计 VWAP 数组。
+    累计和的前缀就是前缀的累计和，因此与逐根调用 calculate_vwap_with_turnover /
+    calculate_vwap_with_hl_average 的结果逐位相同，但整日只做一次 cumsum。
+    """
+    closes = day_df['Close'].to_numpy(dtype=float)
+    if 'Turnover' in day_df.columns:
+        if not day_df['DateTime'].is_monotonic_increasing:
+            # 乱序时保持逐根排序后累计的旧口径
+            return np.array([calculate_vwap_with_turnover(day_df, i) for i in range(len(day_df))], dtype=float)
+        cum_volume = day_df['Volume'].cumsum().to_numpy(dtype=float)
+        cum_turnover = day_df['Turnover'].cumsum().to_numpy(dtype=float)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(cum_volume > 0, cum_turnover / cum_volume, closes)
+    highs = day_df['High'].to_numpy(dtype=float)
+    lows = day_df['Low'].to_numpy(dtype=float)
+    volumes = day_df['Volume'].to_numpy()
+    hl_average = (highs + lows) / 2
+    cum_volume = np.cumsum(volumes)
+    cum_turnover = np.cumsum(hl_average * volumes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cum_volume > 0, cum_turnover / cum_volume, hl_average)
+
+
 def compute_daily_trend_features(minute_df):
     """
     从分钟数据聚合日收盘，计算多种趋势相关标量（仅内存使用，不写回 CSV）。
@@ -76,98 +109,55 @@ def compute_daily_trend_features(minute_df):
     - trend_price_rank60: 前收盘在 60 日高低区间中的位置 [0,1]，价格水位
     - trend_range1: 昨日日内振幅 (High-Low)/Close，shift(1) 对齐开盘前可知
     """
-    if 'Volume' in minute_df.columns:
-        d = minute_df.groupby('Date', as_index=False).agg(
-            Close=('Close', 'last'),
-            High=('High', 'max'),
-            Low=('Low', 'min'),
-            DayVol=('Volume', 'sum'),
-        )
-    else:
-        d = minute_df.groupby('Date', as_index=False).agg(
-            Close=('Close', 'last'),
-            High=('High', 'max'),
-            Low=('Low', 'min'),
-        )
-        d['DayVol'] = np.nan
-    d = d.sort_values('Date').reset_index(drop=True)
-    c = d['Close']
-    d['close_prev'] = c.shift(1)
-    d['mom5'] = d['close_prev'] / c.shift(6) - 1
-    dr = c.pct_change()
-    d['rvol5'] = dr.rolling(5, min_periods=5).std().shift(1)
-    rvol = d['rvol5']
-    d['weekly_trend_strength'] = (
-        d['mom5'].abs() / rvol.replace(0, np.nan)
-    ).where(rvol.notna() & (rvol > 0))
-
-    abs_diff = c.diff().abs()
-    den = abs_diff.shift(1).rolling(5, min_periods=5).sum()
-    num = (c.shift(1) - c.shift(6)).abs()
-    d['trend_er5'] = (num / den.replace(0, np.nan)).where(den.notna() & (den > 0))
-
-    d['ma20'] = c.rolling(20, min_periods=20).mean().shift(1)
-    d['trend_dist_ma20'] = (
-        (d['close_prev'] / d['ma20'] - 1)
-        .where(d['ma20'].notna() & (d['ma20'] > 0))
-    )
+    return compute_trend_features_from_daily(aggregate_daily_bars(minute_df))
 
-    arr = c.values
-    n = len(c)
-    r2 = np.full(n, np.nan)
-    x = np.arange(5, dtype=float)
-    for i in range(5, n):
-        y = arr[i - 5:i]
-        if np.any(np.isnan(y)):
-            continue
-        y_mean = y.mean()
-        x_mean = x.mean()
-        b = np.sum((x - x_mean) * (y - y_mean)) / (np.sum((x - x_mean) ** 2) + 1e-12)
-        a = y_mean - b * x_mean
-        yhat = a + b * x
-        ss_res = np.sum((y - yhat) ** 2)
-        ss_tot = np.sum((y - y_mean) ** 2)
-        r2[i] = 1 - ss_res / ss_tot if ss_tot > 1e-18 else 0.0
-    d['trend_linreg5_r2'] = r2
-
-    rng = (d['High'] - d['Low']) / c.replace(0, np.nan)
-    d['trend_range5'] = rng.rolling(5, min_periods=5).mean().shift(1)
-    d['trend_range1'] = rng.shift(1)  # 昨日振幅；开盘前可知，无未来函数
-
-    delta = c.diff()
-    gain = delta.clip(lower=0)
-    loss = -delta.clip(upper=0)
-    ag = gain.rolling(5, min_periods=5).mean()
-    al = loss.rolling(5, min_periods=5).mean()
-    rs_rsi = ag / al.replace(0, np.nan)
-    d['trend_rsi5'] = (100 - (100 / (1 + rs_rsi))).shift(1)
-
-    dv = d['DayVol']
-    if dv.notna().any():
-        vol_ma20 = dv.rolling(20, min_periods=20).mean().shift(1)
-        d['trend_vol_ratio'] = (dv.shift(1) / vol_ma20.replace(0, np.nan)).where(vol_ma20.notna() & (vol_ma20 > 0))
-    else:
-        d['trend_vol_ratio'] = np.nan
 
-    d['trend_mom5'] = d['mom5']
+def load_trend_features(price_df, config, store_symbol):
+    """
+    回测用趋势特征（Date + 各 trend_* 列）。
+
+    config['feature_store_path'] 存在时经 feature_store 增量更新后按日期读取（与实盘门控同一套代码，
+    按 store_symbol 单独存放，不与实盘的品种键共用行），
+    否则直接由 compute_daily_trend_features 在内存中计算。
+    """
+    store_path = config.get('feature_store_path')
+    if not store_path:
+        return compute_daily_trend_features(price_df)
+    store = FeatureStore(store_path)
+    try:
+        store.update_from_minutes(store_symbol, price_df)
+        return store.features_for_dates(store_symbol, sorted(price_df['Date'].unique()))
+    finally:
+        store.close()
 
-    high20 = c.rolling(20, min_periods=20).max().shift(1)
-    low20 = c.rolling(20, min_periods=20).min().shift(1)
-    d['trend_dist_high20'] = (d['close_prev'] / high20 - 1).where(high20.notna() & (high20 > 0))
-    d['trend_dist_low20'] = (d['close_prev'] / low20 - 1).where(low20.notna() & (low20 > 0))
 
-    roll_min60 = c.rolling(60, min_periods=20).min().shift(1)
-    roll_max60 = c.rolling(60, min_periods=20).max().shift(1)
-    span60 = roll_max60 - roll_min60
-    d['trend_price_rank60'] = (
-        (d['close_prev'] - roll_min60) / span60.replace(0, np.nan)
-    ).where(span60.notna() & (span60 > 0)).clip(0, 1)
+def feature_store_symbol(config, ticker=None):
+    """特征库中的键：注册表数据集用 dataset_symbol，CSV 用「ticker:文件名」区分不同复权来源。"""
+    if config.get('dataset_symbol'):
+        return str(config['dataset_symbol'])
+    return f"{ticker or config.get('ticker') or 'QQQ'}:{os.path.basename(str(config.get('data_path')))}"
+
+
+def load_price_data(config):
+    """
+    按配置加载分钟数据（DateTime / OHLCV / Turnover）。
+
+    config['dataset_symbol'] 存在时从 dataset_registry 取 [start_date - 预热, end_date] 的择优数据，
+    否则读 config['data_path'] CSV。
+    """
+    dataset_symbol = config.get('dataset_symbol')
+    if dataset_symbol:
+        from dataset_registry import DatasetRegistry
 
-    return d[[
-        'Date', 'weekly_trend_strength', 'trend_er5', 'trend_linreg5_r2', 'trend_dist_ma20',
-        'trend_range5', 'trend_range1', 'trend_rsi5', 'trend_vol_ratio', 'trend_mom5',
-        'trend_dist_high20', 'trend_dist_low20', 'trend_price_rank60',
-    ]]
+        registry = DatasetRegistry(config.get('dataset_db_path'))
+        try:
+            price_df = registry.load_for_backtest(dataset_symbol, config.get('start_date'), config.get('end_date'))
+        finally:
+            registry.close()
+        if price_df.empty:
+            raise ValueError(f"数据集注册表中没有 {dataset_symbol} 的数据，请先运行 dataset_registry.py import")
+        return price_df
+    return pd.read_csv(config['data_path'], parse_dates=['DateTime'])
 
 
 def _resolve_k_metric_column(metric):
@@ -194,6 +184,13 @@ def _resolve_k_metric_column(metric):
     }.get(metric, metric)
 
 
+def _column_like(df, values):
+    """逐行结果按 df 的形态返回：DataFrame -> Series，DayMatrix -> (n_days, n_slots) 数组。"""
+    if isinstance(df, pd.DataFrame):
+        return pd.Series(values, index=df.index)
+    return np.array(np.broadcast_to(values, df.shape))
+
+
 def _eval_k_condition_series(df, rule):
     """单条 K 调整规则 -> 布尔 Series（True 用 k_if_true）。"""
     metric = rule['metric']
@@ -209,7 +206,7 @@ def _eval_k_condition_series(df, rule):
     elif 'max' in rule:
         ok = v <= rule['max']
     elif 'min_abs' in rule:
-        ok = v.abs() >= rule['min_abs']
+        ok = np.abs(v) >= rule['min_abs']
     else:
         raise ValueError("k_side_adjustment 规则需要 min、max、min_abs 或 gt_zero 之一")
     return ok
@@ -222,20 +219,23 @@ def compute_k_multiplier_series(df, rule, default_k=1.0):
     指标为 NaN 时回退 default_k（通常为 config 中的 K1/K2 基准）。
     """
     if rule is None:
-        return pd.Series(float(default_k), index=df.index)
+        return _column_like(df, float(default_k))
 
     col = _resolve_k_metric_column(rule['metric'])
     k_true = float(rule.get('k_if_true', rule.get('k_pass', 0.9)))
     k_false = float(rule.get('k_if_false', rule.get('k_fail', 1.1)))
     ok = _eval_k_condition_series(df, rule)
-    nan_mask = df[col].isna()
+    nan_mask = pd.isna(df[col])
     k = np.where(ok, k_true, k_false)
     k = np.where(nan_mask, float(default_k), k)
-    return pd.Series(k, index=df.index)
+    return _column_like(df, k)
 
 
 def apply_k_bounds(price_df, config):
-    """计算 K1_eff/K2_eff 及上下边界；支持 k_side_adjustment 按规则动态调整。"""
+    """
+    计算 K1_eff/K2_eff 及上下边界；支持 k_side_adjustment 按规则动态调整。
+    price_df 可为长表 DataFrame 或 day_matrix.DayMatrix（逐列运算相同）。
+    """
     k1_base = float(config.get('K1', 1))
     k2_base = float(config.get('K2', 1))
     adj = config.get('k_side_adjustment') if config.get('enable_k_side_adjustment', False) else None
@@ -296,26 +296,26 @@ def _single_entry_trend_pass_series(df, filt):
     elif 'max' in filt:
         ok = v <= filt['max']
     elif 'min_abs' in filt:
-        ok = v.abs() >= filt['min_abs']
+        ok = np.abs(v) >= filt['min_abs']
     else:
         raise ValueError("entry_trend_filter 需要 min、max 或 min_abs 之一")
 
-    ok = ok | v.isna()
+    ok = ok | pd.isna(v)
     return ok
 
 
 def compute_entry_trend_pass_series(df, config):
     """
-    根据 config['entry_trend_filter'] 生成与 df 等长的布尔 Series。
+    根据 config['entry_trend_filter'] 生成与 df 等长的布尔 Series（df 为 DayMatrix 时返回同形状布尔矩阵）。
     - 单 dict：一条规则
     - list[dict]：多条规则同时满足（AND）
     特征为 NaN 时不拦截（与历史行为一致）。
     """
     filt = resolve_entry_trend_filter(config)
     if filt is None:
-        return pd.Series(True, index=df.index)
+        return _column_like(df, True)
     rules = filt if isinstance(filt, list) else [filt]
-    ok = pd.Series(True, index=df.index)
+    ok = _column_like(df, True)
     for r in rules:
         ok = ok & _single_entry_trend_pass_series(df, r)
     return ok
@@ -327,7 +327,7 @@ def compute_weekly_trend_strength_by_date(minute_df):
     return d[['Date', 'weekly_trend_strength']]
 
 
-def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_start_capital=None):
+def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_start_capital=None, mark_trace=None):
     """
     模拟单日交易，使用噪声空间策略 + VWAP
     
@@ -337,6 +337,8 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         allowed_times: 允许交易的时间列表
         position_size: 仓位大小
         config: 配置字典，包含所有交易参数
+        mark_trace: 可选 list；传入时逐根记录权益标记点与平仓事件（two_phase_engine 单位仓位模拟用），
+                    元素为 (类型, 持仓方向, 开仓价, High, Low, 已平仓笔数)
     """
     # 从配置中提取参数
     transaction_fee_per_share = config.get('transaction_fee_per_share', 0.01)
@@ -434,6 +436,8 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         nonlocal current_day_pnl, intraday_stop_triggered
         nonlocal intraday_capital_peak, intraday_capital_high, intraday_capital_low, intraday_max_drawdown
         current_day_pnl += pnl
+        if mark_trace is not None:
+            mark_trace.append((TRACE_CLOSE, 0, np.nan, np.nan, np.nan, len(trades)))
         equity = float(day_start_capital) + float(current_day_pnl)
         if equity > intraday_capital_peak:
             intraday_capital_peak = equity
@@ -472,6 +476,7 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
     
     position = 0  # 0: 无仓位, 1: 多头, -1: 空头
     entry_price = np.nan
+    entry_raw_price = np.nan  # 未计滑点的开仓价
     trailing_stop = np.nan
     trade_entry_time = None
     trades = []
@@ -541,6 +546,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 'side': 'Long' if position == 1 else 'Short',
                 'entry_price': entry_price,
                 'exit_price': exit_price,
+                'gross_entry_price': entry_raw_price,  # 未计滑点的成交价（供 cost_repricing 事后重定价）
+                'gross_exit_price': exit_mark,
+                'exit_slipped': True,  # 出场是否计了滑点（收盘平仓按原价成交）
                 'pnl': pnl,
                 'exit_reason': reason_tag,
                 'position_size': position_size,
@@ -562,7 +570,134 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         intraday_stop_triggered = True
         return True
 
-    for idx, row in day_df.iterrows():
+    # 逐根所需的数组一次性取出；VWAP 整日一次 cumsum
+    n_bars = len(day_df)
+    bar_times = day_df['Time'].to_numpy()
+    bar_close = day_df['Close'].to_numpy(dtype=float)
+    bar_high = day_df['High'].to_numpy(dtype=float)
+    bar_low = day_df['Low'].to_numpy(dtype=float)
+    bar_upper = day_df['UpperBound'].to_numpy(dtype=float)
+    bar_lower = day_df['LowerBound'].to_numpy(dtype=float)
+    bar_vwap = calculate_day_vwaps(day_df) if n_bars else np.empty(0)
+    bar_allowed = np.fromiter((t in allowed_times for t in bar_times), dtype=bool, count=n_bars)
+
+    # ⏩ 事件跳跃：空仓时直接跳到下一根可能开仓的 K，持仓时向量化找出下一个出场/日内止损事件，
+    # 中间 K 的权益标记统计整段向量化累计；事件 K 仍走下面的逐根逻辑，结果与逐根扫描逐位相同。
+    # 打印明细（追踪止盈激活等日志出现在非事件 K 上）或价格含 NaN 时退回逐根扫描。
+    event_skip = not print_details and bool(
+        np.isfinite(bar_close).all() and np.isfinite(bar_high).all() and np.isfinite(bar_low).all()
+        and np.isfinite(bar_upper).all() and np.isfinite(bar_lower).all()
+    )
+    if event_skip:
+        if 'entry_trend_pass' in day_df.columns:
+            bar_trend_ok = np.array(
+                [True if pd.isna(v) else bool(v) for v in day_df['entry_trend_pass']], dtype=bool
+            )
+        else:
+            bar_trend_ok = np.ones(n_bars, dtype=bool)
+        long_signal = bar_close > bar_upper
+        short_signal = bar_close < bar_lower
+        if use_vwap:
+            long_signal &= bar_close > bar_vwap
+            short_signal &= bar_close < bar_vwap
+        # 开仓候选 K（开仓次数上限与日内止损状态在跳转时另行判断）
+        entry_candidates = bar_allowed & (bar_times != end_time_str) & bar_trend_ok & (long_signal | short_signal)
+
+    def _next_bar(i, flat_at_mark, closed_this_bar):
+        """返回下一根需要逐根处理的 K；被跳过的持仓 K 在此整段累计权益标记。"""
+        nonlocal intraday_capital_peak, intraday_max_drawdown, intraday_capital_high, intraday_capital_low
+        nonlocal max_profit_price, trailing_tp_activated, dynamic_take_profit_level
+        s = i + 1
+        if s >= n_bars:
+            return s
+        if position == 0:
+            if intraday_stop_triggered:
+                return n_bars
+            if not flat_at_mark or closed_this_bar:
+                # 平仓后的首根空仓 K 权益口径与平仓时不同，需逐根判定日内止损
+                return s
+            # 此后空仓 K 的权益标记不变，只需找下一根可开仓的 K
+            if positions_opened_today >= max_positions_per_day:
+                return n_bars
+            hits = np.flatnonzero(entry_candidates[s:])
+            return s + int(hits[0]) if len(hits) else n_bars
+
+        c, h, l = bar_close[s:], bar_high[s:], bar_low[s:]
+        if position == 1:
+            stop_line = np.where(bar_vwap[s:] > bar_upper[s:], bar_vwap[s:], bar_upper[s:]) if use_vwap else bar_upper[s:]
+            strategy_exit = c < stop_line
+            best_u = position_size * (h - entry_price)
+            worst_u = position_size * (l - entry_price)
+        else:
+            stop_line = np.where(bar_vwap[s:] < bar_lower[s:], bar_vwap[s:], bar_lower[s:]) if use_vwap else bar_lower[s:]
+            strategy_exit = c > stop_line
+            best_u = position_size * (entry_price - l)
+            worst_u = position_size * (entry_price - h)
+
+        if enable_trailing_take_profit:
+            if position == 1:
+                mpp = np.fmax.accumulate(np.concatenate(([max_profit_price], h)))[1:]
+                profit_pct = (mpp - entry_price) / entry_price
+            else:
+                mpp = np.fmin.accumulate(np.concatenate(([max_profit_price], l)))[1:]
+                profit_pct = (entry_price - mpp) / entry_price
+            activated = np.logical_or.accumulate(profit_pct >= trailing_tp_activation_pct) | trailing_tp_activated
+            if position == 1:
+                tp_level = entry_price + (mpp - entry_price) * trailing_tp_callback_pct
+                strategy_exit = strategy_exit | (activated & (c <= tp_level))
+            else:
+                tp_level = entry_price - (entry_price - mpp) * trailing_tp_callback_pct
+                strategy_exit = strategy_exit | (activated & (c >= tp_level))
+        event = strategy_exit & bar_allowed[s:]
+        if enable_per_trade_stop_loss and per_trade_stop_loss_pct > 0:
+            if position == 1:
+                event |= l <= entry_price * (1 - per_trade_stop_loss_pct)
+            else:
+                event |= h >= entry_price * (1 + per_trade_stop_loss_pct)
+
+        base = day_start_capital + current_day_pnl
+        best = base + best_u
+        worst = base + worst_u
+        peak = np.maximum.accumulate(np.concatenate(([intraday_capital_peak], best)))[1:]
+        if _daily_stop_active:
+            if _check_peak_trough:
+                event |= worst <= peak - _max_daily_loss_amt
+            if _check_day_start:
+                event |= worst <= day_start_capital - _max_daily_loss_amt
+
+        hits = np.flatnonzero(event)
+        k = int(hits[0]) if len(hits) else len(event)
+        if k == 0:
+            return s
+        if peak[k - 1] > intraday_capital_peak:
+            intraday_capital_peak = peak[k - 1]
+        dd = (peak[:k] - worst[:k]).max()
+        if dd > intraday_max_drawdown:
+            intraday_max_drawdown = dd
+        hi = best[:k].max()
+        if hi > intraday_capital_high:
+            intraday_capital_high = hi
+        lo = worst[:k].min()
+        if lo < intraday_capital_low:
+            intraday_capital_low = lo
+        if mark_trace is not None:
+            n_closed = len(trades)
+            mark_trace.extend(
+                (TRACE_MARK, position, entry_price, hb, lb, n_closed) for hb, lb in zip(h[:k], l[:k])
+            )
+        if enable_trailing_take_profit:
+            # 事件 K 从前一根的追踪止盈状态继续
+            max_profit_price = mpp[k - 1]
+            trailing_tp_activated = bool(activated[k - 1])
+            if trailing_tp_activated:
+                dynamic_take_profit_level = tp_level[k - 1]
+        return s + k
+
+    i = 0
+    while i < n_bars:
+        row = day_df.iloc[i]
+        position_at_mark = position
+        trades_at_mark = len(trades)
         current_time = row['Time']
         price = row['Close']
         high = row['High']
@@ -579,6 +714,12 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         stop_reason = None
         stop_detail = None
         if not intraday_stop_triggered:
+            if mark_trace is not None:
+                if position != 0:
+                    mark_trace.append((TRACE_MARK, position, entry_price, high, low, len(trades)))
+                elif not mark_trace or mark_trace[-1][0] != TRACE_FLAT:
+                    # 空仓时权益不变，连续空仓 K 只记一次
+                    mark_trace.append((TRACE_FLAT, 0, np.nan, np.nan, np.nan, len(trades)))
             # 使用K线的High和Low来计算最好和最坏情况
             if position == 1:  # 多头持仓
                 best_unrealized = position_size * (high - entry_price)
@@ -644,6 +785,7 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
 
         if stop_now:
             _execute_intraday_stop(row, stop_exit_mark, stop_reason, stop_detail)
+            i = _next_bar(i, False, True) if event_skip else i + 1
             continue
 
         # # 调试特定时间点
@@ -658,19 +800,8 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         #     print("=====================================\n")
         #     debug_printed = True  # 确保只打印一次
         
-        # 计算当前VWAP（使用真实的Turnover数据）
-        # 获取当前行在DataFrame中的位置索引
-        current_index = day_df.index.get_loc(idx)
-        
-        # 检查是否有Turnover字段
-        if 'Turnover' in day_df.columns:
-            vwap = calculate_vwap_with_turnover(day_df, current_index)
-        else:
-            # 如果没有Turnover字段，回退到使用HL平均值的方法
-            highs = day_df.iloc[:current_index + 1]['High'].tolist()
-            lows = day_df.iloc[:current_index + 1]['Low'].tolist()
-            volumes = day_df.iloc[:current_index + 1]['Volume'].tolist()
-            vwap = calculate_vwap_with_hl_average(highs, lows, volumes)
+        # 当前VWAP（整日累计数组，见 calculate_day_vwaps）
+        vwap = bar_vwap[i]
         
         # 🛡️ 日内止损检查 - 如果已触发止损，当日不再开仓
         if enable_intraday_stop_loss and intraday_stop_triggered:
@@ -711,6 +842,7 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 # 允许多头入场
                 position = 1
                 entry_price = apply_slippage(price, is_buy=True, is_entry=True)  # 多头开仓是买入
+                entry_raw_price = price
                 trade_entry_time = row['DateTime']
                 positions_opened_today += 1  # 增加开仓计数器
                 # 初始止损设置
@@ -750,6 +882,7 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 # 允许空头入场
                 position = -1
                 entry_price = apply_slippage(price, is_buy=False, is_entry=True)  # 空头开仓是卖出
+                entry_raw_price = price
                 trade_entry_time = row['DateTime']
                 positions_opened_today += 1  # 增加开仓计数器
                 # 初始止损设置
@@ -851,6 +984,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                         'side': 'Long',
                         'entry_price': entry_price,
                         'exit_price': exit_price,
+                        'gross_entry_price': entry_raw_price,
+                        'gross_exit_price': exit_raw_price,
+                        'exit_slipped': True,
                         'pnl': pnl,
                         'exit_reason': exit_reason,
                         'position_size': position_size,
@@ -965,6 +1101,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                         'side': 'Short',
                         'entry_price': entry_price,
                         'exit_price': exit_price,
+                        'gross_entry_price': entry_raw_price,
+                        'gross_exit_price': exit_raw_price,
+                        'exit_slipped': True,
                         'pnl': pnl,
                         'exit_reason': exit_reason,
                         'position_size': position_size,
@@ -987,6 +1126,11 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                     max_profit_price = np.nan
                     trailing_tp_activated = False
                     dynamic_take_profit_level = np.nan
+
+        if event_skip:
+            i = _next_bar(i, position_at_mark == 0, len(trades) != trades_at_mark)
+        else:
+            i += 1
     
     # 获取交易结束时间字符串，格式为HH:MM
     end_time_str = f"{trading_end_time[0]:02d}:{trading_end_time[1]:02d}"
@@ -1019,6 +1163,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 'side': 'Long',
                 'entry_price': entry_price,
                 'exit_price': close_price,
+                'gross_entry_price': entry_raw_price,
+                'gross_exit_price': close_price,
+                'exit_slipped': False,
                 'pnl': pnl,
                 'exit_reason': 'Intraday Close',
                 'position_size': position_size,
@@ -1058,6 +1205,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 'side': 'Short',
                 'entry_price': entry_price,
                 'exit_price': close_price,
+                'gross_entry_price': entry_raw_price,
+                'gross_exit_price': close_price,
+                'exit_slipped': False,
                 'pnl': pnl,
                 'exit_reason': 'Intraday Close',
                 'position_size': position_size,
@@ -1105,6 +1255,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 'side': 'Long',
                 'entry_price': entry_price,
                 'exit_price': exit_price,
+                'gross_entry_price': entry_raw_price,
+                'gross_exit_price': last_price,
+                'exit_slipped': True,
                 'pnl': pnl,
                 'exit_reason': 'Market Close',
                 'position_size': position_size,
@@ -1143,6 +1296,9 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
                 'side': 'Short',
                 'entry_price': entry_price,
                 'exit_price': exit_price,
+                'gross_entry_price': entry_raw_price,
+                'gross_exit_price': last_price,
+                'exit_slipped': True,
                 'pnl': pnl,
                 'exit_reason': 'Market Close',
                 'position_size': position_size,
@@ -1176,19 +1332,39 @@ def simulate_day(day_df, prev_close, allowed_times, position_size, config, day_s
         intraday_capital_high,
     )
 
-def run_backtest(config):
+def run_backtest(config, force=False):
     """
     运行回测 - 噪声空间策略 + VWAP
     
     参数:
         config: 配置字典，包含所有回测参数
+        force: 启用结果缓存时跳过读取、重新计算并覆盖缓存
         
     返回:
         日度结果DataFrame
         月度结果DataFrame
         交易记录DataFrame
         性能指标字典
+
+    config['result_cache'] 为 True（或缓存库路径）时按 (数据集内容, 规范化配置, ENGINE_VERSION)
+    记忆结果（见 result_cache）；命中时直接返回，不再打印报告、绘图或落盘。
     """
+    cache_opt = config.get('result_cache')
+    if cache_opt:
+        from result_cache import cached_call
+
+        return cached_call(
+            'backtest',
+            config,
+            lambda: _run_backtest(config),
+            force=force,
+            db_path=cache_opt if isinstance(cache_opt, str) else None,
+            label=f"{config.get('ticker') or config.get('dataset_symbol')} {config.get('start_date')}~{config.get('end_date')}",
+        )
+    return _run_backtest(config)
+
+
+def _run_backtest(config):
     # 从配置中提取参数
     data_path = config.get('data_path')
     ticker = config.get('ticker')
@@ -1212,14 +1388,16 @@ def run_backtest(config):
     leverage = config.get('leverage', 1)  # 资金杠杆倍数，默认为1
     
     # 如果未提供ticker，从文件名中提取
-    if ticker is None:
+    if ticker is None and data_path is None:
+        ticker = config.get('dataset_symbol')
+    elif ticker is None:
         # 从文件名中提取ticker
         file_name = os.path.basename(data_path)
         # 移除_market_hours.csv（如果存在）
         ticker = file_name.replace('_market_hours.csv', '')
     
     # 加载和处理数据
-    price_df = pd.read_csv(data_path, parse_dates=['DateTime'])
+    price_df = load_price_data(config)
     price_df.sort_values('DateTime', inplace=True)
     
     # 提取日期和时间组件
@@ -1227,7 +1405,7 @@ def run_backtest(config):
     price_df['Time'] = price_df['DateTime'].dt.strftime('%H:%M')
 
     # 用全样本日收盘计算日频趋势特征（不修改 CSV）；回测窗口截断后再按 Date 合并
-    trend_feat_df = compute_daily_trend_features(price_df)
+    trend_feat_df = load_trend_features(price_df, config, feature_store_symbol(config, ticker))
     
     # 按日期范围过滤数据（如果指定）
     if start_date is not None:
@@ -1239,155 +1417,27 @@ def run_backtest(config):
     price_df = pd.merge(price_df, trend_feat_df, on='Date', how='left')
     # entry_trend_pass 延后到 sigma / 日内特征算完后再写（支持 sigma、minutes_from_open 等门控）
     
-    print(f"加载{ticker}数据: {data_path} ({start_date} ~ {end_date})")
-    
-    # 检查DayOpen和DayClose列是否存在，如果不存在则创建
-    if 'DayOpen' not in price_df.columns or 'DayClose' not in price_df.columns:
-        # 对于每一天，获取第一行（9:30 AM开盘价）
-        opening_prices = price_df.groupby('Date').first().reset_index()
-        opening_prices = opening_prices[['Date', 'Open']].rename(columns={'Open': 'DayOpen'})
-
-        # 对于每一天，获取最后一行（4:00 PM收盘价）
-        closing_prices = price_df.groupby('Date').last().reset_index()
-        closing_prices = closing_prices[['Date', 'Close']].rename(columns={'Close': 'DayClose'})
-
-        # 将开盘价和收盘价合并回主DataFrame
-        price_df = pd.merge(price_df, opening_prices, on='Date', how='left')
-        price_df = pd.merge(price_df, closing_prices, on='Date', how='left')
-    
-    # 使用筛选后数据的DayOpen和DayClose
-    # 这些代表9:30 AM开盘价和4:00 PM收盘价
-    price_df['prev_close'] = price_df.groupby('Date')['DayClose'].transform('first').shift(1)
-    
-    # 使用9:30 AM价格作为当天的开盘价
-    price_df['day_open'] = price_df.groupby('Date')['DayOpen'].transform('first')
+    print(f"加载{ticker}数据: {data_path or 'dataset_registry:' + str(config.get('dataset_symbol'))} ({start_date} ~ {end_date})")
     
-    # 为每个交易日计算一次参考价格，并将其应用于该日的所有时间点
-    # 这确保了整个交易日使用相同的参考价格
-    unique_dates = price_df['Date'].unique()
-    
-    # 创建临时DataFrame来存储每个日期的参考价格
-    date_refs = []
-    for d in unique_dates:
-        day_data = price_df[price_df['Date'] == d].iloc[0]  # 获取该日第一行数据
-        day_open = day_data['day_open']
-        prev_close = day_data['prev_close']
-        
-        # 计算该日的参考价格
-        if not pd.isna(prev_close):
-            upper_ref = max(day_open, prev_close)
-            lower_ref = min(day_open, prev_close)
-        else:
-            upper_ref = day_open
-            lower_ref = day_open
-            
-        date_refs.append({
-            'Date': d,
-            'upper_ref': upper_ref,
-            'lower_ref': lower_ref
-        })
-    
-    # 创建日期参考价格DataFrame
-    date_refs_df = pd.DataFrame(date_refs)
-    
-    # 检查是否有足够的数据进行处理
-    if date_refs_df.empty or len(date_refs) == 0:
+    # 预处理在日×分钟矩阵上完成（day_matrix.DayMatrix）：
+    # DayOpen/DayClose 已存在时沿用，否则取每日首根 K 开盘与末根 K 收盘；
+    # 参考价 upper_ref/lower_ref = max/min(当日开盘, 昨收)；
+    # sigma 为同一时间点 |ret| 沿实际交易日（非日历日）滚动均值并下移一日，
+    # 因此周一或节假日后的第一个交易日使用的是前一个交易日的数据
+    raw_matrix = DayMatrix.from_frame(price_df)
+    if raw_matrix.n_days == 0:
         raise ValueError(f"在指定日期范围内没有找到有效的交易数据。请检查日期范围设置。")
-    
-    # 将参考价格合并回主DataFrame
-    price_df = price_df.drop(columns=['upper_ref', 'lower_ref'], errors='ignore')
-    
-    # 检查Date列是否存在
-    if 'Date' not in price_df.columns:
-        raise ValueError("price_df中缺少Date列，无法进行合并操作")
-    if 'Date' not in date_refs_df.columns:
-        raise ValueError("date_refs_df中缺少Date列，无法进行合并操作")
-    
-    price_df = pd.merge(price_df, date_refs_df, on='Date', how='left')
-    
-    # 计算每分钟相对开盘的回报（使用day_open保持一致性）
-    price_df['ret'] = price_df['Close'] / price_df['day_open'] - 1 
-
-    # 计算噪声区域边界
-    # 将时间点转为列
-    pivot = price_df.pivot(index='Date', columns='Time', values='ret').abs()
-    
-    # 重要修复：确保rolling基于实际交易日而不是日历日
-    # 对于周一或节假日后的第一个交易日，应该使用前一个交易日的数据
-    # 这里使用实际存在的交易日进行rolling计算
-    sigma = pivot.rolling(window=lookback_days, min_periods=lookback_days).mean().shift(1)
-    
-    # 对于lookback_days=1的情况，特殊处理：直接使用前一个交易日的数据
-    if lookback_days == 1:
-        # shift(1)已经确保使用前一个交易日的数据
-        # 因为pivot的索引只包含实际的交易日，所以shift(1)会自动跳过周末
-        pass
-    
-    # 转回长格式
-    sigma = sigma.stack().reset_index(name='sigma')
-    
-    
-    # 保存一个原始数据的副本，用于计算买入持有策略
-    price_df_original = price_df.copy()
-    
-    # 将sigma合并回主DataFrame
-    price_df = pd.merge(price_df, sigma, on=['Date', 'Time'], how='left')
-    
-    # 检查每个交易日是否有足够的sigma数据
-    # 创建一个标记，记录哪些日期的sigma数据严重不完整（缺失超过10%）
-    incomplete_sigma_dates = set()
-    for date in price_df['Date'].unique():
-        day_data = price_df[price_df['Date'] == date]
-        na_count = day_data['sigma'].isna().sum()
-        total_count = len(day_data)
-        missing_ratio = na_count / total_count if total_count > 0 else 1.0
-        
-        # 只有当缺失率超过10%时才过滤掉这一天
-        if missing_ratio > 0.1:
-            incomplete_sigma_dates.add(date)
-            incomplete_sigma_dates.add(date)
-            # print(f"{date} sigma缺失率过高: {na_count}/{total_count} ({missing_ratio*100:.1f}%) - 将被过滤")
-        # elif na_count > 0:
-            # 少量缺失值，填充为前值
-            # print(f"{date} 有少量sigma缺失: {na_count}/{total_count} ({missing_ratio*100:.1f}%) - 将被保留")
-    
-    # 移除sigma数据严重不完整的日期
-    # if incomplete_sigma_dates:
-    #     print(f"sigma严重不完整的日期（将被过滤）: {sorted(incomplete_sigma_dates)}")
-    price_df = price_df[~price_df['Date'].isin(incomplete_sigma_dates)]
-    
-    # 对于剩余的少量缺失值，使用前值填充（forward fill）
-    price_df['sigma'] = price_df.groupby('Date')['sigma'].ffill()
-    # 如果还有缺失（比如第一个值），使用后值填充
-    price_df['sigma'] = price_df.groupby('Date')['sigma'].bfill()
-    # 如果整个时间点都缺失，使用0填充（保守策略）
-    price_df['sigma'] = price_df['sigma'].fillna(0)
-    
-    # 确保所有剩余的sigma值都有有效数据
-    if price_df['sigma'].isna().any():
-        print(f"警告: 仍有{price_df['sigma'].isna().sum()}个缺失的sigma值")
-    
-    
-    # 日内特征（供 k_side_adjustment 动态 K 使用）
-    price_df['intraday_ret'] = price_df['Close'] / price_df['day_open'] - 1
-    day_start_dt = price_df.groupby('Date')['DateTime'].transform('min')
-    price_df['minutes_from_open'] = (price_df['DateTime'] - day_start_dt).dt.total_seconds() / 60
-    price_df['cum_high'] = price_df.groupby('Date')['High'].cummax()
-    price_df['cum_low'] = price_df.groupby('Date')['Low'].cummin()
-    intraday_span = price_df['cum_high'] - price_df['cum_low']
-    price_df['intraday_range_pos'] = (
-        (price_df['Close'] - price_df['cum_low']) / intraday_span.replace(0, np.nan)
-    ).clip(0, 1)
-    day_sigma_med = price_df.groupby('Date')['sigma'].transform('median')
-    price_df['sigma_vs_day_median'] = price_df['sigma'] / day_sigma_med.replace(0, np.nan)
+    # raw_matrix 保留全部交易日（买入持有基准用）；sigma 缺失超过10%的日期在 matrix 中被剔除，
+    # 剩余少量缺失当日内先前值、后值填充，整段缺失记 0（保守策略）
+    matrix = raw_matrix.prepare_noise_area(lookback_days)
 
     # 噪声区域上下边界（支持 k_side_adjustment 动态 K1/K2）
     k1_base = config.get('K1', 1)
     k2_base = config.get('K2', 1)
-    price_df = apply_k_bounds(price_df, config)
+    matrix = apply_k_bounds(matrix, config)
 
     # 开仓门控：放在 sigma 与边界之后，才能使用 sigma / minutes_from_open 等列
-    price_df['entry_trend_pass'] = compute_entry_trend_pass_series(price_df, config)
+    matrix['entry_trend_pass'] = compute_entry_trend_pass_series(matrix, config)
     
     # 根据检查间隔生成允许的交易时间
     allowed_times = []
@@ -1418,8 +1468,10 @@ def run_backtest(config):
     entry_filter = config.get('entry_trend_filter')
     slip = config.get('slippage_per_share', 0)
     if config.get('enable_k_side_adjustment', False) and config.get('k_side_adjustment'):
-        k1_rng = (price_df['K1_eff'].min(), price_df['K1_eff'].max())
-        k2_rng = (price_df['K2_eff'].min(), price_df['K2_eff'].max())
+        k1_vals = matrix.valid_values('K1_eff')
+        k2_vals = matrix.valid_values('K2_eff')
+        k1_rng = (k1_vals.min(), k1_vals.max())
+        k2_rng = (k2_vals.min(), k2_vals.max())
         k_info = f"K1={k1_base}∈[{k1_rng[0]:.2f},{k1_rng[1]:.2f}], K2={k2_base}∈[{k2_rng[0]:.2f},{k2_rng[1]:.2f}]"
     else:
         k_info = f"K1={k1_base}, K2={k2_base}"
@@ -1459,8 +1511,8 @@ def run_backtest(config):
     days_with_trades = []
     if random_plots > 0:
         # 先运行回测，记录有交易的日期
-        for trade_date in unique_dates:
-            day_data = price_df[price_df['Date'] == trade_date].copy()
+        for day_idx, trade_date in enumerate(matrix.dates):
+            day_data = matrix.day_frame(day_idx)
             # 设置数据点阈值：对于今天允许更少的数据点
             is_today = (day_data['Date'].iloc[0] == datetime.now().date()) if len(day_data) > 0 else False
             min_data_points = 1 if is_today else 10
@@ -1501,22 +1553,22 @@ def run_backtest(config):
     
     # 创建买入持有回测数据（使用原始数据，不受sigma筛选影响）
     buy_hold_data = []
-    filtered_dates = price_df['Date'].unique()  # 策略交易使用的日期（经过sigma筛选）
+    filtered_dates = matrix.dates  # 策略交易使用的日期（经过sigma筛选）
     
     # 创建独立的买入持有数据，使用原始数据（未经过sigma筛选）
-    for trade_date in unique_dates:
-        # 获取当天的数据（从原始数据中）
-        day_data = price_df_original[price_df_original['Date'] == trade_date].copy()
-
+    raw_counts = raw_matrix.day_counts
+    raw_day_open = raw_matrix.day('day_open')
+    raw_day_close = raw_matrix.day('DayClose')
+    for day_idx, trade_date in enumerate(raw_matrix.dates):
         # 跳过数据不足的日期
-        is_today = (day_data['Date'].iloc[0] == datetime.now().date()) if len(day_data) > 0 else False
+        is_today = trade_date == datetime.now().date()
         min_data_points = 1 if is_today else 10
-        if len(day_data) < min_data_points:  # 任意阈值
+        if raw_counts[day_idx] < min_data_points:  # 任意阈值
             continue
         
         # 获取当天的开盘价和收盘价（用于计算买入持有）
-        open_price = day_data['day_open'].iloc[0]
-        close_price = day_data['DayClose'].iloc[0]
+        open_price = raw_day_open[day_idx]
+        close_price = raw_day_close[day_idx]
         
         # 存储买入持有数据
         buy_hold_data.append({
@@ -1526,11 +1578,19 @@ def run_backtest(config):
         })
     
     # 处理策略交易部分
+    # parallel_workers>=1 时走两阶段引擎（two_phase_engine）：先并行做单位仓位模拟，
+    # 循环内按当日股数缩放，只有日内止损会触发的交易日才按真实股数重算
+    parallel_workers = config.get('parallel_workers')
+    unit_days = None
+    resimulated_days = 0
+    if parallel_workers and not print_trade_details:
+        from two_phase_engine import scale_unit_day, simulate_unit_days
+
+        unit_days = simulate_unit_days(matrix, allowed_times, config, workers=parallel_workers)
     
     for i, trade_date in enumerate(filtered_dates):
         # 获取当天的数据
-        day_data = price_df[price_df['Date'] == trade_date].copy()
-        day_data = day_data.sort_values('DateTime').reset_index(drop=True)
+        day_data = matrix.day_frame(i)
         
         
         # 跳过数据不足的日期
@@ -1563,12 +1623,20 @@ def run_backtest(config):
             daily_results.append({
                 'Date': trade_date,
                 'capital': capital,
-                'daily_return': 0
+                'daily_return': 0,
+                'day_open': day_open_price,
+                'position_size': 0,
             })
             continue
                 
         # 模拟当天的交易
-        simulation_result = simulate_day(day_data, prev_close, allowed_times, position_size, config, capital)
+        simulation_result = None
+        if unit_days is not None and unit_days[i] is not None:
+            simulation_result = scale_unit_day(unit_days[i], position_size, capital, config)
+            if simulation_result is None:
+                resimulated_days += 1
+        if simulation_result is None:
+            simulation_result = simulate_day(day_data, prev_close, allowed_times, position_size, config, capital)
         
         # 从结果中提取交易、日内回撤、日内最低/最高资金
         trades, intraday_mdd_pct, intraday_loss_from_start_pct, intraday_low, intraday_high = simulation_result
@@ -1679,11 +1747,15 @@ def run_backtest(config):
         capital += day_pnl
         daily_return = day_pnl / capital_start
 
-        # 存储每日结果
+        # 存储每日结果（day_open / position_size / 日内回撤供 cost_repricing 按新成本模型复算复利）
         daily_results.append({
             'Date': trade_date,
             'capital': capital,
-            'daily_return': daily_return
+            'daily_return': daily_return,
+            'day_open': day_open_price,
+            'position_size': position_size,
+            'intraday_mdd_pct': intraday_mdd_pct,
+            'intraday_loss_from_start_pct': intraday_loss_from_start_pct,
         })
         
         # 存储交易
@@ -1691,6 +1763,9 @@ def run_backtest(config):
             trade['Date'] = trade_date
             all_trades.append(trade)
     
+    if unit_days is not None:
+        print(f"两阶段引擎: {len(unit_days)} 日单位仓位模拟（{parallel_workers} 进程），{resimulated_days} 日因日内止损按真实股数重算")
+
     # 创建每日结果DataFrame
     daily_df = pd.DataFrame(daily_results)
     
@@ -1797,6 +1872,7 @@ def run_backtest(config):
     metrics['top_precise_drawdown_days'] = _top_dd_days('precise_dd_pct')
     metrics['top_single_day_intraday_mdd_days'] = _top_dd_days('intraday_mdd_pct')
     metrics['top_single_day_loss_from_start_days'] = _top_dd_days('loss_from_start_pct')
+    metrics['daily_drawdown_records'] = daily_dd_records
 
     # 计算总滑点损耗
     slippage_per_share = config.get('slippage_per_share', 0.01)
@@ -1915,6 +1991,23 @@ def run_backtest(config):
         except Exception as e:
             print(f"警告: 权益报告生成失败: {e}")
 
+    # 可选：结果落盘为 Parquet 列式目录（backtest_store），供 notebook / 权益报告按列惰性读取
+    if config.get('results_dir'):
+        from backtest_store import save_backtest_results
+
+        try:
+            saved_dir = save_backtest_results(
+                config['results_dir'],
+                daily_df,
+                trades_df,
+                metrics,
+                monthly=monthly,
+                config=config,
+            )
+            print(f"回测结果已保存: {saved_dir}")
+        except Exception as e:
+            print(f"警告: 回测结果保存失败: {e}")
+
     return daily_df, monthly, trades_df, metrics 
 
 def calculate_performance_metrics(daily_df, trades_df, initial_capital, risk_free_rate=0.02, trading_days_per_year=252, buy_hold_df=None):
@@ -2360,6 +2453,7 @@ if __name__ == "__main__":
         'check_interval_minutes': 15 ,
         'enable_transaction_fees': True,  # 是否启用手续费计算，False表示不计算手续费
         # —— 券商交易成本（单边 $/股；往返 = 股数 × (fee + slippage) × 2）——
+        # 对比不同券商成本无需重跑：results_dir 落盘后 python cost_repricing.py <results_dir>
         # Longport：平台约 $0.005 + 交收约 $0.003 → 有效单边约 $0.008166
         'transaction_fee_per_share': 0.008166,  # Longport
         # 'transaction_fee_per_share': 0.005,  # IBKR Pro Fixed
@@ -2382,6 +2476,10 @@ if __name__ == "__main__":
         # 'equity_report_dir': 'reports',
         # 'equity_report_open_browser': True,
         # 'equity_report_path': 'reports/equity_report.html',
+        # 'parallel_workers': 4,  # 两阶段引擎：单位仓位并行模拟 + 顺序缩放（见 two_phase_engine），结果与逐日模拟一致
+        # 'results_dir': 'reports/backtest_results',  # Parquet 列式结果目录（见 backtest_store）
+        # 'feature_store_path': 'feature_store.db',  # 趋势特征走持久化特征库（与实盘门控同一套代码，见 feature_store）
+        # 'result_cache': True,  # 相同数据+配置+引擎版本直接复用结果（见 result_cache）；run_backtest(config, force=True) 强制重算
         'K1': 1,  # 上边界sigma乘数（多头）基准；午后动态见 k_side_adjustment
         'K2': 1.04,  # 下边界sigma乘数（空头），本规则不调整空头
         'enable_k_side_adjustment': True,  # 动态 K 总开关；False 时忽略下方 k_side_adjustment，退化为固定 K1/K2
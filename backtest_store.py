@@ -0,0 +1,239 @@
+"""
+回测结果列式存储（Parquet + manifest）。
+
+把 run_backtest / ftmo_ibkr_combo_backtest.run_window 的产物落盘为按表分开的 Parquet 文件：
+  - daily:     按日权益（index=Date）
+  - monthly:   月度回报
+  - trades:    逐笔成交台账
+  - drawdowns: 每日回撤记录（precise_dd_pct / intraday_mdd_pct / loss_from_start_pct）
+  - 其它任意 DataFrame（extra_tables）
+metrics / config 写入 JSON，manifest.json 记录每张表的行数、列名与类型。
+
+读取端 load_backtest_results 只读 manifest，表和列在首次访问时才从 Parquet 按列读取，
+大批量参数扫描的结果目录可以在 notebook / 权益报告里按需打开，而不必整体解析 CSV。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from datetime import date, datetime
+from typing import Any, Iterable, Mapping, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STORE_FORMAT_VERSION = 1
+MANIFEST_NAME = 'manifest.json'
+METRICS_NAME = 'metrics.json'
+
+
+def _json_default(value: Any) -> Any:
+    """metrics / config 里的 Timestamp、date、numpy 标量等转为 JSON 可写形式。"""
+    if isinstance(value, (pd.Timestamp, datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    if value is pd.NaT:
+        return None
+    return str(value)
+
+
+def _coerce_for_arrow(df: pd.DataFrame) -> pd.DataFrame:
+    """混合类型的 object 列（如 None 与 float/str 混杂）无法直接转 Arrow，退化为字符串列。"""
+    out = df
+    for col in df.columns:
+        if df[col].dtype != object:
+            continue
+        try:
+            pa.array(df[col], from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            if out is df:
+                out = df.copy()
+            out[col] = df[col].map(lambda v: None if v is None or (isinstance(v, float) and np.isnan(v)) else str(v))
+    return out
+
+
+def _write_table(path: str, df: pd.DataFrame) -> dict:
+    """写单张表，返回 manifest 中该表的描述。索引（如 daily 的 Date）作为普通列保存并记录列名。"""
+    index_cols: list[str] = []
+    if not isinstance(df.index, pd.RangeIndex):
+        index_cols = [n if n is not None else 'index' for n in df.index.names]
+        df = df.reset_index()
+        df.columns = [str(c) for c in df.columns]
+    table = pa.Table.from_pandas(_coerce_for_arrow(df), preserve_index=False)
+    pq.write_table(table, path)
+    return {
+        'file': os.path.basename(path),
+        'rows': int(table.num_rows),
+        'columns': {f.name: str(f.type) for f in table.schema},
+        'index': index_cols,
+    }
+
+
+def save_backtest_results(
+    output_dir: str,
+    daily_df: pd.DataFrame,
+    trades_df: Optional[pd.DataFrame] = None,
+    metrics: Optional[Mapping[str, Any]] = None,
+    *,
+    monthly: Optional[pd.DataFrame] = None,
+    drawdown_records: Optional[Sequence[Mapping[str, Any]]] = None,
+    config: Optional[Mapping[str, Any]] = None,
+    extra_tables: Optional[Mapping[str, pd.DataFrame]] = None,
+) -> str:
+    """
+    写出一份回测结果目录（整体原子替换：先写临时目录再 rename）。
+
+    参数:
+        output_dir: 结果目录；已存在时整体覆盖
+        daily_df: run_backtest 返回的 daily_df（index=Date）
+        trades_df: 成交台账
+        metrics: 指标字典；其中的 daily_drawdown_records 会拆成 drawdowns 表
+        monthly: 月度回报表
+        drawdown_records: 每日回撤记录（list[dict]），优先于 metrics 内的同名字段
+        config: 回测配置，写入 manifest 便于追溯
+        extra_tables: 其它需要一并保存的表（表名 -> DataFrame）
+
+    返回:
+        结果目录绝对路径
+    """
+    output_dir = os.path.abspath(output_dir)
+    parent = os.path.dirname(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    metrics = dict(metrics or {})
+    if drawdown_records is None:
+        drawdown_records = metrics.get('daily_drawdown_records')
+    metrics.pop('daily_drawdown_records', None)
+
+    tables: dict[str, pd.DataFrame] = {'daily': daily_df}
+    if monthly is not None:
+        tables['monthly'] = monthly
+    if trades_df is not None:
+        tables['trades'] = trades_df
+    if drawdown_records:
+        tables['drawdowns'] = pd.DataFrame(list(drawdown_records))
+    for name, df in (extra_tables or {}).items():
+        if df is not None:
+            tables[name] = df
+
+    manifest: dict[str, Any] = {
+        'format_version': STORE_FORMAT_VERSION,
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'tables': {},
+        'metrics_file': METRICS_NAME,
+        'config': json.loads(json.dumps(dict(config or {}), default=_json_default)),
+    }
+    for name, df in tables.items():
+        manifest['tables'][name] = _write_table(os.path.join(tmp_dir, f'{name}.parquet'), df)
+
+    with open(os.path.join(tmp_dir, METRICS_NAME), 'w', encoding='utf-8') as f:
+        json.dump(metrics, f, ensure_ascii=False, indent=2, default=_json_default)
+    with open(os.path.join(tmp_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(output_dir):
+        old_dir = f"{output_dir}.old-{os.getpid()}"
+        os.rename(output_dir, old_dir)
+        os.rename(tmp_dir, output_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+    else:
+        os.rename(tmp_dir, output_dir)
+    return output_dir
+
+
+class BacktestResults:
+    """
+    惰性读取 save_backtest_results 写出的结果目录。
+
+    打开时只读 manifest；column() / table(columns=...) 只从 Parquet 读取所需列，
+    读过的列缓存在内存中，metrics 首次访问时才解析。
+    """
+
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        manifest_path = os.path.join(self.path, MANIFEST_NAME)
+        if not os.path.exists(manifest_path):
+            raise FileNotFoundError(f"结果目录缺少 {MANIFEST_NAME}: {self.path}")
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self._columns_cache: dict[tuple[str, str], pd.Series] = {}
+        self._metrics: Optional[dict] = None
+
+    def __repr__(self) -> str:
+        parts = [f"{name}({meta['rows']}行)" for name, meta in self.manifest['tables'].items()]
+        return f"BacktestResults({self.path}: {', '.join(parts)})"
+
+    @property
+    def tables(self) -> list[str]:
+        return list(self.manifest['tables'].keys())
+
+    @property
+    def config(self) -> dict:
+        return self.manifest.get('config', {})
+
+    @property
+    def metrics(self) -> dict:
+        """指标字典（日期类字段为 ISO 字符串）。"""
+        if self._metrics is None:
+            with open(os.path.join(self.path, self.manifest.get('metrics_file', METRICS_NAME)), 'r', encoding='utf-8') as f:
+                self._metrics = json.load(f)
+        return self._metrics
+
+    def _table_meta(self, table: str) -> dict:
+        if table not in self.manifest['tables']:
+            raise KeyError(f"结果目录中没有表 {table}，可用: {self.tables}")
+        return self.manifest['tables'][table]
+
+    def columns(self, table: str) -> list[str]:
+        return list(self._table_meta(table)['columns'].keys())
+
+    def num_rows(self, table: str) -> int:
+        return int(self._table_meta(table)['rows'])
+
+    def column(self, table: str, name: str) -> pd.Series:
+        """读取单列（带缓存）。"""
+        key = (table, name)
+        if key not in self._columns_cache:
+            meta = self._table_meta(table)
+            if name not in meta['columns']:
+                raise KeyError(f"表 {table} 中没有列 {name}")
+            arrow_tbl = pq.read_table(os.path.join(self.path, meta['file']), columns=[name])
+            self._columns_cache[key] = arrow_tbl.column(0).to_pandas().rename(name)
+        return self._columns_cache[key]
+
+    def table(self, table: str, columns: Optional[Iterable[str]] = None, *, restore_index: bool = True) -> pd.DataFrame:
+        """
+        按列组装 DataFrame。columns=None 时读取全部列；
+        保存时的索引列（如 daily 的 Date）被选中时恢复为索引。
+        """
+        meta = self._table_meta(table)
+        wanted = list(meta['columns'].keys()) if columns is None else list(columns)
+        index_cols = [c for c in meta.get('index', []) if c in meta['columns']]
+        if restore_index:
+            wanted = index_cols + [c for c in wanted if c not in index_cols]
+        df = pd.DataFrame({c: self.column(table, c) for c in wanted})
+        if restore_index and index_cols:
+            df = df.set_index(index_cols)
+        return df
+
+
+def load_backtest_results(path: str) -> BacktestResults:
+    """打开结果目录（只读 manifest，数据按需加载）。"""
+    return BacktestResults(path)
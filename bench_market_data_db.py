@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+market_data_cache.db 读写争用基准。
+
+1 个写进程模拟行情服务（每轮写 2 根 K 线 + 报价 + 日历/心跳），N 个读进程模拟 simulate_*.py
+（循环执行 get_historical_data 的 20 天 K 线查询、get_quote、心跳检查、交易日历读取），统计:
+  - 写者每轮提交耗时分布与「卡顿」次数（超过 --stall-ms）
+  - 读者查询耗时分布与 "database is locked" 错误数
+
+默认按现行方式（WAL + 写者长连接单事务 + 读者只读长连接）；--legacy 复现旧方式
+（回滚日志模式、每个函数各自 connect/commit/close）作对比。
+
+用法:
+  python bench_market_data_db.py --readers 12 --seconds 10
+  python bench_market_data_db.py --readers 12 --seconds 10 --legacy
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sqlite3
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from market_data_client import init_schema, market_data_connection, open_writer_connection
+
+BENCH_SYMBOL = "QQQ.US"
+BENCH_HISTORY_DAYS = 20
+
+HISTORY_SQL = """
+SELECT datetime_et, open, high, low, close, volume, turnover
+FROM candles
+WHERE symbol = ? AND date >= ? AND date <= ?
+ORDER BY datetime_et ASC
+"""
+QUOTE_SQL = "SELECT symbol, last_done, open, high, low, volume, turnover, quote_timestamp FROM quotes WHERE symbol = ?"
+HEARTBEAT_SQL = "SELECT value FROM service_state WHERE key = 'last_success_at'"
+CALENDAR_SQL = """
+SELECT key, value FROM service_state
+WHERE key IN ('calendar_date', 'is_trading_day', 'is_half_trading_day', 'prev_trading_day_is_half')
+"""
+
+
+def _bar_row(ts, px, now_str):
+    return (BENCH_SYMBOL, ts.strftime("%Y-%m-%d %H:%M:%S"), ts.date().isoformat(), ts.strftime("%H:%M"),
+            px, px + 0.1, px - 0.1, px, 1000.0, px * 1000.0, now_str)
+
+
+def seed_database(db_path, legacy):
+    """写入 BENCH_HISTORY_DAYS 个工作日 × 391 根 K 线，以及报价与服务状态。"""
+    conn = sqlite3.connect(db_path) if legacy else open_writer_connection(db_path)
+    if legacy:
+        conn.execute("PRAGMA journal_mode=DELETE")
+    init_schema(conn)
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    day = date.today()
+    n_days = 0
+    while n_days < BENCH_HISTORY_DAYS:
+        day -= timedelta(days=1)
+        if day.weekday() >= 5:
+            continue
+        n_days += 1
+        start = datetime.combine(day, datetime.min.time()).replace(hour=9, minute=30)
+        rows += [_bar_row(start + timedelta(minutes=m), 400.0 + m * 0.01, now_str) for m in range(391)]
+    with conn if legacy else _transaction(conn):
+        conn.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT OR REPLACE INTO service_state VALUES (?, ?, ?)", _state_rows(now_str))
+        conn.execute("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                     (BENCH_SYMBOL, "400", "400", "401", "399", "1", "1", now_str, now_str))
+    conn.close()
+
+
+class _transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _state_rows(now_str):
+    today = date.today().isoformat()
+    return [
+        ("calendar_date", today, now_str),
+        ("is_trading_day", "1", now_str),
+        ("is_half_trading_day", "0", now_str),
+        ("prev_trading_day", "", now_str),
+        ("prev_trading_day_is_half", "0", now_str),
+        ("last_success_at", now_str, now_str),
+    ]
+
+
+def writer_process(db_path, legacy, seconds, interval, out):
+    durations = []
+    errors = 0
+    conn = None if legacy else open_writer_connection(db_path)
+    ts = datetime.combine(date.today(), datetime.min.time()).replace(hour=9, minute=30)
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        bars = [_bar_row(ts, 400.0, now_str), _bar_row(ts + timedelta(minutes=1), 400.1, now_str)]
+        ts += timedelta(minutes=1)
+        quote = (BENCH_SYMBOL, "400.1", "400", "401", "399", "1", "1", now_str, now_str)
+        started = time.perf_counter()
+        try:
+            if legacy:
+                # 旧方式：日历、K 线、报价 + 心跳各自一次 connect/commit/close
+                for sql, params, many in (
+                    ("INSERT OR REPLACE INTO service_state VALUES (?, ?, ?)", _state_rows(now_str)[:5], True),
+                    ("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", bars, True),
+                    ("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", quote, False),
+                ):
+                    c = sqlite3.connect(db_path)
+                    (c.executemany if many else c.execute)(sql, params)
+                    c.commit()
+                    c.close()
+            else:
+                with _transaction(conn):
+                    conn.executemany("INSERT OR REPLACE INTO service_state VALUES (?, ?, ?)", _state_rows(now_str))
+                    conn.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", bars)
+                    conn.execute("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", quote)
+            durations.append(time.perf_counter() - started)
+        except sqlite3.OperationalError:
+            errors += 1
+        time.sleep(interval)
+    out.put(("writer", durations, errors))
+
+
+def reader_process(db_path, legacy, seconds, out):
+    durations = []
+    locked = 0
+    other_errors = 0
+    end_date = date.today().isoformat()
+    start_date = (date.today() - timedelta(days=BENCH_HISTORY_DAYS * 7 // 5 + 2)).isoformat()
+    queries = (
+        (HISTORY_SQL, (BENCH_SYMBOL, start_date, end_date)),
+        (QUOTE_SQL, (BENCH_SYMBOL,)),
+        (HEARTBEAT_SQL, ()),
+        (CALENDAR_SQL, ()),
+    )
+    deadline = time.perf_counter() + seconds
+    i = 0
+    while time.perf_counter() < deadline:
+        sql, params = queries[i % len(queries)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            if legacy:
+                conn = sqlite3.connect(db_path)
+                conn.execute(sql, params).fetchall()
+                conn.close()
+            else:
+                market_data_connection(db_path).execute(sql, params).fetchall()
+            durations.append(time.perf_counter() - started)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                locked += 1
+            else:
+                other_errors += 1
+    out.put(("reader", durations, locked, other_errors))
+
+
+def _ms(values, q):
+    return float(np.quantile(values, q) * 1000) if len(values) else float("nan")
+
+
+def run_benchmark(readers, seconds, interval, stall_ms, legacy):
+    tmp_dir = tempfile.mkdtemp(prefix="market_data_bench_")
+    db_path = os.path.join(tmp_dir, "market_data_cache.db")
+    seed_database(db_path, legacy)
+    out = mp.Queue()
+    procs = [mp.Process(target=writer_process, args=(db_path, legacy, seconds, interval, out))]
+    procs += [mp.Process(target=reader_process, args=(db_path, legacy, seconds, out)) for _ in range(readers)]
+    for p in procs:
+        p.start()
+    results = [out.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    writer = next(r for r in results if r[0] == "writer")
+    reader_results = [r for r in results if r[0] == "reader"]
+    w = np.asarray(writer[1])
+    r = np.concatenate([np.asarray(x[1]) for x in reader_results]) if reader_results else np.array([])
+    locked = sum(x[2] for x in reader_results)
+    other = sum(x[3] for x in reader_results)
+    mode = "legacy（回滚日志 + 每次 connect）" if legacy else "WAL + 长连接单事务"
+    print(f"模式: {mode} | 读进程 {readers} | 时长 {seconds}s | 写间隔 {interval * 1000:.0f}ms")
+    print(f"写者: {len(w)} 轮, 提交耗时 p50 {_ms(w, 0.5):.2f}ms / p99 {_ms(w, 0.99):.2f}ms / max {_ms(w, 1.0):.2f}ms, "
+          f"卡顿(>{stall_ms:g}ms) {int((w * 1000 > stall_ms).sum())} 次, 写入失败 {writer[2]} 次")
+    print(f"读者: {len(r)} 次查询 ({len(r) / seconds:.0f}/s), 耗时 p50 {_ms(r, 0.5):.2f}ms / p99 {_ms(r, 0.99):.2f}ms / "
+          f"max {_ms(r, 1.0):.2f}ms, database is locked {locked} 次, 其他错误 {other} 次")
+    return {"writer_max_ms": _ms(w, 1.0), "writer_stalls": int((w * 1000 > stall_ms).sum()), "locked": locked}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="market_data_cache.db 读写争用基准")
+    parser.add_argument("--readers", type=int, default=12)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--write-interval", type=float, default=0.05, help="写者每轮间隔（秒）；实盘为 20 秒，这里加压")
+    parser.add_argument("--stall-ms", type=float, default=100.0)
+    parser.add_argument("--legacy", action="store_true", help="旧方式对照")
+    args = parser.parse_args()
+    run_benchmark(args.readers, args.seconds, args.write_interval, args.stall_ms, args.legacy)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+成交台账事后重定价：不重跑分钟级模拟，直接把另一套券商成本套到已有回测结果上。
+
+run_backtest 的逐笔台账记录了毛成交价（gross_entry_price / gross_exit_price，未计滑点）与
+出场是否计滑点（exit_slipped），daily_df 记录了每日开盘价与股数。重定价时：
+  1. 逐笔向量化计算新滑点下的每股盈亏；
+  2. 按日顺序复利：股数 = floor(资金 × 杠杆 / 日开盘)，单笔盈亏 = 股数 × 每股盈亏 − 往返手续费。
+与 simulate_day 的浮点运算顺序一致，成本模型不变时结果与原回测逐位相同。
+日终 peak / drawdown 按新资金重算；日内回撤列（intraday_mdd_pct / intraday_loss_from_start_pct）
+无法从台账精确复原，重定价结果中删除，不返回原回测的旧值。
+
+以下情况成交本身可能变化，退回完整重跑 run_backtest：
+  - 滑点变化且启用了动态追踪止盈 / 单笔止损（两者以含滑点的开仓价计算触发线）；
+  - 启用日内止损且某日在新成本下可能触及限额（按原回测的日内回撤与费用差做保守上界判断）；
+    原回测当日已触发日内止损的日子（出场价由限额反推，随成本变化）一律视为可能触发，
+    所以止损很紧、多数交易日都会触发时，重定价基本都会退回完整重跑，只有宽松止损下才能省掉重跑；
+  - 原回测因资金不足跳过、新成本下却能开仓的交易日（台账里没有当日成交）。
+
+用法:
+  python cost_repricing.py reports/backtest_results          # 读取 backtest_store 结果目录，打印成本敏感性表
+  python cost_repricing.py reports/backtest_results --models longport ibkr_pro_fixed
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import time
+from datetime import date
+from math import floor
+
+import numpy as np
+import pandas as pd
+
+# 与 backtest.py 配置注释中的券商成本一致（单边 $/股；最低往返手续费）
+COST_MODELS = {
+    'longport': {
+        'transaction_fee_per_share': 0.008166,
+        'min_round_trip_fee': 2.16,
+        'slippage_per_share': 0.01,
+    },
+    'ibkr_pro_fixed': {
+        'transaction_fee_per_share': 0.005,
+        'min_round_trip_fee': 2.0,  # 每单最低 $1
+        'slippage_per_share': 0.01,
+    },
+    'ibkr_pro_tiered': {
+        'transaction_fee_per_share': 0.0035,
+        'min_round_trip_fee': 0.7,  # 每单最低 $0.35
+        'slippage_per_share': 0.01,
+    },
+    'icmarkets_cfd': {
+        'transaction_fee_per_share': 0.02,
+        'min_round_trip_fee': 0.04,
+        'slippage_per_share': 0.01,
+    },
+    'no_fees': {
+        'enable_transaction_fees': False,
+        'slippage_per_share': 0.01,
+    },
+}
+
+# 日内止损保守判断的相对容差（原回测日内回撤由百分比反推金额，留出浮点误差）
+STOP_GUARD_EPS = 1e-9
+
+
+def cost_model_config(config, cost_model):
+    """在回测配置上叠加成本模型（名称或 dict），返回新配置。"""
+    if isinstance(cost_model, str):
+        if cost_model not in COST_MODELS:
+            raise ValueError(f"未知成本模型 {cost_model}，可用: {sorted(COST_MODELS)}")
+        cost_model = COST_MODELS[cost_model]
+    new_config = dict(config)
+    new_config.update(cost_model or {})
+    return new_config
+
+
+def _cost_params(config):
+    return (
+        bool(config.get('enable_transaction_fees', True)),
+        float(config.get('transaction_fee_per_share', 0.01)),
+        float(config.get('min_round_trip_fee', 2.16)),
+        float(config.get('slippage_per_share', 0.02)),
+    )
+
+
+def _round_trip_fee(position_size, enabled, fee_per_share, min_fee):
+    """与 simulate_day 相同：max(股数 × 单边费 × 2, 最低往返)。"""
+    if not enabled:
+        return 0
+    return max(position_size * fee_per_share * 2, min_fee)
+
+
+def _trade_dates(trades_df):
+    return pd.to_datetime(trades_df['Date']).dt.normalize().to_numpy()
+
+
+def _fill_sensitive_reason(config, new_config):
+    """滑点变化会改变成交本身时返回原因，否则 None。"""
+    old_slip = _cost_params(config)[3]
+    new_slip = _cost_params(new_config)[3]
+    if old_slip == new_slip:
+        return None
+    if new_config.get('enable_trailing_take_profit', False):
+        return "滑点变化影响动态追踪止盈触发线"
+    if new_config.get('enable_per_trade_stop_loss', False):
+        return "滑点变化影响单笔止损触发线"
+    return None
+
+
+def reprice_backtest(daily_df, trades_df, config, cost_model=None, *, allow_resimulation=True):
+    """
+    按新成本模型重定价一次回测。
+
+    参数:
+        daily_df / trades_df: run_backtest 返回的日度结果与台账（需含毛成交价与 day_open / position_size 列）
+        config: 产生这份结果的回测配置
+        cost_model: COST_MODELS 中的名称或成本参数 dict（transaction_fee_per_share / min_round_trip_fee /
+                    slippage_per_share / enable_transaction_fees）
+        allow_resimulation: 无法精确重定价时是否退回完整重跑；False 时抛 ValueError
+
+    返回:
+        (daily_df, trades_df, summary)；summary['method'] 为 'reprice' 或 'resimulate'
+    """
+    new_config = cost_model_config(config, cost_model)
+    t0 = time.perf_counter()
+    try:
+        daily, trades = _reprice(daily_df, trades_df, config, new_config)
+        method, reason = 'reprice', None
+    except _NeedsResimulation as e:
+        if not allow_resimulation:
+            raise ValueError(f"无法事后重定价: {e}") from None
+        daily, trades = _resimulate(new_config)
+        method, reason = 'resimulate', str(e)
+    summary = summarize_costs(daily, trades, new_config)
+    summary.update({'method': method, 'reason': reason, 'elapsed_ms': (time.perf_counter() - t0) * 1000})
+    return daily, trades, summary
+
+
+class _NeedsResimulation(Exception):
+    pass
+
+
+def _reprice(daily_df, trades_df, config, new_config):
+    missing = [c for c in ('day_open', 'position_size') if c not in daily_df.columns]
+    if trades_df is not None and len(trades_df) > 0:
+        missing += [c for c in ('gross_entry_price', 'gross_exit_price', 'exit_slipped') if c not in trades_df.columns]
+    if missing:
+        raise ValueError(f"回测结果缺少重定价所需列 {missing}，请用新版 run_backtest 重新生成")
+
+    reason = _fill_sensitive_reason(config, new_config)
+    if reason:
+        raise _NeedsResimulation(reason)
+
+    enabled, fee_ps, min_fee, slip = _cost_params(new_config)
+    old_slip = _cost_params(config)[3]
+    leverage = new_config.get('leverage', 1)
+    initial_capital = new_config.get('initial_capital', 100000)
+
+    # 日内止损：新成本下限额与权益路径都会变，逐日做保守判断
+    stop_on = bool(new_config.get('enable_intraday_stop_loss', False))
+    stop_pct = float(new_config.get('intraday_stop_loss_pct', 0.04))
+    stop_amt_cfg = new_config.get('max_daily_loss_amount')
+    stop_mode = str(new_config.get('intraday_stop_loss_mode', 'both')).lower()
+    check_start = stop_mode not in ('peak_to_trough', 'peak', 'mdd')
+    check_peak = stop_mode not in ('day_start', 'from_day_start', 'start')
+
+    trades = trades_df.copy() if trades_df is not None else pd.DataFrame()
+    n_trades = len(trades)
+    if n_trades:
+        is_long = (trades['side'] == 'Long').to_numpy()
+        slipped = trades['exit_slipped'].astype(bool).to_numpy()
+        gross_entry = trades['gross_entry_price'].to_numpy(dtype=float)
+        gross_exit = trades['gross_exit_price'].to_numpy(dtype=float)
+        exit_slip = np.where(slipped, slip, 0.0)
+        entry_px = np.where(is_long, gross_entry + slip, gross_entry - slip)
+        exit_px = np.where(is_long, gross_exit - exit_slip, gross_exit + exit_slip)
+        per_share = np.where(is_long, exit_px - entry_px, entry_px - exit_px)
+        base_fees = trades['transaction_fees'].to_numpy(dtype=float)
+        t_dates = _trade_dates(trades)
+    else:
+        per_share = entry_px = exit_px = base_fees = np.empty(0)
+        t_dates = np.empty(0, dtype='datetime64[ns]')
+
+    d_dates = pd.to_datetime(daily_df.index).normalize().to_numpy()
+    if not np.isin(t_dates, d_dates).all():
+        raise ValueError("台账中存在不属于 daily_df 的交易日")
+    order = np.argsort(t_dates, kind='stable')
+    if not (order == np.arange(n_trades)).all():
+        raise ValueError("台账需按交易日排序（run_backtest 的原始顺序）")
+    starts = np.searchsorted(t_dates, d_dates, side='left')
+    ends = np.searchsorted(t_dates, d_dates, side='right')
+
+    day_open = daily_df['day_open'].to_numpy(dtype=float)
+    base_size = daily_df['position_size'].to_numpy(dtype=float)
+    base_capital = daily_df['capital'].to_numpy(dtype=float)
+    base_mdd = daily_df['intraday_mdd_pct'].to_numpy(dtype=float) if 'intraday_mdd_pct' in daily_df else None
+    base_loss = (
+        daily_df['intraday_loss_from_start_pct'].to_numpy(dtype=float)
+        if 'intraday_loss_from_start_pct' in daily_df else None
+    )
+    if stop_on and (base_mdd is None or base_loss is None):
+        raise _NeedsResimulation("启用日内止损但结果中没有逐日日内回撤，无法判断止损是否受影响")
+
+    new_size = np.zeros(n_trades)
+    new_fees = np.zeros(n_trades)
+    new_pnl = np.zeros(n_trades)
+    capitals = np.empty(len(d_dates))
+    returns = np.zeros(len(d_dates))
+    sizes = np.zeros(len(d_dates), dtype=np.int64)
+    stop_risk_days = []
+
+    capital = initial_capital
+    base_start = initial_capital
+    for j in range(len(d_dates)):
+        a, b = starts[j], ends[j]
+        capital_start = capital
+        day_pnl = 0
+        if not np.isnan(day_open[j]):
+            size = floor(capital * leverage / day_open[j])
+            if size > 0 and not base_size[j] > 0:
+                raise _NeedsResimulation(f"{pd.Timestamp(d_dates[j]).date()} 原回测资金不足未开仓，新成本下可开仓")
+            if size > 0:
+                sizes[j] = size
+                if b > a:
+                    fee = _round_trip_fee(size, enabled, fee_ps, min_fee)
+                    pnl = size * per_share[a:b] - fee
+                    new_size[a:b] = size
+                    new_fees[a:b] = fee
+                    new_pnl[a:b] = pnl
+                    day_pnl = np.cumsum(pnl)[-1]
+                    if stop_on:
+                        m_new = float(stop_amt_cfg) if stop_amt_cfg is not None else stop_pct * capital_start
+                        m_base = float(stop_amt_cfg) if stop_amt_cfg is not None else stop_pct * base_start
+                        if m_new > 0 and _stop_may_fire(
+                            size / base_size[j], base_loss[j] * base_start, base_mdd[j] * base_start,
+                            base_fees[a:b].sum(), fee * (b - a), 2 * size * abs(slip - old_slip) * (b - a + 1),
+                            m_base, m_new, check_start, check_peak,
+                        ):
+                            stop_risk_days.append(pd.Timestamp(d_dates[j]).date())
+        # 新资金不足开仓的交易日：当日台账作废（股数记 0，稍后剔除）
+        capital += day_pnl
+        capitals[j] = capital
+        returns[j] = day_pnl / capital_start
+        base_start = base_capital[j]
+
+    if stop_risk_days:
+        shown = ', '.join(str(d) for d in stop_risk_days[:5])
+        raise _NeedsResimulation(f"{len(stop_risk_days)} 个交易日在新成本下可能触及日内止损（{shown}…）")
+
+    daily = daily_df.drop(columns=['intraday_mdd_pct', 'intraday_loss_from_start_pct'], errors='ignore')
+    daily['capital'] = capitals
+    daily['daily_return'] = returns
+    daily['position_size'] = sizes
+    if 'peak' in daily.columns or 'drawdown' in daily.columns:
+        # 与 calculate_performance_metrics 相同的日终口径
+        daily['peak'] = daily['capital'].cummax()
+        daily['drawdown'] = (daily['capital'] - daily['peak']) / daily['peak']
+    if n_trades:
+        keep = new_size > 0
+        trades['entry_price'] = entry_px
+        trades['exit_price'] = exit_px
+        trades['position_size'] = new_size.astype(np.int64)
+        trades['transaction_fees'] = new_fees
+        trades['pnl'] = new_pnl
+        trades = trades[keep].reset_index(drop=True)
+    return daily, trades
+
+
+def _stop_may_fire(ratio, loss_base, dd_base, fees_base, fees_new, slip_extra,
+                   m_base, m_new, check_start, check_peak):
+    """
+    新成本下日内止损是否可能触发（保守上界）。
+
+    当日任一标记点已平 k 笔时权益变化 E = Σ(股数 × 每股盈亏) + 股数 × 浮动每股盈亏 − k × 原单笔费用，
+    换成本后 E' = ratio × (E + k × 原单笔费用) − k × 新单笔费用 − 滑点差项，因此
+    −E' ≤ ratio × (−E) + max(0, 新费用合计 − ratio × 原费用合计) + 股数 × 滑点差 × 2 × (笔数 + 1)；
+    峰谷回撤（两个标记点之差）同理。原回测当日已接近限额（止损已触发，出场价随成本变化）也视为可能触发。
+    """
+    limit_base = m_base * (1 - STOP_GUARD_EPS)
+    limit_new = m_new * (1 - STOP_GUARD_EPS)
+    extra = max(0.0, fees_new - ratio * fees_base) + slip_extra
+    if check_start:
+        if loss_base >= limit_base:
+            return True
+        if ratio * loss_base + extra >= limit_new:
+            return True
+    if check_peak:
+        if dd_base >= limit_base:
+            return True
+        if ratio * dd_base + extra >= limit_new:
+            return True
+    return False
+
+
+def _resimulate(new_config):
+    """完整重跑（静默输出，不画图、不落盘）。"""
+    from backtest import run_backtest
+
+    cfg = dict(new_config)
+    cfg.update({
+        'print_daily_trades': False,
+        'print_trade_details': False,
+        'show_equity_report': False,
+        'plot_days': None,
+        'random_plots': 0,
+        'results_dir': None,
+    })
+    with contextlib.redirect_stdout(io.StringIO()):
+        daily_df, _, trades_df, _ = run_backtest(cfg)
+    return daily_df, trades_df
+
+
+def summarize_costs(daily_df, trades_df, config):
+    """重定价结果的核心指标：最终资金、总回报、日终最大回撤、手续费与滑点合计。"""
+    initial_capital = config.get('initial_capital', 100000)
+    capital = daily_df['capital'].to_numpy(dtype=float)
+    final_capital = float(capital[-1]) if len(capital) else float(initial_capital)
+    peak = np.maximum.accumulate(np.concatenate([[initial_capital], capital]))[1:] if len(capital) else capital
+    mdd = float(((peak - capital) / peak).max()) if len(capital) else 0.0
+    n_trades = 0 if trades_df is None else len(trades_df)
+    fees = float(trades_df['transaction_fees'].sum()) if n_trades else 0.0
+    slip = _cost_params(config)[3]
+    if n_trades and 'exit_slipped' in trades_df.columns:
+        legs = 1 + trades_df['exit_slipped'].astype(bool).to_numpy()
+        slippage = float((trades_df['position_size'].to_numpy(dtype=float) * slip * legs).sum())
+    elif n_trades:
+        slippage = float((trades_df['position_size'] * slip * 2).sum())
+    else:
+        slippage = 0.0
+    return {
+        'final_capital': final_capital,
+        'total_return': final_capital / initial_capital - 1,
+        'mdd_eod': mdd,
+        'n_trades': n_trades,
+        'transaction_fees': fees,
+        'slippage_cost': slippage,
+        'trading_cost': fees + slippage,
+    }
+
+
+def cost_sensitivity_table(daily_df, trades_df, config, cost_models=None):
+    """
+    多个成本模型的敏感性对比表（每行一个模型）。
+    cost_models: 名称列表或 {名称: 成本参数}；默认全部 COST_MODELS。
+    """
+    if cost_models is None:
+        cost_models = COST_MODELS
+    if not isinstance(cost_models, dict):
+        cost_models = {name: COST_MODELS[name] for name in cost_models}
+    rows = []
+    for name, model in cost_models.items():
+        _, _, summary = reprice_backtest(daily_df, trades_df, config, model)
+        new_config = cost_model_config(config, model)
+        enabled, fee_ps, min_fee, slip = _cost_params(new_config)
+        rows.append({
+            'model': name,
+            'fee_per_share': fee_ps if enabled else 0.0,
+            'min_round_trip_fee': min_fee if enabled else 0.0,
+            'slippage_per_share': slip,
+            **summary,
+        })
+    return pd.DataFrame(rows).set_index('model')
+
+
+def _config_from_results(results):
+    """backtest_store 保存的配置（JSON）还原为 run_backtest 可用的配置。"""
+    cfg = dict(results.config)
+    for key in ('start_date', 'end_date'):
+        if isinstance(cfg.get(key), str):
+            cfg[key] = date.fromisoformat(cfg[key][:10])
+    for key in ('trading_start_time', 'trading_end_time'):
+        if isinstance(cfg.get(key), list):
+            cfg[key] = tuple(cfg[key])
+    return cfg
+
+
+def main():
+    from backtest_store import load_backtest_results
+
+    parser = argparse.ArgumentParser(description='回测台账事后成本重定价')
+    parser.add_argument('results_dir', help='run_backtest results_dir 写出的结果目录')
+    parser.add_argument('--models', nargs='*', choices=sorted(COST_MODELS), help='只比较指定成本模型')
+    args = parser.parse_args()
+
+    results = load_backtest_results(args.results_dir)
+    config = _config_from_results(results)
+    daily_df = results.table('daily')
+    trades_df = results.table('trades') if 'trades' in results.tables else pd.DataFrame()
+    table = cost_sensitivity_table(daily_df, trades_df, config, args.models)
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    print(table.round({'final_capital': 2, 'total_return': 4, 'mdd_eod': 4, 'transaction_fees': 2,
+                       'slippage_cost': 2, 'trading_cost': 2, 'elapsed_ms': 1}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,539 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史分钟数据集注册表（SQLite）。
+
+把 qqq_longport.csv / qqq_longport_2year.csv / qqq_market_hours_with_indicators.csv 等来源
+合并为「每个 symbol 一份」去重后的常规时段分钟库：
+  - history_candles: (symbol, date, time) 唯一，只保留 09:30–16:00 的 OHLCV + Turnover
+  - history_days:    每日覆盖情况（来源、分钟数、缺失分钟数、391 槽位 bitmap、是否半日市）
+  - history_calendar: 交易日历（含半日市），可由数据推断或由 Longport trading_days 写入
+  - history_calendar_ranges: 已拉过的日历查询区间，补数工具据此只跳过完整覆盖的月份
+  - history_sources: 已导入的来源文件（大小 / mtime），未变化时跳过重复导入
+
+同一交易日以「整天」为单位择优，不按分钟拼接不同来源（各来源前复权基准可能不同）：
+完整的日优先；都完整时 rank 小的来源优先；都不完整时分钟数多者优先。
+
+回测通过 load_minutes(symbol, start, end) 取区间数据；缺失分钟诊断走
+history_days(symbol, missing_minutes) 索引，见 gap_days / missing_minutes。
+
+用法:
+  python dataset_registry.py import QQQ      # 按 DATASET_SOURCES 导入/刷新
+  python dataset_registry.py gaps QQQ --min-missing 5
+  python dataset_registry.py summary QQQ
+"""
+
+import argparse
+import hashlib
+import os
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+DATASET_DB_PATH = os.environ.get(
+    "DATASET_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "market_history.db"),
+)
+DATASET_DIR = os.environ.get("DATASET_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+# 常规时段槽位：09:30 ~ 16:00 共 391 个分钟标签（不同来源的 K 线时间戳可能是起点或终点，
+# 因此完整交易日实际占 390 个槽位：09:30–15:59 或 09:31–16:00）
+SESSION_OPEN = "09:30"
+SESSION_CLOSE = "16:00"
+HALF_DAY_CLOSE = "13:00"
+SESSION_SLOT_COUNT = 391
+FULL_DAY_MINUTES = 390
+HALF_DAY_MINUTES = 210
+# 完整日判定允许缺失的分钟数（偶发无成交分钟）
+COMPLETE_DAY_TOLERANCE = 2
+# 回测取数时在 start_date 之前多取的日历天数（趋势特征 rank60 / ma20 等需要预热）
+DATASET_WARMUP_CALENDAR_DAYS = 130
+
+# 各 symbol 的来源（rank 越小越优先）；path 为相对 DATASET_DIR 的路径或绝对路径
+DATASET_SOURCES = {
+    "QQQ": [
+        {"name": "longport_api", "path": None, "rank": 0},
+        {"name": "longport", "path": "qqq_longport.csv", "rank": 1},
+        {"name": "longport_2year", "path": "qqq_longport_2year.csv", "rank": 2},
+        {"name": "market_hours_indicators", "path": "qqq_market_hours_with_indicators.csv", "rank": 3},
+    ],
+}
+
+CANDLE_COLUMNS = ["Open", "High", "Low", "Close", "Volume", "Turnover"]
+
+
+def time_to_slot(time_str):
+    """'HH:MM' -> 距 09:30 的分钟槽位（0~390）。"""
+    return (int(time_str[:2]) - 9) * 60 + int(time_str[3:5]) - 30
+
+
+def slot_to_time(slot):
+    minutes = 9 * 60 + 30 + int(slot)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def slots_to_bitmap(slots):
+    mask = np.zeros(SESSION_SLOT_COUNT, dtype=bool)
+    mask[np.asarray(list(slots), dtype=int)] = True
+    return np.packbits(mask).tobytes()
+
+
+def bitmap_to_mask(bitmap):
+    bits = np.unpackbits(np.frombuffer(bitmap, dtype=np.uint8))
+    return bits[:SESSION_SLOT_COUNT].astype(bool)
+
+
+def _expected_minutes(is_half_day):
+    return HALF_DAY_MINUTES if is_half_day else FULL_DAY_MINUTES
+
+
+def _infer_half_day(times):
+    """无日历时按数据推断半日市：最后一根 K 线不晚于 13:00，且上午基本完整。"""
+    return len(times) >= 150 and max(times) <= HALF_DAY_CLOSE
+
+
+def _is_complete(n_minutes, expected):
+    return n_minutes >= expected - COMPLETE_DAY_TOLERANCE
+
+
+def _candidate_better(new, old):
+    """
+    new / old: (n_minutes, expected, rank)。
+    完整优先；同为完整看 rank（相同 rank 视为刷新，覆盖）；同为不完整看分钟数，再看 rank。
+    """
+    new_n, new_exp, new_rank = new
+    old_n, old_exp, old_rank = old
+    new_ok = _is_complete(new_n, new_exp)
+    old_ok = _is_complete(old_n, old_exp)
+    if new_ok != old_ok:
+        return new_ok
+    if new_ok:
+        return new_rank <= old_rank
+    if new_n != old_n:
+        return new_n > old_n
+    return new_rank <= old_rank
+
+
+class DatasetRegistry:
+    """分钟数据集注册表；一个实例持有一个 SQLite 连接。"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or DATASET_DB_PATH
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def close(self):
+        self.conn.close()
+
+    def _init_schema(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_candles (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            time TEXT NOT NULL,
+            open REAL NOT NULL,
+            high REAL NOT NULL,
+            low REAL NOT NULL,
+            close REAL NOT NULL,
+            volume REAL NOT NULL,
+            turnover REAL,
+            PRIMARY KEY (symbol, date, time)
+        ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_days (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            source TEXT NOT NULL,
+            source_rank INTEGER NOT NULL,
+            n_minutes INTEGER NOT NULL,
+            expected_minutes INTEGER NOT NULL,
+            missing_minutes INTEGER NOT NULL,
+            is_half_day INTEGER NOT NULL,
+            bitmap BLOB NOT NULL,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (symbol, date)
+        )
+        """)
+        cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_history_days_missing
+        ON history_days (symbol, missing_minutes, date)
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_calendar (
+            market TEXT NOT NULL,
+            date TEXT NOT NULL,
+            is_half_day INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            PRIMARY KEY (market, date)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_calendar_ranges (
+            market TEXT NOT NULL,
+            source TEXT NOT NULL,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            synced_at TEXT NOT NULL,
+            PRIMARY KEY (market, source, start_date, end_date)
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS history_sources (
+            symbol TEXT NOT NULL,
+            name TEXT NOT NULL,
+            path TEXT,
+            rank INTEGER NOT NULL,
+            file_size INTEGER,
+            file_mtime REAL,
+            days_written INTEGER,
+            imported_at TEXT NOT NULL,
+            PRIMARY KEY (symbol, name)
+        )
+        """)
+        self.conn.commit()
+
+    # ------------------------------------------------------------------
+    # 交易日历
+    # ------------------------------------------------------------------
+    def set_calendar(self, market, trading_days, half_days=(), source="longport", synced_range=None):
+        """
+        写入交易日历（trading_days 与 half_days 可重叠，取并集）。
+
+        synced_range=(start, end) 时同一事务里记下本次查询覆盖的日期区间，
+        calendar_covered 据此判断某段日历是否已完整拉过（区间内没有交易日也算拉过）。
+        """
+        half = {d.isoformat() if isinstance(d, date) else str(d) for d in half_days}
+        days = {d.isoformat() if isinstance(d, date) else str(d) for d in trading_days} | half
+        with self.conn:
+            self.conn.executemany("""
+            INSERT OR REPLACE INTO history_calendar (market, date, is_half_day, source)
+            VALUES (?, ?, ?, ?)
+            """, [(market, d, 1 if d in half else 0, source) for d in sorted(days)])
+            if synced_range is not None:
+                self.conn.execute("""
+                INSERT OR REPLACE INTO history_calendar_ranges (market, source, start_date, end_date, synced_at)
+                VALUES (?, ?, ?, ?, ?)
+                """, (market, source, str(synced_range[0]), str(synced_range[1]),
+                      datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def calendar(self, market="US", start=None, end=None):
+        """返回 DataFrame[date, is_half_day]（date 为 datetime.date）。"""
+        sql = "SELECT date, is_half_day FROM history_calendar WHERE market = ?"
+        params = [market]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(str(start))
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(str(end))
+        rows = self.conn.execute(sql + " ORDER BY date", params).fetchall()
+        return pd.DataFrame(
+            [(date.fromisoformat(d), bool(h)) for d, h in rows],
+            columns=["date", "is_half_day"],
+        )
+
+    def calendar_covered(self, market, start, end, source="longport"):
+        """
+        [start, end] 是否被该来源已拉过的日历区间完整覆盖（多次拉取的区间合并后判断）。
+        只有零散日期行、没有区间记录的旧库视为未覆盖，补数工具会重拉一次。
+        """
+        rows = self.conn.execute("""
+        SELECT start_date, end_date FROM history_calendar_ranges
+        WHERE market = ? AND source = ? AND end_date >= ? AND start_date <= ?
+        ORDER BY start_date
+        """, (market, source, str(start), str(end))).fetchall()
+        cursor = start
+        for range_start, range_end in rows:
+            if date.fromisoformat(range_start) > cursor:
+                return False
+            cursor = max(cursor, date.fromisoformat(range_end) + timedelta(days=1))
+            if cursor > end:
+                return True
+        return False
+
+    def _calendar_half_flag(self, market, date_str):
+        row = self.conn.execute(
+            "SELECT is_half_day FROM history_calendar WHERE market = ? AND date = ?",
+            (market, date_str),
+        ).fetchone()
+        return None if row is None else bool(row[0])
+
+    # ------------------------------------------------------------------
+    # 写入
+    # ------------------------------------------------------------------
+    def write_day(self, symbol, date_str, day_df, source, rank, market="US", commit=True):
+        """
+        以整天为单位写入某来源的分钟数据（单事务：替换 history_candles 当日行 + history_days）。
+
+        day_df 需含 Time 与 CANDLE_COLUMNS；已按 _candidate_better 与现存数据比较，
+        不优于现存数据时不写入。返回是否写入。
+        """
+        times = day_df["Time"].tolist()
+        if not times:
+            return False
+        half_flag = self._calendar_half_flag(market, date_str)
+        if half_flag is None:
+            half_flag = _infer_half_day(times)
+            self.conn.execute("""
+            INSERT OR IGNORE INTO history_calendar (market, date, is_half_day, source)
+            VALUES (?, ?, ?, ?)
+            """, (market, date_str, 1 if half_flag else 0, "inferred"))
+        expected = _expected_minutes(half_flag)
+        n_minutes = len(times)
+
+        existing = self.conn.execute("""
+        SELECT n_minutes, expected_minutes, source_rank FROM history_days
+        WHERE symbol = ? AND date = ?
+        """, (symbol, date_str)).fetchone()
+        if existing is not None and not _candidate_better((n_minutes, expected, rank), existing):
+            return False
+
+        turnover = day_df["Turnover"] if "Turnover" in day_df.columns else pd.Series(np.nan, index=day_df.index)
+        rows = list(zip(
+            [symbol] * n_minutes,
+            [date_str] * n_minutes,
+            times,
+            day_df["Open"].astype(float).tolist(),
+            day_df["High"].astype(float).tolist(),
+            day_df["Low"].astype(float).tolist(),
+            day_df["Close"].astype(float).tolist(),
+            day_df["Volume"].astype(float).tolist(),
+            [None if pd.isna(v) else float(v) for v in turnover.tolist()],
+        ))
+        bitmap = slots_to_bitmap(time_to_slot(t) for t in times)
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM history_candles WHERE symbol = ? AND date = ?", (symbol, date_str))
+        cursor.executemany("""
+        INSERT INTO history_candles (symbol, date, time, open, high, low, close, volume, turnover)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        cursor.execute("""
+        INSERT OR REPLACE INTO history_days (
+            symbol, date, source, source_rank, n_minutes, expected_minutes,
+            missing_minutes, is_half_day, bitmap, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (
+            symbol, date_str, source, rank, n_minutes, expected,
+            max(0, expected - n_minutes), 1 if half_flag else 0, bitmap, now_str,
+        ))
+        if commit:
+            self.conn.commit()
+        return True
+
+    def import_frame(self, symbol, df, source, rank, market="US"):
+        """导入一份分钟 DataFrame（DateTime + OHLCV[+Turnover]），返回写入（胜出）的天数。"""
+        df = normalize_minute_frame(df)
+        written = 0
+        with self.conn:
+            for date_str, day_df in df.groupby("DateStr", sort=True):
+                if self.write_day(symbol, date_str, day_df, source, rank, market=market, commit=False):
+                    written += 1
+        return written
+
+    def import_csv(self, symbol, path, source, rank, market="US", force=False):
+        """导入 CSV 来源；文件大小与 mtime 未变化时跳过（force=True 强制重导）。"""
+        stat = os.stat(path)
+        row = self.conn.execute("""
+        SELECT file_size, file_mtime FROM history_sources WHERE symbol = ? AND name = ?
+        """, (symbol, source)).fetchone()
+        if not force and row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            print(f"  {source}: 未变化，跳过 ({path})")
+            return 0
+        df = pd.read_csv(path, parse_dates=["DateTime"])
+        written = self.import_frame(symbol, df, source, rank, market=market)
+        with self.conn:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO history_sources (
+                symbol, name, path, rank, file_size, file_mtime, days_written, imported_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (
+                symbol, source, os.path.abspath(path), rank, stat.st_size, stat.st_mtime,
+                written, datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            ))
+        print(f"  {source}: {len(df)} 行，择优写入 {written} 天 ({path})")
+        return written
+
+    def import_configured_sources(self, symbol, force=False):
+        """按 DATASET_SOURCES 导入该 symbol 的所有文件来源（不存在的文件跳过）。"""
+        total = 0
+        for src in DATASET_SOURCES.get(symbol, []):
+            if not src.get("path"):
+                continue
+            path = src["path"] if os.path.isabs(src["path"]) else os.path.join(DATASET_DIR, src["path"])
+            if not os.path.exists(path):
+                print(f"  {src['name']}: 文件不存在，跳过 ({path})")
+                continue
+            total += self.import_csv(symbol, path, src["name"], src["rank"], force=force)
+        return total
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+    def load_minutes(self, symbol, start=None, end=None):
+        """
+        读取 [start, end] 区间（含端点）的分钟数据，返回与 CSV 同列名的 DataFrame：
+        DateTime / Open / High / Low / Close / Volume / Turnover（按时间升序）。
+        Turnover 缺失的来源用 (High+Low)/2 × Volume 近似。
+        """
+        sql = """
+        SELECT date, time, open, high, low, close, volume, turnover
+        FROM history_candles WHERE symbol = ?
+        """
+        params = [symbol]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(str(start))
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(str(end))
+        rows = self.conn.execute(sql + " ORDER BY date, time", params).fetchall()
+        if not rows:
+            return pd.DataFrame(columns=["DateTime"] + CANDLE_COLUMNS)
+        dates, times, o, h, l, c, v, t = zip(*rows)
+        df = pd.DataFrame({
+            "DateTime": pd.to_datetime(pd.Series(dates) + " " + pd.Series(times), format="%Y-%m-%d %H:%M"),
+            "Open": np.asarray(o, dtype=float),
+            "High": np.asarray(h, dtype=float),
+            "Low": np.asarray(l, dtype=float),
+            "Close": np.asarray(c, dtype=float),
+            "Volume": np.asarray(v, dtype=float),
+            "Turnover": np.asarray([np.nan if x is None else x for x in t], dtype=float),
+        })
+        missing_turnover = df["Turnover"].isna()
+        if missing_turnover.any():
+            df.loc[missing_turnover, "Turnover"] = (
+                (df.loc[missing_turnover, "High"] + df.loc[missing_turnover, "Low"]) / 2
+                * df.loc[missing_turnover, "Volume"]
+            )
+        return df
+
+    def load_for_backtest(self, symbol, start_date=None, end_date=None):
+        """回测取数：start_date 前多取 DATASET_WARMUP_CALENDAR_DAYS 天供趋势特征预热。"""
+        start = None
+        if start_date is not None:
+            start = start_date - timedelta(days=DATASET_WARMUP_CALENDAR_DAYS)
+        return self.load_minutes(symbol, start, end_date)
+
+    def backtest_fingerprint(self, symbol, start_date=None, end_date=None):
+        """
+        load_for_backtest 同一区间的内容指纹（sha256）：逐日的来源、分钟数与写入时间。
+        任何一天被重写（write_day 更新 updated_at）指纹即变化，无需读取分钟数据。
+        """
+        sql = """
+        SELECT date, source, source_rank, n_minutes, updated_at
+        FROM history_days WHERE symbol = ?
+        """
+        params = [symbol]
+        if start_date is not None:
+            sql += " AND date >= ?"
+            params.append(str(start_date - timedelta(days=DATASET_WARMUP_CALENDAR_DAYS)))
+        if end_date is not None:
+            sql += " AND date <= ?"
+            params.append(str(end_date))
+        digest = hashlib.sha256(symbol.encode("utf-8"))
+        for row in self.conn.execute(sql + " ORDER BY date", params):
+            digest.update("|".join(str(v) for v in row).encode("utf-8"))
+        return digest.hexdigest()
+
+    def day_coverage(self, symbol, start=None, end=None):
+        """每日覆盖表：date / source / n_minutes / expected_minutes / missing_minutes / is_half_day。"""
+        sql = """
+        SELECT date, source, n_minutes, expected_minutes, missing_minutes, is_half_day
+        FROM history_days WHERE symbol = ?
+        """
+        params = [symbol]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(str(start))
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(str(end))
+        return pd.read_sql_query(sql + " ORDER BY date", self.conn, params=params)
+
+    def gap_days(self, symbol, min_missing=1):
+        """缺失分钟数 >= min_missing 的交易日（走 idx_history_days_missing 索引）。"""
+        return pd.read_sql_query("""
+        SELECT date, source, n_minutes, expected_minutes, missing_minutes, is_half_day
+        FROM history_days
+        WHERE symbol = ? AND missing_minutes >= ?
+        ORDER BY missing_minutes DESC, date
+        """, self.conn, params=[symbol, int(min_missing)])
+
+    def incomplete_dates(self, symbol, market="US", start=None, end=None):
+        """日历内覆盖不完整或完全没有数据的交易日（供补数工具只拉这些天）。"""
+        cal = self.calendar(market, start, end)
+        cov = self.day_coverage(symbol, start, end)
+        have = {
+            r.date: _is_complete(r.n_minutes, r.expected_minutes)
+            for r in cov.itertuples(index=False)
+        }
+        return [d for d in cal["date"] if not have.get(d.isoformat(), False)]
+
+    def missing_minutes(self, symbol, date_str):
+        """返回某日缺失的分钟标签列表（按当日时间戳口径选择 09:30 起或 09:31 起的窗口）。"""
+        row = self.conn.execute("""
+        SELECT bitmap, expected_minutes FROM history_days WHERE symbol = ? AND date = ?
+        """, (symbol, str(date_str))).fetchone()
+        if row is None:
+            return None
+        mask = bitmap_to_mask(row[0])
+        first = 0 if mask[0] or not mask[1:].any() else 1
+        window = range(first, first + int(row[1]))
+        return [slot_to_time(s) for s in window if not mask[s]]
+
+
+def normalize_minute_frame(df):
+    """统一来源 DataFrame：去重、只保留常规时段、补 Time / DateStr 列。"""
+    df = df[["DateTime"] + [c for c in CANDLE_COLUMNS if c in df.columns]].copy()
+    df["DateTime"] = pd.to_datetime(df["DateTime"])
+    df = df.sort_values("DateTime").drop_duplicates(subset=["DateTime"], keep="last")
+    df["Time"] = df["DateTime"].dt.strftime("%H:%M")
+    df = df[(df["Time"] >= SESSION_OPEN) & (df["Time"] <= SESSION_CLOSE)]
+    df["DateStr"] = df["DateTime"].dt.strftime("%Y-%m-%d")
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史分钟数据集注册表")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_import = sub.add_parser("import", help="按 DATASET_SOURCES 导入/刷新来源文件")
+    p_import.add_argument("symbol")
+    p_import.add_argument("--force", action="store_true", help="忽略文件未变化检查，强制重导")
+    p_gaps = sub.add_parser("gaps", help="列出缺失分钟的交易日")
+    p_gaps.add_argument("symbol")
+    p_gaps.add_argument("--min-missing", type=int, default=1)
+    p_summary = sub.add_parser("summary", help="来源与覆盖概况")
+    p_summary.add_argument("symbol")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 DATASET_DB_PATH）")
+    args = parser.parse_args()
+
+    registry = DatasetRegistry(args.db)
+    print(f"数据集注册表: {os.path.abspath(registry.db_path)}")
+    if args.cmd == "import":
+        registry.import_configured_sources(args.symbol, force=args.force)
+    elif args.cmd == "gaps":
+        gaps = registry.gap_days(args.symbol, args.min_missing)
+        if gaps.empty:
+            print("没有缺失分钟的交易日")
+        else:
+            print(gaps.to_string(index=False))
+    elif args.cmd == "summary":
+        cov = registry.day_coverage(args.symbol)
+        if cov.empty:
+            print("尚无数据")
+        else:
+            print(f"交易日: {len(cov)} ({cov['date'].iloc[0]} ~ {cov['date'].iloc[-1]})")
+            print(f"半日市: {int(cov['is_half_day'].sum())} | 有缺失: {int((cov['missing_minutes'] > 0).sum())}")
+            print(cov.groupby("source").size().rename("天数").to_string())
+    registry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+"""
+日 × 分钟 稠密矩阵：回测预处理的核心数据结构。
+
+长表（每行一根分钟 K）按 (Date, Time) 摊成 (n_days, n_slots) 的二维数组，n_slots 为数据中出现过的
+时间标签（常规交易时段 09:30~16:00 共 391 个），缺失的 K 线由 mask 标记。
+原先靠 merge / pivot / stack / groupby.transform 完成的预处理都变成沿轴的 NumPy 运算：
+  - 日开盘 / 日收盘 / 昨收 / 上下参考价：按行取首个、末个有效值
+  - sigma：沿日期轴（实际交易日）滚动均值再下移一天，与 pivot.rolling(...).mean().shift(1) 一致
+  - cum_high / cum_low / intraday_range_pos / minutes_from_open：沿分钟轴累积
+  - K 边界、开仓门控：backtest.apply_k_bounds / compute_entry_trend_pass_series 直接作用于矩阵
+
+回测内核与画图按日读取 day_frame(i)（等价于原先的 price_df[price_df['Date'] == d]），
+to_frame() / from_frame() 与现有长表 DataFrame 互转，保持兼容。
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# sigma 缺失率超过该比例的交易日整体剔除（与原 run_backtest 一致）
+MAX_SIGMA_MISSING_RATIO = 0.1
+INDEX_COLUMNS = ('Date', 'Time')
+
+
+def _first_valid_index(valid):
+    """每行第一个有效格的列号；整行无效时为 0。"""
+    return valid.argmax(axis=1)
+
+
+def _last_valid_index(valid):
+    n_slots = valid.shape[1]
+    return n_slots - 1 - valid[:, ::-1].argmax(axis=1)
+
+
+def _ffill_rows(values):
+    """沿分钟轴前向填充 NaN（行内）。"""
+    valid = ~np.isnan(values)
+    idx = np.where(valid, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(idx, axis=1, out=idx)
+    return values[np.arange(values.shape[0])[:, None], idx]
+
+
+def _bfill_rows(values):
+    return _ffill_rows(values[:, ::-1])[:, ::-1]
+
+
+class DayMatrix:
+    """
+    分钟数据的日 × 分钟矩阵视图。
+
+    字段分两类：逐分钟字段存为 (n_days, n_slots) 数组，逐日字段（day_open、prev_close、参考价等）
+    存为 (n_days,) 数组；__getitem__ 统一返回 (n_days, n_slots) 形状（逐日字段按行广播），
+    因此可以像 DataFrame 列一样参与运算。无 K 线的格子数值为 NaN / NaT，只读 mask 为 True 的格子。
+    """
+
+    def __init__(self, dates, times, mask, fields, columns, dtypes=None, time_dtype=None):
+        self.dates = np.asarray(dates, dtype=object)
+        self.times = np.asarray(times, dtype=object)
+        self.mask = np.asarray(mask, dtype=bool)
+        self._fields = dict(fields)
+        self._columns = list(columns)
+        self._dtypes = dict(dtypes or {})
+        self._time_dtype = time_dtype
+        self._date_pos = None
+
+    # ------------------------------------------------------------------
+    # 构造与互转
+    # ------------------------------------------------------------------
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> 'DayMatrix':
+        """长表 -> 矩阵；df 需含 Date（datetime.date）与 Time（'HH:MM'）列，同一 (Date, Time) 不可重复。"""
+        for col in INDEX_COLUMNS:
+            if col not in df.columns:
+                raise ValueError(f"price_df 中缺少 {col} 列，无法构建日×分钟矩阵")
+        dates, day_idx = np.unique(df['Date'].to_numpy(dtype=object), return_inverse=True)
+        times, slot_idx = np.unique(df['Time'].astype(str).to_numpy(dtype=object), return_inverse=True)
+        shape = (len(dates), len(times))
+        flat = day_idx * shape[1] + slot_idx
+        if len(np.unique(flat)) != len(flat):
+            raise ValueError("price_df 中存在重复的 (Date, Time)，无法构建日×分钟矩阵")
+        mask = np.zeros(shape, dtype=bool)
+        mask[day_idx, slot_idx] = True
+
+        fields = {}
+        dtypes = {}
+        for col in df.columns:
+            if col in INDEX_COLUMNS:
+                continue
+            s = df[col]
+            if pd.api.types.is_bool_dtype(s.dtype):
+                arr = np.zeros(shape, dtype=bool)
+                values = s.to_numpy(dtype=bool)
+            elif pd.api.types.is_datetime64_any_dtype(s.dtype) and not isinstance(s.dtype, pd.DatetimeTZDtype):
+                values = s.to_numpy()
+                arr = np.full(shape, np.datetime64('NaT'), dtype=values.dtype)
+            elif pd.api.types.is_numeric_dtype(s.dtype):
+                arr = np.full(shape, np.nan)
+                values = s.to_numpy(dtype=float, na_value=np.nan)
+                if s.dtype != np.float64:
+                    dtypes[col] = s.dtype
+            else:
+                arr = np.full(shape, None, dtype=object)
+                values = s.to_numpy(dtype=object)
+                if s.dtype != object:
+                    dtypes[col] = s.dtype
+            arr[day_idx, slot_idx] = values
+            fields[col] = arr
+        return cls(
+            dates, times, mask, fields, df.columns, dtypes=dtypes, time_dtype=df['Time'].dtype,
+        )
+
+    def _assemble(self, rows, cols, day_of_row):
+        """按 (rows, cols) 取格子组装长表；day_of_row 为每个输出行所属的日序号。"""
+        data = {}
+        for name in self._columns:
+            if name == 'Date':
+                data[name] = self.dates[day_of_row]
+            elif name == 'Time':
+                data[name] = self.times[cols]
+            else:
+                v = self._fields[name]
+                data[name] = v[rows, cols] if v.ndim == 2 else v[day_of_row]
+        out = pd.DataFrame(data)
+        for name, dtype in self._dtypes.items():
+            if name in out.columns:
+                out[name] = out[name].astype(dtype)
+        if self._time_dtype is not None and 'Time' in out.columns:
+            out['Time'] = out['Time'].astype(self._time_dtype)
+        return out
+
+    def to_frame(self) -> pd.DataFrame:
+        """矩阵 -> 长表（按 Date、Time 排序，RangeIndex），列顺序与字段写入顺序一致。"""
+        rows, cols = np.nonzero(self.mask)
+        return self._assemble(rows, cols, rows)
+
+    def day_frame(self, i: int) -> pd.DataFrame:
+        """第 i 个交易日的长表切片（RangeIndex），等价于 price_df[price_df['Date'] == dates[i]]。"""
+        cols = np.flatnonzero(self.mask[i])
+        rows = np.full(len(cols), i)
+        return self._assemble(rows, cols, rows)
+
+    def day_position(self, d) -> Optional[int]:
+        """交易日 -> 行号；不在矩阵中返回 None。"""
+        if self._date_pos is None:
+            self._date_pos = {dt: i for i, dt in enumerate(self.dates)}
+        return self._date_pos.get(d)
+
+    def day_frame_for(self, d) -> pd.DataFrame:
+        i = self.day_position(d)
+        if i is None:
+            return self._assemble(np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=int))
+        return self.day_frame(i)
+
+    def select_days(self, keep) -> 'DayMatrix':
+        """按布尔数组保留交易日，返回新矩阵（字段数组为切片副本）。"""
+        keep = np.asarray(keep, dtype=bool)
+        fields = {k: v[keep] for k, v in self._fields.items()}
+        return DayMatrix(
+            self.dates[keep], self.times, self.mask[keep], fields, self._columns,
+            dtypes=self._dtypes, time_dtype=self._time_dtype,
+        )
+
+    # ------------------------------------------------------------------
+    # 类 DataFrame 的列访问
+    # ------------------------------------------------------------------
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    @property
+    def n_days(self) -> int:
+        return self.mask.shape[0]
+
+    @property
+    def n_slots(self) -> int:
+        return self.mask.shape[1]
+
+    @property
+    def columns(self) -> list:
+        return list(self._columns)
+
+    @property
+    def day_counts(self):
+        """每个交易日的有效 K 线数。"""
+        return self.mask.sum(axis=1)
+
+    def __len__(self) -> int:
+        return int(self.mask.sum())
+
+    def __contains__(self, name) -> bool:
+        return name in self._columns
+
+    def __getitem__(self, name):
+        if name == 'Date':
+            return np.broadcast_to(self.dates[:, None], self.shape)
+        if name == 'Time':
+            return np.broadcast_to(self.times[None, :], self.shape)
+        if name not in self._fields:
+            raise KeyError(f"DayMatrix 中没有字段 {name}")
+        v = self._fields[name]
+        return v if v.ndim == 2 else np.broadcast_to(v[:, None], self.shape)
+
+    def __setitem__(self, name, value):
+        """标量广播到全矩阵；(n_days,) 存为逐日字段；其余须为 (n_days, n_slots)。"""
+        if isinstance(value, pd.Series):
+            raise TypeError("DayMatrix 字段需为标量或 NumPy 数组（长表 Series 请先 from_frame）")
+        arr = np.asarray(value)
+        if arr.ndim == 0:
+            arr = np.full(self.shape, arr.item())
+        elif arr.shape == (self.n_days,):
+            arr = arr.copy()
+        elif arr.shape != self.shape:
+            raise ValueError(f"字段 {name} 形状 {arr.shape} 与矩阵 {self.shape} 不一致")
+        elif not arr.flags.writeable or arr.base is not None:
+            arr = np.array(arr)
+        self._fields[name] = arr
+        self._dtypes.pop(name, None)
+        if name not in self._columns:
+            self._columns.append(name)
+
+    def day(self, name):
+        """逐日取值：逐日字段直接返回；逐分钟字段取当日首个有效格（等价 groupby('Date').first()）。"""
+        v = self._fields[name]
+        if v.ndim == 1:
+            return v
+        valid = self.mask & ~pd.isna(v)
+        return v[np.arange(self.n_days), _first_valid_index(valid)]
+
+    def day_last(self, name):
+        """逐日末个有效格（等价 groupby('Date').last()）。"""
+        v = self._fields[name]
+        if v.ndim == 1:
+            return v
+        valid = self.mask & ~pd.isna(v)
+        return v[np.arange(self.n_days), _last_valid_index(valid)]
+
+    def valid_values(self, name):
+        """字段在所有有效格上的取值（一维，按 Date、Time 顺序）。"""
+        return self[name][self.mask]
+
+    def drop(self, names: Iterable[str]) -> None:
+        for name in names:
+            if name in self._fields:
+                del self._fields[name]
+                self._columns.remove(name)
+                self._dtypes.pop(name, None)
+
+    # ------------------------------------------------------------------
+    # 噪声区域预处理
+    # ------------------------------------------------------------------
+    def add_reference_prices(self, recompute_day_prices: bool = False) -> None:
+        """
+        日开盘 / 日收盘 / 昨收 / 上下参考价 与分钟回报 ret。
+
+        recompute_day_prices=False 时沿用数据里已有的 DayOpen/DayClose（没有才按首末根 K 计算）；
+        True 时总是按当前窗口重算，避免用到窗口外的日开盘。
+        """
+        if recompute_day_prices or 'DayOpen' not in self._fields or 'DayClose' not in self._fields:
+            day_open_px = self.day('Open')
+            day_close_px = self.day_last('Close')
+            self.drop(['DayOpen', 'DayClose'])
+            self['DayOpen'] = day_open_px
+            self['DayClose'] = day_close_px
+        day_close = np.asarray(self.day('DayClose'), dtype=float)
+        prev_close = np.full(self.n_days, np.nan)
+        prev_close[1:] = day_close[:-1]
+        day_open = np.asarray(self.day('DayOpen'), dtype=float)
+        has_prev = ~np.isnan(prev_close)
+        self['prev_close'] = prev_close
+        self['day_open'] = day_open
+        self['upper_ref'] = np.where(has_prev, np.maximum(day_open, prev_close), day_open)
+        self['lower_ref'] = np.where(has_prev, np.minimum(day_open, prev_close), day_open)
+        self['ret'] = self._fields['Close'] / day_open[:, None] - 1
+
+    def add_sigma(self, lookback_days: int) -> None:
+        """
+        sigma：同一时间标签上 |ret| 沿实际交易日滚动 lookback_days 日均值，再下移一日；
+        窗口内有缺失即为 NaN（min_periods=lookback_days）。
+        """
+        lookback_days = int(lookback_days)
+        abs_ret = np.abs(np.where(self.mask, self._fields['ret'], np.nan))
+        valid = ~np.isnan(abs_ret)
+        sigma = np.full(self.shape, np.nan)
+        if self.n_days > lookback_days:
+            window_sum = sliding_window_view(np.where(valid, abs_ret, 0.0), lookback_days, axis=0).sum(axis=-1)
+            window_cnt = sliding_window_view(valid, lookback_days, axis=0).sum(axis=-1)
+            mean = np.where(window_cnt >= lookback_days, window_sum / lookback_days, np.nan)
+            sigma[lookback_days:] = mean[:-1]
+        self['sigma'] = sigma
+
+    def incomplete_sigma_days(self, max_missing_ratio: float = MAX_SIGMA_MISSING_RATIO):
+        """sigma 缺失率（按当日有效 K 线计）超过阈值的交易日。"""
+        missing = (np.isnan(self._fields['sigma']) & self.mask).sum(axis=1)
+        counts = self.day_counts
+        ratio = np.where(counts > 0, missing / np.maximum(counts, 1), 1.0)
+        return ratio > max_missing_ratio
+
+    def fill_sigma(self) -> None:
+        """当日内先前值、再后值填充，仍缺失（整日无 sigma）记 0。"""
+        sigma = np.where(self.mask, self._fields['sigma'], np.nan)
+        sigma = _bfill_rows(_ffill_rows(sigma))
+        sigma = np.where(np.isnan(sigma), 0.0, sigma)
+        self['sigma'] = np.where(self.mask, sigma, np.nan)
+
+    def add_intraday_features(self) -> None:
+        """日内特征（供 k_side_adjustment 动态 K 与开仓门控使用）。"""
+        close = self._fields['Close']
+        day_open = self._fields['day_open']
+        self['intraday_ret'] = close / day_open[:, None] - 1
+
+        dt = self._fields['DateTime']
+        day_start = dt[np.arange(self.n_days), _first_valid_index(self.mask)]
+        elapsed = (dt - day_start[:, None]).ravel()
+        self['minutes_from_open'] = (
+            pd.TimedeltaIndex(elapsed).total_seconds().to_numpy().reshape(self.shape) / 60
+        )
+
+        cum_high = np.fmax.accumulate(np.where(self.mask, self._fields['High'], np.nan), axis=1)
+        cum_low = np.fmin.accumulate(np.where(self.mask, self._fields['Low'], np.nan), axis=1)
+        self['cum_high'] = cum_high
+        self['cum_low'] = cum_low
+        span = cum_high - cum_low
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self['intraday_range_pos'] = np.clip(
+                (close - cum_low) / np.where(span == 0, np.nan, span), 0, 1
+            )
+            sigma = np.where(self.mask, self._fields['sigma'], np.nan)
+            day_med = np.nanmedian(sigma, axis=1)
+            self['sigma_vs_day_median'] = sigma / np.where(day_med == 0, np.nan, day_med)[:, None]
+
+    def prepare_noise_area(self, lookback_days: int, recompute_day_prices: bool = False,
+                           max_sigma_missing_ratio: float = MAX_SIGMA_MISSING_RATIO) -> 'DayMatrix':
+        """
+        完整预处理：参考价 + sigma（写在 self 上，未剔除任何交易日，供买入持有基准使用），
+        返回剔除 sigma 严重缺失日并补齐 sigma、日内特征后的新矩阵。
+        K 边界与开仓门控由调用方接着调用 apply_k_bounds / compute_entry_trend_pass_series。
+        """
+        self.add_reference_prices(recompute_day_prices=recompute_day_prices)
+        self.add_sigma(lookback_days)
+        prepared = self.select_days(~self.incomplete_sigma_days(max_sigma_missing_ratio))
+        prepared.fill_sigma()
+        prepared.add_intraday_features()
+        return prepared
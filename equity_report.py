@@ -110,6 +110,35 @@ def render_equity_report(
     return abs_path
 
 
+def render_equity_report_from_results(
+    results_path: str,
+    *,
+    open_browser: bool = True,
+    output_path: Optional[str] = None,
+) -> str:
+    """
+    从 backtest_store 结果目录生成权益报告。
+
+    只按列读取 daily 的 capital / daily_return 与 trades 的 Date，
+    不加载整份成交台账，适合批量扫描产出的大目录。
+    """
+    from backtest_store import load_backtest_results
+
+    results = load_backtest_results(results_path)
+    daily_df = results.table('daily', ['capital', 'daily_return'])
+    trades_df = None
+    if 'trades' in results.tables and 'Date' in results.columns('trades'):
+        trades_df = results.table('trades', ['Date'])
+    return render_equity_report(
+        daily_df,
+        results.metrics,
+        results.config,
+        trades_df=trades_df,
+        open_browser=open_browser,
+        output_path=output_path,
+    )
+
+
 def _monthly_rows(daily_df: pd.DataFrame) -> list[dict[str, Any]]:
     monthly = daily_df.resample('ME').first()[['capital']].rename(columns={'capital': 'month_start'})
     monthly['month_end'] = daily_df.resample('ME').last()['capital']
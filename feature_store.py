@@ -0,0 +1,323 @@
+"""
+按 (symbol, 日期) 持久化的日频趋势特征库（SQLite）。
+
+趋势特征（trend_er5 / trend_range1 / trend_dist_ma20 / trend_rsi5 ...）的唯一实现：
+  - backtest.compute_daily_trend_features 直接调用 compute_trend_features_from_daily
+  - trend_er5_gate 的实盘门控从本库读取「截至今日开盘前」的特征
+回测与实盘用同一套聚合与特征代码，但按 symbol 分开存：回测键为 backtest.feature_store_symbol
+（注册表 dataset_symbol 或「ticker:CSV 文件名」），实盘键为行情服务的品种代码（如 QQQ.US），
+分钟数据来源（复权口径）不同，不共用行；同一份分钟数据算出的特征值一致。
+默认库路径 FEATURE_STORE_PATH 相对当前目录，两边各自的工作目录下各有一份。
+
+存储:
+  - daily_bars:     每个已完成交易日的 Close / High / Low / DayVol / 分钟数 / 内容指纹
+  - trend_features: 以 prev_date（最后一个已完成交易日）为键，存「下一交易日开盘前可知」的特征；
+                    所有特征都只用 prev_date 及以前的日线（shift(1) 对齐），与具体是哪天开盘无关
+
+增量更新: update_from_minutes 只聚合库里没有、分钟数变多了、或分钟数相同但内容指纹变了
+（前复权调整、数据源覆盖）的交易日，然后仅重算受影响的 prev_date（取前 FEATURE_WARMUP_BARS 根日线作预热）。
+"""
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+FEATURE_STORE_PATH = os.environ.get("FEATURE_STORE_PATH", "feature_store.db")
+# 最长窗口为 rank60（60 根日线 + shift），留足余量
+FEATURE_WARMUP_BARS = 70
+
+TREND_FEATURE_COLUMNS = [
+    'weekly_trend_strength', 'trend_er5', 'trend_linreg5_r2', 'trend_dist_ma20',
+    'trend_range5', 'trend_range1', 'trend_rsi5', 'trend_vol_ratio', 'trend_mom5',
+    'trend_dist_high20', 'trend_dist_low20', 'trend_price_rank60',
+]
+
+
+def aggregate_daily_bars(minute_df):
+    """分钟数据聚合为日线：Date / Close(last) / High / Low / DayVol（无 Volume 列时为 nan）。"""
+    if 'Volume' in minute_df.columns:
+        d = minute_df.groupby('Date', as_index=False).agg(
+            Close=('Close', 'last'),
+            High=('High', 'max'),
+            Low=('Low', 'min'),
+            DayVol=('Volume', 'sum'),
+        )
+    else:
+        d = minute_df.groupby('Date', as_index=False).agg(
+            Close=('Close', 'last'),
+            High=('High', 'max'),
+            Low=('Low', 'min'),
+        )
+        d['DayVol'] = np.nan
+    return d.sort_values('Date').reset_index(drop=True)
+
+
+def compute_trend_features_from_daily(d):
+    """
+    由日线（Date / Close / High / Low / DayVol，按日期升序）计算趋势特征。
+    第 i 行的特征只用第 i 行之前的日线（开盘前可知）。列说明见 backtest.compute_daily_trend_features。
+    """
+    d = d.copy()
+    c = d['Close']
+    d['close_prev'] = c.shift(1)
+    d['mom5'] = d['close_prev'] / c.shift(6) - 1
+    dr = c.pct_change()
+    d['rvol5'] = dr.rolling(5, min_periods=5).std().shift(1)
+    rvol = d['rvol5']
+    d['weekly_trend_strength'] = (
+        d['mom5'].abs() / rvol.replace(0, np.nan)
+    ).where(rvol.notna() & (rvol > 0))
+
+    abs_diff = c.diff().abs()
+    den = abs_diff.shift(1).rolling(5, min_periods=5).sum()
+    num = (c.shift(1) - c.shift(6)).abs()
+    d['trend_er5'] = (num / den.replace(0, np.nan)).where(den.notna() & (den > 0))
+
+    d['ma20'] = c.rolling(20, min_periods=20).mean().shift(1)
+    d['trend_dist_ma20'] = (
+        (d['close_prev'] / d['ma20'] - 1)
+        .where(d['ma20'].notna() & (d['ma20'] > 0))
+    )
+
+    arr = c.values
+    n = len(c)
+    r2 = np.full(n, np.nan)
+    x = np.arange(5, dtype=float)
+    for i in range(5, n):
+        y = arr[i - 5:i]
+        if np.any(np.isnan(y)):
+            continue
+        y_mean = y.mean()
+        x_mean = x.mean()
+        b = np.sum((x - x_mean) * (y - y_mean)) / (np.sum((x - x_mean) ** 2) + 1e-12)
+        a = y_mean - b * x_mean
+        yhat = a + b * x
+        ss_res = np.sum((y - yhat) ** 2)
+        ss_tot = np.sum((y - y_mean) ** 2)
+        r2[i] = 1 - ss_res / ss_tot if ss_tot > 1e-18 else 0.0
+    d['trend_linreg5_r2'] = r2
+
+    rng = (d['High'] - d['Low']) / c.replace(0, np.nan)
+    d['trend_range5'] = rng.rolling(5, min_periods=5).mean().shift(1)
+    d['trend_range1'] = rng.shift(1)  # 昨日振幅；开盘前可知，无未来函数
+
+    delta = c.diff()
+    gain = delta.clip(lower=0)
+    loss = -delta.clip(upper=0)
+    ag = gain.rolling(5, min_periods=5).mean()
+    al = loss.rolling(5, min_periods=5).mean()
+    rs_rsi = ag / al.replace(0, np.nan)
+    d['trend_rsi5'] = (100 - (100 / (1 + rs_rsi))).shift(1)
+
+    dv = d['DayVol']
+    if dv.notna().any():
+        vol_ma20 = dv.rolling(20, min_periods=20).mean().shift(1)
+        d['trend_vol_ratio'] = (dv.shift(1) / vol_ma20.replace(0, np.nan)).where(vol_ma20.notna() & (vol_ma20 > 0))
+    else:
+        d['trend_vol_ratio'] = np.nan
+
+    d['trend_mom5'] = d['mom5']
+
+    high20 = c.rolling(20, min_periods=20).max().shift(1)
+    low20 = c.rolling(20, min_periods=20).min().shift(1)
+    d['trend_dist_high20'] = (d['close_prev'] / high20 - 1).where(high20.notna() & (high20 > 0))
+    d['trend_dist_low20'] = (d['close_prev'] / low20 - 1).where(low20.notna() & (low20 > 0))
+
+    roll_min60 = c.rolling(60, min_periods=20).min().shift(1)
+    roll_max60 = c.rolling(60, min_periods=20).max().shift(1)
+    span60 = roll_max60 - roll_min60
+    d['trend_price_rank60'] = (
+        (d['close_prev'] - roll_min60) / span60.replace(0, np.nan)
+    ).where(span60.notna() & (span60 > 0)).clip(0, 1)
+
+    return d[['Date'] + TREND_FEATURE_COLUMNS]
+
+
+def compute_next_session_features(bars):
+    """
+    已完成日线 -> 「下一交易日开盘前」的特征（按 prev_date 索引）。
+    在末尾追加一行空日线作为下一交易日占位，第 i 行的特征对应 prev_date = bars.Date[i-1]。
+    """
+    placeholder = pd.DataFrame({'Date': [None], 'Close': [np.nan], 'High': [np.nan], 'Low': [np.nan], 'DayVol': [np.nan]})
+    ext = pd.concat([bars[['Date', 'Close', 'High', 'Low', 'DayVol']], placeholder], ignore_index=True)
+    feats = compute_trend_features_from_daily(ext)
+    feats = feats.iloc[1:].reset_index(drop=True)
+    feats['Date'] = bars['Date'].to_numpy()
+    return feats.rename(columns={'Date': 'prev_date'})
+
+
+def minute_fingerprints(minute_df):
+    """每个交易日分钟数据的内容指纹：收/高/低价合计（前复权整体缩放时分钟数不变、指纹会变）。"""
+    sums = minute_df.groupby('Date')[['Close', 'High', 'Low']].sum()
+    return {
+        d: f"{c:.4f}:{h:.4f}:{l:.4f}"
+        for d, c, h, l in zip(sums.index, sums['Close'], sums['High'], sums['Low'])
+    }
+
+
+def _date_key(d):
+    return d.isoformat() if hasattr(d, 'isoformat') else str(d)
+
+
+class FeatureStore:
+    """趋势特征库；连接可跨线程使用（内部加锁）。"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or FEATURE_STORE_PATH
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.lock = threading.Lock()
+        self._init_schema()
+
+    def close(self):
+        self.conn.close()
+
+    def _init_schema(self):
+        feature_cols = ",\n            ".join(f"{c} REAL" for c in TREND_FEATURE_COLUMNS)
+        with self.conn:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS daily_bars (
+                symbol TEXT NOT NULL,
+                date TEXT NOT NULL,
+                close REAL,
+                high REAL,
+                low REAL,
+                day_vol REAL,
+                n_minutes INTEGER NOT NULL,
+                fingerprint TEXT,
+                PRIMARY KEY (symbol, date)
+            )
+            """)
+            # 旧库没有 fingerprint 列：补上后首次更新按指纹不同重写一遍
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(daily_bars)")}
+            if "fingerprint" not in columns:
+                self.conn.execute("ALTER TABLE daily_bars ADD COLUMN fingerprint TEXT")
+            self.conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS trend_features (
+                symbol TEXT NOT NULL,
+                prev_date TEXT NOT NULL,
+                {feature_cols},
+                PRIMARY KEY (symbol, prev_date)
+            )
+            """)
+
+    def _load_bars(self, symbol, since=None):
+        sql = "SELECT date, close, high, low, day_vol FROM daily_bars WHERE symbol = ?"
+        params = [symbol]
+        if since is not None:
+            sql += " AND date >= ?"
+            params.append(since)
+        rows = self.conn.execute(sql + " ORDER BY date", params).fetchall()
+        return pd.DataFrame(rows, columns=['Date', 'Close', 'High', 'Low', 'DayVol'], dtype=object).astype(
+            {'Close': float, 'High': float, 'Low': float, 'DayVol': float}
+        )
+
+    def update_from_minutes(self, symbol, minute_df, completed_through=None):
+        """
+        用分钟数据增量更新日线与特征。minute_df 需含 Date / Close / High / Low[/ Volume]。
+        completed_through: 只把不晚于该日期的交易日视为已完成（实盘传「今天的前一天」）；None 表示全部已完成。
+        返回本次新写入/更新的日线数。
+        """
+        if minute_df is None or minute_df.empty:
+            return 0
+        dates = minute_df['Date']
+        if completed_through is not None:
+            minute_df = minute_df[dates <= completed_through]
+            dates = minute_df['Date']
+            if minute_df.empty:
+                return 0
+        counts = dates.value_counts()
+        fingerprints = minute_fingerprints(minute_df)
+        first_key = _date_key(min(counts.index))
+        with self.lock:
+            stored = {
+                d: (n, fp) for d, n, fp in self.conn.execute(
+                    "SELECT date, n_minutes, fingerprint FROM daily_bars WHERE symbol = ? AND date >= ?",
+                    (symbol, first_key),
+                ).fetchall()
+            }
+            changed = []
+            for d, n in counts.items():
+                stored_n, stored_fp = stored.get(_date_key(d), (-1, None))
+                # 分钟数变少视为拉取不全，不覆盖；分钟数相同时按内容指纹判断是否被复权 / 修正
+                if stored_n < n or (stored_n == n and stored_fp != fingerprints[d]):
+                    changed.append(d)
+            if not changed:
+                return 0
+
+            bars = aggregate_daily_bars(minute_df[dates.isin(changed)])
+            bars['n_minutes'] = bars['Date'].map(counts).astype(int)
+            with self.conn:
+                self.conn.executemany("""
+                INSERT OR REPLACE INTO daily_bars (symbol, date, close, high, low, day_vol, n_minutes, fingerprint)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [
+                    (symbol, _date_key(r.Date), float(r.Close), float(r.High), float(r.Low),
+                     None if pd.isna(r.DayVol) else float(r.DayVol), int(r.n_minutes), fingerprints[r.Date])
+                    for r in bars.itertuples(index=False)
+                ])
+                self._refresh_features(symbol, _date_key(min(changed)))
+            return len(changed)
+
+    def _refresh_features(self, symbol, first_changed):
+        """重算 prev_date >= first_changed 的特征（调用方持锁并处于事务中）。"""
+        warm = self.conn.execute("""
+        SELECT date FROM daily_bars WHERE symbol = ? AND date < ?
+        ORDER BY date DESC LIMIT 1 OFFSET ?
+        """, (symbol, first_changed, FEATURE_WARMUP_BARS - 1)).fetchone()
+        bars = self._load_bars(symbol, warm[0] if warm else None)
+        feats = compute_next_session_features(bars)
+        feats = feats[feats['prev_date'] >= first_changed]
+        cols = ['prev_date'] + TREND_FEATURE_COLUMNS
+        placeholders = ", ".join("?" for _ in range(len(cols) + 1))
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO trend_features (symbol, {', '.join(cols)}) VALUES ({placeholders})",
+            [
+                (symbol, r[0]) + tuple(None if pd.isna(v) else float(v) for v in r[1:])
+                for r in feats[cols].itertuples(index=False, name=None)
+            ],
+        )
+
+    def features_as_of(self, symbol, session_date):
+        """session_date 开盘前可知的特征（最后一个早于 session_date 的已完成交易日）；没有时返回 None。"""
+        cols = ", ".join(TREND_FEATURE_COLUMNS)
+        with self.lock:
+            row = self.conn.execute(f"""
+            SELECT prev_date, {cols} FROM trend_features
+            WHERE symbol = ? AND prev_date < ?
+            ORDER BY prev_date DESC LIMIT 1
+            """, (symbol, _date_key(session_date))).fetchone()
+        if row is None:
+            return None
+        out = {'prev_date': row[0]}
+        out.update({c: (np.nan if v is None else v) for c, v in zip(TREND_FEATURE_COLUMNS, row[1:])})
+        return out
+
+    def features_for_dates(self, symbol, dates):
+        """
+        批量取多个交易日的特征，返回与 compute_daily_trend_features 同列的 DataFrame（Date + 特征）。
+        每个日期取其前一个已完成交易日的 prev_date 行；库里没有更早日线的日期特征为 nan。
+        """
+        dates = list(dates)
+        if not dates:
+            return pd.DataFrame(columns=['Date'] + TREND_FEATURE_COLUMNS)
+        cols = ", ".join(TREND_FEATURE_COLUMNS)
+        with self.lock:
+            rows = self.conn.execute(f"""
+            SELECT prev_date, {cols} FROM trend_features
+            WHERE symbol = ? AND prev_date < ? ORDER BY prev_date
+            """, (symbol, _date_key(max(dates)))).fetchall()
+        feats = pd.DataFrame(rows, columns=['prev_date'] + TREND_FEATURE_COLUMNS)
+        feats[TREND_FEATURE_COLUMNS] = feats[TREND_FEATURE_COLUMNS].astype(float)
+        keys = np.array([_date_key(d) for d in dates])
+        prev_keys = feats['prev_date'].to_numpy(dtype=str)
+        idx = np.searchsorted(prev_keys, keys, side='left') - 1
+        out = pd.DataFrame({'Date': dates})
+        valid = idx >= 0
+        for c in TREND_FEATURE_COLUMNS:
+            vals = np.full(len(dates), np.nan)
+            vals[valid] = feats[c].to_numpy()[idx[valid]]
+            out[c] = vals
+        return out
@@ -0,0 +1,664 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+FTMO 账户群（fleet）错开起步蒙特卡洛。
+
+ftmo_ibkr_combo_backtest.run_ftmo_path 只模拟 1 个账户再 ×N_FTMO_ACCOUNTS，等价于所有账户同一天报名；
+实际是陆续在不同日期买入 challenge，过关时点与出金节奏都会因此不同。本模块一次向量化扫描
+模拟成百上千个账户，每个账户有自己的起始日与爆仓后重买延迟：
+
+  1) 每个交易日只做一次单位仓位模拟（two_phase_engine.simulate_unit_days，可多进程），
+     压缩成每笔交易的每股盈亏与持仓段内每股最差浮亏；
+  2) 按交易日顺序推进，所有账户状态（阶段、资金、阶段交易日、出金时钟、退费标记）放在 numpy 数组里，
+     单日计算量 ~ 账户数 × 当日交易笔数；只有会触发 EA 日内止损的账户才用真实股数逐根重算
+     （与 simulate_ftmo_day 相同）。
+
+单账户、起始日 0、重买延迟 0 时逐日结果与 run_ftmo_path 相同。
+输出每账户的 time-to-funded、出金合计、报名费消耗，以及分位数分布和按日汇总。
+
+账户可以是异构的（fleet spec）：每条给出考试商类型（PROP_FIRM_PRESETS）、户数、资金规模、
+各阶段杠杆，并可覆盖报名费、分成、出金周期等规则，例如
+  [{"type": "ftmo", "count": 10, "size": 100000, "lev_challenge": 2.0, "lev_funded": 1.5},
+   {"type": "the5ers", "count": 4, "size": 100000, "challenge_fee": 495, "stagger_days": 5},
+   {"type": "e8", "count": 2, "size": 200000, "lev_challenge": 1.5, "lev_funded": 1.0}]
+所有账户共用同一份预处理数据与同一条信号流（各考试商 EA 的交易时段差 1 分钟，这里统一按策略配置）；
+E8 日盈上限、Aqua paylater 的 funded 日亏 3% 等日内规则不在此建模。
+ftmo_ibkr_combo_backtest 通过 FLEET_SPEC / --fleet 使用。
+
+用法:
+  python ftmo_fleet.py --window 2024_2026 --accounts 300 --max-start-days 120 --rebuy-delays 0,2,5
+  python ftmo_fleet.py --window 2024_2026 --spec fleet.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from backtest import TRACE_CLOSE, TRACE_FLAT, TRACE_MARK, simulate_day
+from ftmo_ibkr_combo_backtest import (
+    EA_DAILY_LOSS_BUFFER,
+    FTMO_ACCOUNT_SIZE,
+    LEV_CHALLENGE,
+    LEV_FUNDED,
+    OUTPUT_DIR,
+    WINDOWS,
+    ftmo_day_config,
+    prepare_strategy_data,
+    strategy_config,
+    unpack_simulate_day,
+)
+from prop_rules import RULE_SETS
+from two_phase_engine import simulate_unit_days
+
+# 阶段编码（数组里用 int8 存）
+PHASE_IDLE, PHASE_P1, PHASE_P2, PHASE_FUNDED = 0, 1, 2, 3
+PHASE_NAMES = {PHASE_IDLE: 'idle', PHASE_P1: 'p1', PHASE_P2: 'p2', PHASE_FUNDED: 'funded'}
+
+# 默认蒙特卡洛参数
+FLEET_ACCOUNTS = 300
+FLEET_MAX_START_DAYS = 120        # 起始日在前 N 个交易日内均匀抽取
+FLEET_REBUY_DELAYS = (0, 1, 3, 5)  # 爆仓后隔几个交易日重买（每账户抽一个）
+FLEET_SEED = 20240701
+FLEET_QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+
+# 与 simulate_ftmo_day 相同的容差
+_DAILY_LOSS_EPS = 1e-6
+_FLOOR_EPS = 1e-9
+
+def fleet_preset(rule_set):
+    """prop_rules.PropRuleSet → 车队规则 dict（车队只模拟静态最大亏损 + 全阶段日初口径日亏、无一致性）。"""
+    return {
+        'n_phases': rule_set.n_phases,
+        'p1_target': rule_set.targets[0],
+        'p2_target': rule_set.targets[1] if rule_set.n_phases > 1 else 0.0,
+        'max_daily_loss': rule_set.daily_loss,
+        'max_total_loss': rule_set.max_loss,
+        'min_trading_days': rule_set.min_trading_days,
+        'challenge_fee': rule_set.challenge_fee,
+        'profit_split': rule_set.profit_split,
+        'payout_days': rule_set.payout_days,
+        'refund_fee': rule_set.refund_fee,
+    }
+
+
+def fleet_unsupported_reason(rule_set):
+    if rule_set.max_loss_mode != 'static':
+        return '最大回撤为 trailing'
+    if rule_set.daily_loss is None or rule_set.daily_loss_mode != 'day_start' or rule_set.daily_loss_phases != 'all':
+        return '日亏口径非「全阶段相对日初」'
+    if rule_set.consistency is not None:
+        return '有一致性规则'
+    if rule_set.n_phases > 2:
+        return '考试超过两阶段'
+    return None
+
+
+# 各考试商默认规则取自 prop_rules.RULE_SETS（与 simulate_*.py、SQLiteSignalEA_*.mq5 一致的唯一一份）；
+# 报名费为 100K 标价近似，分成/出金周期为标准档，实际以 fleet spec 覆盖为准
+PROP_FIRM_PRESETS = {
+    name: fleet_preset(rs) for name, rs in RULE_SETS.items() if fleet_unsupported_reason(rs) is None
+}
+# 预设之外、每条 spec 的通用默认（账户规模、杠杆、EA 缓冲、QQQ 费率）
+ACCOUNT_DEFAULTS = {
+    'size': FTMO_ACCOUNT_SIZE,
+    'lev_challenge': LEV_CHALLENGE,
+    'lev_funded': LEV_FUNDED,
+    'ea_buffer': EA_DAILY_LOSS_BUFFER,
+    'fee_per_share': 0.008166,
+    'min_round_trip_fee': 2.16,
+}
+RULE_KEYS = tuple(ACCOUNT_DEFAULTS) + tuple(PROP_FIRM_PRESETS['ftmo'])
+# spec 中与规则无关的键
+SPEC_LAYOUT_KEYS = ('type', 'name', 'count', 'start_offset', 'stagger_days', 'rebuy_delay')
+
+
+def account_rules(firm='ftmo', **overrides):
+    """单个账户的完整规则：ACCOUNT_DEFAULTS + 考试商预设 + 覆盖项。"""
+    if firm in RULE_SETS and firm not in PROP_FIRM_PRESETS:
+        raise ValueError(f'{firm}: {fleet_unsupported_reason(RULE_SETS[firm])}，车队模拟不支持，请用 prop_rules 评估')
+    if firm not in PROP_FIRM_PRESETS:
+        raise ValueError(f'未知考试商类型: {firm}（可选 {", ".join(PROP_FIRM_PRESETS)}）')
+    unknown = set(overrides) - set(RULE_KEYS)
+    if unknown:
+        raise ValueError(f'{firm}: 未知规则参数 {sorted(unknown)}')
+    rules = {**ACCOUNT_DEFAULTS, **PROP_FIRM_PRESETS[firm], **overrides}
+    return {k: float(rules[k]) for k in RULE_KEYS}
+
+
+def stack_rules(per_account):
+    """把每账户规则 dict 列表转成 {参数: 长度 n 的数组}。"""
+    return {k: np.array([r[k] for r in per_account], dtype=float) for k in RULE_KEYS}
+
+
+def ftmo_rules(n_accounts):
+    """n 个 FTMO 100K 2x/1.5x 账户的规则数组（与 run_ftmo_path 相同）。"""
+    return stack_rules([account_rules('ftmo')] * n_accounts)
+
+
+def compress_unit_day(unit):
+    """
+    把 UnitDay 压成按「已平仓笔数」分段的数组（段 k = 第 k 笔平仓之后、第 k+1 笔平仓之前）：
+      per_share: 每笔每股盈亏（含滑点）
+      seg_worst: 段内持仓 K 线的每股最差浮亏（无持仓标记为 +inf）
+      seg_close / seg_flat: 段内是否有平仓事件 / 空仓标记
+    缩放到 pos 股时，段内最差权益 = 段初权益 + pos × seg_worst（单调变换，与逐根取 min 逐位相同）。
+    """
+    n_trades = len(unit.trades)
+    per_share = np.array(
+        [
+            t['exit_price'] - t['entry_price'] if t['side'] == 'Long' else t['entry_price'] - t['exit_price']
+            for t in unit.trades
+        ],
+        dtype=float,
+    )
+    seg_worst = np.full(n_trades + 1, np.inf)
+    is_mark = unit.kind == TRACE_MARK
+    if is_mark.any():
+        worst = np.where(unit.side == 1, unit.low - unit.entry, unit.entry - unit.high)
+        np.minimum.at(seg_worst, unit.n_closed[is_mark], worst[is_mark])
+    seg_close = np.zeros(n_trades + 1, dtype=bool)
+    seg_close[unit.n_closed[unit.kind == TRACE_CLOSE]] = True
+    seg_flat = np.zeros(n_trades + 1, dtype=bool)
+    seg_flat[unit.n_closed[unit.kind == TRACE_FLAT]] = True
+    return per_share, seg_worst, seg_close, seg_flat
+
+
+def prepare_fleet_days(matrix, allowed_times, dates, cfg, workers=None):
+    """阶段一：单位仓位模拟全部交易日，只保留 run_ftmo_path 会交易的日子（≥10 根 K 线且有昨收）。"""
+    unit_cfg = ftmo_day_config(cfg, FTMO_ACCOUNT_SIZE)
+    units = simulate_unit_days(matrix, allowed_times, unit_cfg, workers=workers)
+    days = []
+    for i, trade_date in enumerate(dates):
+        day_data = matrix.day_frame(i)
+        if len(day_data) < 10:
+            continue
+        prev_close = day_data['prev_close'].iloc[0]
+        if pd.isna(prev_close):
+            continue
+        per_share, seg_worst, seg_close, seg_flat = compress_unit_day(units[i])
+        days.append({
+            'Date': trade_date,
+            'index': i,
+            'prev_close': float(prev_close),
+            'day_open': float(day_data['day_open'].iloc[0]),
+            'per_share': per_share,
+            'seg_worst': seg_worst,
+            'seg_close': seg_close,
+            'seg_flat': seg_flat,
+        })
+    return days
+
+
+def _scale_day(day, capital, pos, rules):
+    """
+    把当日单位结果缩放到各账户（capital、pos 为活跃账户数组）。
+    返回 (day_pnl, low, stop_fired)；stop_fired 的账户需要逐根重算。
+    """
+    per_share = day['per_share']
+    n_trades = len(per_share)
+    if n_trades == 0:
+        return np.zeros(len(capital)), capital.copy(), np.zeros(len(capital), dtype=bool)
+
+    posf = pos.astype(float)
+    fee = np.maximum(posf * rules['fee_per_share'] * 2, rules['min_round_trip_fee'])
+    pnl = posf[:, None] * per_share[None, :] - fee[:, None]
+    realized = np.zeros((len(capital), n_trades + 1))
+    realized[:, 1:] = np.cumsum(pnl, axis=1)
+    base = capital[:, None] + realized
+
+    seg_worst = day['seg_worst']
+    has_mark = np.isfinite(seg_worst)
+    on_base = day['seg_close'] | day['seg_flat']
+    mark_worst = np.where(has_mark[None, :], base + posf[:, None] * np.where(has_mark, seg_worst, 0.0)[None, :], np.inf)
+    base_worst = np.where(on_base[None, :], base, np.inf)
+    low = np.minimum(capital, np.minimum(mark_worst.min(axis=1), base_worst.min(axis=1)))
+
+    # 与 scale_unit_day 的 from_day_start 判断相同
+    m = rules['size'] * rules['max_daily_loss'] * (1.0 - rules['ea_buffer'])
+    floor_line = (capital - m)[:, None]
+    fired = (mark_worst <= floor_line).any(axis=1)
+    fired |= (day['seg_flat'][None, :] & (base <= floor_line)).any(axis=1)
+    fired |= (day['seg_close'][None, :] & (realized < 0) & (np.abs(realized) >= m[:, None])).any(axis=1)
+    return realized[:, -1], low, fired
+
+
+class PropFleet:
+    """
+    账户群状态（全部为长度 n 的数组）。
+    rules: {参数: 数组}（stack_rules）；labels: 每账户的分组名（默认为考试商类型）。
+    buy_after[a]: 在第几个交易日收盘后买入下一个 challenge（-1 = 第一天开盘前；<-1 = 不再买）。
+    """
+
+    def __init__(self, start_offsets, rebuy_delays, rules=None, labels=None):
+        start_offsets = np.asarray(start_offsets, dtype=np.int64)
+        n = len(start_offsets)
+        self.n = n
+        self.rules = rules if rules is not None else ftmo_rules(n)
+        self.labels = np.asarray(labels if labels is not None else ['ftmo'] * n, dtype=object)
+        self.start_offsets = start_offsets
+        self.rebuy_delays = np.broadcast_to(np.asarray(rebuy_delays, dtype=np.int64), (n,)).copy()
+
+        self.phase = np.full(n, PHASE_IDLE, dtype=np.int8)
+        self.capital = np.zeros(n)
+        self.phase_trade_days = np.zeros(n, dtype=np.int64)
+        self.last_payout_ord = np.zeros(n, dtype=np.int64)
+        self.refund_pending = np.zeros(n, dtype=bool)
+        self.buy_after = start_offsets - 1
+
+        self.n_challenges = np.zeros(n, dtype=np.int64)
+        self.n_p1_pass = np.zeros(n, dtype=np.int64)
+        self.n_p2_pass = np.zeros(n, dtype=np.int64)
+        self.n_fail = np.zeros((n, 4), dtype=np.int64)
+        self.n_payouts = np.zeros(n, dtype=np.int64)
+        self.fees_paid = np.zeros(n)
+        self.payouts = np.zeros(n)
+        self.refunds = np.zeros(n)
+        self.first_buy_day = np.full(n, -1, dtype=np.int64)
+        self.first_funded_day = np.full(n, -1, dtype=np.int64)
+        self.challenges_to_funded = np.zeros(n, dtype=np.int64)
+
+    def leverage(self):
+        r = self.rules
+        return np.where(self.phase == PHASE_FUNDED, r['lev_funded'], r['lev_challenge'])
+
+    def accrued(self):
+        r = self.rules
+        profit = np.maximum(0.0, self.capital - r['size'])
+        return np.where(self.phase == PHASE_FUNDED, profit * r['profit_split'], 0.0)
+
+    def buy(self, mask, first_day_no):
+        """对 mask 账户买入新 challenge（与 FtmoAccount.buy_new_challenge 相同的重置），first_day_no 为首个交易日序号。"""
+        if not mask.any():
+            return 0.0
+        r = self.rules
+        self.phase[mask] = PHASE_P1
+        self.capital[mask] = r['size'][mask]
+        self.phase_trade_days[mask] = 0
+        self.refund_pending[mask] = False
+        self.n_challenges[mask] += 1
+        self.fees_paid[mask] += r['challenge_fee'][mask]
+        self.first_buy_day[mask & (self.first_buy_day < 0)] = first_day_no
+        self.buy_after[mask] = -2
+        return float(r['challenge_fee'][mask].sum())
+
+    def step(self, day_no, day, matrix, allowed_times, cfg):
+        """推进一个交易日，返回当日汇总行。"""
+        r = self.rules
+        trade_date = day['Date']
+        ordinal = trade_date.toordinal()
+        fees_today = self.buy(self.buy_after == -1, 0) if day_no == 0 else 0.0
+
+        active = np.flatnonzero(self.phase != PHASE_IDLE)
+        phase_sod = self.phase.copy()
+        day_pnl = np.zeros(self.n)
+        failed = np.zeros(self.n, dtype=bool)
+        n_exact = 0
+        if len(active):
+            cap = self.capital[active]
+            lev = self.leverage()[active]
+            day_open = day['day_open']
+            pos = np.where(
+                (cap > 0) & (lev > 0) & (day_open > 0), np.floor(cap * lev / day_open), 0
+            ).astype(np.int64)
+            sub_rules = {k: v[active] for k, v in r.items()}
+            pnl, low, fired = _scale_day(day, cap, pos, sub_rules)
+            n_trades = np.where(pos > 0, len(day['per_share']), 0)
+
+            for j in np.flatnonzero(fired & (pos > 0)):
+                # 日内止损会触发：与 simulate_ftmo_day 相同，用真实股数逐根重算
+                pnl[j], low[j], n_trades[j] = exact_day(
+                    matrix.day_frame(day['index']), day['prev_close'], allowed_times, cfg,
+                    {k: v[j] for k, v in sub_rules.items()}, cap[j], pos[j],
+                )
+                n_exact += 1
+
+            official = sub_rules['size'] * sub_rules['max_daily_loss']
+            floor_eq = sub_rules['size'] * (1.0 - sub_rules['max_total_loss'])
+            lowest = np.minimum(low, cap + pnl)
+            loss_usd = np.maximum(0.0, cap - lowest)
+            day_fail = (pos > 0) & ((loss_usd >= official - _DAILY_LOSS_EPS) | (lowest <= floor_eq + _FLOOR_EPS))
+            day_pnl[active] = np.where(pos > 0, pnl, 0.0)
+            failed[active] = day_fail
+
+            # 爆仓：计数后进入等待重买；未爆仓：记账 → 过关判断 → 出金
+            fail_idx = active[day_fail]
+            np.add.at(self.n_fail, (fail_idx, self.phase[fail_idx]), 1)
+            self.phase[fail_idx] = PHASE_IDLE
+            self.buy_after[fail_idx] = day_no + self.rebuy_delays[fail_idx]
+
+            ok = active[~day_fail]
+            self.capital[ok] += day_pnl[ok]
+            self.phase_trade_days[ok] += (n_trades[~day_fail] > 0)
+            self._pass_phases(ok, day_no, ordinal)
+            payout, refund = self._payouts(ok, ordinal)
+        else:
+            payout = refund = 0.0
+
+        # 收盘后买入（含延迟 0 的爆仓当日重买），费用记在当日、从下一交易日开始交易
+        fees_today += self.buy((self.phase == PHASE_IDLE) & (self.buy_after == day_no), day_no + 1)
+        funded_sod = (phase_sod == PHASE_FUNDED) & ~failed
+        live = self.phase != PHASE_IDLE
+        return {
+            'Date': trade_date,
+            'n_idle': int((self.phase == PHASE_IDLE).sum()),
+            'n_p1': int((self.phase == PHASE_P1).sum()),
+            'n_p2': int((self.phase == PHASE_P2).sum()),
+            'n_funded': int((self.phase == PHASE_FUNDED).sum()),
+            'n_failed': int(failed.sum()),
+            'n_exact': n_exact,
+            'funded_pnl': float(day_pnl[funded_sod].sum()),
+            'payout': payout,
+            'refund': refund,
+            'fees': fees_today,
+            'accrued': float(self.accrued().sum()),
+            'equity': float(self.capital[live].sum()),
+            'phase_mode': _phase_mode(self.phase),
+        }
+
+    def _pass_phases(self, idx, day_no, ordinal):
+        r = self.rules
+        enough = self.phase_trade_days[idx] >= r['min_trading_days'][idx]
+        cap = self.capital[idx]
+        size = r['size'][idx]
+        p1 = idx[enough & (self.phase[idx] == PHASE_P1) & (cap >= size * (1 + r['p1_target'][idx]))]
+        p2 = idx[enough & (self.phase[idx] == PHASE_P2) & (cap >= size * (1 + r['p2_target'][idx]))]
+        # 一阶段考试（n_phases == 1）过 P1 直接 funded
+        one_step = r['n_phases'][p1] <= 1
+        to_p2, to_funded = p1[~one_step], np.concatenate([p1[one_step], p2])
+        for passed, new_phase in ((to_p2, PHASE_P2), (to_funded, PHASE_FUNDED)):
+            self.phase[passed] = new_phase
+            self.capital[passed] = r['size'][passed]
+            self.phase_trade_days[passed] = 0
+        self.n_p1_pass[p1] += 1
+        self.n_p2_pass[p2] += 1
+        self.last_payout_ord[to_funded] = ordinal
+        self.refund_pending[to_funded] = r['refund_fee'][to_funded] > 0
+        first = to_funded[self.first_funded_day[to_funded] < 0]
+        self.first_funded_day[first] = day_no
+        self.challenges_to_funded[first] = self.n_challenges[first]
+
+    def _payouts(self, idx, ordinal):
+        r = self.rules
+        idx = idx[self.phase[idx] == PHASE_FUNDED]
+        due = idx[(ordinal - self.last_payout_ord[idx]) >= r['payout_days'][idx]]
+        profit = self.capital[due] - r['size'][due]
+        due = due[profit > 0]
+        if not len(due):
+            return 0.0, 0.0
+        trader = (self.capital[due] - r['size'][due]) * r['profit_split'][due]
+        refund = np.where(self.refund_pending[due], r['challenge_fee'][due], 0.0)
+        self.refund_pending[due] = False
+        self.payouts[due] += trader
+        self.refunds[due] += refund
+        self.n_payouts[due] += 1
+        self.capital[due] = r['size'][due]
+        self.last_payout_ord[due] = ordinal
+        return float(trader.sum()), float(refund.sum())
+
+
+def _phase_mode(phase):
+    counts = np.bincount(phase, minlength=4)
+    return PHASE_NAMES[int(counts.argmax())]
+
+
+def exact_day(day_data, prev_close, allowed_times, cfg, rules, capital, pos):
+    """
+    逐根模拟单个账户一天（simulate_ftmo_day 的核心），返回 (当日盈亏, 日内最低权益, 成交笔数)。
+    rules: 该账户的规则（标量 dict）。
+    """
+    day_cfg = ftmo_day_config(
+        cfg, rules['size'], rules['max_daily_loss'], rules['ea_buffer'],
+        rules['fee_per_share'], rules['min_round_trip_fee'],
+    )
+    result = simulate_day(day_data, prev_close, allowed_times, int(pos), day_cfg, float(capital))
+    trades, _, _, low, _ = unpack_simulate_day(result)
+    return sum(t['pnl'] for t in trades), low, len(trades)
+
+
+def run_fleet(fleet, days, matrix, allowed_times, cfg, verbose=True):
+    """阶段二：按交易日顺序推进整个账户群，返回按日汇总 DataFrame。"""
+    rows = []
+    n = len(days)
+    for day_no, day in enumerate(days):
+        rows.append(fleet.step(day_no, day, matrix, allowed_times, cfg))
+        if verbose and ((day_no + 1) % 80 == 0 or (day_no + 1) == n):
+            row = rows[-1]
+            print(
+                f"  fleet {day_no+1}/{n} {row['Date']} | p1 {row['n_p1']} p2 {row['n_p2']} "
+                f"funded {row['n_funded']} 等待 {row['n_idle']} | 逐根重算 {row['n_exact']}",
+                flush=True,
+            )
+    daily = pd.DataFrame(rows)
+    if len(daily):
+        for col in ('payout', 'refund', 'fees'):
+            daily[f'{col}_cum'] = daily[col].cumsum()
+    return daily
+
+
+def fleet_accounts(fleet, days):
+    """每账户结果表。time-to-funded 从第一次报名算起（含中途爆仓重买）。"""
+    dates = [d['Date'] for d in days]
+
+    def to_date(day_no):
+        return [dates[k] if 0 <= k < len(dates) else None for k in day_no]
+
+    first_buy = to_date(fleet.first_buy_day)
+    first_funded = to_date(fleet.first_funded_day)
+    accrued = fleet.accrued()
+    df = pd.DataFrame({
+        'account': np.arange(fleet.n),
+        'type': fleet.labels,
+        'start_offset': fleet.start_offsets,
+        'rebuy_delay': fleet.rebuy_delays,
+        'first_buy': first_buy,
+        'first_funded': first_funded,
+        'days_to_funded': [
+            (f - b).days if f is not None and b is not None else np.nan for b, f in zip(first_buy, first_funded)
+        ],
+        'trading_days_to_funded': np.where(
+            fleet.first_funded_day >= 0, fleet.first_funded_day - fleet.first_buy_day, np.nan
+        ),
+        'challenges_to_funded': np.where(fleet.first_funded_day >= 0, fleet.challenges_to_funded, np.nan),
+        'challenges': fleet.n_challenges,
+        'p1_pass': fleet.n_p1_pass,
+        'p2_pass': fleet.n_p2_pass,
+        'fail_p1': fleet.n_fail[:, PHASE_P1],
+        'fail_p2': fleet.n_fail[:, PHASE_P2],
+        'fail_funded': fleet.n_fail[:, PHASE_FUNDED],
+        'payouts': fleet.n_payouts,
+        'payout_total': fleet.payouts,
+        'refund_total': fleet.refunds,
+        'fees_paid': fleet.fees_paid,
+        'accrued': accrued,
+        'end_phase': [PHASE_NAMES[p] for p in fleet.phase],
+        'end_capital': fleet.capital,
+    })
+    df['net'] = df['payout_total'] + df['refund_total'] + df['accrued'] - df['fees_paid']
+    return df
+
+
+def fleet_distribution(accounts, quantiles=FLEET_QUANTILES):
+    """time-to-funded / 出金合计 / 报名费消耗 / 净收益的分位数分布。"""
+    started = accounts[accounts['challenges'] > 0]
+    out = {
+        'accounts': int(len(accounts)),
+        'started': int(len(started)),
+        'funded_share': round(float(started['first_funded'].notna().mean()), 4) if len(started) else 0.0,
+    }
+    for col in ('days_to_funded', 'challenges_to_funded', 'payout_total', 'fees_paid', 'net'):
+        values = started[col].dropna()
+        if values.empty:
+            out[col] = None
+            continue
+        stats = {'mean': round(float(values.mean()), 2)}
+        for q in quantiles:
+            stats[f'p{int(q * 100)}'] = round(float(values.quantile(q)), 2)
+        out[col] = stats
+    return out
+
+
+def random_fleet(n_accounts, n_days, max_start_days=FLEET_MAX_START_DAYS, rebuy_delays=FLEET_REBUY_DELAYS, seed=FLEET_SEED):
+    """起始日在前 max_start_days 个交易日内均匀抽取，每账户的重买延迟从 rebuy_delays 中抽取。"""
+    rng = np.random.default_rng(seed)
+    hi = max(1, min(int(max_start_days), n_days))
+    starts = rng.integers(0, hi, size=n_accounts)
+    delays = rng.choice(np.asarray(rebuy_delays, dtype=np.int64), size=n_accounts)
+    return PropFleet(starts, delays)
+
+
+def fleet_from_spec(spec):
+    """
+    由 fleet spec 构造账户群。spec 为 list（或含 'accounts' 键的 dict），每条：
+      type（PROP_FIRM_PRESETS 的键）、count、name（分组名，默认 type）、
+      start_offset / stagger_days（第 k 户从第 start_offset + k×stagger_days 个交易日起步）、
+      rebuy_delay（爆仓后隔几个交易日重买），其余键覆盖规则（RULE_KEYS）。
+    """
+    entries = spec['accounts'] if isinstance(spec, dict) else spec
+    per_account, labels, starts, delays = [], [], [], []
+    for entry in entries:
+        entry = dict(entry)
+        firm = str(entry.get('type', 'ftmo')).lower()
+        count = int(entry.get('count', 1))
+        overrides = {k: v for k, v in entry.items() if k not in SPEC_LAYOUT_KEYS}
+        rules = account_rules(firm, **overrides)
+        start = int(entry.get('start_offset', 0))
+        stagger = int(entry.get('stagger_days', 0))
+        for k in range(count):
+            per_account.append(rules)
+            labels.append(entry.get('name', firm))
+            starts.append(start + k * stagger)
+            delays.append(int(entry.get('rebuy_delay', 0)))
+    if not per_account:
+        raise ValueError('fleet spec 为空')
+    return PropFleet(starts, delays, stack_rules(per_account), labels)
+
+
+def load_fleet_spec(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def fleet_groups(accounts):
+    """按分组（考试商）汇总账户结果。"""
+    g = accounts.groupby('type', sort=False).agg(
+        accounts=('account', 'size'),
+        challenges=('challenges', 'sum'),
+        funded_accounts=('first_funded', 'count'),
+        days_to_funded_median=('days_to_funded', 'median'),
+        fail=('fail_p1', 'sum'),
+        fail_p2=('fail_p2', 'sum'),
+        fail_funded=('fail_funded', 'sum'),
+        payouts=('payouts', 'sum'),
+        payout_total=('payout_total', 'sum'),
+        refund_total=('refund_total', 'sum'),
+        fees_paid=('fees_paid', 'sum'),
+        accrued=('accrued', 'sum'),
+        net=('net', 'sum'),
+    ).reset_index()
+    g['fail'] = g['fail'] + g.pop('fail_p2') + g.pop('fail_funded')
+    return g
+
+
+def ftmo_daily_from_fleet(daily, fleet):
+    """
+    把 run_fleet 的按日汇总转成 run_ftmo_path 的 ftmo_daily 列（金额为全体账户合计），
+    供 run_ibkr_on_payouts / monthly_from_daily 直接使用；one_equity 为每户平均权益。
+    """
+    out = pd.DataFrame({'Date': daily['Date']})
+    out['phase'] = daily['phase_mode'].shift(1).fillna(PHASE_NAMES[PHASE_P1])
+    out['phase_eod'] = daily['phase_mode']
+    out['funded_pnl'] = daily['funded_pnl']
+    out['one_equity'] = daily['equity'] / fleet.n
+    out['failed'] = daily['n_failed'] > 0
+    out['n_failed'] = daily['n_failed']
+    out['passed_p1'] = (daily['n_p2'] + daily['n_funded']) > 0
+    out['is_funded'] = daily['n_funded'] > 0
+    out['payout_to_ibkr'] = daily['payout']
+    out['refund_to_ibkr'] = daily['refund']
+    out['accrued'] = daily['accrued']
+    out['fees_cum'] = daily['fees_cum']
+    return out
+
+
+def print_distribution(dist):
+    print(f"\n账户 {dist['accounts']} | 已开始 {dist['started']} | 曾进入 funded {dist['funded_share']*100:.1f}%")
+    labels = {
+        'days_to_funded': '首次 funded 日历日',
+        'challenges_to_funded': 'funded 前报名次数',
+        'payout_total': '出金合计 $',
+        'fees_paid': '报名费消耗 $',
+        'net': '净收益 $',
+    }
+    for col, label in labels.items():
+        stats = dist.get(col)
+        if not stats:
+            print(f'  {label:<18} -')
+            continue
+        parts = ' '.join(f'{k}={v:,.0f}' for k, v in stats.items())
+        print(f'  {label:<18} {parts}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='FTMO / 多考试商账户群错开起步蒙特卡洛')
+    parser.add_argument('--window', default=WINDOWS[-1]['key'], choices=[w['key'] for w in WINDOWS])
+    parser.add_argument('--accounts', type=int, default=FLEET_ACCOUNTS)
+    parser.add_argument('--max-start-days', type=int, default=FLEET_MAX_START_DAYS)
+    parser.add_argument('--rebuy-delays', default=','.join(str(d) for d in FLEET_REBUY_DELAYS),
+                        help='逗号分隔，每账户随机取一个（交易日）')
+    parser.add_argument('--seed', type=int, default=FLEET_SEED)
+    parser.add_argument('--spec', default=None, help='fleet spec JSON（给出时忽略 --accounts 等随机参数）')
+    parser.add_argument('--workers', type=int, default=None, help='单位仓位模拟进程数')
+    args = parser.parse_args()
+
+    window = next(w for w in WINDOWS if w['key'] == args.window)
+    cfg = strategy_config(window)
+    t0 = time.perf_counter()
+    print(f"窗口 {window['label']} 预处理...")
+    matrix, allowed_times, dates = prepare_strategy_data(cfg)
+    days = prepare_fleet_days(matrix, allowed_times, dates, cfg, workers=args.workers)
+    print(f'有效交易日 {len(days)}，单位模拟用时 {time.perf_counter() - t0:.1f}s')
+    if not days:
+        return
+
+    delays = [int(x) for x in args.rebuy_delays.split(',') if x.strip()]
+    if args.spec:
+        fleet = fleet_from_spec(load_fleet_spec(args.spec))
+    else:
+        fleet = random_fleet(args.accounts, len(days), args.max_start_days, delays, args.seed)
+    t1 = time.perf_counter()
+    daily = run_fleet(fleet, days, matrix, allowed_times, cfg)
+    accounts = fleet_accounts(fleet, days)
+    dist = fleet_distribution(accounts)
+    print(f'账户群推进用时 {time.perf_counter() - t1:.1f}s')
+    print_distribution(dist)
+    groups = fleet_groups(accounts)
+    if len(groups) > 1:
+        print()
+        print(groups.to_string(index=False, float_format=lambda v: f'{v:,.0f}'))
+
+    out_dir = os.path.join(OUTPUT_DIR, window['key'])
+    os.makedirs(out_dir, exist_ok=True)
+    daily.to_csv(os.path.join(out_dir, 'fleet_daily.csv'), index=False)
+    accounts.to_csv(os.path.join(out_dir, 'fleet_accounts.csv'), index=False)
+    if args.spec:
+        params = {'spec': load_fleet_spec(args.spec)}
+    else:
+        params = {
+            'accounts': args.accounts,
+            'max_start_days': args.max_start_days,
+            'rebuy_delays': delays,
+            'seed': args.seed,
+        }
+    with open(os.path.join(out_dir, 'fleet_summary.json'), 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'distribution': dist}, f, ensure_ascii=False, indent=2)
+    print(f'\n明细: {out_dir}')
+
+
+if __name__ == '__main__':
+    main()
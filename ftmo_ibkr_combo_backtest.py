@@ -22,13 +22,20 @@ FTMO 10×100K（challenge 2x / funded 1.5x）+ IBKR MNQ 逐日联合回测。
 用法:
   conda activate quantra
   python ftmo_ibkr_combo_backtest.py
+  python ftmo_ibkr_combo_backtest.py --force   # 忽略结果缓存重算全部窗口
+  python ftmo_ibkr_combo_backtest.py --fleet fleet.json   # 异构考试商账户群（见 ftmo_fleet）
 """
 
 from __future__ import annotations
 
+import argparse
+import contextlib
+import io
 import json
 import os
-from dataclasses import dataclass, field
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
 from datetime import date
 from math import floor
 
@@ -41,10 +48,14 @@ import pandas as pd
 
 from backtest import (
     apply_k_bounds,
-    compute_daily_trend_features,
     compute_entry_trend_pass_series,
+    feature_store_symbol,
+    load_price_data,
+    load_trend_features,
     simulate_day,
 )
+from day_matrix import DayMatrix
+from two_phase_engine import DayUnits
 
 # ---------------------------------------------------------------------------
 # FTMO
@@ -81,6 +92,17 @@ QUANTRA_DIR = '/Users/Wezhang/workspace/quantra'
 HIST_DATA = os.path.join(QUANTRA_DIR, 'qqq_market_hours_with_indicators.csv')
 LONGPORT_2Y = os.path.join(QUANTRA_DIR, 'qqq_longport_2year.csv')
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'ftmo_ibkr_combo')
+# 每个窗口额外写一份 Parquet 列式结果目录（<key>/columnar，见 backtest_store）
+SAVE_COLUMNAR_RESULTS = True
+# 相同数据 + 配置的窗口直接复用上次的 summary（result_cache）；python ftmo_ibkr_combo_backtest.py --force 强制重算
+USE_RESULT_CACHE = True
+RESULT_CACHE_DB = os.path.join(OUTPUT_DIR, 'result_cache.db')
+# 组合引擎版本：run_joint_path / FtmoAccount / IBKR 出入金 / ftmo_fleet 推进逻辑变化时递增，
+# 旧窗口 summary 随之失效（backtest.ENGINE_VERSION 只覆盖 simulate_day）
+COMBO_ENGINE_VERSION = 1
+
+# 设为 'QQQ' 时各窗口从 dataset_registry 择优取数（忽略窗口里的 data_path），None 为按文件读取
+DATASET_SYMBOL = None
 
 # 与 2024-07-01 ~ 2026-08-07 对齐的两段「两年」窗口 + 原窗口
 WINDOWS = [
@@ -107,10 +129,29 @@ WINDOWS = [
     },
 ]
 
+# 多窗口并行的进程数（1 为顺序执行）；同一数据文件的窗口共用一次读取
+COMBO_WORKERS = len(WINDOWS)
+
+# 只影响执行方式 / 输出位置、不影响结果的模块常量，不计入结果缓存键
+# （数据路径与窗口由 strategy_config 的数据集指纹覆盖，账户群 spec 随窗口单独计入）
+COMBO_NON_RESULT_CONSTANTS = {
+    'COMBO_WORKERS', 'USE_RESULT_CACHE', 'RESULT_CACHE_DB', 'OUTPUT_DIR', 'SAVE_COLUMNAR_RESULTS',
+    'QUANTRA_DIR', 'HIST_DATA', 'LONGPORT_2Y', 'WINDOWS', 'FLEET_SPEC', 'COMBO_NON_RESULT_CONSTANTS',
+}
+
+# 异构考试商账户群（格式见 ftmo_fleet.fleet_from_spec）；None = 上面的 N_FTMO_ACCOUNTS × FTMO 100K
+FLEET_SPEC = None
+# FLEET_SPEC = [
+#     {'type': 'ftmo', 'count': 6, 'size': 100_000, 'lev_challenge': 2.0, 'lev_funded': 1.5},
+#     {'type': 'the5ers', 'count': 4, 'size': 100_000, 'stagger_days': 5},
+#     {'type': 'e8', 'count': 2, 'size': 200_000, 'lev_challenge': 1.5, 'lev_funded': 1.0, 'challenge_fee': 980},
+# ]
+
 
 def strategy_config(window):
     return {
         'data_path': window['data_path'],
+        'dataset_symbol': window.get('dataset_symbol', DATASET_SYMBOL),
         'ticker': 'QQQ',
         'lookback_days': 1,
         'start_date': window['start_date'],
@@ -150,8 +191,28 @@ def strategy_config(window):
     }
 
 
-def prepare_strategy_data(config):
-    data_path = config['data_path']
+def shared_data_key(config):
+    """
+    可在窗口间共享的数据键：按文件读取时为文件绝对路径；
+    dataset_registry 按窗口区间（含预热）取数，各窗口不共享，返回 None。
+    """
+    if config.get('dataset_symbol'):
+        return None
+    return os.path.abspath(config['data_path'])
+
+
+def load_shared_data(config):
+    """与窗口无关的部分：整份分钟数据（排序 + Date/Time）与全样本趋势特征。"""
+    price_df = load_price_data(config)
+    price_df.sort_values('DateTime', inplace=True)
+    price_df['Date'] = price_df['DateTime'].dt.date
+    price_df['Time'] = price_df['DateTime'].dt.strftime('%H:%M')
+    trend_feat_df = load_trend_features(price_df, config, feature_store_symbol(config))
+    return price_df, trend_feat_df
+
+
+def prepare_strategy_data(config, shared=None):
+    """shared: load_shared_data 的结果（同一数据文件的多个窗口共用，不会被修改）；None 时现读。"""
     lookback_days = config.get('lookback_days', 1)
     start_date = config.get('start_date')
     end_date = config.get('end_date')
@@ -159,91 +220,17 @@ def prepare_strategy_data(config):
     trading_end_time = config.get('trading_end_time', (15, 40))
     check_interval_minutes = config.get('check_interval_minutes', 15)
 
-    price_df = pd.read_csv(data_path, parse_dates=['DateTime'])
-    price_df.sort_values('DateTime', inplace=True)
-    price_df['Date'] = price_df['DateTime'].dt.date
-    price_df['Time'] = price_df['DateTime'].dt.strftime('%H:%M')
-
-    trend_feat_df = compute_daily_trend_features(price_df)
+    price_df, trend_feat_df = shared if shared is not None else load_shared_data(config)
     if start_date is not None:
         price_df = price_df[price_df['Date'] >= start_date]
     if end_date is not None:
         price_df = price_df[price_df['Date'] <= end_date]
     price_df = pd.merge(price_df, trend_feat_df, on='Date', how='left')
 
-    if 'DayOpen' not in price_df.columns or 'DayClose' not in price_df.columns:
-        opening_prices = (
-            price_df.groupby('Date').first().reset_index()[['Date', 'Open']]
-            .rename(columns={'Open': 'DayOpen'})
-        )
-        closing_prices = (
-            price_df.groupby('Date').last().reset_index()[['Date', 'Close']]
-            .rename(columns={'Close': 'DayClose'})
-        )
-        price_df = pd.merge(price_df, opening_prices, on='Date', how='left')
-        price_df = pd.merge(price_df, closing_prices, on='Date', how='left')
-    else:
-        # 历史文件已有 DayOpen/DayClose，按窗口内重算，避免用到窗口外的日开盘
-        opening_prices = (
-            price_df.groupby('Date').first().reset_index()[['Date', 'Open']]
-            .rename(columns={'Open': 'DayOpen'})
-        )
-        closing_prices = (
-            price_df.groupby('Date').last().reset_index()[['Date', 'Close']]
-            .rename(columns={'Close': 'DayClose'})
-        )
-        price_df = price_df.drop(columns=['DayOpen', 'DayClose'], errors='ignore')
-        price_df = pd.merge(price_df, opening_prices, on='Date', how='left')
-        price_df = pd.merge(price_df, closing_prices, on='Date', how='left')
-
-    price_df['prev_close'] = price_df.groupby('Date')['DayClose'].transform('first').shift(1)
-    price_df['day_open'] = price_df.groupby('Date')['DayOpen'].transform('first')
-
-    date_refs = []
-    for d in price_df['Date'].unique():
-        row = price_df[price_df['Date'] == d].iloc[0]
-        day_open = row['day_open']
-        prev_close = row['prev_close']
-        if not pd.isna(prev_close):
-            upper_ref = max(day_open, prev_close)
-            lower_ref = min(day_open, prev_close)
-        else:
-            upper_ref = day_open
-            lower_ref = day_open
-        date_refs.append({'Date': d, 'upper_ref': upper_ref, 'lower_ref': lower_ref})
-    price_df = price_df.drop(columns=['upper_ref', 'lower_ref'], errors='ignore')
-    price_df = pd.merge(price_df, pd.DataFrame(date_refs), on='Date', how='left')
-    price_df['ret'] = price_df['Close'] / price_df['day_open'] - 1
-
-    pivot = price_df.pivot(index='Date', columns='Time', values='ret').abs()
-    sigma = pivot.rolling(window=lookback_days, min_periods=lookback_days).mean().shift(1)
-    sigma = sigma.stack().reset_index(name='sigma')
-    price_df = pd.merge(price_df, sigma, on=['Date', 'Time'], how='left')
-
-    incomplete = set()
-    for d in price_df['Date'].unique():
-        dd = price_df[price_df['Date'] == d]
-        if len(dd) and dd['sigma'].isna().mean() > 0.1:
-            incomplete.add(d)
-    price_df = price_df[~price_df['Date'].isin(incomplete)]
-    price_df['sigma'] = price_df.groupby('Date')['sigma'].ffill()
-    price_df['sigma'] = price_df.groupby('Date')['sigma'].bfill()
-    price_df['sigma'] = price_df['sigma'].fillna(0)
-
-    price_df['intraday_ret'] = price_df['Close'] / price_df['day_open'] - 1
-    day_start_dt = price_df.groupby('Date')['DateTime'].transform('min')
-    price_df['minutes_from_open'] = (price_df['DateTime'] - day_start_dt).dt.total_seconds() / 60
-    price_df['cum_high'] = price_df.groupby('Date')['High'].cummax()
-    price_df['cum_low'] = price_df.groupby('Date')['Low'].cummin()
-    span = price_df['cum_high'] - price_df['cum_low']
-    price_df['intraday_range_pos'] = (
-        (price_df['Close'] - price_df['cum_low']) / span.replace(0, np.nan)
-    ).clip(0, 1)
-    day_sigma_med = price_df.groupby('Date')['sigma'].transform('median')
-    price_df['sigma_vs_day_median'] = price_df['sigma'] / day_sigma_med.replace(0, np.nan)
-
-    price_df = apply_k_bounds(price_df, config)
-    price_df['entry_trend_pass'] = compute_entry_trend_pass_series(price_df, config)
+    # 日×分钟矩阵上预处理；DayOpen/DayClose 按窗口内重算，避免历史文件里的值用到窗口外的日开盘
+    matrix = DayMatrix.from_frame(price_df).prepare_noise_area(lookback_days, recompute_day_prices=True)
+    matrix = apply_k_bounds(matrix, config)
+    matrix['entry_trend_pass'] = compute_entry_trend_pass_series(matrix, config)
 
     allowed_times = []
     h, m = trading_start_time
@@ -259,7 +246,7 @@ def prepare_strategy_data(config):
         allowed_times.append(end_str)
         allowed_times.sort()
 
-    return price_df, allowed_times, sorted(price_df['Date'].unique())
+    return matrix, allowed_times, list(matrix.dates)
 
 
 def unpack_simulate_day(result):
@@ -342,26 +329,45 @@ class FtmoAccount:
         return max(0.0, self.capital - self.size) * PROFIT_SPLIT
 
 
-def simulate_ftmo_day(acct: FtmoAccount, day_data, prev_close, allowed_times, base_cfg):
-    official_daily = acct.size * MAX_DAILY_LOSS
-    ea_stop = official_daily * (1.0 - EA_DAILY_LOSS_BUFFER)
-    floor_eq = acct.size * (1.0 - MAX_TOTAL_LOSS)
-    day_open = float(day_data['day_open'].iloc[0])
-    pos = qqq_position_size(acct.capital, acct.leverage, day_open)
-
+def ftmo_day_config(base_cfg, size, max_daily_loss=None, ea_buffer=None,
+                    fee_per_share=0.008166, min_round_trip_fee=None):
+    """
+    FTMO 账户单日模拟配置：EA 日内止损（日初口径，官方日亏限额留 ea_buffer 余量）+ 长桥费率。
+    其他考试商（ftmo_fleet 的 fleet spec）传入各自的日亏比例与费率；None 取本模块常量。
+    """
+    if max_daily_loss is None:
+        max_daily_loss = MAX_DAILY_LOSS
+    if ea_buffer is None:
+        ea_buffer = EA_DAILY_LOSS_BUFFER
     cfg = base_cfg.copy()
-    cfg['initial_capital'] = acct.size
+    cfg['initial_capital'] = size
     cfg['enable_intraday_stop_loss'] = True
     cfg['intraday_stop_loss_mode'] = 'from_day_start'
-    cfg['max_daily_loss_amount'] = ea_stop
+    cfg['max_daily_loss_amount'] = size * max_daily_loss * (1.0 - ea_buffer)
     cfg['enable_transaction_fees'] = True
-    cfg['transaction_fee_per_share'] = 0.008166
+    cfg['transaction_fee_per_share'] = fee_per_share
+    if min_round_trip_fee is not None:
+        cfg['min_round_trip_fee'] = min_round_trip_fee
     cfg['slippage_per_share'] = 0.01
+    return cfg
+
+
+def simulate_ftmo_day(acct: FtmoAccount, day_data, prev_close, allowed_times, base_cfg, units=None):
+    """units: 当日 DayUnits（联合循环里与 IBKR 腿共用）；None 时按真实股数直接模拟。"""
+    official_daily = acct.size * MAX_DAILY_LOSS
+    floor_eq = acct.size * (1.0 - MAX_TOTAL_LOSS)
+    day_open = float(day_data['day_open'].iloc[0])
+    pos = qqq_position_size(acct.capital, acct.leverage, day_open)
+
+    cfg = ftmo_day_config(base_cfg, acct.size)
 
     if pos <= 0:
         return 0.0, False, None, 0
 
-    result = simulate_day(day_data, prev_close, allowed_times, pos, cfg, acct.capital)
+    if units is not None:
+        result = units.simulate(pos, acct.capital, cfg)
+    else:
+        result = simulate_day(day_data, prev_close, allowed_times, pos, cfg, acct.capital)
     trades, mdd, loss_from_start, low, high = unpack_simulate_day(result)
     day_pnl = sum(t['pnl'] for t in trades)
     eod = acct.capital + day_pnl
@@ -442,7 +448,7 @@ def apply_ftmo_eod(acct: FtmoAccount, day_pnl, failed, reason, n_trades, trade_d
     return False
 
 
-def simulate_ibkr_day(equity, day_data, prev_close, allowed_times, base_cfg, usage_pct, daily_stop_pct):
+def simulate_ibkr_day(equity, day_data, prev_close, allowed_times, base_cfg, usage_pct, daily_stop_pct, units=None):
     if equity <= 0:
         return {'pnl': 0.0, 'qty': 0, 'lev': 0.0, 'note': 'no_capital', 'cost': 0.0}
 
@@ -467,7 +473,10 @@ def simulate_ibkr_day(equity, day_data, prev_close, allowed_times, base_cfg, usa
         cfg['enable_intraday_stop_loss'] = False
         cfg['max_daily_loss_amount'] = 0
 
-    result = simulate_day(day_data, prev_close, allowed_times, shares, cfg, equity)
+    if units is not None:
+        result = units.simulate(shares, equity, cfg)
+    else:
+        result = simulate_day(day_data, prev_close, allowed_times, shares, cfg, equity)
     trades, mdd, loss_from_start, low, high = unpack_simulate_day(result)
     cost = len(trades) * qty * (MNQ_COMMISSION_RT + MNQ_SLIPPAGE_RT)
     raw_pnl = sum(t['pnl'] for t in trades)
@@ -490,126 +499,143 @@ def simulate_ibkr_day(equity, day_data, prev_close, allowed_times, base_cfg, usa
     return {'pnl': day_pnl, 'qty': qty, 'lev': lev, 'note': note, 'cost': cost}
 
 
-def run_ftmo_path(price_df, allowed_times, dates, cfg):
-    by_date = {d: g.copy() for d, g in price_df.groupby('Date')}
-    acct = FtmoAccount('F100K_2x/1.5x', FTMO_ACCOUNT_SIZE, LEV_CHALLENGE, LEV_FUNDED)
+def ftmo_valid_day(matrix, trade_date):
+    """FTMO / IBKR 逐日循环共用的日视图：不足 10 根 K 线或缺昨收的交易日返回 None。"""
+    day_data = matrix.day_frame_for(trade_date)
+    if len(day_data) < 10:
+        return None
+    prev_close = day_data['prev_close'].iloc[0]
+    if pd.isna(prev_close):
+        return None
+    return day_data, float(prev_close)
+
+
+def new_ftmo_account():
+    return FtmoAccount('F100K_2x/1.5x', FTMO_ACCOUNT_SIZE, LEV_CHALLENGE, LEV_FUNDED)
+
+
+def ftmo_day_row(acct: FtmoAccount, trade_date, day_data, prev_close, allowed_times, cfg, units=None):
+    """FTMO 一个交易日：模拟 → 记账/过关 → 爆仓重买或出金，返回 ftmo_daily 的一行（金额 ×N_FTMO_ACCOUNTS）。"""
     n_mult = N_FTMO_ACCOUNTS
+    phase_sod = acct.phase
+    lev_sod = acct.leverage
+    day_pnl, failed, reason, n_trades = simulate_ftmo_day(
+        acct, day_data, prev_close, allowed_times, cfg, units
+    )
+    blew = apply_ftmo_eod(acct, day_pnl, failed, reason, n_trades, trade_date)
+    payout = refund = 0.0
+    if blew:
+        acct.buy_new_challenge(trade_date)
+    else:
+        payout, refund = maybe_payout(acct, trade_date)
+
+    one_pnl = 0.0 if blew else day_pnl
+    funded_pnl = one_pnl if phase_sod == 'funded' else 0.0
+    phase_eod = acct.phase
+    return {
+        'Date': trade_date,
+        'phase': phase_sod,
+        'phase_eod': phase_eod,
+        'lev': lev_sod,
+        'one_pnl': one_pnl,
+        'all_pnl': one_pnl * n_mult,
+        'funded_pnl': funded_pnl * n_mult,
+        'one_equity': acct.capital,
+        'failed': blew,
+        'n_failed': n_mult if blew else 0,
+        'passed_p1': phase_eod in ('p2', 'funded'),
+        'is_funded': phase_eod == 'funded',
+        'payout_to_ibkr': payout * n_mult,
+        'refund_to_ibkr': refund * n_mult,
+        'accrued': acct.accrued_trader_share() * n_mult,
+        'fees_cum': acct.fees_paid * n_mult,
+    }
+
+
+def _print_ftmo_progress(acct, i, n, trade_date):
+    print(
+        f'  FTMO {i+1}/{n} {trade_date} | {acct.phase} 单户 ${acct.capital:,.0f} | '
+        f'出金累计 ${acct.payout_to_ibkr * N_FTMO_ACCOUNTS:,.0f} ({N_FTMO_ACCOUNTS}户)',
+        flush=True,
+    )
+
+
+def run_ftmo_path(matrix, allowed_times, dates, cfg):
+    acct = new_ftmo_account()
     rows = []
     n = len(dates)
     for i, trade_date in enumerate(dates):
-        day_data = by_date[trade_date].sort_values('DateTime').reset_index(drop=True)
-        if len(day_data) < 10:
-            continue
-        prev_close = day_data['prev_close'].iloc[0]
-        if pd.isna(prev_close):
+        day = ftmo_valid_day(matrix, trade_date)
+        if day is None:
             continue
-        prev_close = float(prev_close)
-
-        phase_sod = acct.phase
-        lev_sod = acct.leverage
-        day_pnl, failed, reason, n_trades = simulate_ftmo_day(
-            acct, day_data.copy(), prev_close, allowed_times, cfg
-        )
-        blew = apply_ftmo_eod(acct, day_pnl, failed, reason, n_trades, trade_date)
-        payout = refund = 0.0
-        if blew:
-            acct.buy_new_challenge(trade_date)
-        else:
-            payout, refund = maybe_payout(acct, trade_date)
-
-        one_pnl = 0.0 if blew else day_pnl
-        funded_pnl = one_pnl if phase_sod == 'funded' else 0.0
-        phase_eod = acct.phase
-        rows.append({
-            'Date': trade_date,
-            'phase': phase_sod,
-            'phase_eod': phase_eod,
-            'lev': lev_sod,
-            'one_pnl': one_pnl,
-            'all_pnl': one_pnl * n_mult,
-            'funded_pnl': funded_pnl * n_mult,
-            'one_equity': acct.capital,
-            'failed': blew,
-            'n_failed': n_mult if blew else 0,
-            'passed_p1': phase_eod in ('p2', 'funded'),
-            'is_funded': phase_eod == 'funded',
-            'payout_to_ibkr': payout * n_mult,
-            'refund_to_ibkr': refund * n_mult,
-            'accrued': acct.accrued_trader_share() * n_mult,
-            'fees_cum': acct.fees_paid * n_mult,
-        })
+        day_data, prev_close = day
+        rows.append(ftmo_day_row(acct, trade_date, day_data, prev_close, allowed_times, cfg))
         if (i + 1) % 80 == 0 or (i + 1) == n:
-            print(
-                f'  FTMO {i+1}/{n} {trade_date} | {acct.phase} 单户 ${acct.capital:,.0f} | '
-                f'出金累计 ${acct.payout_to_ibkr * n_mult:,.0f} ({n_mult}户)',
-                flush=True,
-            )
+            _print_ftmo_progress(acct, i, n, trade_date)
     return pd.DataFrame(rows), acct
 
 
-def run_ibkr_on_payouts(ftmo_daily, price_df, allowed_times, cfg, usage_pct=1.0):
-    by_date = {d: g.copy() for d, g in price_df.groupby('Date')}
-    equity = 0.0
-    peak = 0.0
-    max_dd = 0.0
-    realized = 0.0
-    fees = 0.0
-    n_trade = n_skip = n_call = n_wipe = n_stop = 0
-    first_trade = None
-    lev_list = []
-    qty_list = []
-    rows = []
+class IbkrLeg:
+    """IBKR MNQ 账户：逐日用当日净值开 MNQ，收盘后再入账 FTMO 当日出金 + 退费。"""
 
-    dates = list(ftmo_daily['Date'])
-    n = len(dates)
-    for i, trade_date in enumerate(dates):
-        day_data = by_date[trade_date].sort_values('DateTime').reset_index(drop=True)
-        prev_close = float(day_data['prev_close'].iloc[0])
+    def __init__(self, usage_pct=1.0):
+        self.usage_pct = usage_pct
+        self.equity = 0.0
+        self.peak = 0.0
+        self.max_dd = 0.0
+        self.realized = 0.0
+        self.fees = 0.0
+        self.n_trade = self.n_skip = self.n_call = self.n_wipe = self.n_stop = 0
+        self.first_trade = None
+        self.lev_list = []
+        self.qty_list = []
+        self.rows = []
+
+    def step(self, trade_date, day_data, prev_close, ftmo_row, allowed_times, cfg, units=None):
         res = simulate_ibkr_day(
-            equity, day_data.copy(), prev_close, allowed_times, cfg,
-            usage_pct, None,
+            self.equity, day_data, prev_close, allowed_times, cfg,
+            self.usage_pct, None, units,
         )
         pnl = float(res['pnl'])
         if res['qty'] >= 1:
-            n_trade += 1
-            if first_trade is None:
-                first_trade = trade_date
-            lev_list.append(res['lev'])
-            qty_list.append(res['qty'])
+            self.n_trade += 1
+            if self.first_trade is None:
+                self.first_trade = trade_date
+            self.lev_list.append(res['lev'])
+            self.qty_list.append(res['qty'])
         else:
-            n_skip += 1
+            self.n_skip += 1
         if res['note'] == 'margin_call':
-            n_call += 1
+            self.n_call += 1
         elif res['note'] == 'wipe':
-            n_wipe += 1
+            self.n_wipe += 1
         elif res['note'] == 'daily_stop':
-            n_stop += 1
-        realized += pnl
-        fees += res['cost']
-        equity = max(0.0, equity + pnl)
-
-        ftmo_row = ftmo_daily.iloc[i]
-        equity += float(ftmo_row['payout_to_ibkr'] + ftmo_row['refund_to_ibkr'])
-        if equity > peak:
-            peak = equity
-        dd = (peak - equity) / peak if peak > 0 else 0.0
-        if dd > max_dd:
-            max_dd = dd
+            self.n_stop += 1
+        self.realized += pnl
+        self.fees += res['cost']
+        self.equity = max(0.0, self.equity + pnl)
+
+        self.equity += float(ftmo_row['payout_to_ibkr'] + ftmo_row['refund_to_ibkr'])
+        if self.equity > self.peak:
+            self.peak = self.equity
+        dd = (self.peak - self.equity) / self.peak if self.peak > 0 else 0.0
+        if dd > self.max_dd:
+            self.max_dd = dd
 
         accrued = float(ftmo_row['accrued'])
         fees_cum = float(ftmo_row['fees_cum'])
-        rows.append({
+        self.rows.append({
             'Date': trade_date,
             'ibkr_pnl': pnl,
             'ibkr_qty': res['qty'],
             'ibkr_lev': res['lev'],
             'ibkr_note': res['note'],
-            'ibkr_equity': equity,
+            'ibkr_equity': self.equity,
             'payout_to_ibkr': float(ftmo_row['payout_to_ibkr']),
             'refund_to_ibkr': float(ftmo_row['refund_to_ibkr']),
             'accrued': accrued,
             'fees_cum': fees_cum,
-            'net_wealth': equity + accrued - fees_cum,
+            'net_wealth': self.equity + accrued - fees_cum,
             'phase': ftmo_row['phase'],
             'phase_eod': ftmo_row['phase_eod'],
             'passed_p1': bool(ftmo_row['passed_p1']),
@@ -618,34 +644,78 @@ def run_ibkr_on_payouts(ftmo_daily, price_df, allowed_times, cfg, usage_pct=1.0)
             'funded_pnl': float(ftmo_row['funded_pnl']),
             'failed': bool(ftmo_row['failed']),
         })
-        if (i + 1) % 80 == 0 or (i + 1) == n:
-            print(
-                f'  IBKR {i+1}/{n} {trade_date} | ${equity:,.0f} | '
-                f'{res["note"]} qty={res["qty"]} lev={res["lev"]:.1f}x',
-                flush=True,
-            )
+        return res
 
-    daily = pd.DataFrame(rows)
-    lev_arr = np.array(lev_list) if lev_list else np.array([0.0])
-    qty_arr = np.array(qty_list) if qty_list else np.array([0])
-    stats = {
-        'ibkr_equity': round(equity, 2),
-        'ibkr_realized_pnl': round(realized, 2),
-        'ibkr_fees_slip': round(fees, 2),
-        'ibkr_trade_days': n_trade,
-        'ibkr_skip_days': n_skip,
-        'ibkr_margin_call': n_call,
-        'ibkr_wipe': n_wipe,
-        'ibkr_daily_stop': n_stop,
-        'ibkr_max_dd_pct': round(max_dd * 100, 2),
-        'ibkr_peak': round(peak, 2),
-        'ibkr_first_trade': str(first_trade) if first_trade else None,
-        'ibkr_lev_median': round(float(np.median(lev_arr)), 2),
-        'ibkr_lev_mean': round(float(np.mean(lev_arr)), 2),
-        'ibkr_qty_median': round(float(np.median(qty_arr)), 1),
-        'net_profit': round(float(daily['net_wealth'].iloc[-1]), 2) if len(daily) else 0.0,
-    }
-    return daily, stats
+    def print_progress(self, i, n, trade_date, res):
+        print(
+            f'  IBKR {i+1}/{n} {trade_date} | ${self.equity:,.0f} | '
+            f'{res["note"]} qty={res["qty"]} lev={res["lev"]:.1f}x',
+            flush=True,
+        )
+
+    def finish(self):
+        daily = pd.DataFrame(self.rows)
+        lev_arr = np.array(self.lev_list) if self.lev_list else np.array([0.0])
+        qty_arr = np.array(self.qty_list) if self.qty_list else np.array([0])
+        stats = {
+            'ibkr_equity': round(self.equity, 2),
+            'ibkr_realized_pnl': round(self.realized, 2),
+            'ibkr_fees_slip': round(self.fees, 2),
+            'ibkr_trade_days': self.n_trade,
+            'ibkr_skip_days': self.n_skip,
+            'ibkr_margin_call': self.n_call,
+            'ibkr_wipe': self.n_wipe,
+            'ibkr_daily_stop': self.n_stop,
+            'ibkr_max_dd_pct': round(self.max_dd * 100, 2),
+            'ibkr_peak': round(self.peak, 2),
+            'ibkr_first_trade': str(self.first_trade) if self.first_trade else None,
+            'ibkr_lev_median': round(float(np.median(lev_arr)), 2),
+            'ibkr_lev_mean': round(float(np.mean(lev_arr)), 2),
+            'ibkr_qty_median': round(float(np.median(qty_arr)), 1),
+            'net_profit': round(float(daily['net_wealth'].iloc[-1]), 2) if len(daily) else 0.0,
+        }
+        return daily, stats
+
+
+def run_ibkr_on_payouts(ftmo_daily, matrix, allowed_times, cfg, usage_pct=1.0):
+    """按已有的 ftmo_daily（如账户群汇总）单独跑 IBKR 腿。"""
+    leg = IbkrLeg(usage_pct)
+    dates = list(ftmo_daily['Date'])
+    n = len(dates)
+    for i, trade_date in enumerate(dates):
+        day_data = matrix.day_frame_for(trade_date)
+        prev_close = float(day_data['prev_close'].iloc[0])
+        res = leg.step(trade_date, day_data, prev_close, ftmo_daily.iloc[i], allowed_times, cfg)
+        if (i + 1) % 80 == 0 or (i + 1) == n:
+            leg.print_progress(i, n, trade_date, res)
+    return leg.finish()
+
+
+def run_joint_path(matrix, allowed_times, dates, cfg, usage_pct=1.0):
+    """
+    FTMO + IBKR 单次逐日循环：每个交易日只构造一次日视图，两条腿共用；
+    信号先按单位仓位模拟（DayUnits，成交配置相同的腿共用一次），再按各自股数缩放，
+    只有 FTMO 的 EA 日内止损会触发时才按真实股数重算。结果与 run_ftmo_path + run_ibkr_on_payouts 相同。
+    返回 (ftmo_daily, acct, daily, stats)。
+    """
+    acct = new_ftmo_account()
+    leg = IbkrLeg(usage_pct)
+    rows = []
+    n = len(dates)
+    for i, trade_date in enumerate(dates):
+        day = ftmo_valid_day(matrix, trade_date)
+        if day is None:
+            continue
+        day_data, prev_close = day
+        units = DayUnits(day_data, prev_close, allowed_times)
+        row = ftmo_day_row(acct, trade_date, day_data, prev_close, allowed_times, cfg, units)
+        rows.append(row)
+        res = leg.step(trade_date, day_data, prev_close, row, allowed_times, cfg, units)
+        if (i + 1) % 80 == 0 or (i + 1) == n:
+            _print_ftmo_progress(acct, i, n, trade_date)
+            leg.print_progress(i, n, trade_date, res)
+    daily, stats = leg.finish()
+    return pd.DataFrame(rows), acct, daily, stats
 
 
 def account_summary(acct: FtmoAccount):
@@ -669,7 +739,7 @@ def account_summary(acct: FtmoAccount):
     }
 
 
-def monthly_from_daily(daily):
+def monthly_from_daily(daily, n_accounts=None):
     d = daily.copy()
     d['month'] = pd.to_datetime(d['Date']).dt.to_period('M').astype(str)
     g = d.groupby('month', as_index=False).agg(
@@ -690,7 +760,7 @@ def monthly_from_daily(daily):
     g['ibkr_pnl_cum'] = g['ibkr_pnl'].cumsum()
     g['funded_pnl_cum'] = g['funded_pnl'].cumsum()
     g['payout_cum'] = g['payout'].cumsum()
-    g['ftmo_equity_all'] = g['one_equity'] * N_FTMO_ACCOUNTS
+    g['ftmo_equity_all'] = g['one_equity'] * (N_FTMO_ACCOUNTS if n_accounts is None else n_accounts)
     return g
 
 
@@ -722,27 +792,76 @@ def print_monthly(monthly):
         )
 
 
-def run_window(window):
-    cfg = strategy_config(window)
-    start_fees = N_FTMO_ACCOUNTS * CHALLENGE_FEE
-    print('\n' + '=' * 72)
-    print(f"窗口 {window['label']}  |  {os.path.basename(window['data_path'])}")
-    print('=' * 72)
-    print(f"数据: {cfg['data_path']}  {cfg['start_date']} ~ {cfg['end_date']}")
-    print('预处理...')
-    price_df, allowed_times, dates = prepare_strategy_data(cfg)
-    if not dates:
-        print('  无有效交易日，跳过')
-        return None
-    print(f'有效交易日: {len(dates)} ({dates[0]} ~ {dates[-1]})')
+def combo_parameters(window):
+    """
+    影响组合结果的参数，作为结果缓存键的一部分；改任一项都会使缓存失效:
+      - 本模块大写常量（账户数、报名费、杠杆、IBKR 保证金 ... 含 COMBO_ENGINE_VERSION；
+        COMBO_NON_RESULT_CONSTANTS 里的并行度 / 输出路径等执行设置除外）
+      - 账户群用到的 ftmo_fleet 大写常量与 prop_rules.RULE_SETS 规则内容
+      - 窗口标识与账户群 spec
+    """
+    import ftmo_fleet
+    import prop_rules
+
+    params = {
+        name: value for name, value in globals().items()
+        if name.isupper() and not name.startswith('_') and name not in COMBO_NON_RESULT_CONSTANTS
+        and (value is None or isinstance(value, (bool, int, float, str, tuple, list, dict)))
+    }
+    params.update({'window_key': window['key'], 'window_label': window['label']})
+    if window.get('fleet'):
+        params['fleet'] = window['fleet']
+        params['fleet_constants'] = {
+            name: value for name, value in vars(ftmo_fleet).items()
+            if name.isupper() and not name.startswith('_')
+            and name not in COMBO_NON_RESULT_CONSTANTS and name != 'RULE_SETS'
+            and isinstance(value, (bool, int, float, str, tuple, list, dict))
+        }
+        params['rule_sets'] = {name: asdict(rules) for name, rules in prop_rules.RULE_SETS.items()}
+    return params
+
+
+def window_cached(window):
+    """该窗口在结果缓存中已有 summary（run_combo 据此跳过为它读取数据）。"""
+    if not USE_RESULT_CACHE:
+        return False
+    from result_cache import is_cached
+
+    return is_cached('combo_window', strategy_config(window), extra=combo_parameters(window), db_path=RESULT_CACHE_DB)
+
+
+def run_window(window, force=False, shared=None):
+    """
+    跑一个窗口并返回 summary。USE_RESULT_CACHE 时按 (数据集内容, 策略配置, 组合参数, 引擎版本)
+    复用之前的 summary（见 result_cache）；命中时不重写该窗口的 CSV / Parquet 明细。force=True 强制重算。
+    shared: 同一数据文件预先读取的 load_shared_data 结果。
+    """
+    if not USE_RESULT_CACHE:
+        return _run_window(window, shared)
+    from result_cache import cached_call
+
+    return cached_call(
+        'combo_window',
+        strategy_config(window),
+        lambda: _run_window(window, shared),
+        extra=combo_parameters(window),
+        force=force,
+        db_path=RESULT_CACHE_DB,
+        label=window['label'],
+    )
+
 
-    print(f'\n--- FTMO {N_FTMO_ACCOUNTS}×100K  2x/1.5x ---')
-    ftmo_daily, acct = run_ftmo_path(price_df, allowed_times, dates, cfg)
+def _ftmo_stage(matrix, allowed_times, dates, cfg, out_dir):
+    """
+    N_FTMO_ACCOUNTS 个相同 FTMO 账户（按 1 条路径 ×N）与 IBKR 腿在同一逐日循环里推进（run_joint_path），
+    返回 (ftmo_daily, summary 字段, 户数, (IBKR daily, stats))。
+    """
+    print(f'\n--- FTMO {N_FTMO_ACCOUNTS}×100K  2x/1.5x + IBKR ---')
+    ftmo_daily, acct, daily, stats = run_joint_path(matrix, allowed_times, dates, cfg, MARGIN_USAGE_PCT)
     if ftmo_daily.empty:
         print('  FTMO 日表为空，跳过')
         return None
 
-    out_dir = os.path.join(OUTPUT_DIR, window['key'])
     os.makedirs(out_dir, exist_ok=True)
     ftmo_daily.to_csv(os.path.join(out_dir, 'ftmo_daily.csv'), index=False)
 
@@ -763,10 +882,109 @@ def run_window(window):
         f"Funded {event_date(acct, 'funded') or '未过'} | "
         f"报名费 ${fees:,.0f} | 出金 ${payouts:,.0f} | 退费 ${refunds:,.0f}"
     )
+    summary = {
+        'p1_date': event_date(acct, 'p1_pass'),
+        'funded_date': event_date(acct, 'funded'),
+        'challenge_fees_paid': round(fees, 2),
+        'payouts_to_ibkr': round(payouts, 2),
+        'refunds_to_ibkr': round(refunds, 2),
+        'accrued_unpaid': round(accrued, 2),
+        'account': account_summary(acct),
+    }
+    return ftmo_daily, summary, N_FTMO_ACCOUNTS, (daily, stats)
+
+
+def _fleet_stage(fleet_spec, matrix, allowed_times, dates, cfg, out_dir):
+    """
+    异构考试商账户群（ftmo_fleet 的 fleet spec）：共用同一份数据与单位仓位信号，逐日向量化推进全部账户。
+    'account' 字段为全体账户的计数合计（与单账户路径同键），分组明细在 'fleet'。
+    """
+    from ftmo_fleet import (
+        fleet_accounts,
+        fleet_from_spec,
+        fleet_groups,
+        ftmo_daily_from_fleet,
+        prepare_fleet_days,
+        run_fleet,
+    )
+
+    fleet = fleet_from_spec(fleet_spec)
+    print(f'\n--- 账户群 {fleet.n} 户（{", ".join(dict.fromkeys(fleet.labels))}） ---')
+    days = prepare_fleet_days(matrix, allowed_times, dates, cfg)
+    if not days:
+        print('  账户群无有效交易日，跳过')
+        return None
+    fleet_daily = run_fleet(fleet, days, matrix, allowed_times, cfg)
+    accounts = fleet_accounts(fleet, days)
+    groups = fleet_groups(accounts)
+    ftmo_daily = ftmo_daily_from_fleet(fleet_daily, fleet)
+
+    os.makedirs(out_dir, exist_ok=True)
+    ftmo_daily.to_csv(os.path.join(out_dir, 'ftmo_daily.csv'), index=False)
+    fleet_daily.to_csv(os.path.join(out_dir, 'fleet_daily.csv'), index=False)
+    accounts.to_csv(os.path.join(out_dir, 'fleet_accounts.csv'), index=False)
+
+    print()
+    print(groups.to_string(index=False, float_format=lambda v: f'{v:,.0f}'))
+    totals = accounts.sum(numeric_only=True)
+    p1_day = np.flatnonzero((fleet_daily['n_p2'] + fleet_daily['n_funded']).to_numpy() > 0)
+    funded_dates = accounts['first_funded'].dropna()
+    summary = {
+        'p1_date': str(fleet_daily['Date'].iloc[p1_day[0]]) if len(p1_day) else None,
+        'funded_date': str(min(funded_dates)) if len(funded_dates) else None,
+        'challenge_fees_paid': round(float(totals['fees_paid']), 2),
+        'payouts_to_ibkr': round(float(totals['payout_total']), 2),
+        'refunds_to_ibkr': round(float(totals['refund_total']), 2),
+        'accrued_unpaid': round(float(totals['accrued']), 2),
+        'account': {
+            'challenges_bought': int(totals['challenges']),
+            'p1_pass': int(totals['p1_pass']),
+            'p2_pass': int(totals['p2_pass']),
+            'fail_p1': int(totals['fail_p1']),
+            'fail_p2': int(totals['fail_p2']),
+            'fail_funded': int(totals['fail_funded']),
+            'payouts': int(totals['payouts']),
+            'payout_to_ibkr': round(float(totals['payout_total']), 2),
+            'refund_to_ibkr': round(float(totals['refund_total']), 2),
+            'fees_paid': round(float(totals['fees_paid']), 2),
+            'final_phase': fleet_daily['phase_mode'].iloc[-1],
+            'final_equity': round(float(fleet_daily['equity'].iloc[-1]), 2),
+            'events': [],
+        },
+        'fleet': groups.round(2).to_dict(orient='records'),
+    }
+    return ftmo_daily, summary, fleet.n, None
+
+
+def _run_window(window, shared=None):
+    cfg = strategy_config(window)
+    start_fees = N_FTMO_ACCOUNTS * CHALLENGE_FEE
+    print('\n' + '=' * 72)
+    print(f"窗口 {window['label']}  |  {os.path.basename(window['data_path'])}")
+    print('=' * 72)
+    source = f"dataset_registry:{cfg['dataset_symbol']}" if cfg.get('dataset_symbol') else cfg['data_path']
+    print(f"数据: {source}  {cfg['start_date']} ~ {cfg['end_date']}")
+    print('预处理...')
+    matrix, allowed_times, dates = prepare_strategy_data(cfg, shared)
+    if not dates:
+        print('  无有效交易日，跳过')
+        return None
+    print(f'有效交易日: {len(dates)} ({dates[0]} ~ {dates[-1]})')
+
+    out_dir = os.path.join(OUTPUT_DIR, window['key'])
+    if window.get('fleet'):
+        stage = _fleet_stage(window['fleet'], matrix, allowed_times, dates, cfg, out_dir)
+    else:
+        stage = _ftmo_stage(matrix, allowed_times, dates, cfg, out_dir)
+    if stage is None:
+        return None
+    ftmo_daily, ftmo_summary, n_accounts, ibkr = stage
 
-    print('\n--- IBKR 日内 100% 净值 ~13x ---')
-    daily, stats = run_ibkr_on_payouts(ftmo_daily, price_df, allowed_times, cfg, MARGIN_USAGE_PCT)
-    monthly = monthly_from_daily(daily)
+    if ibkr is None:
+        print('\n--- IBKR 日内 100% 净值 ~13x ---')
+        ibkr = run_ibkr_on_payouts(ftmo_daily, matrix, allowed_times, cfg, MARGIN_USAGE_PCT)
+    daily, stats = ibkr
+    monthly = monthly_from_daily(daily, n_accounts)
     daily.to_csv(os.path.join(out_dir, 'daily.csv'), index=False)
     monthly.to_csv(os.path.join(out_dir, 'monthly.csv'), index=False)
 
@@ -776,7 +994,7 @@ def run_window(window):
         f"强平 {stats['ibkr_margin_call']} / 打穿 {stats['ibkr_wipe']} | "
         f"MDD {stats['ibkr_max_dd_pct']:.1f}%"
     )
-    print('\n按月账户情况（10 户合计）')
+    print(f'\n按月账户情况（{n_accounts} 户合计）')
     print_monthly(monthly)
 
     cal_days = (dates[-1] - dates[0]).days
@@ -788,13 +1006,7 @@ def run_window(window):
         'end': str(ftmo_daily['Date'].iloc[-1]),
         'trading_days': int(len(ftmo_daily)),
         'calendar_days': int(cal_days),
-        'p1_date': event_date(acct, 'p1_pass'),
-        'funded_date': event_date(acct, 'funded'),
-        'challenge_fees_paid': round(fees, 2),
-        'payouts_to_ibkr': round(payouts, 2),
-        'refunds_to_ibkr': round(refunds, 2),
-        'accrued_unpaid': round(accrued, 2),
-        'account': account_summary(acct),
+        **ftmo_summary,
         'ibkr': stats,
         'monthly': [
             {
@@ -815,18 +1027,87 @@ def run_window(window):
     }
     with open(os.path.join(out_dir, 'summary.json'), 'w', encoding='utf-8') as f:
         json.dump(summary, f, ensure_ascii=False, indent=2)
+    if SAVE_COLUMNAR_RESULTS:
+        from backtest_store import save_backtest_results
+
+        save_backtest_results(
+            os.path.join(out_dir, 'columnar'),
+            daily,
+            metrics=summary,
+            monthly=monthly,
+            config=cfg,
+            extra_tables={'ftmo_daily': ftmo_daily},
+        )
     return summary
 
 
-def run_combo():
-    print('FTMO 10×100K 2x/1.5x + IBKR MNQ  多窗口回测')
+_WORKER_SHARED = {}
+
+
+def _init_window_worker(shared_by_key):
+    global _WORKER_SHARED
+    _WORKER_SHARED = shared_by_key
+
+
+def _window_task(args):
+    """子进程里跑一个窗口；该窗口的打印整段收集后返回，由主进程按完成顺序整块输出，避免多窗口交错。"""
+    window, force = args
+    shared = _WORKER_SHARED.get(shared_data_key(strategy_config(window)))
+    buf = io.StringIO()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(buf):
+        summary = run_window(window, force=force, shared=shared)
+    return summary, buf.getvalue(), time.perf_counter() - t0
+
+
+def run_combo(force=False, workers=None, fleet=None):
+    """
+    跑全部 WINDOWS。同一数据文件只读取一次（含全样本趋势特征），各窗口在进程池中并行，
+    总耗时接近最慢的一个窗口；workers<=1 时按顺序执行。
+    fleet: 账户群 spec（默认 FLEET_SPEC）；随窗口一起传给子进程并计入结果缓存键。
+    """
+    fleet = FLEET_SPEC if fleet is None else fleet
+    windows = [dict(w, fleet=fleet) for w in WINDOWS] if fleet else WINDOWS
+    if fleet:
+        print('考试商账户群 + IBKR MNQ  多窗口回测')
+    else:
+        print('FTMO 10×100K 2x/1.5x + IBKR MNQ  多窗口回测')
     print(f'IBKR 日内 IM {IBKR_INTRADAY_IM_PCT*100:.2f}%  usage 100% → 约 {1.0/IBKR_INTRADAY_IM_PCT:.1f}x')
     os.makedirs(OUTPUT_DIR, exist_ok=True)
-    results = []
-    for window in WINDOWS:
-        summary = run_window(window)
-        if summary:
-            results.append(summary)
+    workers = COMBO_WORKERS if workers is None else workers
+    t0 = time.perf_counter()
+
+    # 已有缓存 summary 的窗口不需要数据
+    shared = {}
+    for window in windows:
+        cfg = strategy_config(window)
+        key = shared_data_key(cfg)
+        if key is None or key in shared or (not force and window_cached(window)):
+            continue
+        print(f'读取数据 {os.path.basename(key)} ...')
+        shared[key] = load_shared_data(cfg)
+
+    summaries = {}
+    if workers <= 1 or len(windows) <= 1:
+        for window in windows:
+            summaries[window['key']] = run_window(
+                window, force=force, shared=shared.get(shared_data_key(strategy_config(window)))
+            )
+    else:
+        n_workers = min(workers, len(windows), os.cpu_count() or 1)
+        print(f'{len(windows)} 个窗口并行（{n_workers} 进程）...')
+        with ProcessPoolExecutor(
+            max_workers=n_workers, initializer=_init_window_worker, initargs=(shared,)
+        ) as pool:
+            futures = {pool.submit(_window_task, (window, force)): window for window in windows}
+            for n_done, future in enumerate(as_completed(futures), 1):
+                window = futures[future]
+                summary, log, elapsed = future.result()
+                print(log, end='')
+                print(f"\n>>> 窗口 {window['label']} 完成 ({n_done}/{len(windows)})，用时 {elapsed:.1f}s")
+                summaries[window['key']] = summary
+    results = [summaries[w['key']] for w in windows if summaries.get(w['key'])]
+    print(f'\n全部窗口用时 {time.perf_counter() - t0:.1f}s')
 
     print('\n' + '=' * 72)
     print('三段对比（净利润 = IBKR 期末 + 应计未出 − 报名费）')
@@ -854,4 +1135,13 @@ def run_combo():
 
 
 if __name__ == '__main__':
-    run_combo()
+    parser = argparse.ArgumentParser(description='FTMO + IBKR 组合多窗口回测')
+    parser.add_argument('--force', action='store_true', help='忽略结果缓存，全部窗口重算')
+    parser.add_argument('--workers', type=int, default=None, help=f'并行进程数（默认 {COMBO_WORKERS}，1 为顺序）')
+    parser.add_argument('--fleet', default=None, help='账户群 spec JSON（覆盖 FLEET_SPEC）')
+    args = parser.parse_args()
+    fleet_spec = None
+    if args.fleet:
+        with open(args.fleet, 'r', encoding='utf-8') as f:
+            fleet_spec = json.load(f)
+    run_combo(force=args.force, workers=args.workers, fleet=fleet_spec)
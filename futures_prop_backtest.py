@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+期货考试商（FundedNext Futures Flex / Tradeify Select Flex）回测。
+
+规则直接取 simulate_futures_core 的 FuturesProgram / AccountRule，与实盘脚本同一份定义：
+  - 固定 trade_contracts 张 MNQ（不随权益缩放），funded 阶段受 funded_micro_scaling 阶梯上限约束
+  - 最大亏损为 EOD 追踪：止损线 = 收盘权益高水位 − max_loss，高水位升到 起始 + max_loss + drawdown_lock_buffer 后锁定
+    （即止损线最高锁在 起始 + buffer）；日内权益最低点触及止损线即失败，无日内亏损限制
+  - 挑战阶段：利润达 profit_target、交易日 ≥ minimum_trading_days、最佳单日 ≤ 总利润 × consistency_pct 时过关；
+    funded 不查 consistency
+
+QQQ 信号换算成 MNQ：1 张 = NQ_QQQ_RATIO × MNQ_POINT_VALUE 股 QQQ 的盈亏（不取整），
+每笔每张扣 MNQ_COMMISSION_RT + MNQ_SLIPPAGE_RT（与 IBKR 腿相同口径）。
+固定手数下当日盈亏与日内最低点都与手数成正比，所以每个交易日只做一次单位仓位模拟，
+压成「每张当日净盈亏 / 每张日内最差浮动」两个数，全部 项目 × 账户规模 × 起始日 在数组里一次推进。
+
+近似：过关按收盘判定（实盘监控线程到达目标即平仓，当日剩余交易不计）；不含出金与报名费。
+
+用法:
+  python futures_prop_backtest.py --window 2024_2026
+  python futures_prop_backtest.py --window 2024_2026 --programs tradeify --horizon 120 --start-step 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from ftmo_fleet import compress_unit_day
+from ftmo_ibkr_combo_backtest import (
+    MNQ_COMMISSION_RT,
+    MNQ_SLIPPAGE_RT,
+    WINDOWS,
+    prepare_strategy_data,
+    strategy_config,
+)
+from simulate_futures_core import FUNDEDNEXT_FLEX, MNQ_POINT_VALUE, NQ_QQQ_RATIO, TRADEIFY_SELECT_FLEX
+from two_phase_engine import simulate_unit_days
+
+PROGRAMS = {p.key: p for p in (FUNDEDNEXT_FLEX, TRADEIFY_SELECT_FLEX)}
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reports', 'futures_prop')
+
+PHASE_CHALLENGE, PHASE_FUNDED, PHASE_DONE = 0, 1, 2
+_FLOOR_EPS = 1e-9
+
+
+def futures_unit_config(base_cfg):
+    """单位仓位配置：滑点与手续费按每张合约另计，QQQ 侧不加。"""
+    cfg = base_cfg.copy()
+    cfg['enable_transaction_fees'] = False
+    cfg['slippage_per_share'] = 0.0
+    cfg['enable_intraday_stop_loss'] = False
+    return cfg
+
+
+def contract_day_values(unit, shares_per_contract, cost_per_trade):
+    """
+    单日 1 张 MNQ 的 (当日净盈亏, 日内相对日初最低浮动 ≤ 0, 成交笔数)。
+    段的划分与 ftmo_fleet._scale_day 相同，只是手数固定为 1 且成本按笔扣除。
+    """
+    per_share, seg_worst, seg_close, seg_flat = compress_unit_day(unit)
+    n_trades = len(per_share)
+    if n_trades == 0:
+        return 0.0, 0.0, 0
+    realized = np.zeros(n_trades + 1)
+    realized[1:] = np.cumsum(shares_per_contract * per_share - cost_per_trade)
+    has_mark = np.isfinite(seg_worst)
+    low = 0.0
+    if has_mark.any():
+        low = min(low, float((realized[has_mark] + shares_per_contract * seg_worst[has_mark]).min()))
+    on_base = seg_close | seg_flat
+    if on_base.any():
+        low = min(low, float(realized[on_base].min()))
+    return float(realized[-1]), min(low, float(realized[-1])), n_trades
+
+
+def prepare_contract_days(matrix, allowed_times, dates, cfg, workers=None):
+    """阶段一：全部交易日单位模拟并压成每张合约的日数组；跳过不足 10 根 K 线或缺昨收的日子。"""
+    units = simulate_unit_days(matrix, allowed_times, futures_unit_config(cfg), workers=workers)
+    shares_per_contract = NQ_QQQ_RATIO * MNQ_POINT_VALUE
+    cost_per_trade = MNQ_COMMISSION_RT + MNQ_SLIPPAGE_RT
+    rows = []
+    for i, trade_date in enumerate(dates):
+        day_data = matrix.day_frame(i)
+        if len(day_data) < 10 or pd.isna(day_data['prev_close'].iloc[0]):
+            continue
+        pnl, low, n_trades = contract_day_values(units[i], shares_per_contract, cost_per_trade)
+        rows.append((trade_date, pnl, low, n_trades))
+    return {
+        'dates': np.array([r[0] for r in rows], dtype=object),
+        'pnl': np.array([r[1] for r in rows], dtype=float),
+        'low': np.array([r[2] for r in rows], dtype=float),
+        'traded': np.array([r[3] > 0 for r in rows], dtype=bool),
+    }
+
+
+def program_accounts(programs):
+    """展开成 (项目, AccountRule) 列表，按项目、账户规模排序。"""
+    return [(program, rule) for program in programs for _, rule in sorted(program.rules.items())]
+
+
+def _scaling_limits(rules, eod_profit):
+    """funded_micro_scaling 阶梯：返回各账户当前 MNQ 上限（与 current_max_contracts 相同取法）。"""
+    limit = np.array([r.max_micro_contracts for r in rules], dtype=np.int64)
+    for i, rule in enumerate(rules):
+        if rule.funded_micro_scaling:
+            cap = rule.funded_micro_scaling[0][1]
+            for required_profit, micro_limit in rule.funded_micro_scaling:
+                if eod_profit[i] >= required_profit:
+                    cap = micro_limit
+            limit[i] = cap
+    return limit
+
+
+def evaluate_programs(days, accounts, start_indices=None, horizon_days=None):
+    """
+    对每个 (项目, 账户规模) × 起始日 推进挑战 + funded，返回每账户一行的 DataFrame。
+    horizon_days: 每个账户最多推进的交易日数（None = 到数据结束）。
+    """
+    n_days = len(days['pnl'])
+    starts = np.arange(n_days) if start_indices is None else np.asarray(start_indices, dtype=np.int64)
+    n_starts = len(starts)
+    n = len(accounts) * n_starts
+    start = np.tile(starts, len(accounts))
+    end = np.full(n, n_days) if horizon_days is None else np.minimum(start + int(horizon_days), n_days)
+
+    def rep(values, dtype=float):
+        return np.repeat(np.asarray(values, dtype=dtype), n_starts)
+
+    rules = [rule for _, rule in accounts for _ in range(n_starts)]
+    size = rep([r.account_size for _, r in accounts])
+    target = rep([r.profit_target for _, r in accounts])
+    max_loss = rep([r.max_loss for _, r in accounts])
+    min_days = rep([r.minimum_trading_days for _, r in accounts], np.int64)
+    contracts = rep([r.trade_contracts for _, r in accounts], np.int64)
+    consistency = rep([p.consistency_pct for p, _ in accounts])
+    hwm_cap = size + max_loss + rep([p.drawdown_lock_buffer for p, _ in accounts])
+    has_scaling = rep([bool(r.funded_micro_scaling) for _, r in accounts], bool)
+
+    phase = np.full(n, PHASE_CHALLENGE, dtype=np.int8)
+    eq = size.copy()
+    hwm = size.copy()
+    phase_days = np.zeros(n, dtype=np.int64)
+    best_day = np.zeros(n)
+    pass_day = np.full(n, -1, dtype=np.int64)
+    fail_day = np.full(n, -1, dtype=np.int64)
+    fail_phase = np.full(n, -1, dtype=np.int8)
+    funded_days = np.zeros(n, dtype=np.int64)
+    funded_low = np.zeros(n)
+    qty_max = np.zeros(n, dtype=np.int64)
+
+    for t in range(n_days):
+        idx = np.flatnonzero((phase != PHASE_DONE) & (start <= t) & (t < end))
+        if not len(idx):
+            continue
+
+        qty = contracts[idx].copy()
+        funded = phase[idx] == PHASE_FUNDED
+        scaled = funded & has_scaling[idx]
+        if scaled.any():
+            sub = idx[scaled]
+            limits = _scaling_limits([rules[i] for i in sub], hwm[sub] - size[sub])
+            qty[scaled] = np.minimum(qty[scaled], limits)
+        qty_max[idx] = np.maximum(qty_max[idx], qty)
+
+        floor = hwm[idx] - max_loss[idx]
+        low = eq[idx] + qty * days['low'][t]
+        failed = low <= floor + _FLOOR_EPS
+        f = idx[failed]
+        fail_day[f] = t
+        fail_phase[f] = phase[f]
+        phase[f] = PHASE_DONE
+        eq[f] = floor[failed]
+
+        a = idx[~failed]
+        day_pnl = qty[~failed] * days['pnl'][t]
+        eq[a] += day_pnl
+        hwm[a] = np.maximum(hwm[a], np.minimum(eq[a], hwm_cap[a]))
+        phase_days[a] += bool(days['traded'][t])
+        best_day[a] = np.maximum(best_day[a], day_pnl)
+        fa = a[phase[a] == PHASE_FUNDED]
+        funded_days[fa] += 1
+        funded_low[fa] = np.minimum(funded_low[fa], eq[fa] - size[fa])
+
+        ch = a[phase[a] == PHASE_CHALLENGE]
+        profit = eq[ch] - size[ch]
+        passed = (
+            (profit >= target[ch])
+            & (phase_days[ch] >= min_days[ch])
+            & (best_day[ch] <= consistency[ch] * profit)
+        )
+        pa = ch[passed]
+        pass_day[pa] = t
+        phase[pa] = PHASE_FUNDED
+        eq[pa] = size[pa]
+        hwm[pa] = size[pa]
+        phase_days[pa] = 0
+        best_day[pa] = 0.0
+
+    dates = days['dates']
+
+    def day_or_none(d):
+        return dates[d] if d >= 0 else None
+
+    out = pd.DataFrame({
+        'program': rep([p.key for p, _ in accounts], object),
+        'account_size': size.astype(np.int64),
+        'start_date': dates[start],
+        'contracts': contracts,
+        'max_contracts_used': qty_max,
+        'passed': pass_day >= 0,
+        'days_to_pass': np.where(pass_day >= 0, pass_day - start + 1, -1),
+        'pass_date': [day_or_none(d) for d in pass_day],
+        'failed_phase': pd.Series(fail_phase).map({-1: None, PHASE_CHALLENGE: 'challenge', PHASE_FUNDED: 'funded'}),
+        'fail_date': [day_or_none(d) for d in fail_day],
+        'funded_days': funded_days,
+        'funded_profit': np.where(pass_day >= 0, eq - size, np.nan),
+        'funded_worst': funded_low,
+        'final_hwm': hwm,
+    })
+    return out
+
+
+def summary_table(results):
+    """按 项目 × 账户规模 汇总过关率、用时与 funded 存活 / 盈亏。"""
+    rows = []
+    for (program, account_size), g in results.groupby(['program', 'account_size'], sort=False):
+        passed = g[g['passed']]
+        rows.append({
+            'program': program,
+            'account_size': account_size,
+            'contracts': int(g['contracts'].iloc[0]),
+            'starts': len(g),
+            'pass_pct': g['passed'].mean() * 100,
+            'fail_challenge_pct': (g['failed_phase'] == 'challenge').mean() * 100,
+            'open_challenge_pct': (~g['passed'] & g['failed_phase'].isna()).mean() * 100,
+            'days_to_pass_p50': passed['days_to_pass'].median() if len(passed) else np.nan,
+            'days_to_pass_p75': passed['days_to_pass'].quantile(0.75) if len(passed) else np.nan,
+            'funded_blown_pct': (passed['failed_phase'] == 'funded').mean() * 100 if len(passed) else np.nan,
+            'funded_profit_mean': passed['funded_profit'].mean() if len(passed) else np.nan,
+            'funded_days_mean': passed['funded_days'].mean() if len(passed) else np.nan,
+        })
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='期货考试商（FuturesProgram / AccountRule）回测')
+    parser.add_argument('--window', default=WINDOWS[-1]['key'], choices=[w['key'] for w in WINDOWS])
+    parser.add_argument('--programs', nargs='+', default=list(PROGRAMS), choices=list(PROGRAMS))
+    parser.add_argument('--horizon', type=int, default=None, help='每个账户最多推进的交易日数')
+    parser.add_argument('--start-step', type=int, default=1, help='每隔 N 个交易日取一个起始日')
+    parser.add_argument('--workers', type=int, default=None, help='单位仓位模拟进程数')
+    args = parser.parse_args()
+
+    window = next(w for w in WINDOWS if w['key'] == args.window)
+    cfg = strategy_config(window)
+    t0 = time.perf_counter()
+    print(f"窗口 {window['label']} 预处理...")
+    matrix, allowed_times, dates = prepare_strategy_data(cfg)
+    days = prepare_contract_days(matrix, allowed_times, dates, cfg, workers=args.workers)
+    n_days = len(days['pnl'])
+    print(f'有效交易日 {n_days}，单位模拟用时 {time.perf_counter() - t0:.1f}s')
+    print(f'1 张 MNQ = {NQ_QQQ_RATIO * MNQ_POINT_VALUE:.1f} 股 QQQ，每笔成本 ${MNQ_COMMISSION_RT + MNQ_SLIPPAGE_RT:.2f}/张')
+    if not n_days:
+        return
+
+    accounts = program_accounts([PROGRAMS[k] for k in args.programs])
+    t1 = time.perf_counter()
+    results = evaluate_programs(days, accounts, np.arange(0, n_days, max(1, args.start_step)), args.horizon)
+    print(f'{len(accounts)} 个账户规格 × {len(results) // len(accounts)} 个起始日，用时 {time.perf_counter() - t1:.2f}s\n')
+    summary = summary_table(results)
+    print(summary.round(1).to_string(index=False))
+
+    out_dir = os.path.join(OUTPUT_DIR, window['key'])
+    os.makedirs(out_dir, exist_ok=True)
+    results.to_csv(os.path.join(out_dir, 'futures_prop_accounts.csv'), index=False)
+    summary.to_csv(os.path.join(out_dir, 'futures_prop_summary.csv'), index=False)
+    print(f'\n明细: {out_dir}')
+
+
+if __name__ == '__main__':
+    main()
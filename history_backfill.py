@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Longport 历史分钟数据补数工具（写入 dataset_registry 的 market_history.db）。
+
+替代 data_fetch_from_longport.py 的逐日串行拉取 + 最后一次性写 CSV：
+  - 先按月拉 Longport 交易日历写入 history_calendar（含半日市），周末 / 节假日不再请求
+  - 只拉日历内覆盖不完整或还没有数据的交易日（DatasetRegistry.incomplete_dates）
+  - 多线程并发请求，所有请求共用一个限速器（--rate 次/秒，--workers 并发数）
+  - 每拉完一天立即在主线程单事务写入（write_day：替换当日分钟 + history_days 覆盖记录），
+    中途崩溃或 Ctrl-C 只丢正在飞行中的几天；重跑即从缺口处继续
+  - 拉到的数据仍不完整的日子会被记录下来，下次重跑再试（来源 longport_api 的 rank 最高，
+    完整时覆盖 CSV 来源）
+
+用法:
+  python history_backfill.py QQQ --start 2024-08-01 --end 2026-08-10
+  python history_backfill.py QQQ --start 2024-08-01 --workers 4 --rate 8
+  python history_backfill.py QQQ --start 2024-08-01 --dry-run          # 只列出待补的日子
+  python history_backfill.py QQQ --start 2024-08-01 --export-csv qqq_longport.csv
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import pandas as pd
+
+from dataset_registry import DATASET_SOURCES, DatasetRegistry
+
+BACKFILL_SOURCE = "longport_api"
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "4"))
+BACKFILL_RATE_PER_SECOND = float(os.environ.get("BACKFILL_RATE_PER_SECOND", "8"))
+BACKFILL_MAX_RETRIES = 3
+BACKFILL_RETRY_BASE_SECONDS = 2.0
+# 距今这么多天以内的月份日历每次都重拉（当月后续日子 / 临时休市公告）
+CALENDAR_REFRESH_RECENT_DAYS = 31
+# 收盘后多久才把当天视为已收盘（盘后 K 线入库有延迟）
+SESSION_SETTLE_TIME = "16:05"
+
+
+def source_rank(symbol):
+    for src in DATASET_SOURCES.get(symbol, []):
+        if src["name"] == BACKFILL_SOURCE:
+            return src["rank"]
+    return 0
+
+
+def last_closed_day(now_et):
+    """最近一个已收盘的日期（不判断是否交易日，交给日历过滤）。"""
+    if now_et.strftime("%H:%M") >= SESSION_SETTLE_TIME:
+        return now_et.date()
+    return now_et.date() - timedelta(days=1)
+
+
+def month_ranges(start, end):
+    """[start, end] 切成自然月区间（Longport trading_days 单次查询不超过一个月）。"""
+    ranges = []
+    cur = start
+    while cur <= end:
+        next_month = (cur.replace(day=1) + timedelta(days=32)).replace(day=1)
+        ranges.append((cur, min(end, next_month - timedelta(days=1))))
+        cur = next_month
+    return ranges
+
+
+def sync_calendar(registry, quote_ctx, limiter, longport_symbol, market, start, end, today, force=False):
+    """
+    按月拉交易日历写入 history_calendar；[month_start, month_end] 已被此前拉过的区间完整覆盖的
+    历史月份跳过（只拉过月中几天的月份会重拉）。返回请求的月数。
+    """
+    from longport_data_service import get_market
+
+    recent_cutoff = today - timedelta(days=CALENDAR_REFRESH_RECENT_DAYS)
+    fetched = 0
+    for month_start, month_end in month_ranges(start, end):
+        if (not force and month_end < recent_cutoff
+                and registry.calendar_covered(market, month_start, month_end, source="longport")):
+            continue
+        limiter.acquire()
+        resp = quote_ctx.trading_days(get_market(longport_symbol), month_start, month_end)
+        registry.set_calendar(
+            market, resp.trading_days, resp.half_trading_days, source="longport",
+            synced_range=(month_start, month_end),
+        )
+        fetched += 1
+    return fetched
+
+
+def fetch_day(quote_ctx, limiter, longport_symbol, day):
+    """拉一天的分钟 K 线，失败按指数退避重试；返回 (day, rows)。"""
+    from longport.openapi import AdjustType, Period
+
+    from longport_data_service import candle_rows, get_us_eastern_time
+
+    for attempt in range(BACKFILL_MAX_RETRIES + 1):
+        try:
+            limiter.acquire()
+            candles = quote_ctx.history_candlesticks_by_date(
+                longport_symbol, Period.Min_1, AdjustType.ForwardAdjust, day, day,
+            )
+            rows = candle_rows(candles, longport_symbol, get_us_eastern_time())
+            return day, [r for r in rows if r[2] == day.isoformat()]
+        except Exception:
+            if attempt == BACKFILL_MAX_RETRIES:
+                raise
+            time.sleep(BACKFILL_RETRY_BASE_SECONDS * 2 ** attempt)
+
+
+def rows_to_day_frame(rows):
+    """candles 表行 → write_day 需要的 Time + OHLCV 帧。"""
+    return pd.DataFrame(
+        [(r[3], r[4], r[5], r[6], r[7], r[8], r[9]) for r in rows],
+        columns=["Time", "Open", "High", "Low", "Close", "Volume", "Turnover"],
+    ).drop_duplicates(subset=["Time"], keep="last").sort_values("Time")
+
+
+def run_backfill(registry, quote_ctx, symbol, longport_symbol, start, end, market="US",
+                 workers=BACKFILL_WORKERS, rate=BACKFILL_RATE_PER_SECOND, refresh_calendar=False, dry_run=False):
+    """补齐 [start, end] 内不完整的交易日；返回 {written, skipped, incomplete, failed} 计数。"""
+    from longport_data_service import RateLimiter, get_us_eastern_time
+
+    limiter = RateLimiter(rate)
+    today = get_us_eastern_time().date()
+    n_months = sync_calendar(
+        registry, quote_ctx, limiter, longport_symbol, market, start, end, today, force=refresh_calendar,
+    )
+    pending = registry.incomplete_dates(symbol, market, start, end)
+    print(f"{symbol}: {start} ~ {end} | 日历请求 {n_months} 个月 | 待补交易日 {len(pending)} 天")
+    stats = {"written": 0, "skipped": 0, "incomplete": [], "failed": []}
+    if dry_run or not pending:
+        for day in pending:
+            print(f"  {day}")
+        return stats
+
+    rank = source_rank(symbol)
+    started = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futures = {executor.submit(fetch_day, quote_ctx, limiter, longport_symbol, day): day for day in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            day = futures[future]
+            try:
+                _, rows = future.result()
+            except Exception as e:
+                stats["failed"].append(day)
+                print(f"  [{i}/{len(pending)}] {day} 拉取失败: {e}")
+                continue
+            if not rows:
+                stats["incomplete"].append(day)
+                print(f"  [{i}/{len(pending)}] {day} 无数据")
+                continue
+            # 主线程逐天单事务写入（SQLite 连接不跨线程）
+            written = registry.write_day(symbol, day.isoformat(), rows_to_day_frame(rows), BACKFILL_SOURCE, rank, market=market)
+            stats["written" if written else "skipped"] += 1
+            missing = registry.missing_minutes(symbol, day.isoformat())
+            if missing:
+                stats["incomplete"].append(day)
+            state = "写入" if written else "未优于现有数据"
+            gap = f"，仍缺 {len(missing)} 分钟" if missing else ""
+            print(f"  [{i}/{len(pending)}] {day} → {len(rows)} 条，{state}{gap}")
+    except KeyboardInterrupt:
+        print("已中断：已写入的交易日保留，重跑即可从缺口继续")
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"完成: 写入 {stats['written']} 天 / 未覆盖 {stats['skipped']} 天 / "
+        f"仍不完整 {len(stats['incomplete'])} 天 / 失败 {len(stats['failed'])} 天，用时 {elapsed:.1f}s"
+    )
+    if stats["failed"] or stats["incomplete"]:
+        print("重跑同一命令会只补这些日子")
+    return stats
+
+
+def export_csv(registry, symbol, start, end, path):
+    """导出为 qqq_longport.csv 同格式（DateTime 为美东时间）。"""
+    df = registry.load_minutes(symbol, start, end)
+    df["DateTime"] = df["DateTime"].dt.strftime("%Y-%m-%d %H:%M:%S")
+    df.to_csv(path, index=False)
+    print(f"已导出 {path}，共 {len(df)} 条")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Longport 历史分钟数据并发补数（可断点续跑）")
+    parser.add_argument("symbol", help="注册表 symbol，如 QQQ")
+    parser.add_argument("--longport-symbol", default=None, help="Longport 代码（默认 <symbol>.US）")
+    parser.add_argument("--start", required=True, help="起始日期 YYYY-MM-DD（美东）")
+    parser.add_argument("--end", default=None, help="结束日期（默认最近一个已收盘日）")
+    parser.add_argument("--market", default="US")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="并发请求数")
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE_PER_SECOND, help="全部请求共用的限速（次/秒）")
+    parser.add_argument("--refresh-calendar", action="store_true", help="重拉全部月份的交易日历")
+    parser.add_argument("--dry-run", action="store_true", help="只同步日历并列出待补交易日")
+    parser.add_argument("--export-csv", default=None, help="补数后把区间导出为 CSV")
+    parser.add_argument("--db", default=None, help="数据库路径（默认 DATASET_DB_PATH）")
+    args = parser.parse_args()
+
+    from longport_data_service import create_quote_context, get_us_eastern_time
+
+    start = date.fromisoformat(args.start)
+    end = date.fromisoformat(args.end) if args.end else last_closed_day(get_us_eastern_time())
+    end = min(end, last_closed_day(get_us_eastern_time()))
+    longport_symbol = args.longport_symbol or f"{args.symbol}.{args.market}"
+
+    registry = DatasetRegistry(args.db)
+    print(f"数据集注册表: {os.path.abspath(registry.db_path)}")
+    try:
+        quote_ctx = create_quote_context()
+        run_backfill(
+            registry, quote_ctx, args.symbol, longport_symbol, start, end, market=args.market,
+            workers=args.workers, rate=args.rate, refresh_calendar=args.refresh_calendar, dry_run=args.dry_run,
+        )
+        if args.export_csv:
+            export_csv(registry, args.symbol, start, end, args.export_csv)
+    finally:
+        registry.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+可断点续跑的批量回测任务队列（SQLite）。
+
+大批量回测（参数网格 × 窗口 × 成本模型）以 campaign（批次名）为单位写入 jobs 表，多个 worker 进程各自：
+  领取（单事务把一条 pending 改成 running）→ 运行 run_backtest / 组合窗口 → 单事务写回结果并置 done。
+中途睡眠、崩溃或 Ctrl-C 都不丢已完成的结果；重新启动只跑未完成的任务：
+  - running 但领取进程已不存在（同一主机上 pid 已退出）的任务会被放回 pending
+  - 运行中抛异常的任务置 failed 并保存 traceback，retry 命令可重新排队
+worker 每领一条任务前都会检查待办，因此运行中的 campaign 可以随时 add 追加任务。
+
+任务类型:
+  - backtest:     spec = {'config': run_backtest 配置, 'cost_model': 可选 cost_repricing 成本模型名}
+                  结果为 metrics；需要完整日表/台账时在配置里设 results_dir（backtest_store 落盘）
+  - combo_window: spec = {'window': ftmo_ibkr_combo_backtest.WINDOWS 中的窗口 dict}，结果为 summary
+
+用法:
+  python job_queue.py add my_sweep jobs.json          # JSON 列表：[{"kind": "backtest", "config": {...}}, ...]
+  python job_queue.py add-combo my_sweep              # 追加 ftmo_ibkr_combo_backtest.WINDOWS 全部窗口
+  python job_queue.py run my_sweep --workers 4
+  python job_queue.py status my_sweep --watch 30
+  python job_queue.py retry my_sweep
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import pickle
+import socket
+import sqlite3
+import time
+import traceback
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+
+JOB_QUEUE_PATH = os.environ.get("JOB_QUEUE_PATH", "job_queue.db")
+JOB_KINDS = ('backtest', 'combo_window')
+# 吞吐量按最近这段时间内完成的任务计算
+THROUGHPUT_WINDOW_MINUTES = 30
+# JSON 任务文件里按日期解析的配置键
+DATE_CONFIG_KEYS = ('start_date', 'end_date')
+
+
+def _now():
+    return time.time()
+
+
+def _headline(kind, result):
+    """status 里展示的几个关键数字。"""
+    if kind == 'backtest':
+        keys = ('total_return', 'irr', 'sharpe_ratio', 'mdd', 'total_trades')
+        return {k: float(result[k]) for k in keys if k in result}
+    ibkr = result.get('ibkr', {}) if result else {}
+    return {k: ibkr[k] for k in ('ibkr_equity', 'net_profit', 'ibkr_max_dd_pct') if k in ibkr}
+
+
+def _describe(kind, spec):
+    if kind == 'backtest':
+        cfg = spec['config']
+        tag = spec.get('cost_model') or ''
+        return f"{cfg.get('ticker') or cfg.get('dataset_symbol')} {cfg.get('start_date')}~{cfg.get('end_date')} {tag}".strip()
+    return spec['window'].get('label', spec['window'].get('key'))
+
+
+def run_job(kind, spec):
+    """在当前进程内执行一条任务，返回结果对象（metrics / summary）。"""
+    if kind == 'backtest':
+        from backtest import run_backtest
+
+        config = dict(spec['config'])
+        if spec.get('cost_model'):
+            from cost_repricing import cost_model_config
+
+            config = cost_model_config(config, spec['cost_model'])
+        config.setdefault('print_daily_trades', False)
+        _, _, _, metrics = run_backtest(config)
+        return metrics
+    if kind == 'combo_window':
+        from ftmo_ibkr_combo_backtest import OUTPUT_DIR, run_window
+
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        return run_window(spec['window'])
+    raise ValueError(f"未知任务类型 {kind}，可用: {JOB_KINDS}")
+
+
+class JobQueue:
+    """任务队列库；一个实例持有一个 SQLite 连接（worker 进程各自新建）。"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or JOB_QUEUE_PATH
+        # isolation_level=None：事务边界全部显式 BEGIN IMMEDIATE / COMMIT，领取与提交各是一次原子写
+        self.conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._init_schema()
+
+    def close(self):
+        self.conn.close()
+
+    def _init_schema(self):
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            campaign TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            label TEXT,
+            spec BLOB NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            worker_host TEXT,
+            worker_pid INTEGER,
+            created_at REAL NOT NULL,
+            claimed_at REAL,
+            finished_at REAL,
+            elapsed_seconds REAL,
+            result BLOB,
+            headline TEXT,
+            error TEXT
+        )
+        """)
+        self.conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_jobs_campaign_status ON jobs (campaign, status, id)
+        """)
+
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+
+    # ------------------------------------------------------------------
+    # 写入任务
+    # ------------------------------------------------------------------
+    def add_jobs(self, campaign, jobs):
+        """jobs: [(kind, spec), ...]；追加为 pending，返回新任务数。运行中的 campaign 也可追加。"""
+        now = _now()
+        rows = []
+        for kind, spec in jobs:
+            if kind not in JOB_KINDS:
+                raise ValueError(f"未知任务类型 {kind}，可用: {JOB_KINDS}")
+            rows.append((campaign, kind, _describe(kind, spec), pickle.dumps(spec), now))
+        self._transaction()
+        try:
+            self.conn.executemany("""
+            INSERT INTO jobs (campaign, kind, label, spec, created_at) VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+    def add_backtest(self, campaign, config, cost_model=None):
+        return self.add_jobs(campaign, [('backtest', {'config': config, 'cost_model': cost_model})])
+
+    def add_sweep(self, campaign, base_config, grid, cost_models=(None,)):
+        """
+        参数网格 × 成本模型：grid 为 {配置键: [取值, ...]}，按笛卡尔积展开为 backtest 任务。
+        多个回测窗口各调用一次（start_date / end_date 写在 base_config 里）。
+        """
+        keys = list(grid)
+        jobs = []
+        for values in itertools.product(*(grid[k] for k in keys)):
+            config = dict(base_config)
+            config.update(zip(keys, values))
+            for cost_model in cost_models:
+                jobs.append(('backtest', {'config': config, 'cost_model': cost_model}))
+        return self.add_jobs(campaign, jobs)
+
+    def add_combo_windows(self, campaign, windows=None):
+        if windows is None:
+            from ftmo_ibkr_combo_backtest import WINDOWS
+
+            windows = WINDOWS
+        return self.add_jobs(campaign, [('combo_window', {'window': w}) for w in windows])
+
+    # ------------------------------------------------------------------
+    # 领取 / 提交
+    # ------------------------------------------------------------------
+    def recover_orphans(self, campaign=None):
+        """
+        本主机上领取进程已退出的 running 任务放回 pending（崩溃 / 被杀 / 机器睡眠后重启）。
+        返回恢复条数。
+        """
+        host = socket.gethostname()
+        sql = "SELECT id, worker_pid FROM jobs WHERE status = 'running' AND worker_host = ?"
+        params = [host]
+        if campaign is not None:
+            sql += " AND campaign = ?"
+            params.append(campaign)
+        orphans = [(job_id,) for job_id, pid in self.conn.execute(sql, params) if not _pid_alive(pid)]
+        if not orphans:
+            return 0
+        self._transaction()
+        self.conn.executemany("""
+        UPDATE jobs SET status = 'pending', worker_host = NULL, worker_pid = NULL
+        WHERE id = ? AND status = 'running'
+        """, orphans)
+        self.conn.execute("COMMIT")
+        return len(orphans)
+
+    def claim(self, campaign):
+        """原子领取一条 pending 任务，返回 (id, kind, spec)；没有待办时返回 None。"""
+        self._transaction()
+        try:
+            row = self.conn.execute("""
+            SELECT id, kind, spec FROM jobs WHERE campaign = ? AND status = 'pending'
+            ORDER BY id LIMIT 1
+            """, (campaign,)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            self.conn.execute("""
+            UPDATE jobs SET status = 'running', attempts = attempts + 1,
+                worker_host = ?, worker_pid = ?, claimed_at = ?, error = NULL
+            WHERE id = ?
+            """, (socket.gethostname(), os.getpid(), _now(), row[0]))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row[0], row[1], pickle.loads(row[2])
+
+    def complete(self, job_id, kind, result, elapsed):
+        """结果与 done 状态在同一事务写入；只提交本进程领取的任务（被恢复后重新领走的不覆盖）。"""
+        headline = json.dumps(_headline(kind, result), ensure_ascii=False, default=str)
+        self._transaction()
+        self.conn.execute("""
+        UPDATE jobs SET status = 'done', result = ?, headline = ?, finished_at = ?, elapsed_seconds = ?
+        WHERE id = ? AND status = 'running' AND worker_pid = ? AND worker_host = ?
+        """, (pickle.dumps(result), headline, _now(), elapsed, job_id, os.getpid(), socket.gethostname()))
+        self.conn.execute("COMMIT")
+
+    def fail(self, job_id, error, elapsed):
+        self._transaction()
+        self.conn.execute("""
+        UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, elapsed_seconds = ?
+        WHERE id = ? AND status = 'running' AND worker_pid = ?
+        """, (error, _now(), elapsed, job_id, os.getpid()))
+        self.conn.execute("COMMIT")
+
+    def reset_running(self, campaign):
+        """不看 pid，把全部 running 任务放回 pending（pid 被复用或换主机续跑时用）。"""
+        self._transaction()
+        n = self.conn.execute("""
+        UPDATE jobs SET status = 'pending', worker_host = NULL, worker_pid = NULL
+        WHERE campaign = ? AND status = 'running'
+        """, (campaign,)).rowcount
+        self.conn.execute("COMMIT")
+        return n
+
+    def retry_failed(self, campaign):
+        self._transaction()
+        n = self.conn.execute("""
+        UPDATE jobs SET status = 'pending', error = NULL WHERE campaign = ? AND status = 'failed'
+        """, (campaign,)).rowcount
+        self.conn.execute("COMMIT")
+        return n
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+    def progress(self, campaign):
+        """各状态计数、最近 THROUGHPUT_WINDOW_MINUTES 分钟的吞吐（jobs/min）与预计剩余时间。"""
+        counts = dict(self.conn.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE campaign = ? GROUP BY status", (campaign,)
+        ).fetchall())
+        since = _now() - THROUGHPUT_WINDOW_MINUTES * 60
+        recent, first_claim = self.conn.execute("""
+        SELECT COUNT(*), MIN(claimed_at) FROM jobs
+        WHERE campaign = ? AND status = 'done' AND finished_at >= ?
+        """, (campaign, since)).fetchone()
+        rate = 0.0
+        if recent:
+            span = _now() - max(since, first_claim or since)
+            rate = recent / max(span / 60.0, 1e-9)
+        remaining = counts.get('pending', 0) + counts.get('running', 0)
+        eta = timedelta(minutes=remaining / rate) if rate > 0 and remaining else None
+        return {
+            'total': sum(counts.values()),
+            'pending': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'done': counts.get('done', 0),
+            'failed': counts.get('failed', 0),
+            'jobs_per_min': rate,
+            'eta': eta,
+        }
+
+    def results(self, campaign, status='done'):
+        """DataFrame：每条任务的 id / kind / label / 状态 / 耗时 / headline 各列。"""
+        rows = self.conn.execute("""
+        SELECT id, kind, label, status, attempts, elapsed_seconds, headline, error
+        FROM jobs WHERE campaign = ? AND (? IS NULL OR status = ?) ORDER BY id
+        """, (campaign, status, status)).fetchall()
+        records = []
+        for job_id, kind, label, st, attempts, elapsed, headline, error in rows:
+            rec = {'id': job_id, 'kind': kind, 'label': label, 'status': st,
+                   'attempts': attempts, 'elapsed_seconds': elapsed}
+            rec.update(json.loads(headline) if headline else {})
+            if error:
+                rec['error'] = error.strip().splitlines()[-1]
+            records.append(rec)
+        return pd.DataFrame(records)
+
+    def load_result(self, job_id):
+        row = self.conn.execute("SELECT result FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return pickle.loads(row[0]) if row and row[0] is not None else None
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def format_progress(campaign, p):
+    eta = str(p['eta']).split('.')[0] if p['eta'] is not None else '-'
+    return (
+        f"[{campaign}] 完成 {p['done']}/{p['total']} | 运行 {p['running']} | 待办 {p['pending']} | "
+        f"失败 {p['failed']} | {p['jobs_per_min']:.2f} jobs/min | ETA {eta}"
+    )
+
+
+def worker_loop(db_path, campaign, max_jobs=None, quiet=False):
+    """
+    单个 worker：循环领取并执行任务直到没有待办（或达到 max_jobs）。返回完成条数。
+    quiet=True 时丢弃回测自身的报告打印（多进程时互相穿插不可读），只保留进度行。
+    """
+    queue = JobQueue(db_path)
+    done = 0
+    try:
+        while max_jobs is None or done < max_jobs:
+            queue.recover_orphans(campaign)
+            claimed = queue.claim(campaign)
+            if claimed is None:
+                break
+            job_id, kind, spec = claimed
+            t0 = time.perf_counter()
+            try:
+                if quiet:
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        result = run_job(kind, spec)
+                else:
+                    result = run_job(kind, spec)
+            except KeyboardInterrupt:
+                raise
+            except Exception:
+                queue.fail(job_id, traceback.format_exc(), time.perf_counter() - t0)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ❌ 任务 {job_id} 失败: {_describe(kind, spec)}")
+                continue
+            elapsed = time.perf_counter() - t0
+            queue.complete(job_id, kind, result, elapsed)
+            done += 1
+            print(
+                f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] ✅ 任务 {job_id} "
+                f"{_describe(kind, spec)} {elapsed:.1f}s | {format_progress(campaign, queue.progress(campaign))}"
+            )
+    finally:
+        queue.close()
+    return done
+
+
+def run_workers(campaign, workers=1, db_path=None, quiet=True):
+    """
+    启动 workers 个进程跑完 campaign 的待办（workers<=1 时在当前进程内运行）。
+    启动前先把本机已退出进程遗留的 running 任务放回 pending，即断点续跑。
+    """
+    db_path = db_path or JOB_QUEUE_PATH
+    queue = JobQueue(db_path)
+    try:
+        recovered = queue.recover_orphans(campaign)
+        p = queue.progress(campaign)
+    finally:
+        queue.close()
+    now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if recovered:
+        print(f"[{now_str}] 恢复 {recovered} 条中断的任务")
+    print(f"[{now_str}] {format_progress(campaign, p)}")
+    if workers <= 1:
+        return worker_loop(db_path, campaign, quiet=quiet)
+    procs = [
+        multiprocessing.Process(target=worker_loop, args=(db_path, campaign), kwargs={'quiet': quiet})
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    return sum(1 for proc in procs if proc.exitcode == 0)
+
+
+def _load_job_file(path):
+    """JSON 任务文件：[{"kind": "backtest", "config": {...}, "cost_model": "ibkr_pro_fixed"}, ...]。"""
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    jobs = []
+    for item in items:
+        kind = item.get('kind', 'backtest')
+        if kind == 'backtest':
+            config = dict(item['config'])
+            for key in DATE_CONFIG_KEYS:
+                if isinstance(config.get(key), str):
+                    config[key] = date.fromisoformat(config[key])
+            jobs.append((kind, {'config': config, 'cost_model': item.get('cost_model')}))
+        else:
+            window = dict(item['window'])
+            for key in DATE_CONFIG_KEYS:
+                if isinstance(window.get(key), str):
+                    window[key] = date.fromisoformat(window[key])
+            jobs.append((kind, {'window': window}))
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="可断点续跑的批量回测任务队列")
+    parser.add_argument("--db", default=None, help=f"任务库路径（默认 {JOB_QUEUE_PATH}）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_add = sub.add_parser("add", help="从 JSON 文件追加任务")
+    p_add.add_argument("campaign")
+    p_add.add_argument("job_file")
+
+    p_combo = sub.add_parser("add-combo", help="追加 ftmo_ibkr_combo_backtest.WINDOWS 的全部窗口")
+    p_combo.add_argument("campaign")
+
+    p_run = sub.add_parser("run", help="启动 worker 跑完待办（可重复执行以续跑）")
+    p_run.add_argument("campaign")
+    p_run.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    p_run.add_argument("--verbose", action="store_true", help="保留回测自身的打印输出")
+    p_run.add_argument("--reset-running", action="store_true",
+                       help="确认没有其它 worker 在跑时，把全部 running 任务放回 pending（如换机器续跑）")
+
+    p_status = sub.add_parser("status", help="进度、吞吐与 ETA")
+    p_status.add_argument("campaign")
+    p_status.add_argument("--watch", type=float, default=0, help="每隔 N 秒刷新一次，直到没有待办")
+    p_status.add_argument("--all", action="store_true", help="列出全部任务而不仅是已完成的")
+
+    p_retry = sub.add_parser("retry", help="失败任务重新排队")
+    p_retry.add_argument("campaign")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        if args.reset_running:
+            queue = JobQueue(args.db)
+            try:
+                print(f"放回 {queue.reset_running(args.campaign)} 条 running 任务")
+            finally:
+                queue.close()
+        run_workers(args.campaign, args.workers, args.db, quiet=not args.verbose)
+        return
+
+    queue = JobQueue(args.db)
+    try:
+        if args.command == "add":
+            n = queue.add_jobs(args.campaign, _load_job_file(args.job_file))
+            print(f"追加 {n} 条任务 | {format_progress(args.campaign, queue.progress(args.campaign))}")
+        elif args.command == "add-combo":
+            n = queue.add_combo_windows(args.campaign)
+            print(f"追加 {n} 条任务 | {format_progress(args.campaign, queue.progress(args.campaign))}")
+        elif args.command == "retry":
+            print(f"重新排队 {queue.retry_failed(args.campaign)} 条失败任务")
+        else:
+            while True:
+                p = queue.progress(args.campaign)
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {format_progress(args.campaign, p)}")
+                if not args.watch or p['pending'] + p['running'] == 0:
+                    break
+                time.sleep(args.watch)
+            df = queue.results(args.campaign, status=None if args.all else 'done')
+            if not df.empty:
+                with pd.option_context('display.max_columns', None, 'display.width', 200):
+                    print(df.to_string(index=False))
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
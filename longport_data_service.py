@@ -1,14 +1,26 @@
+import asyncio
 import os
-import platform
-import sqlite3
 import sys
+import threading
 import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, time, timedelta
 
 import pytz
 from dotenv import load_dotenv
 from longport.openapi import AdjustType, Config, Market, Period, QuoteContext
 
+from market_data_client import (
+    LOOKBACK_MISSING_DAYS_KEY,
+    bump_change_seq,
+    get_market_data_db_path,
+    init_schema,
+    open_writer_connection,
+)
+from market_data_feed import LongportPushFeed, ReplayFeed
+from market_data_maintenance import MARKET_DATA_RETENTION_DAYS, check_query_plans, run_maintenance
+from service_metrics import METRICS, METRICS_FILE, METRICS_PORT, METRICS_FLUSH_SECONDS, start_http_server, write_prometheus_file
 from trend_er5_gate import history_days_back
 
 load_dotenv(override=True)
@@ -18,25 +30,57 @@ load_dotenv(override=True)
 # ============================================================================
 
 SYMBOL = os.environ.get("SYMBOL", "QQQ.US")
+# 同一进程服务多个品种（逗号分隔, 如 "QQQ.US,SPY.US"）；第一个为主品种（交易日历按其市场）。
+# 未设置时只服务 SYMBOL，与单品种时的库内容完全一致
+SYMBOLS = [s.strip() for s in os.environ.get("MARKET_DATA_SYMBOLS", SYMBOL).split(",") if s.strip()]
+# 全部行情接口调用共用的速率上限（次/秒）, 多品种按轮转顺序公平分配
+API_RATE_LIMIT_PER_SECOND = float(os.environ.get("MARKET_DATA_API_RATE_LIMIT", "5"))
+# 每轮最多用于回补已收盘日的调用次数（新加品种回补时不挤占其他品种的今日刷新）
+BACKFILL_CALLS_PER_CYCLE = int(os.environ.get("MARKET_DATA_BACKFILL_CALLS_PER_CYCLE", "6"))
 LOOKBACK_DAYS = 1
 REFRESH_INTERVAL_SECONDS = int(os.environ.get("MARKET_DATA_REFRESH_SECONDS", "20"))
 LOG_FILE = "longport_data_service.log"
 
-
-def get_common_files_dir():
-    """返回和 MT5/EA 可见的 Common Files 目录；非 Windows 使用当前目录。"""
-    if platform.system() == "Windows":
-        appdata_path = os.environ.get("APPDATA", os.path.expanduser("~\\AppData\\Roaming"))
-        mt5_common_path = os.path.join(appdata_path, "MetaQuotes", "Terminal", "Common", "Files")
-        os.makedirs(mt5_common_path, exist_ok=True)
-        return mt5_common_path
-    return "."
+# incremental: 已收盘交易日只回补一次并在 candle_days 标记为不可变, 每轮只拉今日最新几根;
+# full: 旧行为, 每轮按日重拉整个回看窗口;
+# push: 订阅 Longport 推送, K 线收完 / 报价到达即落库, 推送中断时退回 incremental 轮询
+REFRESH_MODE = os.environ.get("MARKET_DATA_REFRESH_MODE", "incremental")
+# 完整性复查: 每隔 N 秒重拉最近 INTEGRITY_CHECK_DAYS 个已收盘交易日, 与库内比对（前复权调整 / 数据商修正）
+INTEGRITY_CHECK_INTERVAL_SECONDS = int(os.environ.get("MARKET_DATA_INTEGRITY_CHECK_SECONDS", "3600"))
+INTEGRITY_CHECK_DAYS = 2
+# 今日增量拉取时在最后一根已存 K 线之前多取的根数（最后一根可能是未收完的 K 线, 需覆盖）
+INCREMENTAL_OVERLAP_BARS = 2
+# push 模式: 超过该秒数没有任何推送即视为断流, 本轮走轮询（盘前/盘后无推送时也靠它刷新心跳）
+PUSH_STALE_SECONDS = int(os.environ.get("MARKET_DATA_PUSH_STALE_SECONDS", "45"))
+# 分钟 K 线时间戳到该 K 线收盘时刻的秒数（按起点标注为 60, 按终点标注为 0）, 用于计算收盘→落库延迟
+BAR_CLOSE_OFFSET_SECONDS = int(os.environ.get("MARKET_DATA_BAR_CLOSE_OFFSET_SECONDS", "60"))
+SESSION_CLOSE = "16:00"
+HALF_DAY_CLOSE = "13:00"
+# push 模式下设为分钟 CSV 路径时用本地回放代替 Longport 订阅（离线验证）, 速度为 MARKET_DATA_REPLAY_SPEED 倍
+REPLAY_CSV = os.environ.get("MARKET_DATA_REPLAY_CSV")
+REPLAY_SPEED = float(os.environ.get("MARKET_DATA_REPLAY_SPEED", "60"))
+# 库维护（保留窗口清理 + ANALYZE/VACUUM）只在非交易时段的后台线程里做: 工作日 START 之后到 END 之前及周末全天（美东）
+MAINTENANCE_WINDOW_START = os.environ.get("MARKET_DATA_MAINTENANCE_START", "17:00")
+MAINTENANCE_WINDOW_END = os.environ.get("MARKET_DATA_MAINTENANCE_END", "08:00")
+MAINTENANCE_INTERVAL_HOURS = float(os.environ.get("MARKET_DATA_MAINTENANCE_INTERVAL_HOURS", "20"))
+# async: 各任务独立调度（默认）; loop: 旧的单线程串行循环（full 模式始终走 loop）
+SERVICE_ENGINE = os.environ.get("MARKET_DATA_SERVICE_ENGINE", "async")
+# async 引擎各任务: 周期 / 单次接口调用超时 / 失败重试起始间隔（指数退避）/ 退避上限，单位秒
+ASYNC_TASK_SETTINGS = {
+    "quote": {"interval": float(os.environ.get("MARKET_DATA_QUOTE_SECONDS", "5")), "timeout": 5, "retry": 2, "max_backoff": 30},
+    "candles": {"interval": REFRESH_INTERVAL_SECONDS, "timeout": 15, "retry": 5, "max_backoff": 120},
+    "calendar": {"interval": 300, "timeout": 15, "retry": 10, "max_backoff": 600},
+    "backfill": {"interval": 60, "timeout": 30, "retry": 30, "max_backoff": 900},
+    "metrics": {"interval": METRICS_FLUSH_SECONDS, "timeout": 10, "retry": 5, "max_backoff": 60},
+}
+# 报价任务写全局心跳的前提: 主品种今日 K 线在这么多秒内刷新成功过（单次慢调用不影响心跳，
+# K 线持续拉不到时心跳停止，消费者仍会按 MARKET_DATA_MAX_AGE_SECONDS 拒绝交易）
+CANDLES_HEARTBEAT_GRACE_SECONDS = int(os.environ.get("MARKET_DATA_CANDLES_HEARTBEAT_GRACE_SECONDS", "90"))
+# 单写者一批提交超过该毫秒数时打印
+SLOW_COMMIT_MS = 200
 
 
-MARKET_DATA_DB_PATH = os.environ.get(
-    "MARKET_DATA_DB_PATH",
-    os.path.join(get_common_files_dir(), "market_data_cache.db"),
-)
+MARKET_DATA_DB_PATH = get_market_data_db_path()
 
 
 class Logger:
@@ -59,6 +103,26 @@ class Logger:
         self.log.flush()
 
 
+class RateLimiter:
+    """最小间隔限速: 相邻两次 acquire 至少间隔 1/rate 秒（线程安全, 推送回调线程也可用）。"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time_module.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time_module.sleep(wait)
+
+
+API_LIMITER = RateLimiter(API_RATE_LIMIT_PER_SECOND)
+
+
 def get_us_eastern_time():
     eastern = pytz.timezone("US/Eastern")
     return datetime.now(eastern)
@@ -82,48 +146,116 @@ def create_quote_context():
                 raise
 
 
+_writer_conn = None
+_write_lock = threading.RLock()
+_tx_depth = 0
+
+
+def writer_connection():
+    """服务进程唯一的写连接（WAL，首次使用时打开）。"""
+    global _writer_conn
+    if _writer_conn is None:
+        _writer_conn = open_writer_connection(MARKET_DATA_DB_PATH)
+    return _writer_conn
+
+
+@contextmanager
+def write_transaction():
+    """
+    写事务（BEGIN IMMEDIATE ... COMMIT）。嵌套调用并入最外层事务，
+    因此一轮刷新里日历、K 线、报价、心跳只提交一次；推送回调线程与主循环经同一把锁串行。
+    """
+    global _tx_depth
+    with _write_lock:
+        conn = writer_connection()
+        outer = _tx_depth == 0
+        if outer:
+            started = time_module.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+        _tx_depth += 1
+        try:
+            yield conn
+        except BaseException:
+            _tx_depth -= 1
+            if outer:
+                conn.execute("ROLLBACK")
+            raise
+        _tx_depth -= 1
+        if outer:
+            conn.execute("COMMIT")
+            METRICS.observe("market_data_db_commit_seconds", time_module.perf_counter() - started)
+
+
+@contextmanager
+def locked_connection():
+    """服务内部的读查询（与写入共用连接，持锁避免与其他线程的事务交错）。"""
+    with _write_lock:
+        yield writer_connection()
+
+
 def init_market_data_db():
-    conn = sqlite3.connect(MARKET_DATA_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS candles (
-        symbol TEXT NOT NULL,
-        datetime_et TEXT NOT NULL,
-        date TEXT NOT NULL,
-        time TEXT NOT NULL,
-        open REAL NOT NULL,
-        high REAL NOT NULL,
-        low REAL NOT NULL,
-        close REAL NOT NULL,
-        volume REAL NOT NULL,
-        turnover REAL NOT NULL,
-        updated_at TEXT NOT NULL,
-        PRIMARY KEY (symbol, datetime_et)
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS quotes (
-        symbol TEXT PRIMARY KEY,
-        last_done TEXT,
-        open TEXT,
-        high TEXT,
-        low TEXT,
-        volume TEXT,
-        turnover TEXT,
-        quote_timestamp TEXT,
-        updated_at TEXT NOT NULL
-    )
-    """)
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS service_state (
-        key TEXT PRIMARY KEY,
-        value TEXT NOT NULL,
-        updated_at TEXT NOT NULL
-    )
-    """)
-    conn.commit()
-    conn.close()
-    print(f"行情缓存数据库: {os.path.abspath(MARKET_DATA_DB_PATH)}")
+    with write_transaction() as conn:
+        init_schema(conn)
+    print(f"行情缓存数据库: {os.path.abspath(MARKET_DATA_DB_PATH)}（WAL）")
+    with locked_connection() as conn:
+        full_scans = check_query_plans(conn, verbose=False)
+    if full_scans:
+        print(f"警告: 以下查询未走索引（全表扫描）: {', '.join(full_scans)}")
+    if 0 < MARKET_DATA_RETENTION_DAYS <= history_days_back(LOOKBACK_DAYS):
+        # 保留窗口比回看窗口短时，清理掉的日子会被回补重新拉回来
+        print(f"警告: MARKET_DATA_RETENTION_DAYS={MARKET_DATA_RETENTION_DAYS} 不大于回看窗口 {history_days_back(LOOKBACK_DAYS)} 天")
+
+
+def in_maintenance_window(now_et):
+    if now_et.weekday() >= 5:
+        return True
+    hm = now_et.strftime("%H:%M")
+    return hm >= MAINTENANCE_WINDOW_START or hm < MAINTENANCE_WINDOW_END
+
+
+_maintenance_thread = None
+
+
+def maintenance_due(now_et):
+    with locked_connection() as conn:
+        row = conn.execute("SELECT value FROM service_state WHERE key = 'maintenance_at'").fetchone()
+    if row is None:
+        return True
+    last = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+    return (now_et.replace(tzinfo=None) - last).total_seconds() >= MAINTENANCE_INTERVAL_HOURS * 3600
+
+
+def run_maintenance_job():
+    ts = get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        started = time_module.perf_counter()
+        result = run_maintenance(
+            writer_connection(),
+            transaction=write_transaction,
+            lock=lambda: _write_lock,
+            today=get_us_eastern_time().date(),
+        )
+        now_et = get_us_eastern_time().strftime("%Y-%m-%d %H:%M:%S")
+        write_state_rows([("maintenance_at", now_et, now_et)])
+        print(
+            f"[{now_et}] 库维护完成: 清理 {MARKET_DATA_RETENTION_DAYS} 天前的分钟K线 {result['pruned_days']} 个品种日, "
+            f"VACUUM {'是' if result['vacuumed'] else '否'}, 库大小 {result['db_mb']:.1f} MB, "
+            f"用时 {time_module.perf_counter() - started:.1f}s"
+        )
+    except Exception as e:
+        print(f"[{ts}] 库维护失败: {str(e)}")
+
+
+def maybe_start_maintenance(now_et):
+    """非交易时段且距上次维护超过间隔时，在后台线程启动一次维护（同一时间只跑一个）。"""
+    global _maintenance_thread
+    if _maintenance_thread is not None and _maintenance_thread.is_alive():
+        return False
+    if not in_maintenance_window(now_et) or not maintenance_due(now_et):
+        return False
+    _maintenance_thread = threading.Thread(target=run_maintenance_job, daemon=True)
+    _maintenance_thread.start()
+    return True
 
 
 def normalize_timestamp(timestamp, symbol):
@@ -141,86 +273,361 @@ def normalize_timestamp(timestamp, symbol):
     return datetime.fromtimestamp(timestamp, eastern)
 
 
-def fetch_historical_candles(quote_ctx, symbol, days_back=None):
-    if days_back is None:
-        days_back = history_days_back(LOOKBACK_DAYS)
-
-    sdk_period = Period.Min_1
-    adjust_type = AdjustType.ForwardAdjust
-    now_et = get_us_eastern_time()
+def candle_rows(candles, symbol, now_et):
+    """SDK K 线 → candles 表行；丢弃未来日期与美股常规时段外的 K 线。"""
     current_date = now_et.date()
-    start_date = current_date - timedelta(days=days_back)
-    date_to_check = current_date
-    all_rows = []
-    api_call_count = 0
-
-    while date_to_check >= start_date:
-        if date_to_check.weekday() >= 5:
-            date_to_check -= timedelta(days=1)
+    updated_at = now_et.strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    for candle in candles or []:
+        dt = normalize_timestamp(candle.timestamp, symbol)
+        if dt.date() > current_date:
+            continue
+        time_str = dt.strftime("%H:%M")
+        if symbol.endswith(".US") and not ("09:30" <= time_str <= "16:00"):
             continue
+        rows.append((
+            symbol,
+            dt.strftime("%Y-%m-%d %H:%M:%S"),
+            dt.date().isoformat(),
+            time_str,
+            float(candle.open),
+            float(candle.high),
+            float(candle.low),
+            float(candle.close),
+            float(candle.volume),
+            float(candle.turnover),
+            updated_at,
+        ))
+    return rows
 
-        if api_call_count > 0:
-            time_module.sleep(0.2)
 
+def fetch_day_candles(quote_ctx, symbol, day, now_et=None):
+    """单个交易日的全部 1 分钟 K 线（一次 API 调用）。"""
+    API_LIMITER.acquire()
+    with METRICS.timed("market_data_api_seconds", "market_data_api_calls_total", op="history_candlesticks"):
         day_candles = quote_ctx.history_candlesticks_by_date(
             symbol,
-            sdk_period,
-            adjust_type,
-            date_to_check,
-            date_to_check,
+            Period.Min_1,
+            AdjustType.ForwardAdjust,
+            day,
+            day,
         )
-        api_call_count += 1
+    return candle_rows(day_candles, symbol, now_et or get_us_eastern_time())
+
+
+def lookback_weekdays(current_date, days_back=None):
+    """回看窗口内的工作日（含 current_date），由近到远。"""
+    if days_back is None:
+        days_back = history_days_back(LOOKBACK_DAYS)
+    start_date = current_date - timedelta(days=days_back)
+    days = []
+    day = current_date
+    while day >= start_date:
+        if day.weekday() < 5:
+            days.append(day)
+        day -= timedelta(days=1)
+    return days
 
-        for candle in day_candles or []:
-            dt = normalize_timestamp(candle.timestamp, symbol)
-            if dt.date() > current_date:
-                continue
-            time_str = dt.strftime("%H:%M")
-            if symbol.endswith(".US") and not ("09:30" <= time_str <= "16:00"):
-                continue
-            all_rows.append((
-                symbol,
-                dt.strftime("%Y-%m-%d %H:%M:%S"),
-                dt.date().isoformat(),
-                time_str,
-                float(candle.open),
-                float(candle.high),
-                float(candle.low),
-                float(candle.close),
-                float(candle.volume),
-                float(candle.turnover),
-                now_et.strftime("%Y-%m-%d %H:%M:%S"),
-            ))
-
-        date_to_check -= timedelta(days=1)
 
+def fetch_historical_candles(quote_ctx, symbol, days_back=None):
+    now_et = get_us_eastern_time()
+    all_rows = []
+    for day in lookback_weekdays(now_et.date(), days_back):
+        all_rows.extend(fetch_day_candles(quote_ctx, symbol, day, now_et))
     return all_rows
 
 
+def day_checksum(rows):
+    """一天 K 线的指纹：根数 + 收盘价/成交量合计（前复权调整或数据修正都会改变它）。"""
+    total_close = sum(r[7] for r in rows)
+    total_volume = sum(r[8] for r in rows)
+    return f"{len(rows)}:{total_close:.4f}:{total_volume:.0f}"
+
+
+def replace_day_candles(symbol, day, rows, complete=True):
+    """单事务替换某交易日的 K 线并记录 candle_days 状态（休市日 rows 为空也会标记, 避免反复请求）。"""
+    date_str = day.isoformat()
+    now_str = get_us_eastern_time().strftime("%Y-%m-%d %H:%M:%S")
+    with write_transaction() as conn:
+        conn.execute("DELETE FROM candles WHERE symbol = ? AND date = ?", (symbol, date_str))
+        conn.executemany("""
+        INSERT INTO candles (
+            symbol, datetime_et, date, time, open, high, low, close, volume, turnover, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        conn.execute("""
+        INSERT OR REPLACE INTO candle_days (symbol, date, n_bars, checksum, complete, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """, (symbol, date_str, len(rows), day_checksum(rows), 1 if complete else 0, now_str))
+        bump_change_seq(conn, "candles", symbol, now_str)
+    METRICS.inc("market_data_rows_written_total", len(rows), table="candles", symbol=symbol)
+
+
+def completed_days(symbol):
+    with locked_connection() as conn:
+        rows = conn.execute(
+            "SELECT date, checksum FROM candle_days WHERE symbol = ? AND complete = 1", (symbol,)
+        ).fetchall()
+    return dict(rows)
+
+
+def missing_completed_days(symbol, days_back=None):
+    """回看窗口内尚未标记完成的已收盘交易日（由近到远）。"""
+    current_date = get_us_eastern_time().date()
+    done = completed_days(symbol)
+    return [d for d in lookback_weekdays(current_date, days_back) if d < current_date and d.isoformat() not in done]
+
+
+def lookback_gap_days(symbol=None):
+    """
+    主品种回看窗口里从未落库过的已收盘交易日数（candle_days 没有记录；休市日回补后也会留一条 0 根的记录）。
+    完整性复查作废的日子 K 线仍在库里、照常可用，重拉期间不算缺口。full 模式每轮直接拉整个窗口，恒为 0。
+    """
+    if REFRESH_MODE == "full":
+        return 0
+    symbol = symbol or SYMBOLS[0]
+    current_date = get_us_eastern_time().date()
+    with locked_connection() as conn:
+        stored = {r[0] for r in conn.execute("SELECT date FROM candle_days WHERE symbol = ?", (symbol,)).fetchall()}
+    return sum(1 for d in lookback_weekdays(current_date) if d < current_date and d.isoformat() not in stored)
+
+
+def write_lookback_state():
+    """
+    回看完整度写入 service_state（LOOKBACK_MISSING_DAYS_KEY），由回补路径在每轮回补后调用。
+    与 last_success_at 心跳相互独立：心跳只反映报价 / 今日 K 线是否新鲜，慢的历史回补不会让心跳过期；
+    首次启动 / 清库后回看窗口没补齐时由消费者读这个键拒绝交易。返回缺口天数。
+    """
+    missing = lookback_gap_days()
+    now_str = get_us_eastern_time().strftime("%Y-%m-%d %H:%M:%S")
+    write_state_rows([(LOOKBACK_MISSING_DAYS_KEY, str(missing), now_str)])
+    return missing
+
+
+def backfill_completed_days(quote_ctx, symbol, days_back=None, max_days=None):
+    """
+    回补回看窗口内尚未标记完成的已收盘交易日（首次启动 / 跨日后的昨天 / 复查作废的日子）。
+    max_days 限制本次最多回补的天数（其余留到下一轮）。返回回补的天数；稳态下为 0，不产生 API 调用。
+    """
+    missing = missing_completed_days(symbol, days_back)[:max_days]
+    for day in missing:
+        rows = fetch_day_candles(quote_ctx, symbol, day)
+        replace_day_candles(symbol, day, rows)
+    return len(missing)
+
+
+def last_candle_time(symbol, day):
+    with locked_connection() as conn:
+        row = conn.execute(
+            "SELECT MAX(datetime_et) FROM candles WHERE symbol = ? AND date = ?", (symbol, day.isoformat())
+        ).fetchone()
+    return row[0] if row and row[0] else None
+
+
+def session_close_time(today):
+    """今日收盘时刻 HH:MM（服务写入的日历标记今天为半日市时为 HALF_DAY_CLOSE）。"""
+    with locked_connection() as conn:
+        state = dict(conn.execute("""
+        SELECT key, value FROM service_state WHERE key IN ('calendar_date', 'is_half_trading_day')
+        """).fetchall())
+    if state.get("calendar_date") == today.isoformat() and state.get("is_half_trading_day") == "1":
+        return HALF_DAY_CLOSE
+    return SESSION_CLOSE
+
+
+def session_candles_final(symbol, today, last_ts, close_hm):
+    """
+    收盘后今日 K 线是否已拉全：最后一根已存到收盘前一分钟（起点或终点口径都覆盖），
+    且该品种在最后一根收完之后至少刷新过一次（收盘时正在形成的那根已拿到终值）。
+    """
+    close_dt = datetime.combine(today, datetime.strptime(close_hm, "%H:%M").time())
+    if last_ts < (close_dt - timedelta(minutes=1)).strftime("%Y-%m-%d %H:%M:%S"):
+        return False
+    settled_at = (close_dt + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS)).strftime("%Y-%m-%d %H:%M:%S")
+    with locked_connection() as conn:
+        row = conn.execute(
+            "SELECT value FROM service_state WHERE key = ?", (f"candles_updated_at:{symbol}",)
+        ).fetchone()
+    return row is not None and row[0] >= settled_at
+
+
+def fetch_today_candles(quote_ctx, symbol):
+    """
+    今日增量：库内还没有今日 K 线时按日拉全天，否则只拉最近 N 根（从最后一根已存 K 线起，含重叠）。
+    每轮恰好一次 API 调用；返回需要写入的行（通常 1~3 行）。开盘前、以及收盘后最后一根已落库时不调用。
+    """
+    now_et = get_us_eastern_time()
+    today = now_et.date()
+    if today.weekday() >= 5 or now_et.strftime("%H:%M") < "09:30":
+        return []
+    last_ts = last_candle_time(symbol, today)
+    if last_ts is None:
+        return fetch_day_candles(quote_ctx, symbol, today, now_et)
+    close_hm = session_close_time(today)
+    if now_et.strftime("%H:%M") >= close_hm and session_candles_final(symbol, today, last_ts, close_hm):
+        return []
+
+    last_dt = datetime.strptime(last_ts, "%Y-%m-%d %H:%M:%S")
+    gap_minutes = int((now_et.replace(tzinfo=None) - last_dt).total_seconds() // 60)
+    count = min(1000, max(1, gap_minutes) + INCREMENTAL_OVERLAP_BARS)
+    API_LIMITER.acquire()
+    with METRICS.timed("market_data_api_seconds", "market_data_api_calls_total", op="candlesticks"):
+        candles = quote_ctx.candlesticks(symbol, Period.Min_1, count, AdjustType.ForwardAdjust)
+    return [r for r in candle_rows(candles, symbol, now_et) if r[2] == today.isoformat() and r[1] >= last_ts]
+
+
+def verify_recent_days(quote_ctx, symbol, n_days=INTEGRITY_CHECK_DAYS):
+    """
+    完整性复查：重拉最近 n_days 个已完成交易日并比对指纹。
+    不一致时（多为除息后前复权价整体平移）作废整个窗口的完成标记，交给 backfill_completed_days 重拉。
+    返回不一致的日期列表。
+    """
+    mismatched = find_mismatched_days(quote_ctx, symbol, n_days)
+    if mismatched:
+        invalidate_completed_days(symbol)
+    return mismatched
+
+
+def find_mismatched_days(quote_ctx, symbol, n_days=INTEGRITY_CHECK_DAYS):
+    """完整性复查的拉取与比对部分（只读）。"""
+    current_date = get_us_eastern_time().date()
+    done = completed_days(symbol)
+    recent = [d for d in lookback_weekdays(current_date) if d < current_date and d.isoformat() in done][:n_days]
+    mismatched = []
+    for day in recent:
+        rows = fetch_day_candles(quote_ctx, symbol, day)
+        if day_checksum(rows) != done[day.isoformat()]:
+            mismatched.append(day)
+    return mismatched
+
+
+def invalidate_completed_days(symbol):
+    with write_transaction() as conn:
+        conn.execute("UPDATE candle_days SET complete = 0 WHERE symbol = ?", (symbol,))
+
+
+def refresh_candles_incremental(quote_ctx, symbol, verify=False, max_backfill_days=None):
+    """
+    增量刷新一轮：补齐已收盘日（稳态无调用, 最多 max_backfill_days 天）+ 今日最新 K 线；
+    verify=True 时先做完整性复查。
+    """
+    ts = get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')
+    if verify:
+        mismatched = verify_recent_days(quote_ctx, symbol)
+        if mismatched:
+            print(f"[{ts}] {symbol} 完整性复查不一致: {', '.join(d.isoformat() for d in mismatched)}，回看窗口将重新回补")
+    n_backfilled = backfill_completed_days(quote_ctx, symbol, max_days=max_backfill_days)
+    if n_backfilled:
+        print(f"[{ts}] {symbol} 已收盘交易日回补: {n_backfilled} 天")
+    return fetch_today_candles(quote_ctx, symbol)
+
+
+def refresh_symbols_incremental(quote_ctx, symbols, cycle_no, verify=False):
+    """
+    多品种增量刷新：每轮从不同品种开始轮转（限速下先轮到的品种不会总是同一个），
+    已收盘日回补按 BACKFILL_CALLS_PER_CYCLE 在品种间分摊，今日刷新每品种每轮一次调用。
+    返回 {symbol: rows}；单个品种失败不影响其他品种。
+    """
+    start = cycle_no % len(symbols)
+    ordered = symbols[start:] + symbols[:start]
+    budget = BACKFILL_CALLS_PER_CYCLE
+    result = {}
+    for i, symbol in enumerate(ordered):
+        # 剩余额度在剩余品种间平分，前面用不完的留给后面
+        share = max(1, budget // (len(ordered) - i)) if budget > 0 else 0
+        try:
+            pending = len(missing_completed_days(symbol))
+            take = min(pending, share)
+            budget -= take
+            result[symbol] = refresh_candles_incremental(quote_ctx, symbol, verify=verify, max_backfill_days=take)
+        except Exception as e:
+            print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] {symbol} K线刷新失败: {str(e)}")
+    return result
+
+
+def symbol_freshness_rows(symbol, **values):
+    """按品种的新鲜度键（service_state 里 "<name>:<symbol>"），供多品种消费者判断各自数据是否过期。"""
+    now_et = get_us_eastern_time().strftime("%Y-%m-%d %H:%M:%S")
+    return [(f"{name}:{symbol}", value, now_et) for name, value in values.items()]
+
+
 def upsert_candles(rows):
-    conn = sqlite3.connect(MARKET_DATA_DB_PATH)
-    cursor = conn.cursor()
-    cursor.executemany("""
-    INSERT OR REPLACE INTO candles (
-        symbol, datetime_et, date, time, open, high, low, close, volume, turnover, updated_at
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, rows)
-    conn.commit()
-    conn.close()
+    """
+    K 线落库；重叠拉取的旧 K 线内容没变时不改写（ON CONFLICT ... WHERE），
+    只有确实新增或改动了的品种才递增 candles_seq，消费者据此跳过重复读取。
+    """
+    rows_by_symbol = {}
+    for row in rows:
+        rows_by_symbol.setdefault(row[0], []).append(row)
+    state_rows = []
+    for symbol, symbol_rows in rows_by_symbol.items():
+        bar_at = max(row[1] for row in symbol_rows)
+        state_rows += symbol_freshness_rows(symbol, candles_updated_at=rows[0][10], last_bar_at=bar_at)
+    with write_transaction() as conn:
+        for symbol, symbol_rows in rows_by_symbol.items():
+            changes_before = conn.total_changes
+            conn.executemany("""
+            INSERT INTO candles (
+                symbol, datetime_et, date, time, open, high, low, close, volume, turnover, updated_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(symbol, datetime_et) DO UPDATE SET
+                open = excluded.open, high = excluded.high, low = excluded.low, close = excluded.close,
+                volume = excluded.volume, turnover = excluded.turnover, updated_at = excluded.updated_at
+            WHERE (open, high, low, close, volume, turnover)
+                IS NOT (excluded.open, excluded.high, excluded.low, excluded.close, excluded.volume, excluded.turnover)
+            """, symbol_rows)
+            changed = conn.total_changes - changes_before
+            if changed:
+                bump_change_seq(conn, "candles", symbol, rows[0][10])
+                METRICS.inc("market_data_rows_written_total", changed, table="candles", symbol=symbol)
+        write_state_rows(state_rows)
+    record_bar_lag(rows_by_symbol)
+
+
+def record_bar_lag(rows_by_symbol):
+    """今日最新一根 K 线的收盘时刻 → 现在的秒数（仪表值；历史日期的行不计）。"""
+    now_et = get_us_eastern_time()
+    today = now_et.date().isoformat()
+    for symbol, symbol_rows in rows_by_symbol.items():
+        bar_at = max(row[1] for row in symbol_rows)
+        if not bar_at.startswith(today):
+            continue
+        bar_close = datetime.strptime(bar_at, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS)
+        # 最新一根还没收完时记 0
+        lag = max(0.0, (now_et.replace(tzinfo=None) - bar_close).total_seconds())
+        METRICS.set_gauge("market_data_bar_lag_seconds", lag, symbol=symbol)
+
+
+def write_state_rows(state_rows):
+    with write_transaction() as conn:
+        conn.executemany("""
+        INSERT OR REPLACE INTO service_state (key, value, updated_at)
+        VALUES (?, ?, ?)
+        """, state_rows)
 
 
 def upsert_quote(quote_ctx, symbol):
-    quotes = quote_ctx.quote([symbol])
-    quote = quotes[0]
+    upsert_quotes(quote_ctx, [symbol])
+
+
+def fetch_quotes(quote_ctx, symbols):
+    """所有品种一次 quote([...]) 调用。"""
+    API_LIMITER.acquire()
+    with METRICS.timed("market_data_api_seconds", "market_data_api_calls_total", op="quote"):
+        return list(quote_ctx.quote(list(symbols)))
+
+
+def upsert_quotes(quote_ctx, symbols):
+    write_quotes(fetch_quotes(quote_ctx, symbols))
+
+
+def write_quote(symbol, quote, heartbeat=True):
+    """
+    报价 + 成功心跳（全局 last_success_at 与按品种 quote_updated_at）落库（轮询与推送共用）。
+    heartbeat=False 时只写报价与 quote_updated_at，不刷新全局心跳。
+    """
     now_et = get_us_eastern_time().strftime("%Y-%m-%d %H:%M:%S")
-    conn = sqlite3.connect(MARKET_DATA_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT OR REPLACE INTO quotes (
-        symbol, last_done, open, high, low, volume, turnover, quote_timestamp, updated_at
-    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        quote.symbol,
+    values = (
         str(quote.last_done),
         str(quote.open),
         str(quote.high),
@@ -228,14 +635,33 @@ def upsert_quote(quote_ctx, symbol):
         str(quote.volume),
         str(quote.turnover),
         quote.timestamp.isoformat(),
-        now_et,
-    ))
-    cursor.execute("""
-    INSERT OR REPLACE INTO service_state (key, value, updated_at)
-    VALUES (?, ?, ?)
-    """, ("last_success_at", now_et, now_et))
-    conn.commit()
-    conn.close()
+    )
+    with write_transaction() as conn:
+        unchanged = conn.execute("""
+        SELECT 1 FROM quotes
+        WHERE symbol = ? AND last_done IS ? AND open IS ? AND high IS ? AND low IS ?
+          AND volume IS ? AND turnover IS ? AND quote_timestamp IS ?
+        """, (symbol,) + values).fetchone()
+        conn.execute("""
+        INSERT OR REPLACE INTO quotes (
+            symbol, last_done, open, high, low, volume, turnover, quote_timestamp, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (symbol,) + values + (now_et,))
+        if not unchanged:
+            bump_change_seq(conn, "quotes", symbol, now_et)
+            METRICS.inc("market_data_rows_written_total", table="quotes", symbol=symbol)
+        state_rows = symbol_freshness_rows(symbol, quote_updated_at=now_et)
+        if heartbeat:
+            state_rows.append(("last_success_at", now_et, now_et))
+        write_state_rows(state_rows)
+    if heartbeat:
+        METRICS.set_gauge("market_data_heartbeat_unixtime", time_module.time())
+
+
+def write_quotes(quotes, heartbeat=True):
+    with write_transaction():
+        for quote in quotes:
+            write_quote(quote.symbol, quote, heartbeat=heartbeat)
 
 
 def get_market(symbol):
@@ -248,13 +674,16 @@ def get_market(symbol):
     return Market.US
 
 
-def upsert_trading_calendar(quote_ctx, symbol):
+def fetch_trading_calendar(quote_ctx, symbol):
+    """交易日历 → service_state 行（calendar_date / is_trading_day / 半日市标记）。"""
     now_et = get_us_eastern_time()
     current_date = now_et.date()
     # 往前多查一段日历，以便判断上一个交易日是否为半交易日
     # （半交易日次日午后历史分钟数据缺失，会污染噪声区间计算，策略需跳过该日）
     lookback_start = current_date - timedelta(days=15)
-    calendar_resp = quote_ctx.trading_days(get_market(symbol), lookback_start, current_date)
+    API_LIMITER.acquire()
+    with METRICS.timed("market_data_api_seconds", "market_data_api_calls_total", op="trading_days"):
+        calendar_resp = quote_ctx.trading_days(get_market(symbol), lookback_start, current_date)
     half_trading_days = set(calendar_resp.half_trading_days)
     # trading_days 与 half_trading_days 是独立列表，全交易日历需取并集
     all_trading_days = sorted(set(calendar_resp.trading_days) | half_trading_days)
@@ -266,51 +695,395 @@ def upsert_trading_calendar(quote_ctx, symbol):
     prev_trading_day = prev_days[-1] if prev_days else None
     prev_is_half = prev_trading_day is not None and prev_trading_day in half_trading_days
     updated_at = now_et.strftime("%Y-%m-%d %H:%M:%S")
-
-    conn = sqlite3.connect(MARKET_DATA_DB_PATH)
-    cursor = conn.cursor()
-    cursor.executemany("""
-    INSERT OR REPLACE INTO service_state (key, value, updated_at)
-    VALUES (?, ?, ?)
-    """, [
+    return [
         ("calendar_date", current_date.isoformat(), updated_at),
         ("is_trading_day", "1" if is_trade_day else "0", updated_at),
         ("is_half_trading_day", "1" if is_half_trade_day else "0", updated_at),
         ("prev_trading_day", prev_trading_day.isoformat() if prev_trading_day else "", updated_at),
         ("prev_trading_day_is_half", "1" if prev_is_half else "0", updated_at),
-    ])
-    conn.commit()
-    conn.close()
+    ]
+
+
+def upsert_trading_calendar(quote_ctx, symbol):
+    write_state_rows(fetch_trading_calendar(quote_ctx, symbol))
+
+
+def on_push_bar(symbol, candle):
+    """推送的已收完 K 线立即落库，并记录收盘→落库延迟。"""
+    received = time_module.perf_counter()
+    METRICS.inc("market_data_push_events_total", kind="bar", symbol=symbol)
+    rows = candle_rows([candle], symbol, get_us_eastern_time())
+    if not rows:
+        return
+    upsert_candles(rows)
+    write_ms = (time_module.perf_counter() - received) * 1000
+    now_et = get_us_eastern_time()
+    bar_close = normalize_timestamp(candle.timestamp, symbol) + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS)
+    latency = (now_et - bar_close).total_seconds()
+    # 回放数据的时间戳是历史时间，只报告写库耗时
+    latency_str = f"收盘→落库 {latency:.2f}s, " if abs(latency) < 3600 else ""
+    print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 推送K线 {rows[0][3]} 已落库（{latency_str}写库 {write_ms:.1f}ms）")
+
+
+def on_push_quote(symbol, quote):
+    METRICS.inc("market_data_push_events_total", kind="quote", symbol=symbol)
+    write_quote(symbol, quote)
+
+
+def create_push_feed(quote_ctx, symbols):
+    if REPLAY_CSV:
+        print(f"推送源: 本地回放 {REPLAY_CSV}（{REPLAY_SPEED:g} 倍速）")
+        return ReplayFeed.from_csv(REPLAY_CSV, symbols[0], speed=REPLAY_SPEED)
+    print("推送源: Longport 订阅")
+    return LongportPushFeed(quote_ctx, symbols)
+
+
+def push_feed_healthy(feed):
+    age = feed.last_event_age()
+    return feed.connected and age is not None and age <= PUSH_STALE_SECONDS
+
+
+def write_metrics_snapshot():
+    with write_transaction() as conn:
+        conn.executemany("""
+        INSERT OR REPLACE INTO service_metrics (name, labels, kind, value, count, sum, buckets, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, METRICS.snapshot_rows())
+
+
+def export_metrics_file():
+    if METRICS_FILE:
+        write_prometheus_file(METRICS.render_prometheus(), METRICS_FILE)
+
+
+def flush_metrics():
+    """指标快照入库 + 导出 Prometheus 文本文件（loop 引擎每轮调用）。"""
+    write_metrics_snapshot()
+    export_metrics_file()
+
+
+class SingleWriter:
+    """
+    async 引擎的唯一写入者：各任务把写操作（落库函数 + 参数）放进队列，
+    写者在专用线程里把当前排队的操作合并为一个事务提交（每个操作一个 SAVEPOINT，单个失败不影响同批其他操作）。
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.loop = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="market-data-writer")
+
+    async def submit(self, fn, *args):
+        future = self.loop.create_future()
+        await self.queue.put((fn, args, future))
+        return await future
+
+    def submit_threadsafe(self, fn, *args):
+        """推送回调线程使用：只入队不等待结果。"""
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (fn, args, None))
+
+    @staticmethod
+    def _commit(batch):
+        outcomes = []
+        with write_transaction() as conn:
+            for fn, args, _ in batch:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    result = fn(*args)
+                    conn.execute("RELEASE write_op")
+                    outcomes.append((result, None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    conn.execute("RELEASE write_op")
+                    outcomes.append((None, e))
+        return outcomes
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            METRICS.set_gauge("market_data_writer_batch_size", len(batch))
+            started = time_module.perf_counter()
+            try:
+                outcomes = await self.loop.run_in_executor(self._executor, self._commit, batch)
+            except Exception as e:
+                outcomes = [(None, e)] * len(batch)
+            commit_ms = (time_module.perf_counter() - started) * 1000
+            if commit_ms > SLOW_COMMIT_MS:
+                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 写入较慢: {len(batch)} 个操作 {commit_ms:.0f}ms")
+            for (fn, _, future), (result, error) in zip(batch, outcomes):
+                if future is None:
+                    if error is not None:
+                        print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] {fn.__name__} 写入失败: {error}")
+                elif error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+
+class AsyncMarketDataService:
+    """
+    asyncio 版行情服务：报价/心跳、今日 K 线、交易日历、已收盘日回补四个任务各自按
+    ASYNC_TASK_SETTINGS 的周期、超时和退避运行。每个任务的接口调用在自己的单线程池里执行，
+    慢的历史调用只会拖住回补任务本身；所有写库经 SingleWriter 串行。
+    """
+
+    def __init__(self, quote_ctx, symbols, feed=None):
+        self.quote_ctx = quote_ctx
+        self.symbols = list(symbols)
+        self.primary = self.symbols[0]
+        self.feed = feed
+        self.writer = SingleWriter()
+        self.executors = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"market-data-{name}") for name in ASYNC_TASK_SETTINGS}
+        self.candles_ok_at = None
+        self.calendar_date = None
+        self.heartbeat_paused = None
+        self.last_verify_at = time_module.monotonic()
+
+    def log(self, message):
+        print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
+
+    async def call(self, task, fn, *args):
+        """在任务自己的线程里执行阻塞接口调用，超过该任务的 timeout 抛 TimeoutError。"""
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self.executors[task], fn, *args), ASYNC_TASK_SETTINGS[task]["timeout"])
+
+    def push_healthy(self):
+        return self.feed is not None and push_feed_healthy(self.feed)
+
+    def candles_fresh(self):
+        return self.candles_ok_at is not None and time_module.monotonic() - self.candles_ok_at <= CANDLES_HEARTBEAT_GRACE_SECONDS
+
+    async def quote_step(self):
+        if self.push_healthy():
+            return
+        quotes = await self.call("quote", fetch_quotes, self.quote_ctx, self.symbols)
+        heartbeat = self.candles_fresh()
+        if self.heartbeat_paused is not None and heartbeat == self.heartbeat_paused:
+            self.log("K线恢复，继续写心跳" if heartbeat else f"{self.primary} K线超过 {CANDLES_HEARTBEAT_GRACE_SECONDS} 秒未刷新，暂停心跳")
+        self.heartbeat_paused = not heartbeat
+        await self.writer.submit(write_quotes, quotes, heartbeat)
+
+    async def candles_step(self):
+        if self.push_healthy():
+            # 推送正常时今日 K 线由推送写入
+            self.candles_ok_at = time_module.monotonic()
+            return
+        rows = []
+        counts = {}
+        primary_error = None
+        for symbol in self.symbols:
+            try:
+                symbol_rows = await self.call("candles", fetch_today_candles, self.quote_ctx, symbol)
+            except Exception as e:
+                if symbol == self.primary:
+                    primary_error = e
+                else:
+                    self.log(f"{symbol} K线刷新失败: {e!r}")
+                continue
+            counts[symbol] = len(symbol_rows)
+            rows += symbol_rows
+        if rows:
+            await self.writer.submit(upsert_candles, rows)
+        if primary_error is not None:
+            raise primary_error
+        self.candles_ok_at = time_module.monotonic()
+
+    async def calendar_step(self):
+        today = get_us_eastern_time().date()
+        if self.calendar_date == today:
+            return
+        rows = await self.call("calendar", fetch_trading_calendar, self.quote_ctx, self.primary)
+        await self.writer.submit(write_state_rows, rows)
+        self.calendar_date = today
+        self.log(f"交易日历已更新: {dict((k, v) for k, v, _ in rows)}")
+
+    async def backfill_step(self):
+        await self.call("backfill", maybe_start_maintenance, get_us_eastern_time())
+        if time_module.monotonic() - self.last_verify_at >= INTEGRITY_CHECK_INTERVAL_SECONDS:
+            self.last_verify_at = time_module.monotonic()
+            for symbol in self.symbols:
+                mismatched = await self.call("backfill", find_mismatched_days, self.quote_ctx, symbol)
+                if mismatched:
+                    await self.writer.submit(invalidate_completed_days, symbol)
+                    self.log(f"{symbol} 完整性复查不一致: {', '.join(d.isoformat() for d in mismatched)}，回看窗口将重新回补")
+        budget = BACKFILL_CALLS_PER_CYCLE
+        for symbol in self.symbols:
+            if budget <= 0:
+                break
+            missing = await self.call("backfill", missing_completed_days, symbol)
+            taken = missing[:budget]
+            for day in taken:
+                rows = await self.call("backfill", fetch_day_candles, self.quote_ctx, symbol, day)
+                await self.writer.submit(replace_day_candles, symbol, day, rows)
+            budget -= len(taken)
+            if taken:
+                self.log(f"{symbol} 已收盘交易日回补: {len(taken)} 天，剩余 {len(missing) - len(taken)} 天")
+        await self.writer.submit(write_lookback_state)
+
+    async def metrics_step(self):
+        await self.writer.submit(write_metrics_snapshot)
+        await self.call("metrics", export_metrics_file)
+
+    async def run_periodic(self, name, step):
+        settings = ASYNC_TASK_SETTINGS[name]
+        failures = 0
+        while True:
+            started = time_module.monotonic()
+            try:
+                await step()
+                failures = 0
+                delay = settings["interval"] - (time_module.monotonic() - started)
+            except Exception as e:
+                failures += 1
+                METRICS.inc("market_data_task_failures_total", task=name)
+                delay = min(settings["max_backoff"], settings["retry"] * 2 ** (failures - 1))
+                reason = "超时" if isinstance(e, asyncio.TimeoutError) else repr(e)
+                self.log(f"{name} 任务失败（第 {failures} 次）: {reason}，{delay:g} 秒后重试")
+            METRICS.observe("market_data_task_seconds", time_module.monotonic() - started, task=name)
+            await asyncio.sleep(max(0.0, delay))
+
+    async def run(self):
+        writer_task = asyncio.create_task(self.writer.run())
+        await asyncio.sleep(0)
+        if self.feed is not None:
+            self.feed.start(
+                lambda symbol, candle: self.writer.submit_threadsafe(on_push_bar, symbol, candle),
+                lambda symbol, quote: self.writer.submit_threadsafe(on_push_quote, symbol, quote),
+            )
+        tasks = [
+            asyncio.create_task(self.run_periodic("calendar", self.calendar_step)),
+            asyncio.create_task(self.run_periodic("candles", self.candles_step)),
+            asyncio.create_task(self.run_periodic("quote", self.quote_step)),
+            asyncio.create_task(self.run_periodic("backfill", self.backfill_step)),
+            asyncio.create_task(self.run_periodic("metrics", self.metrics_step)),
+        ]
+        await asyncio.gather(writer_task, *tasks)
 
 
 def run_service():
     sys.stdout = Logger(LOG_FILE)
     sys.stderr = sys.stdout
     init_market_data_db()
-    quote_ctx = create_quote_context()
-    print(f"交易品种: {SYMBOL}")
+    replay = REFRESH_MODE == "push" and REPLAY_CSV
+    quote_ctx = None if replay else create_quote_context()
+    primary = SYMBOLS[0]
+    if not replay:
+        # 先写回看完整度，首轮回补之前报价任务写的心跳不会被当成回看窗口已就绪
+        write_lookback_state()
+    print(f"交易品种: {', '.join(SYMBOLS)}")
     print(f"刷新间隔: {REFRESH_INTERVAL_SECONDS} 秒")
+    print(f"刷新模式: {REFRESH_MODE}")
+    print(f"接口限速: {API_RATE_LIMIT_PER_SECOND:g} 次/秒")
+    if start_http_server(METRICS, METRICS_PORT):
+        print(f"指标: http://127.0.0.1:{METRICS_PORT}/metrics")
+    if METRICS_FILE:
+        print(f"指标文件: {os.path.abspath(METRICS_FILE)}（每 {METRICS_FLUSH_SECONDS} 秒）")
+    last_verify_at = time_module.monotonic()
 
+    feed = None
+    if REFRESH_MODE == "push":
+        feed = create_push_feed(quote_ctx, SYMBOLS)
+    if SERVICE_ENGINE == "async" and REFRESH_MODE != "full" and not replay:
+        print("服务引擎: async（" + " / ".join(f"{name} {cfg['interval']:g}s" for name, cfg in ASYNC_TASK_SETTINGS.items()) + "）")
+        asyncio.run(AsyncMarketDataService(quote_ctx, SYMBOLS, feed).run())
+        return
+    if feed is not None:
+        feed.start(on_push_bar, on_push_quote)
+    if replay:
+        while feed.connected:
+            time_module.sleep(1)
+        print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 回放结束")
+        return
+
+    polling = False
+    cycle_no = 0
     while True:
-        # 交易日历优先更新，避免 K 线拉取失败导致 calendar_date 滞留
+        cycle_no += 1
+        try:
+            maybe_start_maintenance(get_us_eastern_time())
+        except Exception as e:
+            print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 库维护调度失败: {str(e)}")
+        if cycle_no > 1:
+            try:
+                flush_metrics()
+            except Exception as e:
+                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 指标导出失败: {str(e)}")
+        # 先完成全部网络请求，再把日历 + K 线 + 报价 + 心跳放进一个事务提交（读者只会看到整轮结果）
+        # 交易日历优先获取，避免 K 线拉取失败导致 calendar_date 滞留（按主品种的市场）
+        calendar_rows = None
         try:
-            upsert_trading_calendar(quote_ctx, SYMBOL)
-            print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 交易日历缓存更新完成")
+            calendar_rows = fetch_trading_calendar(quote_ctx, primary)
         except Exception as e:
             print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 交易日历缓存更新失败: {str(e)}")
 
+        if feed is not None:
+            healthy = push_feed_healthy(feed)
+            if healthy == polling:
+                state = "推送恢复，停止轮询" if healthy else "推送中断或无推送，退回轮询"
+                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] {state}")
+                polling = not healthy
+            if healthy:
+                if calendar_rows:
+                    write_state_rows(calendar_rows)
+                # 推送正常时只补已收盘日（稳态无 API 调用）
+                for symbol in SYMBOLS:
+                    try:
+                        backfill_completed_days(quote_ctx, symbol, max_days=BACKFILL_CALLS_PER_CYCLE)
+                    except Exception as e:
+                        print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] {symbol} 已收盘交易日回补失败: {str(e)}")
+                write_lookback_state()
+                time_module.sleep(REFRESH_INTERVAL_SECONDS)
+                continue
+
+        rows_by_symbol = {}
+        quotes = []
         try:
-            rows = fetch_historical_candles(quote_ctx, SYMBOL)
-            if rows:
-                upsert_candles(rows)
-                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] K线缓存更新完成: {len(rows)} 条")
+            if REFRESH_MODE == "full":
+                rows_by_symbol = {symbol: fetch_historical_candles(quote_ctx, symbol) for symbol in SYMBOLS}
             else:
-                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 警告: 本轮没有获取到K线")
-            upsert_quote(quote_ctx, SYMBOL)
-            print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 报价缓存更新完成")
+                verify = time_module.monotonic() - last_verify_at >= INTEGRITY_CHECK_INTERVAL_SECONDS
+                if verify:
+                    last_verify_at = time_module.monotonic()
+                rows_by_symbol = refresh_symbols_incremental(quote_ctx, SYMBOLS, cycle_no, verify=verify)
+            # 与单品种时一致：主品种 K 线没刷新成功时不写心跳，消费者据此拒绝交易
+            if primary not in rows_by_symbol:
+                raise RuntimeError(f"{primary} K线未刷新，跳过本轮心跳")
+            quotes = fetch_quotes(quote_ctx, SYMBOLS)
         except Exception as e:
             print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 行情缓存更新失败: {str(e)}")
 
+        rows = [row for symbol_rows in rows_by_symbol.values() for row in symbol_rows]
+        try:
+            commit_started = time_module.perf_counter()
+            with write_transaction():
+                if calendar_rows:
+                    write_state_rows(calendar_rows)
+                if rows:
+                    upsert_candles(rows)
+                for quote in quotes:
+                    write_quote(quote.symbol, quote)
+                missing = write_lookback_state()
+            commit_ms = (time_module.perf_counter() - commit_started) * 1000
+            parts = []
+            if calendar_rows:
+                parts.append("交易日历")
+            if rows:
+                parts.append("K线 " + ", ".join(f"{symbol} {len(r)}" for symbol, r in rows_by_symbol.items()) + " 条")
+            elif REFRESH_MODE == "full" and rows_by_symbol:
+                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 警告: 本轮没有获取到K线")
+            if quotes:
+                parts.append("报价")
+            if missing:
+                parts.append(f"回看窗口尚缺 {missing} 个交易日")
+            if parts:
+                print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 缓存更新完成: {' / '.join(parts)}（单事务提交 {commit_ms:.1f}ms）")
+        except Exception as e:
+            print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 行情缓存写入失败: {str(e)}")
+
         time_module.sleep(REFRESH_INTERVAL_SECONDS)
 
 
@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+market_data_cache.db 的连接约定（longport_data_service 写、各 simulate_*.py 读）。
+
+  - 库以 WAL 模式运行：读者不阻塞写者、写者不阻塞读者，提交只追加 WAL，不再整库加锁
+  - 写者（行情服务）进程内只持有一条长连接，每轮的日历 + K 线 + 报价 + 心跳在一个事务里提交
+  - 读者每个线程一条只读长连接（query_only），不再每次查询 connect/close；
+    库文件被删除重建（delete_db.py / 回放）时按 inode 变化自动重连
+
+表结构也定义在这里（MARKET_DATA_SCHEMA），写者建表、基准测试与回放工具共用。
+
+变更序号: 写者在内容真正变化时把 service_state 的 "candles_seq:<symbol>" / "quotes_seq:<symbol>"
+在同一事务里 +1。读者先读序号（单行主键查询），序号没变就复用内存里上次解析好的结果（ChangeSeqCache），
+两根 K 线之间几乎不再有 I/O 和解析开销。序号为 0（旧版服务未写）时每次都重新读取。
+
+回放时钟: market_data_replay.py 回放历史数据时把虚拟时钟锚点写进 service_state
+（replay_clock / replay_wall / replay_speed），消费者设 MARKET_DATA_REPLAY_CLOCK=1 后经 ReplayClock
+读取，当前时间与 sleep 都跟随回放倍速。
+"""
+import os
+import pathlib
+import platform
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+# 读写两侧的忙等待上限（毫秒）。WAL 下只有 checkpoint 与写者之间会短暂互等
+MARKET_DATA_BUSY_TIMEOUT_MS = 5000
+# WAL 文件累计到约 N 页时自动 checkpoint（SQLite 默认 1000 页）
+MARKET_DATA_WAL_AUTOCHECKPOINT = 1000
+# 行情服务写入的回看完整度：主品种回看窗口里还没落库的已收盘交易日数（与 last_success_at 心跳独立）
+LOOKBACK_MISSING_DAYS_KEY = "lookback_missing_days"
+
+MARKET_DATA_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS candles (
+        symbol TEXT NOT NULL,
+        datetime_et TEXT NOT NULL,
+        date TEXT NOT NULL,
+        time TEXT NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        volume REAL NOT NULL,
+        turnover REAL NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (symbol, datetime_et)
+    )
+    """,
+    # 消费者都按 WHERE symbol = ? AND date >= ? AND date <= ? 取数，主键 (symbol, datetime_et) 用不上；
+    # 带上 datetime_et 后 MAX(datetime_et) / 按日删除也直接走索引
+    """
+    CREATE INDEX IF NOT EXISTS idx_candles_symbol_date
+    ON candles (symbol, date, datetime_et)
+    """,
+    # 超出保留窗口的分钟 K 线删除前汇总成日线（market_data_maintenance）
+    """
+    CREATE TABLE IF NOT EXISTS candles_daily (
+        symbol TEXT NOT NULL,
+        date TEXT NOT NULL,
+        open REAL NOT NULL,
+        high REAL NOT NULL,
+        low REAL NOT NULL,
+        close REAL NOT NULL,
+        volume REAL NOT NULL,
+        turnover REAL NOT NULL,
+        n_bars INTEGER NOT NULL,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (symbol, date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS quotes (
+        symbol TEXT PRIMARY KEY,
+        last_done TEXT,
+        open TEXT,
+        high TEXT,
+        low TEXT,
+        volume TEXT,
+        turnover TEXT,
+        quote_timestamp TEXT,
+        updated_at TEXT NOT NULL
+    )
+    """,
+    # 已收盘交易日的回补状态: complete=1 后增量模式不再重拉; checksum 用于完整性复查
+    """
+    CREATE TABLE IF NOT EXISTS candle_days (
+        symbol TEXT NOT NULL,
+        date TEXT NOT NULL,
+        n_bars INTEGER NOT NULL,
+        checksum TEXT NOT NULL,
+        complete INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (symbol, date)
+    )
+    """,
+    # 行情服务运行指标快照（service_metrics.py）；labels 为 JSON，直方图的桶计数放在 buckets
+    """
+    CREATE TABLE IF NOT EXISTS service_metrics (
+        name TEXT NOT NULL,
+        labels TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        value REAL,
+        count INTEGER,
+        sum REAL,
+        buckets TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (name, labels)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS service_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    )
+    """,
+)
+
+
+def get_common_files_dir():
+    """返回和 MT5/EA 可见的 Common Files 目录；非 Windows 使用当前目录。"""
+    if platform.system() == "Windows":
+        appdata_path = os.environ.get("APPDATA", os.path.expanduser("~\\AppData\\Roaming"))
+        mt5_common_path = os.path.join(appdata_path, "MetaQuotes", "Terminal", "Common", "Files")
+        os.makedirs(mt5_common_path, exist_ok=True)
+        return mt5_common_path
+    return "."
+
+
+def get_market_data_db_path():
+    """行情服务、维护与看板工具共用的库路径：MARKET_DATA_DB_PATH，否则 Common Files 下的 market_data_cache.db。"""
+    return os.environ.get("MARKET_DATA_DB_PATH", os.path.join(get_common_files_dir(), "market_data_cache.db"))
+
+
+def open_writer_connection(db_path):
+    """
+    写者长连接：WAL + synchronous=NORMAL（WAL 下断电最多丢最后几个事务，不会损坏库）。
+    isolation_level=None，事务由调用方显式 BEGIN IMMEDIATE / COMMIT 控制；
+    check_same_thread=False 供推送回调线程共用，调用方需自行加锁串行化。
+    """
+    conn = sqlite3.connect(db_path, timeout=MARKET_DATA_BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={MARKET_DATA_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA wal_autocheckpoint={MARKET_DATA_WAL_AUTOCHECKPOINT}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def init_schema(conn):
+    for ddl in MARKET_DATA_SCHEMA:
+        conn.execute(ddl)
+
+
+CHANGE_SEQ_KINDS = ("candles", "quotes")
+
+
+def change_seq_key(kind, symbol):
+    if kind not in CHANGE_SEQ_KINDS:
+        raise ValueError(f"未知的变更序号类型: {kind}")
+    return f"{kind}_seq:{symbol}"
+
+
+def bump_change_seq(conn, kind, symbol, now_str):
+    """写者侧：在调用方的事务里把序号 +1（不存在时置 1）。"""
+    conn.execute("""
+    INSERT INTO service_state (key, value, updated_at) VALUES (?, '1', ?)
+    ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1, updated_at = excluded.updated_at
+    """, (change_seq_key(kind, symbol), now_str))
+
+
+def read_change_seq(conn, kind, symbol):
+    row = conn.execute("SELECT value FROM service_state WHERE key = ?", (change_seq_key(kind, symbol),)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def read_lookback_missing_days(conn):
+    """主品种回看窗口尚缺的交易日数；旧版服务 / 回放库没写该键时按 0 处理。"""
+    row = conn.execute("SELECT value FROM service_state WHERE key = ?", (LOOKBACK_MISSING_DAYS_KEY,)).fetchone()
+    return int(row[0]) if row else 0
+
+
+def changed_since(db_path, kind, symbol, seq):
+    """返回 (是否有变化, 当前序号)。seq 为上次读到的序号；序号为 0 视为无法判断、按有变化处理。"""
+    current = read_change_seq(market_data_connection(db_path), kind, symbol)
+    return current == 0 or current != seq, current
+
+
+class ChangeSeqCache:
+    """
+    读者侧的结果缓存：按 (kind, symbol) 记住上次的序号、查询参数与解析结果。
+        seq, value = cache.lookup(conn, "candles", symbol, key)
+        if value is None:
+            value = ...  # 查库 + 解析
+            cache.store(conn, "candles", symbol, key, seq, value)
+    key 是除序号外影响结果的参数（如查询日期区间），变化时同样视为未命中。
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def lookup(self, conn, kind, symbol, key):
+        seq = read_change_seq(conn, kind, symbol)
+        entry = self._entries.get((kind, symbol))
+        # 库被删除重建后序号从 1 重新计数，连接也会换新，连同连接一起比对
+        if seq and entry is not None and entry[0] == (seq, conn) and entry[1] == key:
+            return seq, entry[2]
+        return seq, None
+
+    def store(self, conn, kind, symbol, key, seq, value):
+        if seq:
+            self._entries[(kind, symbol)] = ((seq, conn), key, value)
+
+    def clear(self):
+        self._entries = {}
+
+
+REPLAY_CLOCK_KEYS = ("replay_clock", "replay_wall", "replay_speed")
+REPLAY_CLOCK_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+# 读者重新读取锚点的间隔（真实秒）；回放跳过夜间时消费者在这个延迟内看到新日期
+REPLAY_CLOCK_REFRESH_SECONDS = 0.2
+# 跟随虚拟时钟 sleep 时单次真实等待的上限（秒）
+REPLAY_SLEEP_POLL_SECONDS = 0.5
+
+
+def replay_clock_rows(virtual_now, speed, now_str):
+    """写者侧（回放服务）：虚拟时钟锚点 = 此刻的虚拟时间（美东、无时区）+ 真实 unix 时间 + 倍速。"""
+    return [
+        ("replay_clock", virtual_now.strftime(REPLAY_CLOCK_FORMAT), now_str),
+        ("replay_wall", repr(time.time()), now_str),
+        ("replay_speed", repr(float(speed)), now_str),
+    ]
+
+
+class ReplayClock:
+    """
+    读者侧的回放虚拟时钟: 虚拟时间 = 锚点 + (真实时间 - 锚点写入时刻) × 倍速。
+    库里没有锚点（接的是真实行情服务）时 now() 返回 None，调用方退回真实时钟；
+    倍速为 0 表示回放已结束、时钟停在最后时刻。
+    """
+
+    def __init__(self, db_path, refresh_seconds=REPLAY_CLOCK_REFRESH_SECONDS):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self._anchor = None
+        self._loaded_at = None
+        self._time_module = None
+
+    def _load_anchor(self):
+        started = time.monotonic()
+        if self._loaded_at is not None and started - self._loaded_at < self.refresh_seconds:
+            return self._anchor
+        try:
+            rows = market_data_connection(self.db_path).execute(
+                "SELECT key, value FROM service_state WHERE key IN (?, ?, ?)", REPLAY_CLOCK_KEYS
+            ).fetchall()
+            state = dict(rows)
+            self._anchor = (
+                datetime.strptime(state["replay_clock"], REPLAY_CLOCK_FORMAT),
+                float(state["replay_wall"]),
+                float(state["replay_speed"]),
+            )
+        except (sqlite3.Error, KeyError, ValueError):
+            self._anchor = None
+        self._loaded_at = started
+        return self._anchor
+
+    def speed(self):
+        anchor = self._load_anchor()
+        return None if anchor is None else anchor[2]
+
+    def now(self):
+        """当前虚拟时间（带美东时区）；没有回放锚点时返回 None。"""
+        anchor = self._load_anchor()
+        if anchor is None:
+            return None
+        clock, wall, speed = anchor
+        virtual = clock + timedelta(seconds=(time.time() - wall) * speed)
+        return pytz.timezone("US/Eastern").localize(virtual)
+
+    def sleep(self, seconds):
+        """
+        等到虚拟时间过去 seconds 秒（回放跳过夜间时随之提前醒来）。
+        没有锚点或回放已停止时按真实时间等待剩余部分，避免消费者的等待循环空转。
+        """
+        remaining = seconds
+        start = self.now()
+        while remaining > 0:
+            speed = self.speed()
+            if start is None or not speed or speed <= 0:
+                time.sleep(remaining)
+                return
+            time.sleep(min(remaining / speed, REPLAY_SLEEP_POLL_SECONDS))
+            now = self.now()
+            if now is None:
+                return
+            remaining = seconds - (now - start).total_seconds()
+
+    def time_module(self):
+        """替换消费者模块里的 time_module：sleep 走虚拟时钟，其余属性照旧取自 time。"""
+        if self._time_module is None:
+            self._time_module = _ReplayTimeModule(self)
+        return self._time_module
+
+
+class _ReplayTimeModule:
+    def __init__(self, clock):
+        self._clock = clock
+
+    def sleep(self, seconds):
+        self._clock.sleep(seconds)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def _file_id(db_path):
+    try:
+        st = os.stat(db_path)
+    except OSError:
+        return None
+    return st.st_dev, st.st_ino
+
+
+_local = threading.local()
+
+
+def market_data_connection(db_path):
+    """
+    当前线程的只读长连接（按 db_path 缓存）。库文件不存在时抛 sqlite3.OperationalError，
+    与原先 connect 后查询失败走同一个异常分支。
+    """
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    file_id = _file_id(db_path)
+    cached = conns.get(db_path)
+    if cached is not None:
+        conn, cached_id = cached
+        if cached_id == file_id:
+            return conn
+        conn.close()
+        del conns[db_path]
+    if file_id is None:
+        raise sqlite3.OperationalError(f"行情缓存数据库不存在: {db_path}")
+    uri = pathlib.Path(os.path.abspath(db_path)).as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, timeout=MARKET_DATA_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    conn.execute("PRAGMA query_only=1")
+    conn.execute(f"PRAGMA busy_timeout={MARKET_DATA_BUSY_TIMEOUT_MS}")
+    conns[db_path] = (conn, file_id)
+    return conn
+
+
+def close_market_data_connections():
+    """关闭当前线程缓存的只读连接（线程退出前可选调用）。"""
+    for conn, _ in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+行情推送源（longport_data_service 的推送模式使用）。
+
+推送源统一成同一组方法，服务端只依赖这些方法，不关心背后是 Longport 长连接还是本地回放:
+    start(on_bar, on_quote)   开始推送; on_bar(symbol, candle) 只收到「已收完」的 1 分钟 K 线,
+                              on_quote(symbol, quote) 收到最新报价
+    stop()                    退订并停止
+    last_event_age()          距最近一次推送的秒数（从未收到返回 None）, 服务据此判断是否退回轮询
+    connected                 是否处于订阅状态
+
+candle / quote 与 Longport SDK 对象同名属性（timestamp/open/high/low/close/volume/turnover、
+last_done/...），服务端复用同一套落库代码。
+
+ReplayFeed 从分钟 CSV（DateTime,Open,High,Low,Close,Volume,Turnover, 美东时间）按加速时钟回放,
+无需 Longport 凭据即可离线验证推送模式:
+    python longport_data_service.py  （MARKET_DATA_REFRESH_MODE=push, MARKET_DATA_REPLAY_CSV=qqq_longport.csv）
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+
+class BarFinalizer:
+    """
+    把逐笔更新的 K 线推送收敛成「已收完」的 K 线。
+    推送带 is_confirmed 时直接以它为准; 否则同一品种出现更晚时间戳时, 上一根视为已收完。
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    def push(self, symbol, candle, confirmed=None):
+        """返回本次推送确认收完的 K 线列表（0~1 根）。"""
+        if confirmed:
+            pending = self._pending.get(symbol)
+            if pending is not None and pending.timestamp == candle.timestamp:
+                del self._pending[symbol]
+            return [candle]
+        pending = self._pending.get(symbol)
+        self._pending[symbol] = candle
+        if confirmed is None and pending is not None and candle.timestamp > pending.timestamp:
+            return [pending]
+        return []
+
+    def flush(self):
+        """数据流结束时, 把各品种未确认的最后一根当作已收完返回。"""
+        pending, self._pending = self._pending, {}
+        return list(pending.items())
+
+
+class LongportPushFeed:
+    """Longport QuoteContext 订阅: 1 分钟 K 线 + 报价。"""
+
+    def __init__(self, quote_ctx, symbols):
+        self.quote_ctx = quote_ctx
+        self.symbols = list(symbols)
+        self.connected = False
+        self._finalizer = BarFinalizer()
+        self._last_event = None
+        self._lock = threading.Lock()
+
+    def _touch(self):
+        with self._lock:
+            self._last_event = time.monotonic()
+
+    def last_event_age(self):
+        with self._lock:
+            return None if self._last_event is None else time.monotonic() - self._last_event
+
+    def start(self, on_bar, on_quote):
+        from longport.openapi import Period, SubType
+
+        def handle_candlestick(symbol, event):
+            self._touch()
+            confirmed = getattr(event, "is_confirmed", None)
+            for candle in self._finalizer.push(symbol, event.candlestick, confirmed):
+                on_bar(symbol, candle)
+
+        def handle_quote(symbol, event):
+            self._touch()
+            on_quote(symbol, event)
+
+        self.quote_ctx.set_on_candlestick(handle_candlestick)
+        self.quote_ctx.set_on_quote(handle_quote)
+        self.quote_ctx.subscribe(self.symbols, [SubType.Quote])
+        for symbol in self.symbols:
+            self.quote_ctx.subscribe_candlesticks(symbol, Period.Min_1)
+        self.connected = True
+
+    def stop(self):
+        from longport.openapi import Period, SubType
+
+        if not self.connected:
+            return
+        try:
+            for symbol in self.symbols:
+                self.quote_ctx.unsubscribe_candlesticks(symbol, Period.Min_1)
+            self.quote_ctx.unsubscribe(self.symbols, [SubType.Quote])
+        finally:
+            self.connected = False
+
+
+class ReplayFeed:
+    """
+    本地回放替身: 按 speed 倍速把分钟 K 线当作推送发出（每根 K 线先发一次未确认更新,
+    下一根到来时由 BarFinalizer 确认上一根），同时用收盘价合成报价。
+    """
+
+    def __init__(self, bars_by_symbol, speed=60.0):
+        self.bars_by_symbol = bars_by_symbol
+        self.speed = float(speed)
+        self.connected = False
+        self._finalizer = BarFinalizer()
+        self._last_event = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_csv(cls, path, symbol, day=None, speed=60.0):
+        """读取分钟 CSV; day 给定时只回放这一天（默认最后一天）。"""
+        df = pd.read_csv(path)
+        df["DateTime"] = pd.to_datetime(df["DateTime"])
+        if day is None:
+            day = df["DateTime"].dt.date.max()
+        df = df[df["DateTime"].dt.date == pd.Timestamp(day).date()].sort_values("DateTime")
+        bars = [
+            SimpleNamespace(
+                timestamp=row.DateTime.to_pydatetime(),
+                open=row.Open, high=row.High, low=row.Low, close=row.Close,
+                volume=row.Volume, turnover=getattr(row, "Turnover", 0.0),
+            )
+            for row in df.itertuples(index=False)
+        ]
+        return cls({symbol: bars}, speed=speed)
+
+    def last_event_age(self):
+        return None if self._last_event is None else time.monotonic() - self._last_event
+
+    def start(self, on_bar, on_quote):
+        self._stop.clear()
+        self.connected = True
+        self._thread = threading.Thread(target=self._run, args=(on_bar, on_quote), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.connected = False
+
+    def _run(self, on_bar, on_quote):
+        streams = {symbol: iter(bars) for symbol, bars in self.bars_by_symbol.items()}
+        day_stats = {}
+        while streams and not self._stop.is_set():
+            for symbol in list(streams):
+                bar = next(streams[symbol], None)
+                if bar is None:
+                    del streams[symbol]
+                    continue
+                self._last_event = time.monotonic()
+                for candle in self._finalizer.push(symbol, bar):
+                    on_bar(symbol, candle)
+                stats = day_stats.setdefault(symbol, {"open": bar.open, "high": bar.high, "low": bar.low, "volume": 0.0, "turnover": 0.0})
+                stats["high"] = max(stats["high"], bar.high)
+                stats["low"] = min(stats["low"], bar.low)
+                stats["volume"] += bar.volume
+                stats["turnover"] += bar.turnover
+                on_quote(symbol, SimpleNamespace(last_done=bar.close, timestamp=bar.timestamp, **stats))
+            self._stop.wait(60.0 / self.speed)
+        # 回放结束: 最后一根也视为收完
+        for symbol, candle in self._finalizer.flush():
+            on_bar(symbol, candle)
+        self.connected = False
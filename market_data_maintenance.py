@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+market_data_cache.db 的保留、压缩与查询计划检查。
+
+  - 保留窗口: 分钟 K 线只保留最近 MARKET_DATA_RETENTION_DAYS 个日历天（消费者最多回看约 20 天，
+    留足余量）；更早的按天先汇总进 candles_daily（MARKET_DATA_ARCHIVE_DAILY=1）再删除，
+    每天一个短事务，不长时间占住写锁
+  - ANALYZE 每次维护都做；空闲页占比超过 MAINTENANCE_VACUUM_FREE_RATIO 时再 VACUUM，
+    最后 wal_checkpoint(TRUNCATE) 收缩 WAL 文件
+  - 查询计划检查: 对消费者 / 服务的固定查询做 EXPLAIN QUERY PLAN，出现对 candles 的全表扫描即失败
+
+行情服务在非交易时段后台线程里自动调度（见 longport_data_service.maybe_start_maintenance）；
+也可以手动运行:
+  python market_data_maintenance.py check          # 查询计划检查（有全表扫描时退出码 1）
+  python market_data_maintenance.py run            # 立即执行一次保留 + ANALYZE/VACUUM
+  python market_data_maintenance.py stats
+"""
+
+import argparse
+import os
+import sys
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+from market_data_client import get_market_data_db_path, init_schema, market_data_connection, open_writer_connection
+
+# 分钟 K 线保留的日历天数；0 表示不清理
+MARKET_DATA_RETENTION_DAYS = int(os.environ.get("MARKET_DATA_RETENTION_DAYS", "120"))
+# 清理前是否汇总为日线存入 candles_daily
+MARKET_DATA_ARCHIVE_DAILY = os.environ.get("MARKET_DATA_ARCHIVE_DAILY", "1") == "1"
+# 空闲页占比达到该值才 VACUUM（重写整库，平时只 ANALYZE）
+MAINTENANCE_VACUUM_FREE_RATIO = float(os.environ.get("MARKET_DATA_VACUUM_FREE_RATIO", "0.2"))
+
+# 需要走索引的固定查询（参数只用于 EXPLAIN，取值无关）
+MARKET_DATA_QUERIES = {
+    "history": (
+        "SELECT datetime_et, open, high, low, close, volume, turnover FROM candles "
+        "WHERE symbol = ? AND date >= ? AND date <= ? ORDER BY datetime_et ASC",
+        ("QQQ.US", "2026-01-01", "2026-01-31"),
+    ),
+    "last_candle_time": (
+        "SELECT MAX(datetime_et) FROM candles WHERE symbol = ? AND date = ?",
+        ("QQQ.US", "2026-01-02"),
+    ),
+    "delete_day": (
+        "DELETE FROM candles WHERE symbol = ? AND date = ?",
+        ("QQQ.US", "2026-01-02"),
+    ),
+    "expired_days": (
+        "SELECT DISTINCT symbol, date FROM candles WHERE date < ?",
+        ("2026-01-01",),
+    ),
+    "quote": (
+        "SELECT symbol, last_done, open, high, low, volume, turnover, quote_timestamp FROM quotes WHERE symbol = ?",
+        ("QQQ.US",),
+    ),
+    "service_state": (
+        "SELECT value FROM service_state WHERE key = ?",
+        ("last_success_at",),
+    ),
+    "completed_days": (
+        "SELECT date, checksum FROM candle_days WHERE symbol = ? AND complete = 1",
+        ("QQQ.US",),
+    ),
+}
+
+# 允许全表扫描的查询（按 date 跨品种找过期日，只在维护时运行）
+FULL_SCAN_ALLOWED = {"expired_days"}
+
+
+@contextmanager
+def _immediate_transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+@contextmanager
+def _no_lock():
+    yield
+
+
+def explain_query_plans(conn):
+    """返回 [(name, plan_details, full_scan)]；full_scan 表示计划里有 SCAN（整表或整个索引遍历）。"""
+    results = []
+    for name, (sql, params) in MARKET_DATA_QUERIES.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+        full_scan = any(detail.startswith("SCAN ") for detail in plan)
+        results.append((name, plan, full_scan))
+    return results
+
+
+def check_query_plans(conn, verbose=True):
+    """全表扫描回归检查；返回不合格的查询名列表。"""
+    failed = []
+    for name, plan, full_scan in explain_query_plans(conn):
+        bad = full_scan and name not in FULL_SCAN_ALLOWED
+        if bad:
+            failed.append(name)
+        if verbose:
+            print(f"  {'FAIL' if bad else 'ok  '} {name}: {' | '.join(plan)}")
+    return failed
+
+
+def expired_days(conn, cutoff_date):
+    return conn.execute(
+        "SELECT DISTINCT symbol, date FROM candles WHERE date < ? ORDER BY date", (cutoff_date.isoformat(),)
+    ).fetchall()
+
+
+def archive_day(conn, symbol, date_str, now_str):
+    """一天的分钟 K 线汇总为日线写入 candles_daily（开 = 第一根开，收 = 最后一根收）。"""
+    conn.execute("""
+    INSERT OR REPLACE INTO candles_daily (symbol, date, open, high, low, close, volume, turnover, n_bars, updated_at)
+    SELECT symbol, date,
+        (SELECT open FROM candles WHERE symbol = ? AND date = ? ORDER BY datetime_et ASC LIMIT 1),
+        MAX(high), MIN(low),
+        (SELECT close FROM candles WHERE symbol = ? AND date = ? ORDER BY datetime_et DESC LIMIT 1),
+        SUM(volume), SUM(turnover), COUNT(*), ?
+    FROM candles WHERE symbol = ? AND date = ?
+    GROUP BY symbol, date
+    """, (symbol, date_str, symbol, date_str, now_str, symbol, date_str))
+
+
+def prune_candles(conn, retention_days=MARKET_DATA_RETENTION_DAYS, archive=MARKET_DATA_ARCHIVE_DAILY,
+                  transaction=None, today=None, lock=None):
+    """
+    删除保留窗口外的分钟 K 线（可选先汇总为日线），每个 (symbol, date) 一个事务。返回处理的天数。
+    过期日查询也在 lock 内执行：行情服务的写连接由推送 / 刷新线程共用，不能在锁外使用。
+    """
+    if retention_days <= 0:
+        return 0
+    transaction = transaction or (lambda: _immediate_transaction(conn))
+    lock = lock or _no_lock
+    cutoff = (today or date.today()) - timedelta(days=retention_days)
+    now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with lock():
+        days = expired_days(conn, cutoff)
+    for symbol, date_str in days:
+        with transaction():
+            if archive:
+                archive_day(conn, symbol, date_str, now_str)
+            conn.execute("DELETE FROM candles WHERE symbol = ? AND date = ?", (symbol, date_str))
+            conn.execute("DELETE FROM candle_days WHERE symbol = ? AND date = ?", (symbol, date_str))
+    return len(days)
+
+
+def compact(conn, free_ratio=MAINTENANCE_VACUUM_FREE_RATIO):
+    """ANALYZE；空闲页过多时 VACUUM；最后截断 WAL。返回是否执行了 VACUUM。"""
+    conn.execute("ANALYZE")
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    vacuumed = page_count > 0 and freelist / page_count >= free_ratio
+    if vacuumed:
+        conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return vacuumed
+
+
+def run_maintenance(conn, retention_days=MARKET_DATA_RETENTION_DAYS, archive=MARKET_DATA_ARCHIVE_DAILY,
+                    transaction=None, lock=None, today=None):
+    """
+    完整维护一次。transaction / lock 由行情服务传入自己的写事务与写锁（与刷新线程串行）；
+    命令行直接使用本模块时为简单的 BEGIN IMMEDIATE / 无锁。
+    返回 {pruned_days, vacuumed, db_mb}。
+    """
+    lock = lock or _no_lock
+    pruned = prune_candles(conn, retention_days, archive, transaction=transaction, today=today, lock=lock)
+    # VACUUM 不能在事务内执行，持锁期间刷新线程等待（只在非交易时段调度）
+    with lock():
+        vacuumed = compact(conn)
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return {"pruned_days": pruned, "vacuumed": vacuumed, "db_mb": page_size * page_count / 1024 / 1024}
+
+
+def table_stats(conn):
+    rows = []
+    for table in ("candles", "candles_daily", "candle_days", "quotes", "service_state"):
+        n = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        rows.append((table, n))
+    span = conn.execute("SELECT MIN(date), MAX(date) FROM candles").fetchone()
+    return rows, span
+
+
+def main():
+    parser = argparse.ArgumentParser(description="market_data_cache.db 保留 / 压缩 / 查询计划检查")
+    parser.add_argument("cmd", choices=["check", "run", "stats"])
+    parser.add_argument("--db", default=None, help="数据库路径（默认与行情服务相同: MARKET_DATA_DB_PATH 或 Common Files 下的 market_data_cache.db）")
+    parser.add_argument("--retention-days", type=int, default=MARKET_DATA_RETENTION_DAYS)
+    parser.add_argument("--no-archive", action="store_true", help="清理前不汇总日线")
+    args = parser.parse_args()
+
+    db_path = args.db or get_market_data_db_path()
+    # 路径写错时不能悄悄建一个空库再报告通过
+    if not os.path.isfile(db_path):
+        print(f"行情缓存数据库不存在: {os.path.abspath(db_path)}")
+        sys.exit(1)
+    if args.cmd == "run":
+        conn = open_writer_connection(db_path)
+        init_schema(conn)
+    else:
+        # check / stats 只读，不建表、不改库
+        conn = market_data_connection(db_path)
+    print(f"行情缓存数据库: {os.path.abspath(db_path)}")
+    if args.cmd == "check":
+        failed = check_query_plans(conn)
+        if failed:
+            print(f"全表扫描: {', '.join(failed)}")
+            sys.exit(1)
+        print("查询计划检查通过")
+    elif args.cmd == "run":
+        result = run_maintenance(conn, args.retention_days, not args.no_archive)
+        print(f"清理 {result['pruned_days']} 个品种日 | VACUUM: {'是' if result['vacuumed'] else '否'} | 库大小 {result['db_mb']:.1f} MB")
+    else:
+        rows, span = table_stats(conn)
+        for table, n in rows:
+            print(f"  {table:<14} {n:>10}")
+        print(f"  分钟 K 线日期范围: {span[0]} ~ {span[1]}")
+    if args.cmd == "run":
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
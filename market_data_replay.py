@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+历史行情加速回放服务：不连 Longport，按虚拟时钟把历史分钟数据写进与 longport_data_service
+完全相同结构的 market_data_cache.db，消费者（simulate_*.py）照常读 MARKET_DATA_DB_PATH。
+
+写入内容与真实服务一致:
+  - candles: 每根 K 线在收盘时刻（时间戳 + BAR_CLOSE_OFFSET_SECONDS）到达时写入，并递增 candles_seq
+  - quotes: 当前分钟按开→收线性插值合成最新价，当日开高低量额累计，变化时递增 quotes_seq
+  - service_state: last_success_at 心跳、交易日历键（calendar_date / is_trading_day / 半日市 /
+    上一交易日）、按品种新鲜度键，时间戳全部用虚拟美东时间
+  - candle_days: 回放完的交易日与预载的历史日记为完整
+  - service_metrics: 提交耗时、写入行数、K 线延迟等（service_metrics.py dashboard 可直接看）
+虚拟时钟锚点写在 service_state（replay_clock / replay_wall / replay_speed），消费者设
+MARKET_DATA_REPLAY_CLOCK=1 后当前时间与 sleep 都跟随回放倍速（market_data_client.ReplayClock）。
+
+默认收盘后直接跳到下一交易日 --day-start（跟随回放时钟的消费者 sleep 会随之醒来）；
+--no-skip-overnight 则夜间与周末也按倍速走完，日历在虚拟零点切换。
+倍速受消费者处理速度限制：单次轮询耗时 × 倍速超过其检查间隔时会错过时点，压测时逐步加速。
+
+用法:
+  python market_data_replay.py --csv qqq_longport.csv --start 2024-06-17 --speed 60 --db replay.db --fresh
+  python market_data_replay.py --registry QQQ --start 2026-03-02 --end 2026-03-06 --speed 600
+  MARKET_DATA_DB_PATH=replay.db MARKET_DATA_REPLAY_CLOCK=1 python simulate.py
+"""
+
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytz
+
+from market_data_client import (
+    bump_change_seq,
+    close_market_data_connections,
+    get_market_data_db_path,
+    init_schema,
+    market_data_connection,
+    open_writer_connection,
+    replay_clock_rows,
+)
+from service_metrics import METRICS
+
+REPLAY_SPEED_MIN = 1.0
+REPLAY_SPEED_MAX = 1000.0
+# 每次写库推进的虚拟秒数（真实服务约 20 秒一轮；需小于消费者心跳容忍 MARKET_DATA_MAX_AGE_SECONDS）
+REPLAY_STEP_SECONDS = 10.0
+# 真实时间下两次写库的最小间隔
+REPLAY_MIN_TICK_SECONDS = 0.01
+# 每个交易日虚拟时钟的起点（美东），消费者在开盘前先看到新日历与心跳
+REPLAY_DAY_START = "09:00"
+# 最后一根 K 线收完后继续走多久才切到下一交易日
+REPLAY_SETTLE_SECONDS = 300
+# 回放首日之前预载的历史日历天数（消费者回看约 20 个交易日）
+REPLAY_HISTORY_DAYS = 35
+REPLAY_METRICS_FLUSH_SECONDS = 2.0
+BAR_CLOSE_OFFSET_SECONDS = int(os.environ.get("MARKET_DATA_BAR_CLOSE_OFFSET_SECONDS", "60"))
+HALF_DAY_LAST_BAR = "13:00"
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+EASTERN = pytz.timezone("US/Eastern")
+
+
+@contextmanager
+def _immediate_transaction(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def load_csv_minutes(path, start=None, end=None):
+    """分钟 CSV（DateTime,Open,High,Low,Close,Volume[,Turnover]，美东时间）→ 与 load_minutes 同列的帧。"""
+    df = pd.read_csv(path)
+    df["DateTime"] = pd.to_datetime(df["DateTime"])
+    if "Turnover" not in df.columns:
+        df["Turnover"] = (df["High"] + df["Low"]) / 2 * df["Volume"]
+    if start is not None:
+        df = df[df["DateTime"].dt.date >= start]
+    if end is not None:
+        df = df[df["DateTime"].dt.date <= end]
+    return df
+
+
+def split_days(df):
+    """按日拆成 {date: [(ts, open, high, low, close, volume, turnover), ...]}，只保留 09:30–16:00。"""
+    df = df.sort_values("DateTime").drop_duplicates(subset=["DateTime"], keep="last")
+    times = df["DateTime"].dt.strftime("%H:%M")
+    df = df[(times >= "09:30") & (times <= "16:00")]
+    days = {}
+    for row in df.itertuples(index=False):
+        ts = row.DateTime.to_pydatetime()
+        days.setdefault(ts.date(), []).append((
+            ts, float(row.Open), float(row.High), float(row.Low), float(row.Close),
+            float(row.Volume), float(row.Turnover),
+        ))
+    return days
+
+
+def candle_row(symbol, bar, updated_at):
+    ts, o, h, l, c, v, t = bar
+    return (symbol, ts.strftime(TIMESTAMP_FORMAT), ts.date().isoformat(), ts.strftime("%H:%M"),
+            o, h, l, c, v, t, updated_at)
+
+
+def day_checksum(rows):
+    """与 longport_data_service.day_checksum 同口径。"""
+    return f"{len(rows)}:{sum(r[7] for r in rows):.4f}:{sum(r[8] for r in rows):.0f}"
+
+
+class VirtualClock:
+    """虚拟美东时间（无时区）= 起点 + 真实流逝 × 倍速；jump_to 直接跳到更晚的时刻。"""
+
+    def __init__(self, start, speed):
+        self.speed = float(speed)
+        self._origin = start
+        self._origin_real = time.monotonic()
+
+    def now(self):
+        return self._origin + timedelta(seconds=(time.monotonic() - self._origin_real) * self.speed)
+
+    def jump_to(self, virtual):
+        if virtual > self.now():
+            self._origin = virtual
+            self._origin_real = time.monotonic()
+
+
+class MarketDataReplay:
+    """
+    回放主体。days / history 为 split_days 的结果；half_days 为半日市日期集合；
+    trading_days 为已知全部交易日（含预载历史与数据集日历），用于写上一交易日。
+    """
+
+    def __init__(self, conn, symbol, days, history=None, half_days=(), trading_days=(),
+                 speed=60.0, step_seconds=REPLAY_STEP_SECONDS, day_start=REPLAY_DAY_START, skip_overnight=True):
+        self.conn = conn
+        self.symbol = symbol
+        self.days = dict(sorted(days.items()))
+        self.history = dict(sorted((history or {}).items()))
+        self.half_days = set(half_days)
+        self.trading_days = sorted(set(trading_days) | set(self.days) | set(self.history))
+        self.speed = float(speed)
+        self.step_seconds = step_seconds
+        self.day_start = datetime.strptime(day_start, "%H:%M").time()
+        self.skip_overnight = skip_overnight
+        self.clock = None
+        self.calendar_date = None
+        self.last_quote = None
+        self.stats = {"ticks": 0, "overruns": 0, "bars": 0, "quotes": 0, "commit": [], "bar_lag": []}
+
+    # ------------------------------------------------------------------
+    # 准备
+    # ------------------------------------------------------------------
+    def reset_symbol(self):
+        """清掉回放区间及之后的 K 线与报价，避免消费者看到「未来」数据。"""
+        first_day = next(iter(self.days)).isoformat()
+        now_str = datetime.now().strftime(TIMESTAMP_FORMAT)
+        with _immediate_transaction(self.conn) as conn:
+            conn.execute("DELETE FROM candles WHERE symbol = ? AND date >= ?", (self.symbol, first_day))
+            conn.execute("DELETE FROM candle_days WHERE symbol = ? AND date >= ?", (self.symbol, first_day))
+            conn.execute("DELETE FROM quotes WHERE symbol = ?", (self.symbol,))
+            bump_change_seq(conn, "candles", self.symbol, now_str)
+            bump_change_seq(conn, "quotes", self.symbol, now_str)
+
+    def preload_history(self):
+        """回放首日之前的交易日整天写入并标记完整（与服务启动时的历史回补一致）。返回写入天数。"""
+        if not self.history:
+            return 0
+        first_day = next(iter(self.days))
+        updated_at = datetime.combine(first_day, self.day_start).strftime(TIMESTAMP_FORMAT)
+        with _immediate_transaction(self.conn) as conn:
+            for day, bars in self.history.items():
+                rows = [candle_row(self.symbol, bar, updated_at) for bar in bars]
+                self._replace_day(conn, day, rows, updated_at)
+            bump_change_seq(conn, "candles", self.symbol, updated_at)
+        return len(self.history)
+
+    def _replace_day(self, conn, day, rows, updated_at):
+        conn.execute("DELETE FROM candles WHERE symbol = ? AND date = ?", (self.symbol, day.isoformat()))
+        conn.executemany("INSERT INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("""
+        INSERT OR REPLACE INTO candle_days (symbol, date, n_bars, checksum, complete, updated_at)
+        VALUES (?, ?, ?, ?, 1, ?)
+        """, (self.symbol, day.isoformat(), len(rows), day_checksum(rows), updated_at))
+
+    # ------------------------------------------------------------------
+    # 每轮写库
+    # ------------------------------------------------------------------
+    def calendar_rows(self, current_date, now_str):
+        """与 longport_data_service.fetch_trading_calendar 相同的键；全日市与半日市分开标记。"""
+        is_half = current_date in self.half_days
+        is_trade = current_date in self.trading_days and not is_half
+        prev_days = [d for d in self.trading_days if d < current_date]
+        prev_day = prev_days[-1] if prev_days else None
+        return [
+            ("calendar_date", current_date.isoformat(), now_str),
+            ("is_trading_day", "1" if is_trade else "0", now_str),
+            ("is_half_trading_day", "1" if is_half else "0", now_str),
+            ("prev_trading_day", prev_day.isoformat() if prev_day else "", now_str),
+            ("prev_trading_day_is_half", "1" if prev_day in self.half_days else "0", now_str),
+        ]
+
+    def quote_values(self, bars, n_closed, virtual_now):
+        """已收完的 K 线 + 正在形成的一根（按开→收线性插值）合成报价；开盘前返回 None。"""
+        forming = None
+        if n_closed < len(bars) and bars[n_closed][0] <= virtual_now:
+            forming = bars[n_closed]
+        if n_closed == 0 and forming is None:
+            return None
+        closed = bars[:n_closed]
+        prices = [(b[2], b[3]) for b in closed]
+        volume = sum(b[5] for b in closed)
+        turnover = sum(b[6] for b in closed)
+        if forming is not None:
+            frac = min(1.0, max(0.0, (virtual_now - forming[0]).total_seconds() / BAR_CLOSE_OFFSET_SECONDS))
+            last = forming[1] + (forming[4] - forming[1]) * frac
+            prices.append((max(forming[1], last), min(forming[1], last)))
+            volume += forming[5] * frac
+            turnover += forming[6] * frac
+        else:
+            last = closed[-1][4]
+        day_open = bars[0][1]
+        return (
+            f"{last:.4f}", f"{day_open:.4f}",
+            f"{max(p[0] for p in prices):.4f}", f"{min(p[1] for p in prices):.4f}",
+            f"{volume:.0f}", f"{turnover:.2f}",
+        )
+
+    def write_tick(self, day, n_closed, new_bars, virtual_now):
+        now_str = virtual_now.strftime(TIMESTAMP_FORMAT)
+        rows = [candle_row(self.symbol, bar, now_str) for bar in new_bars]
+        quote = self.quote_values(self.days.get(day, []), n_closed, virtual_now) if day else None
+        state_rows = [("last_success_at", now_str, now_str)]
+        state_rows += replay_clock_rows(virtual_now, self.speed, now_str)
+        if virtual_now.date() != self.calendar_date:
+            state_rows += self.calendar_rows(virtual_now.date(), now_str)
+        started = time.perf_counter()
+        with _immediate_transaction(self.conn) as conn:
+            if rows:
+                conn.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                bump_change_seq(conn, "candles", self.symbol, now_str)
+                state_rows += [
+                    (f"candles_updated_at:{self.symbol}", now_str, now_str),
+                    (f"last_bar_at:{self.symbol}", rows[-1][1], now_str),
+                ]
+            if quote is not None and quote != self.last_quote:
+                quote_ts = EASTERN.localize(virtual_now.replace(microsecond=0)).isoformat()
+                conn.execute("INSERT OR REPLACE INTO quotes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (self.symbol,) + quote + (quote_ts, now_str))
+                bump_change_seq(conn, "quotes", self.symbol, now_str)
+                state_rows.append((f"quote_updated_at:{self.symbol}", now_str, now_str))
+            conn.executemany("INSERT OR REPLACE INTO service_state (key, value, updated_at) VALUES (?, ?, ?)", state_rows)
+        commit_seconds = time.perf_counter() - started
+        self.calendar_date = virtual_now.date()
+        self._record(rows, quote, commit_seconds)
+
+    def _record(self, rows, quote, commit_seconds):
+        self.stats["ticks"] += 1
+        self.stats["commit"].append(commit_seconds)
+        METRICS.observe("market_data_db_commit_seconds", commit_seconds)
+        METRICS.set_gauge("market_data_heartbeat_unixtime", time.time())
+        if rows:
+            self.stats["bars"] += len(rows)
+            METRICS.inc("market_data_rows_written_total", len(rows), table="candles", symbol=self.symbol)
+            # 落库时刻的虚拟时间 − 最新一根的收盘时刻（虚拟秒，反映步长与写库耗时）
+            bar_close = datetime.strptime(rows[-1][1], TIMESTAMP_FORMAT) + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS)
+            lag = max(0.0, (self.clock.now() - bar_close).total_seconds())
+            self.stats["bar_lag"].append(lag)
+            METRICS.set_gauge("market_data_bar_lag_seconds", lag, symbol=self.symbol)
+        if quote is not None and quote != self.last_quote:
+            self.stats["quotes"] += 1
+            self.last_quote = quote
+            METRICS.inc("market_data_rows_written_total", table="quotes", symbol=self.symbol)
+
+    def finish_day(self, day):
+        updated_at = self.clock.now().strftime(TIMESTAMP_FORMAT)
+        rows = [candle_row(self.symbol, bar, updated_at) for bar in self.days[day]]
+        with _immediate_transaction(self.conn) as conn:
+            conn.execute("""
+            INSERT OR REPLACE INTO candle_days (symbol, date, n_bars, checksum, complete, updated_at)
+            VALUES (?, ?, ?, ?, 1, ?)
+            """, (self.symbol, day.isoformat(), len(rows), day_checksum(rows), updated_at))
+
+    def flush_metrics(self):
+        with _immediate_transaction(self.conn) as conn:
+            conn.executemany("""
+            INSERT OR REPLACE INTO service_metrics (name, labels, kind, value, count, sum, buckets, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, METRICS.snapshot_rows())
+
+    # ------------------------------------------------------------------
+    # 主循环
+    # ------------------------------------------------------------------
+    def run(self):
+        tick_seconds = max(REPLAY_MIN_TICK_SECONDS, self.step_seconds / self.speed)
+        first_day = next(iter(self.days))
+        self.clock = VirtualClock(datetime.combine(first_day, self.day_start), self.speed)
+        real_started = time.monotonic()
+        last_flush = real_started
+        for day, bars in self.days.items():
+            if self.skip_overnight:
+                self.clock.jump_to(datetime.combine(day, self.day_start))
+            self.last_quote = None
+            day_end = bars[-1][0] + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS + REPLAY_SETTLE_SECONDS)
+            n_closed = 0
+            deadline = time.monotonic()
+            print(f"[{day}] 回放 {len(bars)} 根 K 线{'（半日市）' if day in self.half_days else ''}")
+            while True:
+                # 没有跳过夜间时，先把到这一天开盘前的空档按倍速走完
+                virtual_now = self.clock.now()
+                new_bars = []
+                if virtual_now.date() >= day:
+                    while n_closed < len(bars) and bars[n_closed][0] + timedelta(seconds=BAR_CLOSE_OFFSET_SECONDS) <= virtual_now:
+                        new_bars.append(bars[n_closed])
+                        n_closed += 1
+                self.write_tick(day if virtual_now.date() >= day else None, n_closed, new_bars, virtual_now)
+                if time.monotonic() - last_flush >= REPLAY_METRICS_FLUSH_SECONDS:
+                    self.flush_metrics()
+                    last_flush = time.monotonic()
+                if n_closed == len(bars) and virtual_now >= day_end:
+                    break
+                deadline += tick_seconds
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.stats["overruns"] += 1
+                    deadline = time.monotonic()
+            self.finish_day(day)
+        self.stop()
+        self.stats["real_seconds"] = time.monotonic() - real_started
+        return self.stats
+
+    def stop(self):
+        """回放结束：时钟停在最后时刻（倍速 0），消费者的时间不再前进。"""
+        virtual_now = self.clock.now()
+        now_str = virtual_now.strftime(TIMESTAMP_FORMAT)
+        with _immediate_transaction(self.conn) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO service_state (key, value, updated_at) VALUES (?, ?, ?)",
+                replay_clock_rows(virtual_now, 0.0, now_str),
+            )
+        self.flush_metrics()
+
+
+def _ms(values, q):
+    return float(np.quantile(values, q) * 1000) if len(values) else float("nan")
+
+
+def print_summary(stats, days, speed):
+    lag = np.asarray(stats["bar_lag"])
+    print(
+        f"完成: {len(days)} 个交易日 | {stats['bars']} 根 K 线 / {stats['quotes']} 次报价 / {stats['ticks']} 轮写库 | "
+        f"真实用时 {stats['real_seconds']:.1f}s（设定 {speed:g}x）"
+    )
+    print(
+        f"写库提交 p50 {_ms(stats['commit'], 0.5):.2f}ms / p99 {_ms(stats['commit'], 0.99):.2f}ms / "
+        f"max {_ms(stats['commit'], 1.0):.2f}ms | 落后于时钟 {stats['overruns']} 轮"
+    )
+    if len(lag):
+        print(f"K 线收盘→落库（虚拟秒）p50 {np.quantile(lag, 0.5):.1f} / max {lag.max():.1f}")
+
+
+def guard_live_database(conn, force):
+    """库里有心跳却没有回放锚点，多半是真实行情服务在用的库，默认拒绝覆盖（含 --fresh 删除）。"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'service_state'").fetchone() is None:
+        return
+    state = dict(conn.execute(
+        "SELECT key, value FROM service_state WHERE key IN ('last_success_at', 'replay_speed')"
+    ).fetchall())
+    if "last_success_at" in state and "replay_speed" not in state and not force:
+        print(f"该库已有行情服务心跳（{state['last_success_at']}），不像回放库；确认覆盖请加 --force，或用 --db 指定新路径")
+        sys.exit(1)
+
+
+def load_source(args, start, end):
+    """返回 (分钟帧, 半日市集合, 日历交易日集合)。"""
+    if args.csv:
+        return load_csv_minutes(args.csv, start, end), None, set()
+    from dataset_registry import DatasetRegistry
+
+    registry = DatasetRegistry(args.dataset_db)
+    try:
+        df = registry.load_minutes(args.registry, start, end)
+        calendar = registry.calendar("US", start, end)
+    finally:
+        registry.close()
+    if calendar.empty:
+        return df, None, set()
+    return df, set(calendar.loc[calendar["is_half_day"], "date"]), set(calendar["date"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="历史分钟数据加速回放（写 market_data_cache.db，无需 Longport 凭据）")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="分钟 CSV（DateTime 为美东时间）")
+    source.add_argument("--registry", help="dataset_registry 里的 symbol，如 QQQ")
+    parser.add_argument("--dataset-db", default=None, help="数据集注册表路径（默认 DATASET_DB_PATH）")
+    parser.add_argument("--symbol", default=os.environ.get("SYMBOL", "QQQ.US"), help="写入缓存库的品种代码")
+    parser.add_argument("--start", default=None, help="回放首日 YYYY-MM-DD（默认数据集最后一天）")
+    parser.add_argument("--end", default=None, help="回放末日（默认同 --start）")
+    parser.add_argument("--speed", type=float, default=60.0, help=f"倍速 {REPLAY_SPEED_MIN:g}–{REPLAY_SPEED_MAX:g}")
+    parser.add_argument("--step-seconds", type=float, default=REPLAY_STEP_SECONDS, help="每轮写库推进的虚拟秒数")
+    parser.add_argument("--day-start", default=REPLAY_DAY_START, help="每个交易日虚拟时钟起点 HH:MM")
+    parser.add_argument("--history-days", type=int, default=REPLAY_HISTORY_DAYS, help="预载首日之前的日历天数")
+    parser.add_argument("--no-skip-overnight", action="store_true", help="夜间与周末也按倍速走完")
+    parser.add_argument("--db", default=None, help="缓存库路径（默认与行情服务相同: MARKET_DATA_DB_PATH 或 Common Files 下的 market_data_cache.db）")
+    parser.add_argument("--fresh", action="store_true", help="先删除已有缓存库（含 -wal/-shm）")
+    parser.add_argument("--force", action="store_true", help="允许写入 / --fresh 删除带真实服务心跳的库")
+    args = parser.parse_args()
+
+    if not REPLAY_SPEED_MIN <= args.speed <= REPLAY_SPEED_MAX:
+        parser.error(f"--speed 需在 {REPLAY_SPEED_MIN:g}–{REPLAY_SPEED_MAX:g} 之间")
+    start = date.fromisoformat(args.start) if args.start else None
+    end = date.fromisoformat(args.end) if args.end else start
+    load_start = start - timedelta(days=args.history_days) if start else None
+    df, half_days, calendar_days = load_source(args, load_start, end)
+    all_days = split_days(df)
+    if not all_days:
+        print("数据集中没有可回放的分钟数据")
+        sys.exit(1)
+    if start is None:
+        start = end = max(all_days)
+    days = {d: bars for d, bars in all_days.items() if start <= d <= end}
+    history = {d: bars for d, bars in all_days.items() if d < start}
+    if not days:
+        print(f"{start} ~ {end} 没有分钟数据")
+        sys.exit(1)
+    if half_days is None:
+        half_days = {d for d, bars in all_days.items() if bars[-1][0].strftime("%H:%M") <= HALF_DAY_LAST_BAR}
+
+    db_path = args.db or get_market_data_db_path()
+    if os.path.isfile(db_path):
+        # 先只读检查再删除 / 写入，--fresh 也不能一条命令删掉真实服务在用的库
+        guard_live_database(market_data_connection(db_path), args.force)
+        close_market_data_connections()
+    if args.fresh:
+        for path in (db_path, f"{db_path}-wal", f"{db_path}-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+    conn = open_writer_connection(db_path)
+    init_schema(conn)
+    print(f"回放缓存库: {os.path.abspath(db_path)} | {args.symbol} {start} ~ {end}（{len(days)} 天）| {args.speed:g}x")
+
+    replay = MarketDataReplay(
+        conn, args.symbol, days, history=history, half_days=half_days, trading_days=calendar_days,
+        speed=args.speed, step_seconds=args.step_seconds, day_start=args.day_start,
+        skip_overnight=not args.no_skip_overnight,
+    )
+    replay.reset_symbol()
+    print(f"预载历史 {replay.preload_history()} 个交易日")
+    try:
+        stats = replay.run()
+    except KeyboardInterrupt:
+        replay.stop()
+        print("已中断：时钟停在当前虚拟时刻")
+        conn.close()
+        return
+    print_summary(stats, days, args.speed)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+通用考试商（prop firm）规则引擎：在一份回测的逐日结果上，一次向量化推进评估任意多套规则。
+
+规则以声明式 PropRuleSet 描述：
+  - 各阶段盈利目标（1 段 / 2 段）与最少交易日
+  - 最大亏损：静态（初始资金 − L）或 EOD 移动（阶段内收盘权益高水位 − L，可选锁定在初始资金）
+  - 日内亏损：相对日初（FTMO 口径）或相对日内峰值；可只在 funded 阶段生效
+  - 一致性：单日最大盈利不超过阶段累计盈利的 consistency 比例（考试阶段不满足时继续交易直到满足；
+    funded 阶段不满足时推迟出金）
+  - funded 出金周期与分成
+
+输入是 run_backtest 的 daily_df（capital / daily_return / intraday_loss_from_start_pct / intraday_mdd_pct）
+与可选的 trades_df（判断交易日）。每套规则 × 每个起始日视为一个账户，所有账户的状态放在数组里，
+按交易日顺序推进一次即得到全部结果：首次过关/进入 funded 的用时、失败阶段与原因、funded 出金。
+
+近似：账户收益 = 回测日收益 × (规则杠杆 / 回测杠杆)，日内亏损同比例缩放；不含股数取整与最低手续费差异，
+也不模拟触发限额后 EA 当日平仓（以「当天是否触及」判定失败）。需要逐笔精确时用 ftmo_fleet。
+
+用法:
+  python prop_rules.py reports/backtest_results
+  python prop_rules.py reports/backtest_results --rules ftmo the5ers e8 --horizon 120
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+# 与 simulate_ftmo_day 相同的容差
+LOSS_EPS = 1e-9
+
+
+@dataclass(frozen=True)
+class PropRuleSet:
+    """一套考试商规则（比例均相对账户初始资金）。"""
+    name: str
+    targets: tuple = (0.10, 0.05)
+    max_loss: float = 0.10
+    max_loss_mode: str = 'static'  # static / trailing_eod
+    trailing_lock_at_start: bool = False  # trailing_eod 时，止损线升到初始资金后不再上移
+    daily_loss: float | None = 0.05
+    daily_loss_mode: str = 'day_start'  # day_start / peak
+    daily_loss_phases: str = 'all'  # all / funded（考试阶段无日亏）
+    min_trading_days: int = 0
+    consistency: float | None = None
+    consistency_phases: str = 'challenge'  # challenge（过关条件）/ funded（出金条件）
+    payout_days: int = 14
+    profit_split: float = 0.80
+    challenge_fee: float = 549.0  # 100K 标价近似（ftmo_fleet 计费用）
+    refund_fee: bool = True
+    leverage: float | None = None  # None = 与回测同杠杆
+    notes: str = field(default='', compare=False)
+
+    @property
+    def n_phases(self):
+        return len(self.targets)
+
+
+# 目标 / 日亏 / 最大亏损与 simulate_*.py、SQLiteSignalEA_*.mq5 一致；
+# ftmo_fleet.PROP_FIRM_PRESETS 由本表生成（只取它能模拟的静态回撤规则），改规则只改这里
+RULE_SETS = {
+    rs.name: rs
+    for rs in (
+        PropRuleSet('ftmo', (0.10, 0.05), 0.10, daily_loss=0.05, min_trading_days=4, challenge_fee=540.0),
+        PropRuleSet('fundednext', (0.08, 0.05), 0.10, daily_loss=0.05, min_trading_days=5),
+        PropRuleSet('the5ers', (0.08, 0.05), 0.10, daily_loss=0.05, min_trading_days=3, challenge_fee=495.0),
+        PropRuleSet('goat', (0.10, 0.05), 0.10, daily_loss=0.05, min_trading_days=3),
+        PropRuleSet('blueberry', (0.08, 0.06), 0.10, daily_loss=0.04, min_trading_days=3),
+        PropRuleSet('aqua', (0.08, 0.05), 0.08, daily_loss=0.05, min_trading_days=3, challenge_fee=499.0),
+        PropRuleSet(
+            'aqua_paylater', (0.03,), 0.05, max_loss_mode='trailing_eod',
+            daily_loss=0.03, daily_loss_phases='funded', consistency=0.15, consistency_phases='funded',
+            notes='challenge 无日亏 / funded 日亏 3%；最大回撤 5% trailing；funded 一致性 15%',
+        ),
+        PropRuleSet('e8', (0.08,), 0.08, daily_loss=0.025, min_trading_days=3, challenge_fee=588.0,
+                    notes='E8 Pro 一阶段；日盈 2% 上限未建模'),
+        PropRuleSet('ttp_1step', (0.10,), 0.06, max_loss_mode='trailing_eod', daily_loss=0.03, challenge_fee=599.0),
+        PropRuleSet('ttp_2step', (0.08, 0.05), 0.08, max_loss_mode='trailing_eod', daily_loss=0.05,
+                    min_trading_days=3, challenge_fee=599.0),
+    )
+}
+
+OUTCOME_PENDING, OUTCOME_ACTIVE, OUTCOME_FAILED, OUTCOME_TIMEOUT = -1, 0, 1, 2
+FAIL_REASONS = {0: None, 1: 'daily_loss', 2: 'max_loss'}
+
+
+def backtest_day_arrays(daily_df, trades_df=None):
+    """
+    把 run_backtest 的 daily_df 转成引擎输入：日收益、日内相对日初最大亏损、日内峰谷回撤、是否有成交、日期。
+    无 trades_df 时以「当日收益非 0」近似交易日。
+    """
+    df = daily_df.reset_index() if 'Date' not in daily_df.columns else daily_df
+    dates = pd.to_datetime(df['Date']).dt.date.to_numpy()
+    ret = df['daily_return'].fillna(0.0).to_numpy(dtype=float)
+    loss = df.get('intraday_loss_from_start_pct', pd.Series(0.0, index=df.index)).fillna(0.0).to_numpy(dtype=float)
+    mdd = df.get('intraday_mdd_pct', pd.Series(0.0, index=df.index)).fillna(0.0).to_numpy(dtype=float)
+    if trades_df is not None and len(trades_df) and 'Date' in trades_df.columns:
+        trade_dates = set(pd.to_datetime(trades_df['Date']).dt.date)
+        traded = np.array([d in trade_dates for d in dates])
+    else:
+        traded = ret != 0
+    return {
+        'dates': dates,
+        'ordinals': np.array([d.toordinal() for d in dates], dtype=np.int64),
+        'ret': ret,
+        'loss': loss,
+        'mdd': mdd,
+        'traded': traded,
+    }
+
+
+def _rule_arrays(rule_sets, n_starts, base_leverage):
+    """规则参数展开成长度 R×S 的数组（账户按 规则 主序、起始日 次序排列）。"""
+    max_phases = max(rs.n_phases for rs in rule_sets)
+
+    def rep(values, dtype=float):
+        return np.repeat(np.asarray(values, dtype=dtype), n_starts)
+
+    targets = np.full((len(rule_sets), max_phases), np.inf)
+    for i, rs in enumerate(rule_sets):
+        targets[i, :rs.n_phases] = rs.targets
+    return {
+        'targets': np.repeat(targets, n_starts, axis=0),
+        'n_phases': rep([rs.n_phases for rs in rule_sets], np.int64),
+        'max_loss': rep([rs.max_loss for rs in rule_sets]),
+        'trailing': rep([rs.max_loss_mode == 'trailing_eod' for rs in rule_sets], bool),
+        'lock': rep([rs.trailing_lock_at_start for rs in rule_sets], bool),
+        'daily_loss': rep([np.inf if rs.daily_loss is None else rs.daily_loss for rs in rule_sets]),
+        'daily_from_peak': rep([rs.daily_loss_mode == 'peak' for rs in rule_sets], bool),
+        'daily_funded_only': rep([rs.daily_loss_phases == 'funded' for rs in rule_sets], bool),
+        'min_days': rep([rs.min_trading_days for rs in rule_sets], np.int64),
+        'consistency': rep([np.inf if rs.consistency is None else rs.consistency for rs in rule_sets]),
+        'consistency_funded': rep([rs.consistency_phases == 'funded' for rs in rule_sets], bool),
+        'payout_days': rep([rs.payout_days for rs in rule_sets], np.int64),
+        'split': rep([rs.profit_split for rs in rule_sets]),
+        'scale': rep([(rs.leverage / base_leverage) if rs.leverage else 1.0 for rs in rule_sets]),
+    }
+
+
+def evaluate_rule_sets(arrays, rule_sets, start_indices=None, horizon_days=None, base_leverage=1.0):
+    """
+    对每套规则 × 每个起始日（start_indices，默认每个交易日）评估一次考试 + funded，
+    返回每账户一行的 DataFrame。horizon_days: 每个账户最多推进的交易日数（None = 到数据结束）。
+    """
+    rule_sets = list(rule_sets)
+    n_days = len(arrays['ret'])
+    starts = np.arange(n_days) if start_indices is None else np.asarray(start_indices, dtype=np.int64)
+    n_starts = len(starts)
+    p = _rule_arrays(rule_sets, n_starts, base_leverage)
+    n = len(rule_sets) * n_starts
+    start = np.tile(starts, len(rule_sets))
+    end = np.full(n, n_days) if horizon_days is None else np.minimum(start + int(horizon_days), n_days)
+    max_phases = p['targets'].shape[1]
+    rows = np.arange(n)
+
+    status = np.full(n, OUTCOME_PENDING, dtype=np.int8)
+    phase = np.zeros(n, dtype=np.int64)
+    eq = np.ones(n)
+    hwm = np.ones(n)
+    phase_days = np.zeros(n, dtype=np.int64)
+    best_day = np.zeros(n)
+    last_payout = np.zeros(n, dtype=np.int64)
+    payout_total = np.zeros(n)
+    n_payouts = np.zeros(n, dtype=np.int64)
+    pass_day = np.full((n, max_phases), -1, dtype=np.int64)
+    fail_day = np.full(n, -1, dtype=np.int64)
+    fail_reason = np.zeros(n, dtype=np.int8)
+
+    ords = arrays['ordinals']
+    for t in range(n_days):
+        status[(status == OUTCOME_PENDING) & (start == t)] = OUTCOME_ACTIVE
+        status[(status == OUTCOME_ACTIVE) & (t >= end)] = OUTCOME_TIMEOUT
+        idx = np.flatnonzero(status == OUTCOME_ACTIVE)
+        if not len(idx):
+            continue
+
+        k = p['scale'][idx]
+        day_start = eq[idx]
+        eod = day_start * (1.0 + k * arrays['ret'][t])
+        low = np.minimum(day_start * (1.0 - k * arrays['loss'][t]), eod)
+        drop = np.where(p['daily_from_peak'][idx], day_start * k * arrays['mdd'][t], day_start - low)
+        floor = np.where(p['trailing'][idx], hwm[idx] - p['max_loss'][idx], 1.0 - p['max_loss'][idx])
+        floor = np.where(p['trailing'][idx] & p['lock'][idx], np.minimum(floor, 1.0), floor)
+
+        daily_limit = np.where(p['daily_funded_only'][idx] & (phase[idx] < p['n_phases'][idx]), np.inf, p['daily_loss'][idx])
+        daily_fail = drop >= daily_limit - LOSS_EPS
+        total_fail = low <= floor + LOSS_EPS
+        failed = daily_fail | total_fail
+        f = idx[failed]
+        status[f] = OUTCOME_FAILED
+        fail_day[f] = t
+        fail_reason[f] = np.where(daily_fail[failed], 1, 2)
+
+        ok = ~failed
+        a = idx[ok]
+        eq[a] = eod[ok]
+        hwm[a] = np.maximum(hwm[a], eq[a])
+        phase_days[a] += bool(arrays['traded'][t])
+        best_day[a] = np.maximum(best_day[a], eod[ok] - day_start[ok])
+
+        # 考试阶段过关
+        in_challenge = phase[a] < p['n_phases'][a]
+        target = p['targets'][a, np.minimum(phase[a], max_phases - 1)]
+        profit = eq[a] - 1.0
+        consistent = np.ones(len(a), dtype=bool)
+        capped = np.isfinite(p['consistency'][a])
+        consistent[capped] = best_day[a][capped] <= p['consistency'][a][capped] * profit[capped]
+        challenge_consistent = consistent | p['consistency_funded'][a]
+        passed = (
+            in_challenge
+            & (eq[a] >= 1.0 + target)
+            & (phase_days[a] >= p['min_days'][a])
+            & challenge_consistent
+        )
+        pa = a[passed]
+        pass_day[pa, phase[pa]] = t
+        phase[pa] += 1
+        eq[pa] = 1.0
+        hwm[pa] = 1.0
+        phase_days[pa] = 0
+        best_day[pa] = 0.0
+        last_payout[pa] = ords[t]
+
+        # funded 出金（进入 funded 当天不出金；funded 一致性不满足时推迟）
+        funded_mask = ~passed & ~in_challenge
+        funded = a[funded_mask]
+        funded_consistent = consistent[funded_mask] | ~p['consistency_funded'][funded]
+        due = funded[
+            ((ords[t] - last_payout[funded]) >= p['payout_days'][funded]) & (eq[funded] > 1.0) & funded_consistent
+        ]
+        payout_total[due] += (eq[due] - 1.0) * p['split'][due]
+        n_payouts[due] += 1
+        eq[due] = 1.0
+        hwm[due] = 1.0
+        best_day[due] = 0.0
+        last_payout[due] = ords[t]
+
+    status[(status == OUTCOME_ACTIVE)] = OUTCOME_TIMEOUT
+    return _results_frame(rule_sets, arrays, starts, p, rows, status, phase, pass_day, fail_day,
+                          fail_reason, payout_total, n_payouts, eq)
+
+
+def _results_frame(rule_sets, arrays, starts, p, rows, status, phase, pass_day, fail_day,
+                   fail_reason, payout_total, n_payouts, eq):
+    dates = arrays['dates']
+    n_starts = len(starts)
+    start = np.tile(starts, len(rule_sets))
+    funded = phase >= p['n_phases']
+    funded_day = np.where(funded, pass_day[rows, np.maximum(p['n_phases'] - 1, 0)], -1)
+
+    def phase_name(ph, n_ph):
+        return 'funded' if ph >= n_ph else f'p{ph + 1}'
+
+    outcome = []
+    for st, ph, n_ph in zip(status, phase, p['n_phases']):
+        name = phase_name(ph, n_ph)
+        if st == OUTCOME_FAILED:
+            outcome.append(f'failed_{name}')
+        else:
+            outcome.append('funded' if name == 'funded' else f'open_{name}')
+
+    def to_date(day):
+        return [dates[d] if d >= 0 else None for d in day]
+
+    df = pd.DataFrame({
+        'rule_set': np.repeat([rs.name for rs in rule_sets], n_starts),
+        'start_date': dates[start],
+        'outcome': outcome,
+        'fail_reason': [FAIL_REASONS[r] for r in fail_reason],
+        'fail_date': to_date(fail_day),
+        'p1_date': to_date(pass_day[:, 0]),
+        'funded_date': to_date(funded_day),
+        'trading_days_to_p1': np.where(pass_day[:, 0] >= 0, pass_day[:, 0] - start + 1, np.nan),
+        'trading_days_to_funded': np.where(funded_day >= 0, funded_day - start + 1, np.nan),
+        'payouts': n_payouts,
+        'payout_pct': payout_total * 100.0,
+        'end_equity_pct': (eq - 1.0) * 100.0,
+    })
+    df['calendar_days_to_funded'] = [
+        (f - s).days if f is not None else np.nan for s, f in zip(df['start_date'], df['funded_date'])
+    ]
+    return df
+
+
+def summary_matrix(results):
+    """每套规则一行：过关率、失败分布、到 funded 用时分位数、平均出金（%初始资金）。"""
+    g = results.groupby('rule_set', sort=False)
+    out = pd.DataFrame({
+        'starts': g.size(),
+        'funded_pct': g['funded_date'].apply(lambda s: s.notna().mean() * 100),
+        'failed_p1_pct': g['outcome'].apply(lambda s: (s == 'failed_p1').mean() * 100),
+        'failed_p2_pct': g['outcome'].apply(lambda s: (s == 'failed_p2').mean() * 100),
+        'failed_funded_pct': g['outcome'].apply(lambda s: (s == 'failed_funded').mean() * 100),
+        'open_pct': g['outcome'].apply(lambda s: s.str.startswith('open_').mean() * 100),
+        'days_to_funded_p50': g['trading_days_to_funded'].median(),
+        'days_to_funded_p75': g['trading_days_to_funded'].quantile(0.75),
+        'payout_pct_mean': g['payout_pct'].mean(),
+    })
+    return out.reset_index()
+
+
+def time_to_target_matrix(results, freq='M'):
+    """规则 × 起始月份的到 funded 交易日数中位数（未过关为 NaN）。"""
+    df = results.copy()
+    df['start_period'] = pd.to_datetime(df['start_date']).dt.to_period(freq).astype(str)
+    return df.pivot_table(
+        index='rule_set', columns='start_period', values='trading_days_to_funded', aggfunc='median', sort=False
+    )
+
+
+def main():
+    from backtest_store import load_backtest_results
+
+    parser = argparse.ArgumentParser(description='考试商规则批量评估（基于回测逐日结果）')
+    parser.add_argument('results_dir', help='run_backtest results_dir 写出的结果目录')
+    parser.add_argument('--rules', nargs='*', choices=sorted(RULE_SETS), help='只评估指定规则（默认全部）')
+    parser.add_argument('--horizon', type=int, default=None, help='每个起始日最多推进的交易日数')
+    parser.add_argument('--start-step', type=int, default=1, help='每隔 N 个交易日取一个起始日')
+    args = parser.parse_args()
+
+    results = load_backtest_results(args.results_dir)
+    daily_df = results.table('daily')
+    trades_df = results.table('trades') if 'trades' in results.tables else None
+    base_leverage = float(dict(results.config).get('leverage', 1) or 1)
+    arrays = backtest_day_arrays(daily_df, trades_df)
+    rule_sets = [RULE_SETS[name] for name in (args.rules or RULE_SETS)]
+    starts = np.arange(0, len(arrays['ret']), max(1, args.start_step))
+
+    t0 = time.perf_counter()
+    res = evaluate_rule_sets(arrays, rule_sets, starts, args.horizon, base_leverage)
+    elapsed = time.perf_counter() - t0
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', None)
+    print(f'{len(rule_sets)} 套规则 × {len(starts)} 个起始日 = {len(res)} 个账户，用时 {elapsed:.2f}s\n')
+    print(summary_matrix(res).round(2).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""
+回测结果缓存（内容寻址，SQLite）。
+
+同一份数据 + 同一组参数 + 同一版引擎，结果必然相同：以
+    sha256(数据集内容指纹, 规范化配置, ENGINE_VERSION)
+为键缓存 run_backtest 的四元组与 ftmo_ibkr_combo_backtest 各窗口的 summary，命中时直接返回。
+
+  - 数据集指纹：CSV 为文件内容 sha256（按 路径+大小+mtime 记忆，文件不变不重复读）；
+    dataset_registry 数据集为 history_days 逐日来源/分钟数/写入时间的指纹
+  - 规范化配置：去掉只影响打印、绘图、落盘与并行度的键，日期/元组/numpy 标量转成 JSON 口径后按键排序
+  - 容量上限 RESULT_CACHE_MAX_MB，超出时按最近访问时间淘汰（LRU）
+
+启用：run_backtest 配置 'result_cache': True（或缓存库路径）；run_backtest(config, force=True) 跳过读取并覆盖。
+命中/未命中计数见 cache_stats()，每次命中或写入都会打印一行。
+
+用法:
+  python result_cache.py stats
+  python result_cache.py evict --max-mb 512
+  python result_cache.py clear
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "result_cache.db")
+RESULT_CACHE_MAX_MB = float(os.environ.get("RESULT_CACHE_MAX_MB", "2048"))
+# CSV 内容哈希的读块大小
+HASH_CHUNK_BYTES = 1 << 20
+
+# 不影响回测数值结果的配置键：打印 / 绘图 / 报告 / 落盘 / 并行度 / 缓存自身。
+# data_path 与 dataset_db_path 由数据集内容指纹代替（同内容换路径仍命中）。
+NON_RESULT_CONFIG_KEYS = frozenset({
+    'print_daily_trades', 'print_trade_details', 'debug_time',
+    'plot_days', 'random_plots', 'plots_dir',
+    'show_equity_report', 'equity_report_open_browser', 'equity_report_path',
+    'results_dir', 'parallel_workers',
+    'result_cache', 'result_cache_max_mb',
+    'data_path', 'dataset_db_path',
+})
+
+# 本进程内的命中统计
+CACHE_STATS = {'hits': 0, 'misses': 0, 'forced': 0, 'stores': 0, 'evictions': 0, 'seconds_saved': 0.0}
+
+
+def _canonical(value):
+    """配置值转为稳定的 JSON 口径（键排序在 json.dumps 里完成）。"""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(v) for v in value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return repr(value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return repr(value)
+
+
+def normalize_config(config):
+    """去掉不影响结果的键后的规范化配置 dict。"""
+    return {k: _canonical(v) for k, v in config.items() if k not in NON_RESULT_CONFIG_KEYS}
+
+
+def result_key(kind, dataset_hash, config, extra=None):
+    """缓存键：sha256(类型, 数据集指纹, 规范化配置, 引擎版本, 附加参数)。"""
+    from backtest import ENGINE_VERSION
+
+    payload = {
+        'kind': kind,
+        'dataset': dataset_hash,
+        'config': normalize_config(config),
+        'engine_version': ENGINE_VERSION,
+        'extra': _canonical(extra or {}),
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=True, separators=(',', ':'))
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """结果缓存库；一个实例持有一个 SQLite 连接。"""
+
+    def __init__(self, db_path=None, max_mb=None):
+        self.db_path = db_path or RESULT_CACHE_PATH
+        self.max_bytes = int((RESULT_CACHE_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._init_schema()
+
+    def close(self):
+        self.conn.close()
+
+    def _init_schema(self):
+        with self.conn:
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                label TEXT,
+                payload BLOB NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                compute_seconds REAL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+            self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_results_last_access ON results (last_access)
+            """)
+            self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS file_hashes (
+                path TEXT PRIMARY KEY,
+                file_size INTEGER NOT NULL,
+                file_mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL
+            )
+            """)
+
+    # ------------------------------------------------------------------
+    # 数据集指纹
+    # ------------------------------------------------------------------
+    def file_hash(self, path):
+        """文件内容 sha256；路径、大小与 mtime 都未变时直接用记忆值。"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.conn.execute(
+            "SELECT file_size, file_mtime_ns, sha256 FROM file_hashes WHERE path = ?", (path,)
+        ).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                digest.update(chunk)
+        sha = digest.hexdigest()
+        with self.conn:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO file_hashes (path, file_size, file_mtime_ns, sha256)
+            VALUES (?, ?, ?, ?)
+            """, (path, stat.st_size, stat.st_mtime_ns, sha))
+        return sha
+
+    def dataset_hash(self, config):
+        """与 backtest.load_price_data 同一数据来源的内容指纹。"""
+        symbol = config.get('dataset_symbol')
+        if symbol:
+            from dataset_registry import DatasetRegistry
+
+            registry = DatasetRegistry(config.get('dataset_db_path'))
+            try:
+                return 'registry:' + registry.backtest_fingerprint(
+                    str(symbol), config.get('start_date'), config.get('end_date')
+                )
+            finally:
+                registry.close()
+        return 'file:' + self.file_hash(config['data_path'])
+
+    # ------------------------------------------------------------------
+    # 读写与淘汰
+    # ------------------------------------------------------------------
+    def get(self, key):
+        """命中返回 (value, compute_seconds)，未命中返回 None。"""
+        row = self.conn.execute(
+            "SELECT payload, compute_seconds FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE results SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+        return pickle.loads(row[0]), row[1]
+
+    def contains(self, key):
+        return self.conn.execute("SELECT 1 FROM results WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, key, kind, value, label=None, compute_seconds=None):
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self.conn:
+            self.conn.execute("""
+            INSERT OR REPLACE INTO results (
+                key, kind, label, payload, size_bytes, compute_seconds, created_at, last_access, hits
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+            """, (key, kind, label, sqlite3.Binary(payload), len(payload), compute_seconds, now, now))
+        CACHE_STATS['stores'] += 1
+        self.evict()
+
+    def evict(self, max_bytes=None):
+        """按最近访问时间淘汰，直到总大小不超过上限；返回淘汰条数。"""
+        limit = self.max_bytes if max_bytes is None else int(max_bytes)
+        total = self.conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM results").fetchone()[0]
+        if total <= limit:
+            return 0
+        doomed = []
+        for key, size in self.conn.execute("SELECT key, size_bytes FROM results ORDER BY last_access"):
+            if total <= limit:
+                break
+            doomed.append((key,))
+            total -= size
+        with self.conn:
+            self.conn.executemany("DELETE FROM results WHERE key = ?", doomed)
+        CACHE_STATS['evictions'] += len(doomed)
+        return len(doomed)
+
+    def clear(self):
+        with self.conn:
+            self.conn.execute("DELETE FROM results")
+        self.conn.execute("VACUUM")
+
+    def summary(self):
+        """库内条目数 / 总大小 / 各类型条数与累计命中。"""
+        rows = self.conn.execute("""
+        SELECT kind, COUNT(*), COALESCE(SUM(size_bytes), 0), COALESCE(SUM(hits), 0)
+        FROM results GROUP BY kind ORDER BY kind
+        """).fetchall()
+        return {
+            'entries': sum(r[1] for r in rows),
+            'bytes': sum(r[2] for r in rows),
+            'max_bytes': self.max_bytes,
+            'by_kind': {r[0]: {'entries': r[1], 'bytes': r[2], 'hits': r[3]} for r in rows},
+        }
+
+
+def cache_stats():
+    """本进程内的命中 / 未命中 / 强制重算 / 写入 / 淘汰计数与命中节省的计算秒数。"""
+    stats = dict(CACHE_STATS)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    return stats
+
+
+def _stats_line():
+    s = cache_stats()
+    return (
+        f"命中 {s['hits']} / 未命中 {s['misses']} / 强制 {s['forced']}，"
+        f"累计节省 {s['seconds_saved']:.1f}s"
+    )
+
+
+def is_cached(kind, config, extra=None, db_path=None):
+    """是否已有缓存结果（不计入命中统计、不更新访问时间）；用于调度前判断是否需要准备数据。"""
+    cache = ResultCache(db_path)
+    try:
+        return cache.contains(result_key(kind, cache.dataset_hash(config), config, extra))
+    finally:
+        cache.close()
+
+
+def cached_call(kind, config, compute, *, extra=None, force=False, db_path=None, label=None):
+    """
+    以 (数据集指纹, 规范化配置, 引擎版本, extra) 为键缓存 compute() 的返回值。
+
+    force=True 时不读缓存、重算后覆盖写入。返回 compute() 的结果（命中时为缓存中的副本）。
+    """
+    cache = ResultCache(db_path, max_mb=config.get('result_cache_max_mb'))
+    try:
+        key = result_key(kind, cache.dataset_hash(config), config, extra)
+        now_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        if not force:
+            hit = cache.get(key)
+            if hit is not None:
+                value, compute_seconds = hit
+                CACHE_STATS['hits'] += 1
+                CACHE_STATS['seconds_saved'] += compute_seconds or 0.0
+                print(f"[{now_str}] 结果缓存命中 {kind} {key[:12]}（{_stats_line()}）")
+                return value
+            CACHE_STATS['misses'] += 1
+        else:
+            CACHE_STATS['forced'] += 1
+        t0 = time.perf_counter()
+        value = compute()
+        elapsed = time.perf_counter() - t0
+        if value is not None:
+            cache.put(key, kind, value, label=label, compute_seconds=elapsed)
+            print(f"[{now_str}] 结果已缓存 {kind} {key[:12]} 计算 {elapsed:.1f}s（{_stats_line()}）")
+        return value
+    finally:
+        cache.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="回测结果缓存管理")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--db", default=None, help=f"缓存库路径（默认 {RESULT_CACHE_PATH}）")
+    parser.add_argument("--max-mb", type=float, default=None, help="evict 的容量上限（MB）")
+    args = parser.parse_args()
+
+    cache = ResultCache(args.db, max_mb=args.max_mb)
+    try:
+        if args.command == "stats":
+            s = cache.summary()
+            print(f"{cache.db_path}: {s['entries']} 条, {s['bytes'] / 1024 / 1024:.1f} MB"
+                  f" / 上限 {s['max_bytes'] / 1024 / 1024:.0f} MB")
+            for kind, v in s['by_kind'].items():
+                print(f"  {kind:<12} {v['entries']:>6} 条 {v['bytes'] / 1024 / 1024:>8.1f} MB  累计命中 {v['hits']}")
+        elif args.command == "evict":
+            print(f"淘汰 {cache.evict()} 条")
+        else:
+            cache.clear()
+            print("已清空")
+    finally:
+        cache.close()
+
+
+if __name__ == "__main__":
+    main()
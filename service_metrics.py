@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+行情服务运行指标：计数器、仪表值与按操作的耗时直方图。
+
+服务进程内用全局 METRICS 记录:
+  market_data_api_seconds{op}              Longport 接口耗时（直方图）
+  market_data_api_calls_total{op,status}   接口调用次数（ok / error）
+  market_data_db_commit_seconds            写事务提交耗时（直方图）
+  market_data_rows_written_total{table,symbol}
+  market_data_bar_lag_seconds{symbol}      最新 K 线收盘 → 落库的延迟（仪表）
+  market_data_heartbeat_unixtime           最近一次写心跳的时间（仪表）
+  market_data_task_seconds{task} / market_data_task_failures_total{task}（async 引擎）
+
+定期快照到 market_data_cache.db 的 service_metrics 表（跨进程看板读取），并导出
+Prometheus 文本格式: 写文件（MARKET_DATA_METRICS_FILE，供 node_exporter textfile 采集）
+和/或本地 HTTP（MARKET_DATA_METRICS_PORT，GET /metrics）。
+
+看板:
+  python service_metrics.py dashboard                 # 每 2 秒刷新
+  python service_metrics.py dashboard --once
+  python service_metrics.py prom                      # 从库里的快照打印 Prometheus 文本
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+# 直方图桶上界（秒），覆盖本地写库的毫秒级到慢接口的十秒级
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS_FILE = os.environ.get("MARKET_DATA_METRICS_FILE", "market_data_metrics.prom")
+METRICS_PORT = int(os.environ.get("MARKET_DATA_METRICS_PORT", "0"))
+METRICS_FLUSH_SECONDS = int(os.environ.get("MARKET_DATA_METRICS_FLUSH_SECONDS", "15"))
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(label_key, extra=()):
+    items = list(label_key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, upper in enumerate(self.buckets):
+            if value <= upper:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+
+def histogram_quantile(q, buckets, counts):
+    """按桶内线性插值估计分位数（与 Prometheus histogram_quantile 同口径）；无样本返回 nan。"""
+    total = sum(counts)
+    if total == 0:
+        return math.nan
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for i, n in enumerate(counts):
+        upper = buckets[i] if i < len(buckets) else buckets[-1]
+        if cumulative + n >= rank and n > 0:
+            if i >= len(buckets):
+                return buckets[-1]
+            return lower + (upper - lower) * (rank - cumulative) / n
+        cumulative += n
+        lower = upper
+    return buckets[-1]
+
+
+class MetricsRegistry:
+    """线程安全的进程内指标（服务主循环、async 任务线程、推送回调线程共用）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        with self._lock:
+            self.gauges[(name, _label_key(labels))] = float(value)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(seconds)
+
+    def timed(self, name, counter=None, **labels):
+        """计时上下文：记录耗时直方图；给了 counter 时再按 status=ok/error 计数（异常照常抛出）。"""
+        return _Timer(self, name, counter, labels)
+
+    def render_prometheus(self):
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: (h.buckets, list(h.counts), h.count, h.sum) for k, h in self.histograms.items()}
+        return render_prometheus(counters, gauges, histograms)
+
+    def snapshot_rows(self):
+        """service_metrics 表行: (name, labels_json, kind, value, count, sum, buckets_json, updated_at)。"""
+        now_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = []
+        with self._lock:
+            for (name, key), value in self.counters.items():
+                rows.append((name, json.dumps(dict(key)), "counter", float(value), None, None, None, now_str))
+            for (name, key), value in self.gauges.items():
+                rows.append((name, json.dumps(dict(key)), "gauge", value, None, None, None, now_str))
+            for (name, key), h in self.histograms.items():
+                buckets = json.dumps({"le": list(h.buckets), "counts": h.counts})
+                rows.append((name, json.dumps(dict(key)), "histogram", None, h.count, h.sum, buckets, now_str))
+        return rows
+
+
+class _Timer:
+    def __init__(self, registry, name, counter, labels):
+        self.registry = registry
+        self.name = name
+        self.counter = counter
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.name, time.perf_counter() - self.started, **self.labels)
+        if self.counter:
+            self.registry.inc(self.counter, status="error" if exc_type else "ok", **self.labels)
+        return False
+
+
+def render_prometheus(counters, gauges, histograms):
+    lines = []
+    seen = set()
+
+    def type_line(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, key), value in sorted(counters.items()):
+        type_line(name, "counter")
+        lines.append(f"{name}{_format_labels(key)} {value:g}")
+    for (name, key), value in sorted(gauges.items()):
+        type_line(name, "gauge")
+        lines.append(f"{name}{_format_labels(key)} {value:g}")
+    for (name, key), (buckets, counts, count, total) in sorted(histograms.items()):
+        type_line(name, "histogram")
+        cumulative = 0
+        for upper, n in zip(list(buckets) + ["+Inf"], counts):
+            cumulative += n
+            le = upper if upper == "+Inf" else f"{upper:g}"
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(key)} {total:g}")
+        lines.append(f"{name}_count{_format_labels(key)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_file(text, path=METRICS_FILE):
+    """先写临时文件再 rename，采集端不会读到半个文件。"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def start_http_server(registry, port=METRICS_PORT, host="127.0.0.1"):
+    """本地 HTTP 暴露 /metrics（守护线程）；port 为 0 时不启动。"""
+    if not port:
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") not in ("", "/metrics"):
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+METRICS = MetricsRegistry()
+
+
+# ----------------------------------------------------------------------
+# 看板（读 service_metrics 快照，与服务进程解耦）
+# ----------------------------------------------------------------------
+def load_snapshot(conn):
+    counters, gauges, histograms = {}, {}, {}
+    updated_at = None
+    for name, labels, kind, value, count, total, buckets, row_updated in conn.execute(
+        "SELECT name, labels, kind, value, count, sum, buckets, updated_at FROM service_metrics"
+    ):
+        key = _label_key(json.loads(labels))
+        updated_at = max(updated_at or row_updated, row_updated)
+        if kind == "counter":
+            counters[(name, key)] = value
+        elif kind == "gauge":
+            gauges[(name, key)] = value
+        else:
+            b = json.loads(buckets)
+            histograms[(name, key)] = (tuple(b["le"]), b["counts"], count, total)
+    return counters, gauges, histograms, updated_at
+
+
+def render_dashboard(snapshot, previous=None, heartbeat_at=None):
+    counters, gauges, histograms, updated_at = snapshot
+    lines = [f"行情服务指标  快照时间 {updated_at or '-'}  心跳 {heartbeat_at or '-'}", ""]
+    lines.append(f"{'操作':<34}{'次数':>8}{'错误':>7}{'错误率':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'区间次数':>9}")
+    for (name, key), (buckets, counts, count, _) in sorted(histograms.items()):
+        labels = dict(key)
+        op = labels.get("op") or labels.get("task") or ""
+        errors = 0
+        if name == "market_data_api_seconds":
+            errors = counters.get(("market_data_api_calls_total", _label_key({"op": op, "status": "error"})), 0)
+        elif name == "market_data_task_seconds":
+            errors = counters.get(("market_data_task_failures_total", _label_key({"task": op})), 0)
+        delta = ""
+        if previous is not None and (name, key) in previous[2]:
+            delta = count - previous[2][(name, key)][2]
+        label = f"{name.replace('market_data_', '').replace('_seconds', '')} {op}".strip()
+        p = [histogram_quantile(q, buckets, counts) * 1000 for q in (0.5, 0.95, 0.99)]
+        lines.append(
+            f"{label:<34}{count:>8}{int(errors):>7}{(errors / count if count else 0):>8.1%}"
+            f"{p[0]:>9.1f}{p[1]:>9.1f}{p[2]:>9.1f}{str(delta):>9}"
+        )
+    lines.append("")
+    for (name, key), value in sorted(gauges.items()):
+        if name == "market_data_heartbeat_unixtime":
+            lines.append(f"心跳距今 {time.time() - value:.1f}s")
+        else:
+            lines.append(f"{name}{_format_labels(key)} = {value:.2f}")
+    rows_written = {k: v for k, v in counters.items() if k[0] == "market_data_rows_written_total"}
+    if rows_written:
+        lines.append("写入行数: " + ", ".join(f"{dict(k[1]).get('table')}/{dict(k[1]).get('symbol')} {int(v)}" for k, v in sorted(rows_written.items())))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="行情服务指标看板")
+    parser.add_argument("cmd", choices=["dashboard", "prom"])
+    parser.add_argument("--db", default=None, help="数据库路径（默认与行情服务相同: MARKET_DATA_DB_PATH 或 Common Files 下的 market_data_cache.db）")
+    parser.add_argument("--interval", type=float, default=2.0)
+    parser.add_argument("--once", action="store_true")
+    args = parser.parse_args()
+
+    from market_data_client import get_market_data_db_path, market_data_connection
+
+    db_path = args.db or get_market_data_db_path()
+    if not os.path.isfile(db_path):
+        print(f"行情缓存数据库不存在: {os.path.abspath(db_path)}")
+        sys.exit(1)
+    if args.cmd == "prom":
+        counters, gauges, histograms, _ = load_snapshot(market_data_connection(db_path))
+        print(render_prometheus(counters, gauges, histograms), end="")
+        return
+    previous = None
+    while True:
+        conn = market_data_connection(db_path)
+        snapshot = load_snapshot(conn)
+        row = conn.execute("SELECT value FROM service_state WHERE key = 'last_success_at'").fetchone()
+        text = render_dashboard(snapshot, previous, row[0] if row else None)
+        if args.once:
+            print(text)
+            return
+        print("\033[2J\033[H" + text, flush=True)
+        previous = snapshot
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,6 @@ from datetime import datetime, time, timedelta, date as date_type
 import time as time_module
 import os
 import sys
-import sqlite3
 import platform
 import pytz
 from math import floor
@@ -20,6 +19,7 @@ from functools import wraps
 
 from longport.openapi import Config, TradeContext, OrderSide, OrderType, TimeInForceType, OutsideRTH
 
+from market_data_client import ChangeSeqCache, ReplayClock, market_data_connection, read_lookback_missing_days
 from trend_er5_gate import history_days_back, apply_entry_gates_to_signal
 from k_side_adjust import effective_k1_for_time, format_k_strategy_params
 
@@ -65,6 +65,12 @@ def get_market_data_db_path():
 
 MARKET_DATA_DB_PATH = get_market_data_db_path()
 MARKET_DATA_MAX_AGE_SECONDS = int(os.environ.get('MARKET_DATA_MAX_AGE_SECONDS', '120'))
+# 按服务端变更序号缓存上次读取结果：K 线/报价没变时不重复查库和解析
+MARKET_DATA_READ_CACHE = ChangeSeqCache()
+# 接 market_data_replay.py 回放库时设 MARKET_DATA_REPLAY_CLOCK=1：当前时间与 sleep 跟随回放的虚拟时钟
+MARKET_DATA_REPLAY_CLOCK = ReplayClock(MARKET_DATA_DB_PATH) if os.environ.get('MARKET_DATA_REPLAY_CLOCK') == '1' else None
+if MARKET_DATA_REPLAY_CLOCK is not None:
+    time_module = MARKET_DATA_REPLAY_CLOCK.time_module()
 
 # 调试模式配置
 DEBUG_MODE = False   # 设置为True开启调试模式
@@ -103,6 +109,10 @@ def api_retry(max_retries=3, retry_delay=2):
     return decorator
 
 def get_us_eastern_time():
+    if MARKET_DATA_REPLAY_CLOCK is not None:
+        replay_now = MARKET_DATA_REPLAY_CLOCK.now()
+        if replay_now is not None:
+            return replay_now
     # 正常模式返回当前时间
     eastern = pytz.timezone('US/Eastern')
     return datetime.now(eastern)
@@ -130,12 +140,11 @@ def ensure_market_data_service_available():
         print("请先启动 longport_data_service.py")
         return False
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
         row = conn.execute("""
         SELECT value FROM service_state
         WHERE key = 'last_success_at'
         """).fetchone()
-        conn.close()
     except Exception as e:
         print(f"错误: 无法读取行情服务心跳: {str(e)}")
         return False
@@ -150,6 +159,14 @@ def ensure_market_data_service_available():
     if age_seconds > MARKET_DATA_MAX_AGE_SECONDS:
         print(f"错误: 行情缓存过旧，最近成功更新: {row[0]}，距今 {age_seconds:.0f} 秒")
         return False
+    try:
+        missing_days = read_lookback_missing_days(conn)
+    except Exception as e:
+        print(f"错误: 无法读取行情服务回看完整度: {str(e)}")
+        return False
+    if missing_days:
+        print(f"错误: 行情服务回看窗口尚缺 {missing_days} 个交易日，回补完成前不交易")
+        return False
     return True
 
 
@@ -228,14 +245,17 @@ def get_historical_data(symbol, days_back=None):
         return pd.DataFrame()
 
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
+        cache_key = (start_date, current_date)
+        seq, cached = MARKET_DATA_READ_CACHE.lookup(conn, "candles", symbol, cache_key)
+        if cached is not None:
+            return cached.copy()
         rows = conn.execute("""
         SELECT datetime_et, open, high, low, close, volume, turnover
         FROM candles
         WHERE symbol = ? AND date >= ? AND date <= ?
         ORDER BY datetime_et ASC
         """, (symbol, start_date.isoformat(), current_date.isoformat())).fetchall()
-        conn.close()
     except Exception as e:
         print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 读取行情缓存失败: {e}")
         return pd.DataFrame()
@@ -266,26 +286,29 @@ def get_historical_data(symbol, days_back=None):
     df = df[df["Date"] <= current_date]
     weekday_mask = df["Date"].apply(lambda x: x.weekday() < 5 if isinstance(x, date_type) else True)
     df = df[weekday_mask]
-    return df
+    MARKET_DATA_READ_CACHE.store(conn, "candles", symbol, cache_key, seq, df)
+    return df.copy()
 
 
 def get_quote(symbol):
     if not ensure_market_data_service_available():
         return {}
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
+        seq, cached = MARKET_DATA_READ_CACHE.lookup(conn, "quotes", symbol, None)
+        if cached is not None:
+            return dict(cached)
         row = conn.execute("""
         SELECT symbol, last_done, open, high, low, volume, turnover, quote_timestamp
         FROM quotes
         WHERE symbol = ?
         """, (symbol,)).fetchone()
-        conn.close()
     except Exception as e:
         print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 读取报价缓存失败: {e}")
         return {}
     if row is None:
         return {}
-    return {
+    quote = {
         "symbol": row[0],
         "last_done": row[1],
         "open": row[2],
@@ -295,6 +318,8 @@ def get_quote(symbol):
         "turnover": row[6],
         "timestamp": row[7],
     }
+    MARKET_DATA_READ_CACHE.store(conn, "quotes", symbol, None, seq, quote)
+    return dict(quote)
 
 
 def calculate_vwap(df):
@@ -658,12 +683,11 @@ def is_trading_day(symbol=None):
     if not ensure_market_data_service_available():
         return False, False, True
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
         rows = conn.execute("""
         SELECT key, value FROM service_state
         WHERE key IN ('calendar_date', 'is_trading_day', 'is_half_trading_day')
         """).fetchall()
-        conn.close()
     except Exception as e:
         print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 读取交易日历缓存失败: {e}")
         return False, False, True
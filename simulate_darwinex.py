@@ -14,6 +14,7 @@ import platform
 
 from longport.openapi import OutsideRTH
 
+from market_data_client import ChangeSeqCache, ReplayClock, market_data_connection, read_lookback_missing_days
 from trend_er5_gate import history_days_back, apply_entry_gates_to_signal
 from k_side_adjust import effective_k1_for_time, format_k_strategy_params
 
@@ -195,6 +196,12 @@ def get_market_data_db_path():
 
 MARKET_DATA_DB_PATH = get_market_data_db_path()
 MARKET_DATA_MAX_AGE_SECONDS = int(os.environ.get('MARKET_DATA_MAX_AGE_SECONDS', '120'))
+# 按服务端变更序号缓存上次读取结果：K 线/报价没变时不重复查库和解析
+MARKET_DATA_READ_CACHE = ChangeSeqCache()
+# 接 market_data_replay.py 回放库时设 MARKET_DATA_REPLAY_CLOCK=1：当前时间与 sleep 跟随回放的虚拟时钟
+MARKET_DATA_REPLAY_CLOCK = ReplayClock(MARKET_DATA_DB_PATH) if os.environ.get('MARKET_DATA_REPLAY_CLOCK') == '1' else None
+if MARKET_DATA_REPLAY_CLOCK is not None:
+    time_module = MARKET_DATA_REPLAY_CLOCK.time_module()
 
 
 def parse_cache_timestamp(value):
@@ -221,12 +228,11 @@ def ensure_market_data_service_available():
         return False
 
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
         row = conn.execute("""
         SELECT value FROM service_state
         WHERE key = 'last_success_at'
         """).fetchone()
-        conn.close()
     except Exception as e:
         print(f"错误: 无法读取行情服务心跳: {str(e)}")
         return False
@@ -244,6 +250,14 @@ def ensure_market_data_service_available():
     if age_seconds > MARKET_DATA_MAX_AGE_SECONDS:
         print(f"错误: 行情缓存过旧，最近成功更新时间: {row[0]}，距今 {age_seconds:.0f} 秒")
         return False
+    try:
+        missing_days = read_lookback_missing_days(conn)
+    except Exception as e:
+        print(f"错误: 无法读取行情服务回看完整度: {str(e)}")
+        return False
+    if missing_days:
+        print(f"错误: 行情服务回看窗口尚缺 {missing_days} 个交易日，回补完成前不交易")
+        return False
 
     if LOG_VERBOSE:
         print(f"行情缓存服务可用: {os.path.abspath(MARKET_DATA_DB_PATH)}，最近更新 {age_seconds:.0f} 秒前")
@@ -309,6 +323,11 @@ def get_us_eastern_time():
         except ValueError:
             print(f"错误的调试时间格式: {DEBUG_TIME}，应为 'YYYY-MM-DD HH:MM:SS'")
     
+    if MARKET_DATA_REPLAY_CLOCK is not None:
+        replay_now = MARKET_DATA_REPLAY_CLOCK.now()
+        if replay_now is not None:
+            return replay_now
+
     # 正常模式或调试时间格式错误时返回当前时间
     eastern = pytz.timezone('US/Eastern')
     return datetime.now(eastern)
@@ -367,7 +386,11 @@ def get_historical_data(symbol, days_back=None):
         print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 从本地行情缓存读取历史数据: {symbol}")
 
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
+        cache_key = (start_date, current_date)
+        seq, cached = MARKET_DATA_READ_CACHE.lookup(conn, "candles", symbol, cache_key)
+        if cached is not None:
+            return cached.copy()
         query = """
         SELECT datetime_et, open, high, low, close, volume, turnover
         FROM candles
@@ -375,7 +398,6 @@ def get_historical_data(symbol, days_back=None):
         ORDER BY datetime_et ASC
         """
         rows = conn.execute(query, (symbol, start_date.isoformat(), current_date.isoformat())).fetchall()
-        conn.close()
     except Exception as e:
         print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 读取行情缓存失败: {str(e)}")
         return pd.DataFrame()
@@ -414,20 +436,23 @@ def get_historical_data(symbol, days_back=None):
         latest_row = df.sort_values(by=["Date", "Time"]).iloc[-1]
         print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 缓存数据日期: {unique_dates}, 最新K线: {latest_row['Date']} {latest_row['Time']}")
 
-    return df
+    MARKET_DATA_READ_CACHE.store(conn, "candles", symbol, cache_key, seq, df)
+    return df.copy()
 
 def get_quote(symbol):
     if not ensure_market_data_service_available():
         return {}
 
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
+        seq, cached = MARKET_DATA_READ_CACHE.lookup(conn, "quotes", symbol, None)
+        if cached is not None:
+            return dict(cached)
         row = conn.execute("""
         SELECT symbol, last_done, open, high, low, volume, turnover, quote_timestamp
         FROM quotes
         WHERE symbol = ?
         """, (symbol,)).fetchone()
-        conn.close()
     except Exception as e:
         print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 读取报价缓存失败: {str(e)}")
         return {}
@@ -436,7 +461,7 @@ def get_quote(symbol):
         print(f"[{get_us_eastern_time().strftime('%Y-%m-%d %H:%M:%S')}] 报价缓存为空: {symbol}")
         return {}
 
-    return {
+    quote = {
         "symbol": row[0],
         "last_done": row[1],
         "open": row[2],
@@ -446,6 +471,8 @@ def get_quote(symbol):
         "turnover": row[6],
         "timestamp": row[7],
     }
+    MARKET_DATA_READ_CACHE.store(conn, "quotes", symbol, None, seq, quote)
+    return dict(quote)
 
 def calculate_vwap(df):
     # 创建一个结果DataFrame的副本
@@ -824,12 +851,11 @@ def is_trading_day(symbol=None):
     now_et = get_us_eastern_time()
     current_date = now_et.date()
     try:
-        conn = sqlite3.connect(MARKET_DATA_DB_PATH)
+        conn = market_data_connection(MARKET_DATA_DB_PATH)
         rows = conn.execute("""
         SELECT key, value FROM service_state
         WHERE key IN ('calendar_date', 'is_trading_day', 'is_half_trading_day', 'prev_trading_day_is_half')
         """).fetchall()
-        conn.close()
     except Exception as e:
         print(f"[{now_et.strftime('%Y-%m-%d %H:%M:%S')}] 读取交易日历缓存失败: {str(e)}")
         return False, True
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""消费者 / 服务固定查询的全表扫描回归检查（market_data_maintenance.check_query_plans）。"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from market_data_client import init_schema, open_writer_connection
+from market_data_maintenance import check_query_plans
+
+
+def test_fixed_queries_use_indexes(tmp_path):
+    conn = open_writer_connection(str(tmp_path / "market_data_cache.db"))
+    try:
+        init_schema(conn)
+        assert check_query_plans(conn, verbose=False) == []
+    finally:
+        conn.close()
@@ -2,9 +2,14 @@
 与 Quantra/backtest.py 中 trend_er5（Kaufman 5 日效率比）及 entry_trend_filter 门控一致。
 供各 simulate_*.py 共用，避免重复粘贴。
 """
+import os
+from datetime import timedelta
+
 import numpy as np
 import pandas as pd
 
+from feature_store import FeatureStore, aggregate_daily_bars, compute_next_session_features
+
 ENABLE_ENTRY_TREND_FILTER = True
 ENTRY_TREND_ER5_MIN = 0.1
 # 昨日振幅上限门控（与 Quantra/backtest.py entry_trend_filter range1 一致）
@@ -14,6 +19,15 @@ ENTRY_TREND_RANGE1_MAX = 0.029
 ENABLE_SIGMA_FILTER = True
 ENTRY_TREND_SIGMA_MIN = 0.0003
 MINUTE_HISTORY_CALENDAR_DAYS_FOR_ER5 = 20
+# 趋势特征走持久化特征库（feature_store，与回测 feature_store_path 同一实现）；0 则每次从分钟数据现算
+ENABLE_FEATURE_STORE = os.environ.get("ENABLE_FEATURE_STORE", "1") == "1"
+# 实盘特征在库中的键（行情服务品种代码）。回测按 backtest.feature_store_symbol 另存一份，两边不共用行
+FEATURE_STORE_SYMBOL = os.environ.get("SYMBOL", "QQQ.US")
+_feature_store = None
+_feature_store_warned = False
+# 当日特征缓存：键为 (品种, 当日, 已完成日分钟行数, 收盘/最高/最低价合计)，已完成交易日的分钟数据不变时
+# 同一交易日的每次门控检查（er5 / range1 各读一次）不再重复聚合与查库；数据商修正会改变键
+_latest_features = {}
 
 
 def history_days_back(lookback_days: int) -> int:
@@ -24,49 +38,66 @@ def history_days_back(lookback_days: int) -> int:
     return b
 
 
+def _get_feature_store():
+    global _feature_store
+    if _feature_store is None:
+        _feature_store = FeatureStore()
+    return _feature_store
+
+
+def latest_trend_features(minute_df):
+    """
+    当日开盘前可知的趋势特征 dict（trend_er5 / trend_range1 / ...），最后一行日期视为当日。
+
+    启用特征库时：先用分钟数据增量写入已完成交易日（每个交易日只聚合一次），
+    再按 (FEATURE_STORE_SYMBOL, 当日) 查询；与回测是同一套计算代码，但回测的特征存在
+    backtest.feature_store_symbol 键下，不读这里写的行。特征库不可用时退回内存计算。
+    已完成交易日的分钟数据没变时直接返回本交易日缓存的结果。
+    """
+    global _feature_store_warned
+    if minute_df is None or minute_df.empty:
+        return {}
+    today = minute_df['Date'].max()
+    completed = minute_df['Date'].to_numpy() < today
+    sums = minute_df[['Close', 'High', 'Low']].to_numpy(dtype=float)[completed].sum(axis=0)
+    cache_key = (FEATURE_STORE_SYMBOL, today, int(completed.sum())) + tuple(float(v) for v in sums)
+    cached = _latest_features.get(cache_key)
+    if cached is not None:
+        return cached
+    feats = None
+    if ENABLE_FEATURE_STORE:
+        try:
+            store = _get_feature_store()
+            store.update_from_minutes(
+                FEATURE_STORE_SYMBOL, minute_df, completed_through=today - timedelta(days=1)
+            )
+            feats = store.features_as_of(FEATURE_STORE_SYMBOL, today)
+        except Exception as e:
+            if not _feature_store_warned:
+                print(f"⚠️ 特征库不可用，改为内存计算趋势特征: {e}")
+                _feature_store_warned = True
+    if feats is None:
+        bars = aggregate_daily_bars(minute_df[completed])
+        feats = compute_next_session_features(bars).iloc[-1].to_dict() if not bars.empty else {}
+    # 只保留当前交易日的结果
+    _latest_features.clear()
+    _latest_features[cache_key] = feats
+    return feats
+
+
 def compute_trend_er5_latest(minute_df):
     """与 backtest.compute_daily_trend_features 中 trend_er5 一致；nan 表示不拦截。"""
-    if minute_df is None or minute_df.empty:
-        return np.nan
-    if 'Volume' in minute_df.columns:
-        d = minute_df.groupby('Date', as_index=False).agg(
-            Close=('Close', 'last'),
-            High=('High', 'max'),
-            Low=('Low', 'min'),
-            DayVol=('Volume', 'sum'),
-        )
-    else:
-        d = minute_df.groupby('Date', as_index=False).agg(
-            Close=('Close', 'last'),
-            High=('High', 'max'),
-            Low=('Low', 'min'),
-        )
-    d = d.sort_values('Date').reset_index(drop=True)
-    c = d['Close']
-    abs_diff = c.diff().abs()
-    den = abs_diff.shift(1).rolling(5, min_periods=5).sum()
-    num = (c.shift(1) - c.shift(6)).abs()
-    d['trend_er5'] = (num / den.replace(0, np.nan)).where(den.notna() & (den > 0))
-    v = d.iloc[-1]['trend_er5']
+    v = latest_trend_features(minute_df).get('trend_er5', np.nan)
     return float(v) if pd.notna(v) else np.nan
 
 
 def compute_trend_range1_latest(minute_df):
     """
     与 backtest.compute_daily_trend_features 中 trend_range1 一致：
-    昨日 (日内最高-日内最低)/日收盘。最后一行日期视为当日，shift(1) 取昨日整日数据。
+    昨日 (日内最高-日内最低)/日收盘。最后一行日期视为当日。
     nan 表示不拦截。
     """
-    if minute_df is None or minute_df.empty:
-        return np.nan
-    d = minute_df.groupby('Date', as_index=False).agg(
-        Close=('Close', 'last'),
-        High=('High', 'max'),
-        Low=('Low', 'min'),
-    )
-    d = d.sort_values('Date').reset_index(drop=True)
-    rng = (d['High'] - d['Low']) / d['Close'].replace(0, np.nan)
-    v = rng.shift(1).iloc[-1]
+    v = latest_trend_features(minute_df).get('trend_range1', np.nan)
     return float(v) if pd.notna(v) else np.nan
 
 
@@ -0,0 +1,228 @@
+"""
+两阶段日模拟：并行的单位仓位模拟 + 顺序复利缩放。
+
+逐日顺序模拟只是因为 position_size = floor(资金 × 杠杆 / 日开盘) 依赖昨日资金；
+信号与成交本身与股数无关（唯一例外是日内止损，其限额依赖日初资金）。因此：
+
+阶段一（可多进程）：每个交易日以 1 股、关闭手续费与日内止损运行 simulate_day，
+    记录成交（含滑点的每股成交价）与权益标记轨迹 mark_trace（持仓 K 的 High/Low、平仓事件）。
+阶段二（顺序、向量化）：按当日股数与日初资金缩放：
+    单笔盈亏 = 股数 × 每股盈亏 − 往返手续费；沿轨迹重算日内峰值、峰谷回撤、最高/最低权益，
+    并按与 simulate_day 相同的比较判断日内止损是否会触发——只有会触发的交易日才用真实股数
+    重新完整模拟。浮点运算顺序与 simulate_day 一致，结果与逐日顺序回测逐位相同。
+
+run_backtest 中通过 config['parallel_workers'] 启用（>=1；1 为单进程两阶段）。
+"""
+
+from __future__ import annotations
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from backtest import TRACE_CLOSE, TRACE_MARK, simulate_day
+
+UNIT_POSITION_SIZE = 1
+# 每个进程任务包含的交易日数（太小则序列化开销占比高）
+UNIT_CHUNK_DAYS = 20
+
+
+@dataclass
+class UnitDay:
+    """单个交易日的单位仓位模拟结果。"""
+    trades: list
+    kind: np.ndarray = field(repr=False)
+    side: np.ndarray = field(repr=False)
+    entry: np.ndarray = field(repr=False)
+    high: np.ndarray = field(repr=False)
+    low: np.ndarray = field(repr=False)
+    n_closed: np.ndarray = field(repr=False)
+
+    @classmethod
+    def from_trace(cls, trades, trace):
+        if trace:
+            kind, side, entry, high, low, n_closed = zip(*trace)
+        else:
+            kind = side = entry = high = low = n_closed = ()
+        return cls(
+            trades=trades,
+            kind=np.asarray(kind, dtype=np.int8),
+            side=np.asarray(side, dtype=np.int8),
+            entry=np.asarray(entry, dtype=float),
+            high=np.asarray(high, dtype=float),
+            low=np.asarray(low, dtype=float),
+            n_closed=np.asarray(n_closed, dtype=np.int64),
+        )
+
+
+def unit_config(config):
+    """阶段一配置：关闭手续费、日内止损与逐笔打印（三者都不影响单位仓位下的成交）。"""
+    cfg = dict(config)
+    cfg.update({
+        'enable_transaction_fees': False,
+        'enable_intraday_stop_loss': False,
+        'print_trade_details': False,
+    })
+    return cfg
+
+
+def simulate_unit_day(day_df, prev_close, allowed_times, config):
+    """单个交易日的单位仓位模拟（config 为该腿的完整配置，内部套 unit_config）。"""
+    trace = []
+    result = simulate_day(
+        day_df, prev_close, allowed_times, UNIT_POSITION_SIZE, unit_config(config),
+        config.get('initial_capital', 100000), mark_trace=trace,
+    )
+    return UnitDay.from_trace(result[0], trace)
+
+
+# 不影响单位仓位成交的配置键（资金、日内止损限额、手续费）；其余键相同的两条腿可共用单位结果
+UNIT_NEUTRAL_KEYS = (
+    'initial_capital',
+    'max_daily_loss_amount',
+    'intraday_stop_loss_mode',
+    'intraday_stop_loss_pct',
+    'transaction_fee_per_share',
+    'min_round_trip_fee',
+)
+
+
+class DayUnits:
+    """
+    单日单位仓位结果的按需缓存：逐日循环里多条腿（FTMO / IBKR ...）共用同一个 day_df，
+    成交相关配置（滑点、信号参数）相同的腿只模拟一次。
+    """
+
+    def __init__(self, day_df, prev_close, allowed_times):
+        self.day_df = day_df
+        self.prev_close = prev_close
+        self.allowed_times = allowed_times
+        self._units = {}
+
+    def get(self, config):
+        cfg = unit_config(config)
+        key = tuple(sorted((k, repr(v)) for k, v in cfg.items() if k not in UNIT_NEUTRAL_KEYS))
+        unit = self._units.get(key)
+        if unit is None:
+            unit = self._units[key] = simulate_unit_day(self.day_df, self.prev_close, self.allowed_times, config)
+        return unit
+
+    def simulate(self, position_size, day_start_capital, config):
+        """与 simulate_day 同返回值：先按单位结果缩放，日内止损会触发时用真实股数完整重算。"""
+        result = scale_unit_day(self.get(config), position_size, day_start_capital, config)
+        if result is None:
+            result = simulate_day(
+                self.day_df, self.prev_close, self.allowed_times, position_size, config, day_start_capital
+            )
+        return result
+
+
+def _simulate_unit_chunk(args):
+    matrix, allowed_times, config = args
+    out = []
+    for i in range(matrix.n_days):
+        day_df = matrix.day_frame(i)
+        if day_df.empty:
+            out.append(None)
+            continue
+        prev_close = day_df['prev_close'].iloc[0]
+        prev_close = None if np.isnan(prev_close) else prev_close
+        out.append(simulate_unit_day(day_df, prev_close, allowed_times, config))
+    return out
+
+
+def simulate_unit_days(matrix, allowed_times, config, workers=None):
+    """
+    阶段一：对 DayMatrix 的每个交易日做单位仓位模拟，返回与 matrix.dates 对齐的 UnitDay 列表。
+    workers<=1 时在当前进程内运行。
+    """
+    workers = int(workers or 1)
+    bounds = list(range(0, matrix.n_days, UNIT_CHUNK_DAYS)) + [matrix.n_days]
+    chunks = []
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        keep = np.zeros(matrix.n_days, dtype=bool)
+        keep[a:b] = True
+        chunks.append((matrix.select_days(keep), allowed_times, config))
+    if workers <= 1 or len(chunks) <= 1:
+        results = [_simulate_unit_chunk(c) for c in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks), os.cpu_count() or 1)) as pool:
+            results = list(pool.map(_simulate_unit_chunk, chunks))
+    return [u for chunk in results for u in chunk]
+
+
+def _round_trip_fee(position_size, config):
+    if not config.get('enable_transaction_fees', True):
+        return 0
+    return max(
+        position_size * config.get('transaction_fee_per_share', 0.01) * 2,
+        config.get('min_round_trip_fee', 2.16),
+    )
+
+
+def scale_unit_day(unit, position_size, day_start_capital, config):
+    """
+    阶段二：把单位仓位结果缩放到 position_size 股、日初资金 day_start_capital。
+
+    返回与 simulate_day 相同的五元组；若该日在真实股数下日内止损会触发，返回 None（调用方应完整重算）。
+    """
+    fee = _round_trip_fee(position_size, config)
+    trades = []
+    realized = [0]
+    day_pnl = 0
+    for t in unit.trades:
+        if t['side'] == 'Long':
+            pnl = position_size * (t['exit_price'] - t['entry_price']) - fee
+        else:
+            pnl = position_size * (t['entry_price'] - t['exit_price']) - fee
+        trades.append({**t, 'pnl': pnl, 'position_size': position_size, 'transaction_fees': fee})
+        day_pnl += pnl
+        realized.append(day_pnl)
+    realized = np.asarray(realized, dtype=float)
+
+    start = day_start_capital
+    base = start + realized[unit.n_closed]
+    is_mark = unit.kind == TRACE_MARK
+    is_close = unit.kind == TRACE_CLOSE
+    is_long = unit.side == 1
+    best_u = np.where(is_long, position_size * (unit.high - unit.entry), position_size * (unit.entry - unit.low))
+    worst_u = np.where(is_long, position_size * (unit.low - unit.entry), position_size * (unit.entry - unit.high))
+    best = np.where(is_mark, base + best_u, base)
+    worst = np.where(is_mark, base + worst_u, base)
+    # 平仓事件的权益按 float(日初) + float(已实现) 计，与 _after_trade_close_add_realized 一致
+    peak = np.maximum.accumulate(np.concatenate([[start], best]))[1:] if len(best) else best
+
+    if config.get('enable_intraday_stop_loss', False):
+        max_loss_cfg = config.get('max_daily_loss_amount')
+        if max_loss_cfg is not None:
+            m = float(max_loss_cfg)
+        else:
+            m = float(config.get('intraday_stop_loss_pct', 0.04)) * float(start)
+        if m > 0 and len(best):
+            mode = str(config.get('intraday_stop_loss_mode', 'both')).lower()
+            check_start = mode not in ('peak_to_trough', 'peak', 'mdd')
+            check_peak = mode not in ('day_start', 'from_day_start', 'start')
+            bar = ~is_close
+            fired = np.zeros(len(best), dtype=bool)
+            if check_peak:
+                fired |= bar & (worst <= peak - m)
+                fired |= is_close & (peak - worst >= m)
+            if check_start:
+                fired |= bar & (worst <= start - m)
+                r = realized[unit.n_closed]
+                fired |= is_close & (r < 0) & (np.abs(r) >= m)
+            if fired.any():
+                return None
+
+    max_dd = max(0, float((peak - worst).max())) if len(worst) else 0
+    cap_high = max(start, float(best.max())) if len(best) else start
+    cap_low = min(start, float(worst.min())) if len(worst) else start
+    if start > 0:
+        mdd_pct = max_dd / start
+        loss_pct = max(0.0, start - cap_low) / start
+    else:
+        mdd_pct = 0
+        loss_pct = 0.0
+    return trades, mdd_pct, loss_pct, cap_low, cap_high